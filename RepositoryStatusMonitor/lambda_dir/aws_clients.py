@@ -0,0 +1,34 @@
+import os
+import threading
+
+import boto3
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(service_name: str):
+    """Returns the boto3 client for the specified service, creating it the first time it is requested
+
+    Clients are created lazily and cached at module level, so importing a module that talks to AWS costs nothing and
+    warm Lambda invocations reuse the same client (and its connection pool) instead of building a new one per call
+
+    :param service_name: the name of the AWS service, e.g. 'cloudwatch'
+    :type service_name: str
+    :returns: the shared client for the service
+    :rtype: botocore.client.BaseClient
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = boto3.client(service_name, region_name=os.environ.get('AWS_REGION'))
+                _clients[service_name] = client
+    return client
+
+
+def reset_clients():
+    """Drops all cached clients so that the next call to get_client() creates new ones"""
+    with _clients_lock:
+        _clients.clear()
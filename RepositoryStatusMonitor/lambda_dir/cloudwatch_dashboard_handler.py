@@ -1,87 +1,342 @@
+import hashlib
 import json
 import os
 
-import boto3
-
 import cloudwatch_interactions as cw_interactions
-import collect_github_docker_metrics as github_docker
-import handle_webhook_events as handle_webhook_events
+import dashboards
+import metric_refresh
+import repository_counters
+import rollup_metrics
+import state_store
+import text_widget_renderer
+import webhook_catch_up
+import webhook_handler
+import webhook_redrive
+
+# The state key of the fingerprint of the widgets the dashboards were last reconciled with
+WIDGET_PLAN_STATE_KEY = 'widget-plan'
 
 
-def handler(event, context) -> None:
+def handler(event, context):
     """Called when the Lambda function is invoked, creates or updates a CloudWatch dashboard
 
+    The hourly run always publishes the metrics, but only reconciles the dashboards when the widgets differ from the
+    ones they were last reconciled with. An event with 'reconcile' set, sent on deploy and by a daily rule, reconciles
+    the dashboards regardless. An event with 'redrive' set replays the webhook events of the dead-letter queue, and
+    batches from the refresh queue collect the fields that depend on recent webhook events again
+
     :param event: information about what is invoking the function
     :type event: usually dict, but can also be list, str, int, float, NoneType
     :param context: information provided by AWS Lambda about the invocation, function, and execution environment
     :type context: LambdaContext
+    :returns: for a batch of webhook events, the partial batch response listing the records that failed, so SQS only
+              retries those, and for a redrive, the number of events it redrove (see
+              webhook_redrive.redrive_dead_letter_queue())
+    :rtype: Optional[dict]
     """
-    widgets = {}
-    # If 'Records' is in event, the trigger is a GitHub webhook posting to the SQS Queue, not the EventBridge rule
+    # If 'Records' is in event, the trigger is an SQS queue, not the EventBridge rule. Webhook events are handled by the
+    # webhook handler function, but batches that were still mapped to this function during a deploy are handled too
     if 'Records' in event.keys():
-        print("Updating widgets for a Webhook event")
-        webhook_payload = json.loads(event['Records'][0]['body'])
-        webhook_metric = handle_webhook_events.handle_webhook(webhook_payload)
-        if webhook_metric:
-            widgets.update(webhook_metric)
-        boto3.client('sqs').delete_message(
-            QueueUrl=os.environ['queue_url'],
-            ReceiptHandle=event['Records'][0]['receiptHandle']
-        )
-    else:
-        print("Updating widgets for an EventBridge event")
-        widgets.update(create_and_put_metrics_and_widgets())
+        if event['Records'] and \
+                event['Records'][0].get('eventSourceARN', '').endswith(':' + metric_refresh.REFRESH_QUEUE_NAME):
+            return handle_refresh_records(event['Records'])
+        return webhook_handler.handle_webhook_records(event['Records'])
+    if 'redrive' in event.keys():
+        print('Redriving the webhook events of the dead-letter queue')
+        return webhook_redrive.redrive_dead_letter_queue(webhook_handler.handle_webhook_records, event['redrive'],
+                                                         context.get_remaining_time_in_millis() / 1000)
+
+    print("Updating widgets for an EventBridge event")
+    if os.environ.get('webhook_catch_up') == 'y':
+        catch_up_webhook_events()
+    widgets = create_and_put_metrics_and_widgets(reconcile=bool(event.get('reconcile')))
+    widget_plan_fingerprint = get_widget_plan_fingerprint(widgets)
+    if widgets and not event.get('reconcile') and \
+            widget_plan_fingerprint == state_store.get_state(WIDGET_PLAN_STATE_KEY).get('fingerprint'):
+        print('Widgets unchanged since the dashboards were last reconciled, only metrics were published.')
+        return
+
+    dashboard_results = dashboards.update_dashboards(widgets, dashboards.get_superseded_widgets(widgets))
+    # A failed dashboard leaves the fingerprint as it was, so the next hourly run tries again
+    if dashboard_results and all(result['status'] != cw_interactions.FAILED for result in dashboard_results.values()):
+        state_store.put_state(WIDGET_PLAN_STATE_KEY, {'fingerprint': widget_plan_fingerprint})
+
+
+def catch_up_webhook_events():
+    """Handles the events of each repository that happened since the last run but weren't delivered as webhook events,
+    e.g. while the webhook was failing or the queue was unavailable
+
+    The events are handled as a batch of webhook events, so the events that were delivered are skipped. A repository
+    whose events couldn't all be handled keeps its cursor, and they are caught up again on the next run. A failure
+    never stops the other repositories or the hourly collection that follows
+    """
+    for repo_name in os.environ['repo_names'].split(','):
+        owner = os.environ['owner']
+        if '/' in repo_name:
+            [owner, repo_name] = repo_name.split('/')
+
+        try:
+            messages, cursor = webhook_catch_up.fetch_missed_events(owner, repo_name)
+            if messages:
+                print('Catching up %d webhook events of %s/%s' % (len(messages), owner, repo_name))
+                response = webhook_handler.handle_webhook_records(
+                    [{'messageId': 'catch-up-%d' % index, 'body': json.dumps(message)}
+                     for index, message in enumerate(messages)])
+                if response['batchItemFailures']:
+                    continue
+            if cursor:
+                webhook_catch_up.save_cursor(owner, repo_name, cursor)
+        except Exception as error:
+            print('Failed to catch up the webhook events of %s/%s. Unexpected error occurred: %r'
+                  % (owner, repo_name, error))
+
+
+def handle_refresh_records(records: list) -> dict:
+    """Handles a batch of refresh jobs, collecting the fields that depend on the jobs' webhook events again for each
+    repository once
+
+    :param records: the SQS records of the batch
+    :type records: list
+    :returns: the partial batch response, listing the message IDs of the records that failed
+    :rtype: dict
+    """
+    print("Refreshing metrics for %d refresh jobs" % len(records))
+    failed_message_ids = []
+    jobs = {}
+    for record in records:
+        try:
+            job = json.loads(record['body'])
+            repository_job = jobs.setdefault((job['owner'], job['repo_name']), {'events': set(), 'message_ids': []})
+        except (KeyError, TypeError, ValueError) as error:
+            print('Invalid refresh job ' + record['messageId'] + ': ' + repr(error))
+            failed_message_ids.append(record['messageId'])
+            continue
+        repository_job['events'].add(job.get('event'))
+        repository_job['message_ids'].append(record['messageId'])
+
+    widgets = {}
+    dashboard_message_ids = {}
+    for (owner, repo_name), job in jobs.items():
+        try:
+            repository_widgets = refresh_repository_widgets(owner, repo_name, job['events'])
+        except Exception as error:
+            print('Failed to refresh the metrics of ' + owner + '/' + repo_name + ': ' + repr(error))
+            failed_message_ids.extend(job['message_ids'])
+            continue
+        for dashboard_name, dashboard_widgets in repository_widgets.items():
+            widgets.setdefault(dashboard_name, []).extend(dashboard_widgets)
+            dashboard_message_ids.setdefault(dashboard_name, []).extend(job['message_ids'])
 
     if widgets:
-        cw_interactions.create_or_update_dashboard(widgets)
-    else:
-        print('No valid widgets, dashboard cannot be created.')
+        # Collecting the fields again is harmless, so the jobs of a dashboard that failed to update are retried
+        for dashboard_name in dashboards.get_failed_dashboards(widgets.keys(), dashboards.update_dashboards(widgets)):
+            failed_message_ids.extend(dashboard_message_ids[dashboard_name])
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in dict.fromkeys(failed_message_ids)]}
+
+
+def refresh_repository_widgets(owner: str, repo_name: str, events) -> dict:
+    """Collects the fields of a repository that depend on webhook events again, publishing the metrics and updating
+    the text widgets from the values the hourly run stored
+
+    Text widgets the hourly run didn't store the values of yet are left to it, as they would lose the fields that
+    aren't collected again
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param events: the webhook events the repository received
+    :type events: Iterable[str]
+    :returns: a mapping of the dashboard name to the text widgets to put on it
+    :rtype: dict
+    """
+    import collect_github_docker_metrics as github_docker
+
+    metric_names = metric_refresh.get_refresh_metric_names(events)
+    if not metric_names:
+        return {}
+
+    sorted_widgets = github_docker.aggregate_metrics(owner, repo_name, only_metrics=metric_names)
+    text_snapshot = state_store.get_state(text_widget_renderer.get_snapshot_key(owner, repo_name))
+    # The widgets that process_metrics() builds show one field, the configured ones can show several
+    configured_widget_titles = set(json.loads(os.environ['widgets']).keys())
+    configured_widget_titles.add(os.environ['default_text_widget_name'])
+
+    widgets = {}
+    for widget_title, widget in sorted_widgets.items():
+        if widget['type'] == 'metric':
+            cw_interactions.publish_widget_metrics(repo_name, widget['data'])
+            continue
+
+        title = get_text_widget_title(repo_name, widget_title)
+        if title not in text_snapshot:
+            continue
+        text_data = widget['data']
+        if widget_title in configured_widget_titles:
+            text_data = dict(text_snapshot[title], **text_data)
+        text_snapshot[title] = text_data
 
+        if os.environ.get('custom_text_widgets') == 'y':
+            continue
+        if os.environ.get('shared_details_dashboard') == 'y' and widget['dashboard_level'] != 'main':
+            cw_interactions.log_text_snapshot(owner, repo_name, title, widget['data'])
+            continue
+        dashboard_name = os.environ['dashboard_name_prefix']
+        if widget['dashboard_level'] != 'main':
+            dashboard_name = dashboards.get_details_dashboard_name(repo_name)
+        widgets.setdefault(dashboard_name, []).append(cw_interactions.create_text_widget(text_data, title=title))
 
-def create_and_put_metrics_and_widgets() -> dict:
+    text_widget_renderer.save_snapshot(owner, repo_name, text_snapshot)
+    return widgets
+
+
+def create_and_put_metrics_and_widgets(reconcile=False) -> dict:
     """For each repository, aggregates all text and metric data and creates widgets for each
 
+    When the counters that webhook events keep up to date are all that is collected from the repository endpoint, the
+    endpoint is only requested when reconciling or when the stored counters expired, and they are published otherwise
+    (see repository_counters.replaces_repository_request())
+
+    :param reconcile: whether to poll every counter from GitHub (default is False)
+    :type reconcile: bool
     :returns: a dictionary mapping the dashboard name to the list of the text and metric widgets for each repository to
               put in the dashboard
     :rtype: dict
     """
+    # The collection stack is only needed by the hourly run, so webhook invocations never pay for importing it
+    import collect_github_docker_metrics as github_docker
+
+    shared_details = os.environ.get('shared_details_dashboard') == 'y'
+    # With search widgets, the main dashboard shows each metric of every repository in one fixed widget
+    search_widgets = os.environ.get('search_widgets') == 'y'
+    search_metric_names = {}
+    # With custom text widgets, text widgets are rendered from a snapshot when the dashboard is viewed
+    custom_text_widgets = os.environ.get('custom_text_widgets') == 'y'
+    # Totals of each owner and repository group, added to as each repository is collected
+    rollups = {}
+    # With a shared details dashboard, its widgets are built for the first repository only, with a placeholder for the
+    # repository in their titles and log queries. Dashboard variables switch them to the other repositories
+    widget_repo_name = dashboards.get_repo_names()[0]
+
     widgets = {}
     for repo_name in os.environ['repo_names'].split(','):
         owner = os.environ['owner']
         if '/' in repo_name:
             [owner, repo_name] = repo_name.split('/')
 
-        sorted_widgets = github_docker.aggregate_metrics(owner, repo_name)
+        counters = {} if reconcile else repository_counters.get_counters(owner, repo_name)
+        sorted_widgets = github_docker.aggregate_metrics(owner, repo_name, counters)
+        # Counters whose endpoint was requested come back collected, and replace the stored ones if they differ
+        polled_counters = repository_counters.get_polled_counters(sorted_widgets)
+        if polled_counters != counters:
+            repository_counters.save_counters(owner, repo_name, polled_counters)
+        text_snapshot = {}
+        rollup_metrics.add_repository_metrics(rollups, owner, repo_name, sorted_widgets)
         # Create a Cloudwatch metric/text widget out of each sorted widget
         for widget_title, widget in sorted_widgets.items():
+            shared = shared_details and widget['dashboard_level'] != 'main'
+            title_repo_name = cw_interactions.REPOSITORY_PLACEHOLDER if shared else repo_name
             if widget['type'] == 'metric':
-                title = repo_name
-                if widget_title != os.environ['default_metric_widget_name']:
-                    title += ' ' + widget_title
+                title = dashboards.get_metric_widget_title(title_repo_name, widget_title)
+                if shared and repo_name != widget_repo_name:
+                    cw_interactions.publish_widget_metrics(repo_name, widget['data'])
+                    continue
+                if search_widgets and widget['dashboard_level'] == 'main':
+                    cw_interactions.publish_widget_metrics(repo_name, widget['data'])
+                    search_metric_names.update(dict.fromkeys(widget['data'].keys()))
+                    continue
                 formatted_widget = cw_interactions.create_metric_widget(repo_name, widget['data'], title)
             elif widget['type'] == 'text':
-                title = repo_name
-                if widget_title == os.environ['default_text_widget_name']:
-                    title += ' Properties'
+                title = get_text_widget_title(repo_name, widget_title)
+                # Refresh jobs update the text widgets from the snapshot as well
+                if custom_text_widgets or os.environ.get('refresh_queue_url'):
+                    text_snapshot[title] = widget['data']
+                if custom_text_widgets:
+                    if shared and repo_name != widget_repo_name:
+                        continue
+                    formatted_widget = cw_interactions.create_custom_text_widget(
+                        title_repo_name, get_text_widget_title(title_repo_name, widget_title), widget['data'],
+                        owner=None if shared else owner)
+                elif shared:
+                    cw_interactions.log_text_snapshot(owner, repo_name, title, widget['data'])
+                    if repo_name != widget_repo_name:
+                        continue
+                    formatted_widget = cw_interactions.create_log_text_widget(
+                        title_repo_name, get_text_widget_title(title_repo_name, widget_title))
                 else:
-                    title += ' ' + widget_title
-                formatted_widget = cw_interactions.create_text_widget(widget['data'], title=title)
+                    formatted_widget = cw_interactions.create_text_widget(widget['data'], title=title)
             else:
                 print("Invalid widget type specified for widget:", widget_title)
                 continue
 
             dashboard_name = os.environ['dashboard_name_prefix']
             if widget['dashboard_level'] != 'main':
-                dashboard_name += '-' + repo_name
+                dashboard_name = dashboards.get_details_dashboard_name(repo_name)
 
             # Add widgets to dashboard
             widgets_for_specified_dashboard = widgets.get(dashboard_name, [])
             widgets_for_specified_dashboard.append(formatted_widget)
             widgets[dashboard_name] = widgets_for_specified_dashboard
 
+        if text_snapshot:
+            text_widget_renderer.save_snapshot(owner, repo_name, text_snapshot)
+
         # Add activity widget
-        main_widgets = widgets.get(os.environ['dashboard_name_prefix'], [])
-        main_widgets.append(cw_interactions.create_activity_widget(repo_name))
-        widgets[os.environ['dashboard_name_prefix']] = main_widgets
+        if search_widgets:
+            cw_interactions.fill_missing_activity_metrics(repo_name)
+        else:
+            main_widgets = widgets.get(os.environ['dashboard_name_prefix'], [])
+            main_widgets.append(cw_interactions.create_activity_widget(repo_name))
+            widgets[os.environ['dashboard_name_prefix']] = main_widgets
+
+        # Add daily traffic widget
+        if os.environ.get('traffic_history') == 'y' and (not shared_details or repo_name == widget_repo_name):
+            details_dashboard_name = dashboards.get_details_dashboard_name(repo_name)
+            details_widgets = widgets.get(details_dashboard_name, [])
+            if shared_details:
+                details_widgets.append(cw_interactions.create_traffic_widget(
+                    repo_name, title=cw_interactions.REPOSITORY_PLACEHOLDER + ' Daily Traffic'))
+            else:
+                details_widgets.append(cw_interactions.create_traffic_widget(repo_name))
+            widgets[details_dashboard_name] = details_widgets
+
+    if search_widgets:
+        main_search_widgets = [cw_interactions.create_search_widget(metric_name,
+                                                                    dashboards.get_search_widget_title(metric_name))
+                               for metric_name in search_metric_names.keys()]
+        main_search_widgets.extend(cw_interactions.create_activity_search_widgets())
+        widgets[os.environ['dashboard_name_prefix']] = main_search_widgets + widgets.get(
+            os.environ['dashboard_name_prefix'], [])
+
+    if rollups:
+        rollup_metrics.publish_rollups(rollups)
+        widgets[os.environ['dashboard_name_prefix']] = [cw_interactions.create_rollup_widget(rollups)] + widgets.get(
+            os.environ['dashboard_name_prefix'], [])
 
     return widgets
+
+
+def get_widget_plan_fingerprint(widgets: dict) -> str:
+    """Returns a fingerprint of the widgets and properties the collection planned for every dashboard
+
+    :param widgets: a mapping of the dashboard name to its list of widgets
+    :type widgets: dict
+    :returns: the hex digest of the SHA-256 hash of the canonical JSON of the plan
+    :rtype: str
+    """
+    widget_plan = {'widgets': widgets, 'properties': dashboards.get_dashboard_properties()}
+    return hashlib.sha256(json.dumps(widget_plan, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def get_text_widget_title(repo_name: str, widget_title: str) -> str:
+    """Returns the title of a repository's text widget
+
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param widget_title: the title of the widget the text data is sorted into
+    :type widget_title: str
+    :rtype: str
+    """
+    if widget_title == os.environ['default_text_widget_name']:
+        return repo_name + ' Properties'
+    return repo_name + ' ' + widget_title
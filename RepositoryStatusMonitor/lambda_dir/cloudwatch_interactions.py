@@ -1,76 +1,536 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
+import hashlib
 import json
 import math
 import os
 import re
+import threading
+import time
+import uuid
 
-import boto3
+import aws_clients
+import state_store
 
-cloudwatch = boto3.client('cloudwatch')
+# The most metric data points a single PutMetricData request accepts
+MAX_METRIC_DATA_PER_PUT = 1000
+# The metrics put by each thread inside buffered_metrics(), put in CloudWatch together when it exits
+metric_buffers = threading.local()
 
+# CloudWatch rejects data points that are timestamped more than two weeks in the past. The margin keeps the oldest data
+# point from being rejected because of the time the requests take
+MAX_METRIC_BACKDATE = timedelta(days=14) - timedelta(hours=1)
 
-def create_or_update_dashboard(dashboard_widget_mapping: dict):
-    """Creates or updates the specified dashboard with the specified widgets
+# The most dashboards fetched and written at the same time, bounded so many dashboards don't get throttled
+MAX_DASHBOARD_WORKERS = 8
+
+# Limits on a single dashboard. The widget and metric limits are CloudWatch quotas, the body size is a conservative cap
+# on the size of a PutDashboard request
+MAX_WIDGETS_PER_DASHBOARD = 500
+MAX_METRICS_PER_DASHBOARD = 2500
+MAX_DASHBOARD_BODY_BYTES = 1000000
+# How full a dashboard page may get before new widgets go on the next page
+PAGE_FILL_RATIO = 0.9
+
+# How long a dashboard's lease is held if its holder never releases it, e.g. because the invocation timed out, and how
+# long to wait for another invocation to release it, in seconds
+DASHBOARD_LEASE_SECONDS = 60
+DASHBOARD_LEASE_WAIT_SECONDS = 30
+DASHBOARD_LEASE_POLL_SECONDS = 0.25
+
+# The metrics counted from webhook events, shown in the activity widgets
+ACTIVITY_METRIC_NAMES = [
+    'PRs Merged',
+    'PRs Closed',
+    'PRs Opened',
+    'Issues Closed',
+    'Issues Opened',
+    'Releases Published',
+    'Pushes to Master'
+]
+
+# The number of repositories a search widget shows, the ones with the highest values
+SEARCH_WIDGET_TOP_REPOSITORIES = 25
+
+# The properties of each type of widget that hold the data this app generates, the rest belong to the user
+GENERATED_PROPERTIES = {
+    'custom': ['endpoint', 'params'],
+    'log': ['query'],
+    'metric': ['metrics'],
+    'text': ['markdown']
+}
+
+# The types of the widgets that show text data. The same data is shown by a different type depending on the text and
+# shared dashboard settings, so a widget of one of these types replaces the widgets of the others with its title
+TEXT_WIDGET_TYPES = ['text', 'custom', 'log']
+
+# Stands in for the repository name in the titles and log queries of the widgets on a shared details dashboard, until a
+# dashboard variable replaces it with the selected repository. Braces can't be part of a repository name
+REPOSITORY_PLACEHOLDER = '{repository}'
+
+# The results of reconciling a dashboard
+WRITTEN = 'written'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+def create_or_update_dashboard(dashboard_widget_mapping: dict, dashboard_properties=None,
+                               superseded_widgets=None) -> dict:
+    """Creates or updates the specified dashboards with the specified widgets
 
     cloudwatch.put_dashboard() replaces the entire contents of a dashboard with the new data, so we need to copy existing
-    widgets into our new list of widgets
+    widgets into our new list of widgets. Dashboards whose merged body is the same as the existing one aren't written.
+    The existing dashboards are listed once, then the dashboards are reconciled concurrently, and a dashboard that fails
+    doesn't stop the others from being updated. A dashboard that would grow past the CloudWatch limits is split into
+    numbered pages (see plan_pages()). Each dashboard is read and written under a lease, so concurrent invocations
+    updating the same dashboard don't overwrite each other's widgets
 
     :param dashboard_widget_mapping: a mapping of the dashboard name to the widgets to create/update that dashboard with
     :type dashboard_widget_mapping: dict
+    :param dashboard_properties: a mapping of the dashboard name to the properties to set on the dashboard besides its
+                                 widgets, e.g. its variables (default is None, which keeps the existing properties)
+    :type dashboard_properties: Optional[dict]
+    :param superseded_widgets: a mapping of the dashboard name to the identities of the generated widgets that the new
+                               widgets replace, which are removed (see merge_widgets()) (default is None)
+    :type superseded_widgets: Optional[dict]
+    :returns: a mapping of the name of each dashboard page to its result, a dictionary with the 'status' (WRITTEN,
+              SKIPPED or FAILED) and, for failed pages, the 'error'
+    :rtype: dict
     """
-    for dashboard_name, widgets_to_put in dashboard_widget_mapping.items():
-        final_widgets = []
-        # Get the existing widgets from a dashboard
-        existing_dashboards = cloudwatch.list_dashboards(
-            DashboardNamePrefix=dashboard_name
-        )
-        existing_widgets = []
-        for dashboard in existing_dashboards['DashboardEntries']:
-            if dashboard['DashboardName'] == dashboard_name:
-                existing_widgets = json.loads(cloudwatch.get_dashboard(DashboardName=dashboard_name)['DashboardBody'])[
-                    'widgets']
-
-        # If a new widget matches an existing one, update the existing widget data with the new metrics.
-        # Otherwise, just add the new widget
-        for widget in widgets_to_put:
-            match = False
-            if widget['type'] == 'metric':
-                for ew in existing_widgets:
-                    if ew['type'] != 'text' and widget['properties']['title'] == ew['properties']['title']:
-                        match = True
-                        existing_widgets.remove(ew)
-                        ew['properties']['metrics'] = widget['properties']['metrics']
-                        final_widgets.append(ew)
-            elif widget['type'] == 'text':
-                title = re.search(r'#\s(.*?)\n', widget['properties']['markdown']).groups()[0]
-                for ew in existing_widgets:
-                    if ew['type'] == 'text' and title in ew['properties']['markdown']:
-                        match = True
-                        existing_widgets.remove(ew)
-                        ew['properties']['markdown'] = widget['properties']['markdown']
-                        final_widgets.append(ew)
-
-            if not match:
-                final_widgets.append(widget)
-
-        # Add any existing widgets that didn't have new data
-        final_widgets.extend(existing_widgets)
+    if not dashboard_widget_mapping:
+        return {}
+
+    existing_dashboard_names = list_dashboard_names(os.path.commonprefix(list(dashboard_widget_mapping.keys())))
+    max_workers = min(MAX_DASHBOARD_WORKERS, len(dashboard_widget_mapping))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(reconcile_dashboard, dashboard_name, widgets_to_put, existing_dashboard_names,
+                            (dashboard_properties or {}).get(dashboard_name),
+                            (superseded_widgets or {}).get(dashboard_name))
+            for dashboard_name, widgets_to_put in dashboard_widget_mapping.items()
+        ]
+        results = {}
+        for future in futures:
+            results.update(future.result())
+
+    statuses = [result['status'] for result in results.values()]
+    print('Dashboards written: %d, unchanged and skipped: %d, failed: %d' % (
+        statuses.count(WRITTEN), statuses.count(SKIPPED), statuses.count(FAILED)))
+    return results
+
+
+def list_dashboard_names(prefix='') -> set:
+    """Lists the names of all existing dashboards that start with the prefix, following every page of the listing
+
+    :param prefix: the prefix of the dashboard names (default is "", which lists every dashboard)
+    :type prefix: Optional[str]
+    :returns: the names of the existing dashboards
+    :rtype: set
+    """
+    list_parameters = {'DashboardNamePrefix': prefix} if prefix else {}
+    dashboard_names = set()
+    for page in aws_clients.get_client('cloudwatch').get_paginator('list_dashboards').paginate(**list_parameters):
+        dashboard_names.update(dashboard['DashboardName'] for dashboard in page['DashboardEntries'])
+    return dashboard_names
+
+
+def get_page_names(dashboard_name: str, existing_dashboard_names: set) -> list:
+    """Returns the names of the existing pages of a dashboard in page order, the first page being the dashboard itself
+
+    :param dashboard_name: the name of the dashboard
+    :type dashboard_name: str
+    :param existing_dashboard_names: the names of all existing dashboards
+    :type existing_dashboard_names: set
+    :returns: the page names, e.g. ['prefix', 'prefix-page-2', 'prefix-page-3']
+    :rtype: list
+    """
+    page_numbers = []
+    for name in existing_dashboard_names:
+        match = re.fullmatch(re.escape(dashboard_name) + r'-page-(\d+)', name)
+        if match:
+            page_numbers.append(int(match.groups()[0]))
+    return [dashboard_name] + [get_page_name(dashboard_name, number) for number in sorted(page_numbers)]
+
+
+def get_page_name(dashboard_name: str, page_number: int) -> str:
+    """Returns the name of a page of a dashboard
+
+    :param dashboard_name: the name of the dashboard
+    :type dashboard_name: str
+    :param page_number: the number of the page, starting at 1
+    :type page_number: int
+    :rtype: str
+    """
+    return dashboard_name if page_number == 1 else dashboard_name + '-page-' + str(page_number)
+
+
+def reconcile_dashboard(dashboard_name: str, widgets_to_put: list, existing_dashboard_names: set,
+                        properties=None, superseded_identities=None) -> dict:
+    """Spreads the new widgets over the pages of the dashboard and reconciles every page
+
+    :param dashboard_name: the name of the dashboard
+    :type dashboard_name: str
+    :param widgets_to_put: the widgets to create/update the dashboard with
+    :type widgets_to_put: list
+    :param existing_dashboard_names: the names of all existing dashboards
+    :type existing_dashboard_names: set
+    :param properties: the properties to set on every page besides its widgets (default is None)
+    :type properties: Optional[dict]
+    :param superseded_identities: the identities of the generated widgets to remove from every page (default is None)
+    :type superseded_identities: Optional[set]
+    :returns: a mapping of the name of each page to its 'status' (WRITTEN, SKIPPED or FAILED) and, if it failed, the
+              'error'
+    :rtype: dict
+    """
+    lease_key = 'dashboard-lease#' + dashboard_name
+    lease_holder = str(uuid.uuid4())
+    try:
+        leased = acquire_dashboard_lease(lease_key, lease_holder)
+    except Exception as error:
+        print("Failed to lease dashboard " + dashboard_name + ". Unexpected error occurred: " + repr(error))
+        return {dashboard_name: {'status': FAILED, 'error': repr(error)}}
+    if not leased:
+        error = 'Timed out waiting for another invocation to finish updating the dashboard'
+        print("Failed to lease dashboard " + dashboard_name + ". " + error)
+        return {dashboard_name: {'status': FAILED, 'error': error}}
 
+    try:
+        return reconcile_leased_dashboard(dashboard_name, widgets_to_put, existing_dashboard_names, properties,
+                                          superseded_identities)
+    finally:
         try:
-            print("Populating dashboard " + dashboard_name + " with the following widgets")
-            print(final_widgets)
-            cloudwatch.put_dashboard(
-                DashboardName=dashboard_name,
-                DashboardBody=json.dumps({'widgets': final_widgets})
-            )
-        except cloudwatch.exceptions.DashboardInvalidInputError:
-            print("Failed to create dashboard. Dashboard input invalid")
-        except:
-            print("Failed to create dashboard. Unexpected error occurred")
+            state_store.release_lease(lease_key, lease_holder)
+        except Exception as error:
+            # The lease expires by itself, the dashboard was already reconciled
+            print("Failed to release the lease on dashboard " + dashboard_name + ": " + repr(error))
+
+
+def acquire_dashboard_lease(lease_key: str, lease_holder: str) -> bool:
+    """Takes the lease on a dashboard, waiting up to DASHBOARD_LEASE_WAIT_SECONDS for another invocation to release it
+
+    :param lease_key: the state key of the dashboard's lease
+    :type lease_key: str
+    :param lease_holder: the unique ID to take the lease with
+    :type lease_holder: str
+    :returns: whether the lease was taken
+    :rtype: bool
+    """
+    deadline = time.monotonic() + DASHBOARD_LEASE_WAIT_SECONDS
+    while not state_store.acquire_lease(lease_key, lease_holder, DASHBOARD_LEASE_SECONDS):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(DASHBOARD_LEASE_POLL_SECONDS)
+    return True
+
+
+def reconcile_leased_dashboard(dashboard_name: str, widgets_to_put: list, existing_dashboard_names: set,
+                               properties=None, superseded_identities=None) -> dict:
+    """Reconciles every page of a dashboard whose lease is held (see reconcile_dashboard())
+
+    The pages are read under the lease, so their bodies are current. The listing of the dashboards may be older than the
+    lease though, so before a page is created the dashboard's pages are listed again, in case another invocation
+    created it in the meantime
+
+    :param dashboard_name: the name of the dashboard
+    :type dashboard_name: str
+    :param widgets_to_put: the widgets to create/update the dashboard with
+    :type widgets_to_put: list
+    :param existing_dashboard_names: the names of the existing dashboards
+    :type existing_dashboard_names: set
+    :param properties: the properties to set on every page besides its widgets (default is None)
+    :type properties: Optional[dict]
+    :param superseded_identities: the identities of the generated widgets to remove from every page (default is None)
+    :type superseded_identities: Optional[set]
+    :returns: a mapping of the name of each page to its 'status' (WRITTEN, SKIPPED or FAILED) and, if it failed, the
+              'error'
+    :rtype: dict
+    """
+    try:
+        existing_bodies = get_page_bodies(dashboard_name, existing_dashboard_names)
+        pages = plan_pages(dashboard_name, widgets_to_put, existing_bodies)
+        if any(page_name not in existing_bodies for page_name in pages):
+            current_dashboard_names = list_dashboard_names(dashboard_name)
+            current_page_names = [page_name for page_name in get_page_names(dashboard_name, current_dashboard_names)
+                                  if page_name in current_dashboard_names]
+            if current_page_names != list(existing_bodies.keys()):
+                existing_bodies = get_page_bodies(dashboard_name, current_dashboard_names)
+                pages = plan_pages(dashboard_name, widgets_to_put, existing_bodies)
+    except Exception as error:
+        print("Failed to retrieve dashboard " + dashboard_name + ". Unexpected error occurred: " + repr(error))
+        return {dashboard_name: {'status': FAILED, 'error': repr(error)}}
+
+    index_widget = create_page_index_widget(dashboard_name, list(pages.keys())) if len(pages) > 1 else None
+    return {
+        page_name: reconcile_page(page_name, page_widgets, existing_bodies.get(page_name), leading_widget=index_widget,
+                                  properties=properties, superseded_identities=superseded_identities)
+        for page_name, page_widgets in pages.items()
+    }
+
+
+def get_page_bodies(dashboard_name: str, existing_dashboard_names) -> dict:
+    """Retrieves the bodies of the existing pages of a dashboard
+
+    :param dashboard_name: the name of the dashboard
+    :type dashboard_name: str
+    :param existing_dashboard_names: the names of the existing dashboards
+    :type existing_dashboard_names: Iterable[str]
+    :returns: a mapping of the name of each existing page, in page order, to its body
+    :rtype: dict
+    """
+    cloudwatch = aws_clients.get_client('cloudwatch')
+    existing_dashboard_names = set(existing_dashboard_names)
+    existing_bodies = {}
+    for page_name in get_page_names(dashboard_name, existing_dashboard_names):
+        if page_name in existing_dashboard_names:
+            existing_bodies[page_name] = json.loads(cloudwatch.get_dashboard(DashboardName=page_name)['DashboardBody'])
+    return existing_bodies
+
+
+def plan_pages(dashboard_name: str, widgets_to_put: list, existing_bodies: dict) -> dict:
+    """Decides which page of the dashboard each new widget goes on
+
+    A widget that is already on a page stays on that page, so widgets don't move between runs. Other widgets go on the
+    last page, or on a new page once the last page is filled to PAGE_FILL_RATIO of one of the CloudWatch limits, which
+    leaves room for the widgets already on a page to grow
+
+    :param dashboard_name: the name of the dashboard
+    :type dashboard_name: str
+    :param widgets_to_put: the widgets to create/update the dashboard with
+    :type widgets_to_put: list
+    :param existing_bodies: a mapping of the name of each existing page to its body
+    :type existing_bodies: dict
+    :returns: a mapping of the name of each page, in page order, to the widgets to create/update that page with
+    :rtype: dict
+    """
+    pages = {}
+    usage = {}
+    widget_pages = {}
+    for page_name in get_page_names(dashboard_name, set(existing_bodies.keys())):
+        pages[page_name] = []
+        usage[page_name] = [0, 0, 0]
+        for widget in existing_bodies.get(page_name, {}).get('widgets', []):
+            add_widget_usage(usage[page_name], widget)
+            widget_pages.setdefault(widget_identity(widget), page_name)
+
+    for widget in widgets_to_put:
+        identity = widget_identity(widget)
+        page_name = widget_pages.get(identity) if identity is not None else None
+        if page_name is None:
+            page_name = list(pages.keys())[-1]
+            if not widget_fits(usage[page_name], widget):
+                page_number = len(pages) + 1
+                while get_page_name(dashboard_name, page_number) in pages:
+                    page_number += 1
+                page_name = get_page_name(dashboard_name, page_number)
+                pages[page_name] = []
+                usage[page_name] = [0, 0, 0]
+            add_widget_usage(usage[page_name], widget)
+            if identity is not None:
+                widget_pages[identity] = page_name
+        pages[page_name].append(widget)
+
+    return pages
+
+
+def add_widget_usage(usage: list, widget: dict):
+    """Adds what a widget takes up of the dashboard limits to the usage of a page
+
+    :param usage: the number of widgets, the number of metrics and the body size in bytes of the page
+    :type usage: list
+    :param widget: the widget on the page
+    :type widget: dict
+    """
+    usage[0] += 1
+    usage[1] += len(widget.get('properties', {}).get('metrics', []))
+    usage[2] += len(json.dumps(widget).encode('utf-8')) + 1
+
+
+def widget_fits(usage: list, widget: dict) -> bool:
+    """Checks whether a widget can be added to a page without filling the page past PAGE_FILL_RATIO of a limit
+
+    One widget is kept free for the page index
+
+    :param usage: the number of widgets, the number of metrics and the body size in bytes of the page
+    :type usage: list
+    :param widget: the widget to add
+    :type widget: dict
+    :rtype: bool
+    """
+    new_usage = list(usage)
+    add_widget_usage(new_usage, widget)
+    limits = [MAX_WIDGETS_PER_DASHBOARD - 1, MAX_METRICS_PER_DASHBOARD, MAX_DASHBOARD_BODY_BYTES]
+    return all(used <= limit * PAGE_FILL_RATIO for used, limit in zip(new_usage, limits))
+
+
+def create_page_index_widget(dashboard_name: str, page_names: list) -> dict:
+    """Creates the text widget that links the pages of a dashboard to each other
+
+    :param dashboard_name: the name of the dashboard
+    :type dashboard_name: str
+    :param page_names: the names of the pages in page order
+    :type page_names: list
+    :returns: the dictionary representing the text widget
+    :rtype: dict
+    """
+    links = ['[Page %d](#dashboards:name=%s)' % (number, page_name)
+             for number, page_name in enumerate(page_names, start=1)]
+    return {
+        'type': 'text',
+        'width': 24,
+        'height': 1,
+        'properties': {
+            'markdown': '## ' + dashboard_name + ' Pages\n' + ' | '.join(links)
+        }
+    }
+
+
+def reconcile_page(page_name: str, widgets_to_put: list, existing_body=None, leading_widget=None,
+                   properties=None, superseded_identities=None) -> dict:
+    """Merges the new widgets into the existing dashboard page and writes the page if its body changed
+
+    :param page_name: the name of the dashboard page
+    :type page_name: str
+    :param widgets_to_put: the widgets to create/update the page with
+    :type widgets_to_put: list
+    :param existing_body: the current body of the page (default is None, for a page that doesn't exist yet)
+    :type existing_body: Optional[dict]
+    :param leading_widget: a widget to keep at the top of the page, added there if the page doesn't have it yet
+                           (default is None)
+    :type leading_widget: Optional[dict]
+    :param properties: the properties to set on the page besides its widgets, properties that aren't specified, such as
+                       the time range set in the console, keep their existing value (default is None)
+    :type properties: Optional[dict]
+    :param superseded_identities: the identities of the generated widgets to remove from the page (default is None)
+    :type superseded_identities: Optional[set]
+    :returns: the 'status' of the page (WRITTEN, SKIPPED or FAILED) and, if it failed, the 'error'
+    :rtype: dict
+    """
+    cloudwatch = aws_clients.get_client('cloudwatch')
+    try:
+        existing_widgets = existing_body['widgets'] if existing_body is not None else []
+        existing_fingerprint = get_dashboard_fingerprint(existing_body) if existing_body is not None else None
+        if leading_widget is not None:
+            existing_identities = {widget_identity(widget) for widget in existing_widgets}
+            if widget_identity(leading_widget) not in existing_identities:
+                existing_widgets = [leading_widget] + existing_widgets
+            widgets_to_put = [leading_widget] + widgets_to_put
+
+        final_body = {key: value for key, value in (existing_body or {}).items() if key != 'widgets'}
+        final_body.update(properties or {})
+        final_body['widgets'] = merge_widgets(existing_widgets, widgets_to_put, superseded_identities)
+        if existing_fingerprint == get_dashboard_fingerprint(final_body):
+            return {'status': SKIPPED}
+
+        print("Populating dashboard " + page_name + " with the following widgets")
+        print(final_body['widgets'])
+        cloudwatch.put_dashboard(
+            DashboardName=page_name,
+            DashboardBody=json.dumps(final_body)
+        )
+        return {'status': WRITTEN}
+    except cloudwatch.exceptions.DashboardInvalidInputError as error:
+        print("Failed to create dashboard " + page_name + ". Dashboard input invalid")
+        return {'status': FAILED, 'error': str(error)}
+    except Exception as error:
+        # Isolate the failure so the other dashboards are still reconciled, the caller decides what to do with it
+        print("Failed to create dashboard " + page_name + ". Unexpected error occurred: " + repr(error))
+        return {'status': FAILED, 'error': repr(error)}
+
+
+def merge_widgets(existing_widgets: list, widgets_to_put: list, superseded_identities=None) -> list:
+    """Merges the new widgets into the existing widgets of a dashboard
+
+    A new widget replaces the data of the existing widget with the same identity (see widget_identity()), which keeps its
+    place and any changes made to it in the console. New widgets without an existing counterpart are added at the end,
+    and existing widgets that don't match any new widget, such as widgets added by users, are kept as they are, unless
+    they are generated widgets the new widgets replace, e.g. the text widgets of a repository once custom text widgets
+    are enabled. A widget of a text type also replaces the widgets of the other text types with its title
+
+    :param existing_widgets: the widgets currently on the dashboard
+    :type existing_widgets: list
+    :param widgets_to_put: the widgets to create/update the dashboard with
+    :type widgets_to_put: list
+    :param superseded_identities: the identities of the generated widgets the new widgets replace (default is None)
+    :type superseded_identities: Optional[set]
+    :returns: the widgets of the updated dashboard
+    :rtype: list
+    """
+    identities_to_put = {widget_identity(widget) for widget in widgets_to_put}
+    superseded_identities = set(superseded_identities or [])
+    for widget_type, title in filter(None, identities_to_put):
+        if widget_type in TEXT_WIDGET_TYPES:
+            superseded_identities.update((other_type, title) for other_type in TEXT_WIDGET_TYPES)
+    superseded_identities -= identities_to_put
+    final_widgets = [widget for widget in existing_widgets if widget_identity(widget) not in superseded_identities]
+    positions = {}
+    for position, widget in enumerate(final_widgets):
+        positions.setdefault(widget_identity(widget), position)
+
+    for widget in widgets_to_put:
+        identity = widget_identity(widget)
+        position = positions.get(identity) if identity is not None else None
+        if position is None:
+            if identity is not None:
+                positions[identity] = len(final_widgets)
+            final_widgets.append(widget)
+            continue
+
+        # Only the data is updated, so the position, size and view the widget has on the dashboard are kept
+        existing_widget = final_widgets[position]
+        properties = dict(existing_widget.get('properties', {}))
+        for property_name in GENERATED_PROPERTIES.get(widget['type'], []):
+            properties[property_name] = widget['properties'][property_name]
+        final_widgets[position] = dict(existing_widget, properties=properties)
+
+    return final_widgets
+
+
+def widget_identity(widget: dict):
+    """Returns the key that identifies a widget across runs: its type and its title
+
+    Text widgets have no title property, their title is the first markdown heading, which create_text_widget() writes on
+    the first line
+
+    :param widget: the widget to identify
+    :type widget: dict
+    :returns: the (type, title) tuple, or None if the widget has no title
+    :rtype: Optional[tuple]
+    """
+    properties = widget.get('properties', {})
+    if widget.get('type') == 'text':
+        match = re.match(r'#+[ \t]+(.*?)[ \t]*(\n|$)', properties.get('markdown', ''))
+        title = match.groups()[0] if match else None
+    else:
+        title = properties.get('title')
+
+    if not title:
+        return None
+    return widget.get('type'), title
+
+
+def get_dashboard_fingerprint(dashboard_body: dict) -> str:
+    """Hashes a stable serialisation of the dashboard body, so that two bodies with the same content have the same
+    fingerprint however their keys are ordered
+
+    The order of the widgets only matters for widgets without a position, since CloudWatch lays those out in list order.
+    When every widget has a position the widgets are sorted first, so moving them around in the list isn't a change
+
+    :param dashboard_body: the dashboard body, a dictionary with a list of widgets
+    :type dashboard_body: dict
+    :returns: the SHA-256 hex digest of the canonical body
+    :rtype: str
+    """
+    widgets = [json.dumps(widget, sort_keys=True, separators=(',', ':')) for widget in dashboard_body.get('widgets', [])]
+    if all('x' in widget and 'y' in widget for widget in dashboard_body.get('widgets', [])):
+        widgets.sort()
+    other_properties = {key: value for key, value in dashboard_body.items() if key != 'widgets'}
+    canonical_body = '[' + ','.join(widgets) + ']' + json.dumps(other_properties, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical_body.encode('utf-8')).hexdigest()
 
 
 def create_metric_widget(repo_name: str, metric_data: dict, title: str, view='singleValue', id_str=None,
-                         granularity=None) -> dict:
+                         granularity=None, publish=True) -> dict:
     """Creates a new metric widget
 
     :param repo_name: the name of the repository to use as a dimension of the metric
@@ -85,6 +545,8 @@ def create_metric_widget(repo_name: str, metric_data: dict, title: str, view='si
     :type id_str: str
     :param granularity: the granularity to use for the expression (used in metric expression)
     :type granularity: str
+    :param publish: whether to put the metric data in CloudWatch (default is True)
+    :type publish: bool
     :returns: the dictionary representing the widget
     :rtype: dict
     """
@@ -97,12 +559,12 @@ def create_metric_widget(repo_name: str, metric_data: dict, title: str, view='si
 
     print("creating metric widget " + title + " for " + repo_name)
 
-    cloudwatch_metrics = []
+    if publish:
+        publish_widget_metrics(repo_name, metric_data)
+
     widget_metric_data = []
     namespace = os.environ['namespace']
-    for metric_name, metric_value in metric_data.items():
-        cloudwatch_metrics.append(new_metric(repo_name, metric_name, metric_value))
-
+    for metric_name in metric_data.keys():
         if not id_str or granularity not in ['minutes', 'hours', 'days']:
             widget_metric_data.append([namespace, metric_name, 'REPO_NAME', repo_name])
         else:
@@ -113,8 +575,6 @@ def create_metric_widget(repo_name: str, metric_data: dict, title: str, view='si
             widget_metric_data.append([{'expression': id_str + '/' + denominator[granularity],
                                         'label': metric_name + suffix[granularity], "id": id_str + "Expression"}])
 
-    put_metrics_in_cloudwatch(cloudwatch_metrics)
-
     rows = math.ceil(len(metric_data) / 3)
     return {
         'type': 'metric',
@@ -131,6 +591,18 @@ def create_metric_widget(repo_name: str, metric_data: dict, title: str, view='si
     }
 
 
+def publish_widget_metrics(repo_name: str, metric_data: dict):
+    """Puts the data of a metric widget in CloudWatch without creating the widget
+
+    :param repo_name: the name of the repository to use as a dimension of the metrics
+    :type repo_name: str
+    :param metric_data: a mapping of the metric names to their values
+    :type metric_data: dict
+    """
+    put_metrics_in_cloudwatch([new_metric(repo_name, metric_name, metric_value)
+                               for metric_name, metric_value in metric_data.items()])
+
+
 def create_text_widget(text_data: dict, title: str) -> dict:
     """Creates a new text widget with the specified data
 
@@ -145,30 +617,176 @@ def create_text_widget(text_data: dict, title: str) -> dict:
         print("failed to create a text widget. Missing parameters")
         return {}
 
-    text_widget_string = '## ' + title + '\n Name | Value \n ----|----- \n'
-    for metric_name, metric_text in text_data.items():
-        text_widget_string += metric_name + ' | ' + metric_text + '\n'
+    text_widget_string = '## ' + title + '\n' + create_text_table(text_data)
 
-    # Keep height of text widget closer to height of content (makes height more responsive)
-    height = 2 + (math.ceil(len(text_data) / 3) * 2 if math.floor(len(text_data) / 3) >= 1 else 2)
     return {
         'type': 'text',
-        'height': height,
+        'height': get_text_widget_height(text_data),
         'properties': {
             'markdown': text_widget_string
         }
     }
 
 
-def new_metric(repo_name: str, metric_name: str, metric_value: float) -> dict:
+def create_text_table(text_data: dict) -> str:
+    """Creates the markdown table of a text widget
+
+    :param text_data: a mapping of the metric names to their text
+    :type text_data: dict
+    :returns: the markdown table
+    :rtype: str
+    """
+    text_table = ' Name | Value \n ----|----- \n'
+    for metric_name, metric_text in text_data.items():
+        text_table += metric_name + ' | ' + metric_text + '\n'
+    return text_table
+
+
+def get_text_widget_height(text_data: dict) -> int:
+    """Returns the height of a text widget showing the text data
+
+    :param text_data: a mapping of the metric names to their text
+    :type text_data: dict
+    :rtype: int
+    """
+    # Keep height of text widget closer to height of content (makes height more responsive)
+    return 2 + (math.ceil(len(text_data) / 3) * 2 if math.floor(len(text_data) / 3) >= 1 else 2)
+
+
+def create_custom_text_widget(repo_name: str, title: str, text_data: dict, owner: str = None) -> dict:
+    """Creates a custom widget that the text widget renderer function fills in when the dashboard is viewed
+
+    The widget only references the renderer and the repository, so it doesn't change when the text does
+
+    :param repo_name: the repository the widget belongs to
+    :type repo_name: str
+    :param title: the title of the widget
+    :type title: str
+    :param text_data: the current text data, only used to size the widget
+    :type text_data: dict
+    :param owner: the owner of the repository, left out when a dashboard variable switches the repository, for the
+                  renderer to look up
+    :type owner: str
+    :returns: the dictionary representing the widget
+    :rtype: dict
+    """
+    params = {'repo_name': repo_name, 'title': title}
+    if owner:
+        params['owner'] = owner
+    return {
+        'type': 'custom',
+        'width': 6,
+        'height': get_text_widget_height(text_data),
+        'properties': {
+            'endpoint': os.environ['text_widget_renderer_arn'],
+            'params': params,
+            'updateOn': {
+                'refresh': True,
+                'resize': False,
+                'timeRange': False
+            },
+            'title': title
+        }
+    }
+
+
+def log_text_snapshot(owner: str, repo_name: str, title: str, text_data: dict):
+    """Logs the data of a text widget as one JSON line per value, for log widgets to query with CloudWatch Logs Insights
+
+    :param owner: the owner of the repository the data belongs to
+    :type owner: str
+    :param repo_name: the repository the data belongs to
+    :type repo_name: str
+    :param title: the title of the text widget the data would be shown in
+    :type title: str
+    :param text_data: a mapping of the names to the text values
+    :type text_data: dict
+    """
+    for name, value in text_data.items():
+        print(json.dumps({'snapshot': 'text', 'owner': owner, 'repo_name': repo_name, 'title': title, 'name': name,
+                          'value': value}))
+
+
+def create_log_text_widget(repo_name: str, title: str) -> dict:
+    """Creates a log widget that shows the latest text snapshot logged by log_text_snapshot() as a table
+
+    Unlike a text widget the values aren't part of the dashboard body, so the widget doesn't change when they do, and the
+    repository in its query can be switched by a dashboard variable
+
+    :param repo_name: the repository whose snapshot to show
+    :type repo_name: str
+    :param title: the title the snapshot was logged with, also used as the title of the widget
+    :type title: str
+    :returns: the dictionary representing the widget
+    :rtype: dict
+    """
+    log_group_name = '/aws/lambda/' + os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'MetricsHandler')
+    query = ("SOURCE '" + log_group_name + "' | filter snapshot = 'text' and repo_name = '" + repo_name + "' and title = '"
+             + title + "' | stats latest(value) as Value by name | sort name asc")
+    return {
+        'type': 'log',
+        'width': 6,
+        'height': 6,
+        'properties': {
+            'query': query,
+            'view': 'table',
+            'region': os.environ['AWS_REGION'],
+            'title': title
+        }
+    }
+
+
+def create_repository_variables(repo_names: list) -> list:
+    """Creates the dashboard variables that switch a dashboard built for the first repository to any other repository
+
+    A property variable switches the REPO_NAME dimension of the metric widgets. The titles and log queries can't be
+    switched by a property, so they hold REPOSITORY_PLACEHOLDER instead, which a pattern variable replaces
+
+    :param repo_names: the names of the repositories to choose from, the first is the one the widgets are built for
+    :type repo_names: list
+    :returns: the dictionaries representing the variables
+    :rtype: list
+    """
+    values = [{'value': repo_name, 'label': repo_name} for repo_name in repo_names]
+    return [
+        {
+            'type': 'property',
+            'property': 'REPO_NAME',
+            'inputType': 'select',
+            'id': 'repository',
+            'label': 'Repository',
+            'defaultValue': repo_names[0],
+            'visible': True,
+            'values': values
+        },
+        {
+            'type': 'pattern',
+            'pattern': re.escape(REPOSITORY_PLACEHOLDER),
+            'inputType': 'select',
+            'id': 'repository_text',
+            'label': 'Repository Titles and Text',
+            'defaultValue': repo_names[0],
+            'visible': True,
+            'values': values
+        }
+    ]
+
+
+def new_metric(repo_name: str, metric_name: str, metric_value: float, timestamp=None,
+               dimension_name='REPO_NAME') -> dict:
     """Creates a new metric in the format required for CloudWatch
 
-    :param repo_name: the repository name to associate with the metric
+    :param repo_name: the repository name to associate with the metric, or the value of the given dimension
     :type repo_name: str
     :param metric_name: the name of the metric
     :type metric_name: str
     :param metric_value: the value of the metric
     :type metric_value: int
+    :param timestamp: the time the value was observed at (default is None, which lets CloudWatch use the time it
+                      receives the metric)
+    :type timestamp: Optional[datetime]
+    :param dimension_name: the name of the dimension to associate the metric with (default is "REPO_NAME")
+    :type dimension_name: Optional[str]
     :returns: the dictionary representing the metric
     :rtype: dict
     """
@@ -182,29 +800,67 @@ def new_metric(repo_name: str, metric_name: str, metric_value: float) -> dict:
             return {}
         metric_value = float(metric_value)
 
-    return {
+    metric = {
         'MetricName': metric_name,
         'Dimensions': [
             {
-                'Name': 'REPO_NAME',
+                'Name': dimension_name,
                 'Value': repo_name
             }
         ],
         'Unit': 'None',
         'Value': metric_value
     }
+    if timestamp is not None:
+        metric['Timestamp'] = timestamp
+    return metric
 
 
 def put_metrics_in_cloudwatch(cloudwatch_metrics: list):
-    """Puts the specified metrics in CloudWatch
+    """Puts the specified metrics in CloudWatch, using as few requests as possible
+
+    Inside buffered_metrics(), the metrics are only put when it exits
 
     :param cloudwatch_metrics: the metric data to put in CloudWatch
-    :type cloudwatch_metrics: dict
+    :type cloudwatch_metrics: list
     """
-    cloudwatch.put_metric_data(
-        Namespace=os.environ['namespace'],
-        MetricData=cloudwatch_metrics
-    )
+    buffer = getattr(metric_buffers, 'metrics', None)
+    if buffer is not None:
+        buffer.extend(cloudwatch_metrics)
+        return
+
+    for start in range(0, len(cloudwatch_metrics), MAX_METRIC_DATA_PER_PUT):
+        aws_clients.get_client('cloudwatch').put_metric_data(
+            Namespace=os.environ['namespace'],
+            MetricData=cloudwatch_metrics[start:start + MAX_METRIC_DATA_PER_PUT]
+        )
+
+
+@contextmanager
+def buffered_metrics(put_on_error: bool = True):
+    """Collects the metrics the current thread puts in CloudWatch and puts them together on exit, so handling many
+    events takes one PutMetricData request per 1000 data points instead of one per event
+
+    Inside another buffered_metrics(), the metrics are put in the enclosing buffer on exit
+
+    :param put_on_error: whether the metrics are put on exit even if an exception is raised, as they would have been
+                         without the buffer, or dropped, so that retrying the work doesn't put them twice (default is
+                         True)
+    :type put_on_error: bool
+    """
+    enclosing_buffer = getattr(metric_buffers, 'metrics', None)
+    buffer = []
+    metric_buffers.metrics = buffer
+    try:
+        yield
+    except BaseException:
+        metric_buffers.metrics = enclosing_buffer
+        if put_on_error and buffer:
+            put_metrics_in_cloudwatch(buffer)
+        raise
+    metric_buffers.metrics = enclosing_buffer
+    if buffer:
+        put_metrics_in_cloudwatch(buffer)
 
 
 def create_activity_widget(repo_name):
@@ -215,19 +871,47 @@ def create_activity_widget(repo_name):
     :returns: a widget representing the activity data
     :rtype: dict
     """
+    fill_missing_activity_metrics(repo_name)
+
+    namespace = os.environ['namespace']
+    widget_metric_data = [[namespace, metric_name, 'REPO_NAME', repo_name] for metric_name in ACTIVITY_METRIC_NAMES]
+
+    return {
+        'type': 'metric',
+        'width': 6,
+        'height': math.ceil(len(widget_metric_data) / 3) * 3,
+        'properties': {
+            'metrics': widget_metric_data,
+            'view': 'singleValue',
+            'period': 3600 * 24,
+            'stat': 'Sum',
+            'region': os.environ['AWS_REGION'],
+            'title': get_activity_widget_title(repo_name)
+        }
+    }
+
+
+def get_activity_widget_title(repo_name: str) -> str:
+    """Returns the title of a repository's activity widget
+
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :rtype: str
+    """
+    return repo_name + ' Activity Over the Last 24 hours'
+
+
+def fill_missing_activity_metrics(repo_name: str):
+    """Puts a zero for every activity metric that has no data for the repository over the last 24 hours, so the
+    repository shows no activity instead of no data
+
+    :param repo_name: the repository to fill the activity metrics of
+    :type repo_name: str
+    """
     namespace = os.environ['namespace']
-    metric_names = [
-        'PRs Merged',
-        'PRs Closed',
-        'PRs Opened',
-        'Issues Closed',
-        'Issues Opened',
-        'Releases Published',
-        'Pushes to Master'
-    ]
     metric_data_queries = []
-    for index in range(len(metric_names)):
-        metric_name = metric_names[index]
+    for index in range(len(ACTIVITY_METRIC_NAMES)):
+        metric_name = ACTIVITY_METRIC_NAMES[index]
         metric_data_queries.append(
             {
                 'Id': 'm' + str(index),
@@ -247,7 +931,7 @@ def create_activity_widget(repo_name):
                 }
             }
         )
-    response = cloudwatch.get_metric_data(
+    response = aws_clients.get_client('cloudwatch').get_metric_data(
         MetricDataQueries=metric_data_queries,
         StartTime=datetime.now(timezone.utc) - timedelta(days=1),
         EndTime=datetime.now(timezone.utc)
@@ -256,7 +940,20 @@ def create_activity_widget(repo_name):
         if not result['Values']:
             put_metrics_in_cloudwatch([new_metric(repo_name, result['Label'], 0)])
 
-    widget_metric_data = [[namespace, metric_name, 'REPO_NAME', repo_name] for metric_name in metric_names]
+
+def create_rollup_widget(rollups: dict) -> dict:
+    """Creates a widget showing the totals of every owner and repository group
+
+    :param rollups: a mapping of (dimension name, dimension value) to the totals of each metric
+    :type rollups: dict
+    :returns: the dictionary representing the widget
+    :rtype: dict
+    """
+    namespace = os.environ['namespace']
+    widget_metric_data = [[namespace, metric_name, dimension_name, dimension_value,
+                           {'label': dimension_value + ' ' + metric_name}]
+                          for (dimension_name, dimension_value), totals in rollups.items()
+                          for metric_name in totals.keys()]
 
     return {
         'type': 'metric',
@@ -265,9 +962,85 @@ def create_activity_widget(repo_name):
         'properties': {
             'metrics': widget_metric_data,
             'view': 'singleValue',
+            'period': 3600,
+            'stat': 'Maximum',
+            'region': os.environ['AWS_REGION'],
+            'title': 'Totals Across Repositories'
+        }
+    }
+
+
+def create_search_widget(metric_name: str, title: str, stat='Maximum', period=3600) -> dict:
+    """Creates a widget that finds the metric of every repository with a SEARCH expression and shows the top repositories
+
+    The widget doesn't list the repositories, so it doesn't change when repositories are added or removed, and new
+    repositories show up as soon as their metric is published
+
+    :param metric_name: the name of the metric to show
+    :type metric_name: str
+    :param title: the title of the widget
+    :type title: str
+    :param stat: the statistic to show and to sort the repositories by, 'Maximum' or 'Sum' (default is "Maximum")
+    :type stat: Optional[str]
+    :param period: the period of the statistic in seconds (default is 3600)
+    :type period: Optional[int]
+    :returns: the dictionary representing the widget
+    :rtype: dict
+    """
+    search = "SEARCH('{%s,REPO_NAME} MetricName=\"%s\"', '%s', %d)" % (os.environ['namespace'], metric_name, stat,
+                                                                       period)
+    sort_function = 'SUM' if stat == 'Sum' else 'MAX'
+    return {
+        'type': 'metric',
+        'width': 6,
+        'height': 6,
+        'properties': {
+            'metrics': [[{
+                'expression': 'SORT(%s, %s, DESC, %d)' % (search, sort_function, SEARCH_WIDGET_TOP_REPOSITORIES),
+                'id': 'search',
+                'label': "${PROP('Dim.REPO_NAME')}"
+            }]],
+            'view': 'bar',
+            'period': period,
+            'stat': stat,
+            'region': os.environ['AWS_REGION'],
+            'title': title
+        }
+    }
+
+
+def create_activity_search_widgets() -> list:
+    """Creates a search widget for every activity metric, showing the most active repositories over the last 24 hours
+
+    :returns: the list of widgets
+    :rtype: list
+    """
+    return [create_search_widget(metric_name, metric_name + ' Over the Last 24 hours', stat='Sum', period=3600 * 24)
+            for metric_name in ACTIVITY_METRIC_NAMES]
+
+
+def create_traffic_widget(repo_name: str, title=None) -> dict:
+    """Creates a widget graphing the daily clone and view counts published by the traffic history collection
+
+    :param repo_name: the repository to create the widget for
+    :type repo_name: str
+    :param title: the title of the widget (default is None, which titles it with the repository name)
+    :type title: Optional[str]
+    :returns: a widget representing the daily traffic data
+    :rtype: dict
+    """
+    namespace = os.environ['namespace']
+    metric_names = ['Daily Clones', 'Daily Unique Cloners', 'Daily Views', 'Daily Unique Visitors']
+    return {
+        'type': 'metric',
+        'width': 12,
+        'height': 6,
+        'properties': {
+            'metrics': [[namespace, metric_name, 'REPO_NAME', repo_name] for metric_name in metric_names],
+            'view': 'timeSeries',
             'period': 3600 * 24,
-            'stat': 'Sum',
+            'stat': 'Maximum',
             'region': os.environ['AWS_REGION'],
-            'title': repo_name + ' Activity Over the Last 24 hours'
+            'title': title or repo_name + ' Daily Traffic'
         }
     }
@@ -2,18 +2,25 @@ from datetime import datetime
 import json
 import os
 
-import boto3
-
+import aws_clients
 import http_handler as hh
+import traffic_history
 
 
-def aggregate_metrics(owner: str, repo_name: str) -> dict:
+def aggregate_metrics(owner: str, repo_name: str, known_metrics=None, only_metrics=None) -> dict:
     """Aggregates all supported GitHub and Docker metrics for the specified repository
 
     :param owner: the owner of the repository
     :type owner: str
     :param repo_name: the repository name to collect metrics for
     :type repo_name: str
+    :param known_metrics: the values of GitHub metrics that are already known. An endpoint whose metrics are all known
+                          isn't requested and its metrics take the known values, the metrics of a requested endpoint
+                          take the collected ones (default is None)
+    :type known_metrics: Optional[dict]
+    :param only_metrics: the names of the GitHub metrics to collect, without the traffic history and Docker metrics
+                         (default is None, which collects every metric)
+    :type only_metrics: Optional[set]
     :returns: the dictionary containing all the available, requested metrics, sorted by which widget they belong to
     :rtype: dict
     """
@@ -21,13 +28,21 @@ def aggregate_metrics(owner: str, repo_name: str) -> dict:
     github_fields_unpaginated, github_unpgn_param_name_mapping = process_fields('github_fields_unpaginated')
     github_fields_paginated, github_pgn_param_name_mapping = process_fields('github_fields_paginated')
     docker_fields, docker_param_name_mapping = process_fields('docker_fields')
+    if only_metrics is not None:
+        github_fields_unpaginated = {url_ending: {metric_name: api_key for metric_name, api_key in fields_at_url.items()
+                                                  if metric_name in only_metrics}
+                                     for url_ending, fields_at_url in github_fields_unpaginated.items()}
+        github_fields_unpaginated = {url_ending: fields_at_url
+                                     for url_ending, fields_at_url in github_fields_unpaginated.items() if fields_at_url}
+        github_fields_paginated = {metric_name: url_ending for metric_name, url_ending in github_fields_paginated.items()
+                                   if metric_name in only_metrics}
 
     param_to_name = github_unpgn_param_name_mapping
     param_to_name.update(github_pgn_param_name_mapping)
     param_to_name.update(docker_param_name_mapping)
 
     github_headers = {
-        'Authorization': "token " + boto3.client('secretsmanager').get_secret_value(
+        'Authorization': "token " + aws_clients.get_client('secretsmanager').get_secret_value(
             SecretId="github_auth_token")['SecretString'],
         'Accept': 'application/vnd.github.nebula-preview+json',
         'User-Agent': os.environ['user_agent_header']
@@ -39,16 +54,41 @@ def aggregate_metrics(owner: str, repo_name: str) -> dict:
     github_url = 'https://api.github.com/repos/' + owner + '/'
     github_unpgn_data = {}
 
-    for url_ending in github_fields_unpaginated.keys():
+    known_metrics = known_metrics or {}
+    for url_ending, fields_at_url in github_fields_unpaginated.items():
+        if all(metric_name in known_metrics for metric_name in fields_at_url.keys()):
+            continue
         request_param = None if url_ending == 'None' else url_ending
         github_unpgn_data[url_ending] = retrieve_unpaginated_metrics(github_url,
                                                                      repo_name,
                                                                      headers=github_headers,
                                                                      param=request_param)
 
-    github_unpgn_requested_metrics, github_unpgn_text_data = verify_and_retrieve_metric_data(github_fields_unpaginated,
-                                                                                             github_unpgn_data,
-                                                                                             repo_name)
+    if os.environ.get('traffic_history') == 'y' and only_metrics is None:
+        # The per-day breakdown comes with the 14 day totals, so only request the endpoints that aren't already fetched
+        traffic_data = {}
+        for endpoint in traffic_history.TRAFFIC_ENDPOINTS.keys():
+            if endpoint in github_unpgn_data.keys():
+                traffic_data[endpoint] = github_unpgn_data[endpoint]
+            else:
+                traffic_data[endpoint] = retrieve_unpaginated_metrics(github_url, repo_name, headers=github_headers,
+                                                                      param=endpoint)
+        # Losing the repository's traffic history for this run mustn't lose its metrics or the other repositories
+        try:
+            traffic_history.publish_traffic_history(owner, repo_name, traffic_data)
+        except Exception as error:
+            print('Failed to publish the traffic history of %s/%s. Unexpected error occurred: %r'
+                  % (owner, repo_name, error))
+
+    requested_fields_unpaginated = {url_ending: fields_at_url
+                                    for url_ending, fields_at_url in github_fields_unpaginated.items()
+                                    if url_ending in github_unpgn_data.keys()}
+    github_unpgn_requested_metrics, github_unpgn_text_data = verify_and_retrieve_metric_data(
+        requested_fields_unpaginated, github_unpgn_data, repo_name)
+    github_unpgn_requested_metrics.update({metric_name: known_metrics[metric_name]
+                                           for url_ending, fields_at_url in github_fields_unpaginated.items()
+                                           if url_ending not in github_unpgn_data.keys()
+                                           for metric_name in fields_at_url.keys()})
     github_pgn_requested_metrics = retrieve_paginated_metrics(github_url,
                                                               repo_name,
                                                               github_fields_paginated,
@@ -58,7 +98,7 @@ def aggregate_metrics(owner: str, repo_name: str) -> dict:
     requested_metric_data.update(github_pgn_requested_metrics)
     requested_text_data.update(github_unpgn_text_data)
 
-    include_docker = os.environ['docker_bool'] == 'y'
+    include_docker = os.environ['docker_bool'] == 'y' and only_metrics is None
     if include_docker:
         docker_data = {}
         docker_url = 'https://hub.docker.com/v2/repositories/amazon/'
@@ -74,16 +114,19 @@ def aggregate_metrics(owner: str, repo_name: str) -> dict:
         requested_metric_data.update(docker_requested_metrics)
         requested_text_data.update(docker_requested_text_data)
 
-    return sort_metrics_by_widget(requested_metric_data, requested_text_data, param_to_name)
+    return sort_metrics_by_widget(requested_metric_data, requested_text_data, param_to_name, only_metrics)
 
 
-def sort_metrics_by_widget(requested_metric_data: dict, requested_text_data: dict, param_to_name: dict) -> dict:
+def sort_metrics_by_widget(requested_metric_data: dict, requested_text_data: dict, param_to_name: dict,
+                           only_metrics=None) -> dict:
     """Sorts all metrics into a dictionary corresponding to the widget they belong to
 
     :param requested_metric_data: a dictionary of the numeric metrics
     :type requested_metric_data: dict
     :param requested_text_data: a dictionary of the text metrics
     :type requested_text_data: dict
+    :param only_metrics: the names of the metrics that were collected (default is None, meaning every metric)
+    :type only_metrics: Optional[set]
     :returns: the dictionary containing all the available, requested metrics, sorted by which widget they belong to
     :rtype: dict
     """
@@ -102,14 +145,14 @@ def sort_metrics_by_widget(requested_metric_data: dict, requested_text_data: dic
             elif name in requested_text_data.keys():
                 metric_values[name] = requested_text_data[name]
                 requested_text_data.pop(name)
-            else:
+            elif only_metrics is None or name in only_metrics:
                 print('Requested metric ' + name + ' could not be retrieved.')
 
         if metric_values:
             sorted_metrics[widget_title] = {'type': widget_data['type'],
                                             'dashboard_level': dashboard_level,
                                             'data': metric_values}
-        else:
+        elif only_metrics is None:
             print('No valid metrics for widget ' + widget_title + '.')
 
     if requested_metric_data:
@@ -0,0 +1,150 @@
+import json
+import os
+import re
+
+import cloudwatch_interactions as cw_interactions
+
+
+def update_dashboards(widgets: dict, superseded_widgets=None) -> dict:
+    """Reconciles the dashboards with the widgets and reports the dashboards that failed to update
+
+    :param widgets: a mapping of the dashboard name to its list of widgets
+    :type widgets: dict
+    :param superseded_widgets: a mapping of the dashboard name to the identities of the generated widgets to remove
+                               (see get_superseded_widgets()) (default is None)
+    :type superseded_widgets: Optional[dict]
+    :returns: a mapping of the name of each dashboard page to its result (see
+              cw_interactions.create_or_update_dashboard())
+    :rtype: dict
+    """
+    if not widgets:
+        print('No valid widgets, dashboard cannot be created.')
+        return {}
+
+    dashboard_results = cw_interactions.create_or_update_dashboard(widgets, get_dashboard_properties(),
+                                                                   superseded_widgets)
+    for dashboard_name, result in dashboard_results.items():
+        if result['status'] == cw_interactions.FAILED:
+            print('Dashboard ' + dashboard_name + ' was not updated: ' + result['error'])
+    return dashboard_results
+
+
+def get_failed_dashboards(dashboard_names, dashboard_results: dict) -> set:
+    """Returns the dashboards that have a page that failed to update
+
+    :param dashboard_names: the names of the dashboards that were updated
+    :type dashboard_names: Iterable[str]
+    :param dashboard_results: a mapping of the name of each dashboard page to its result
+    :type dashboard_results: dict
+    :returns: the names of the dashboards that failed
+    :rtype: set
+    """
+    failed_pages = [page_name for page_name, result in dashboard_results.items()
+                    if result['status'] == cw_interactions.FAILED]
+    return {dashboard_name for dashboard_name in dashboard_names
+            if any(re.fullmatch(re.escape(dashboard_name) + r'(-page-\d+)?', page_name) for page_name in failed_pages)}
+
+
+def get_repo_names() -> list:
+    """Returns the names of the repositories without their owners, in the order they are configured
+
+    :rtype: list
+    """
+    return [repo_name.split('/')[-1] for repo_name in os.environ['repo_names'].split(',')]
+
+
+def get_details_dashboard_name(repo_name: str) -> str:
+    """Returns the name of the dashboard that holds the details widgets of a repository
+
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :returns: the name of the shared details dashboard if it is enabled, otherwise the repository's own details dashboard
+    :rtype: str
+    """
+    if os.environ.get('shared_details_dashboard') == 'y':
+        return os.environ['dashboard_name_prefix'] + '-details'
+    return os.environ['dashboard_name_prefix'] + '-' + repo_name
+
+
+def get_metric_widget_title(repo_name: str, widget_title: str) -> str:
+    """Returns the title of a repository's metric widget
+
+    :param repo_name: the name of the repository, or the placeholder on a shared details dashboard
+    :type repo_name: str
+    :param widget_title: the title of the widget the metrics are sorted into
+    :type widget_title: str
+    :rtype: str
+    """
+    if widget_title == os.environ['default_metric_widget_name']:
+        return repo_name
+    return repo_name + ' ' + widget_title
+
+
+def get_search_widget_title(metric_name: str) -> str:
+    """Returns the title of the search widget of a metric on the main dashboard
+
+    :param metric_name: the name of the metric
+    :type metric_name: str
+    :rtype: str
+    """
+    return metric_name + ' by Repository'
+
+
+def get_superseded_widgets(widgets: dict) -> dict:
+    """Returns the generated widgets that the widgets replace because of the dashboard settings
+
+    Search widgets replace the metric and activity widgets of every repository on the main dashboard, and the other way
+    round. The widgets of a shared details dashboard replace the ones built before their titles held the placeholder.
+    Widgets of the text types replace each other by themselves (see cw_interactions.merge_widgets())
+
+    :param widgets: a mapping of the dashboard name to its list of widgets, as planned by the hourly run
+    :type widgets: dict
+    :returns: a mapping of the dashboard name to the identities (see cw_interactions.widget_identity()) of the widgets
+              to remove
+    :rtype: dict
+    """
+    superseded_widgets = {}
+    main_dashboard_name = os.environ['dashboard_name_prefix']
+    main_identities = superseded_widgets.setdefault(main_dashboard_name, set())
+    if os.environ.get('search_widgets') == 'y':
+        main_widget_titles = [widget_title for widget_title, widget in json.loads(os.environ['widgets']).items()
+                              if widget['type'] == 'metric' and widget.get('dashboard_level') == 'main']
+        for repo_name in get_repo_names():
+            main_identities.add(('metric', cw_interactions.get_activity_widget_title(repo_name)))
+            main_identities.update(('metric', get_metric_widget_title(repo_name, widget_title))
+                                   for widget_title in main_widget_titles)
+    else:
+        main_identities.update(cw_interactions.widget_identity(widget)
+                               for widget in cw_interactions.create_activity_search_widgets())
+        main_identities.update(('metric', get_search_widget_title(metric[1]))
+                               for widget in widgets.get(main_dashboard_name, []) if widget.get('type') == 'metric'
+                               for metric in widget['properties']['metrics'] if len(metric) > 1)
+
+    for dashboard_name, dashboard_widgets in widgets.items():
+        for widget in dashboard_widgets:
+            identity = cw_interactions.widget_identity(widget)
+            if identity is None or cw_interactions.REPOSITORY_PLACEHOLDER not in identity[1]:
+                continue
+            [widget_type, title] = identity
+            title = title.replace(cw_interactions.REPOSITORY_PLACEHOLDER, get_repo_names()[0])
+            widget_types = cw_interactions.TEXT_WIDGET_TYPES if widget_type in cw_interactions.TEXT_WIDGET_TYPES \
+                else [widget_type]
+            superseded_widgets.setdefault(dashboard_name, set()).update((other_type, title)
+                                                                        for other_type in widget_types)
+    return superseded_widgets
+
+
+def get_dashboard_properties() -> dict:
+    """Returns the properties to set on the dashboards besides their widgets
+
+    :returns: a mapping of the dashboard name to its properties
+    :rtype: dict
+    """
+    if os.environ.get('shared_details_dashboard') != 'y':
+        return {}
+
+    return {
+        get_details_dashboard_name(''): {
+            'variables': cw_interactions.create_repository_variables(get_repo_names())
+        }
+    }
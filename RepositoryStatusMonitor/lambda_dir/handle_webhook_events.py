@@ -2,60 +2,60 @@ import datetime
 import math
 import os
 
-import boto3
-
 import cloudwatch_interactions as cw_interactions
-import http_handler as hh
+import dashboards
+import release_history
+import repository_counters
+import response_markers
+import webhook_messages
 
 
 def handle_webhook(payload: dict) -> dict:
     """Based on what type of webhook event is posted, calls separate handling functions
 
-    :param payload: the payload of the POST request coming from the webhook
+    :param payload: the compact message of the webhook event (see webhook_messages.MESSAGE_FIELDS), or the full payload
+                    of the POST request coming from the webhook
     :type payload: dict
     :returns: the widget representing the metric that the event is for or an empty dictionary if no widget is created
     :rtype: dict
     """
-    dashboard_name_prefix = os.environ['dashboard_name_prefix']
-    if 'issue' in payload.keys():
-        return handle_issues(payload, dashboard_name_prefix)
-    elif 'pull_request' in payload.keys():
-        return handle_prs(payload, dashboard_name_prefix)
-    elif 'release' in payload.keys():
-        return handle_releases(payload, dashboard_name_prefix)
-    elif 'pusher' in payload.keys():
-        return handle_pushes(payload)
-    return {}
+    if 'event' not in payload:
+        payload = webhook_messages.compact_payload(payload)
+
+    if not webhook_messages.is_handled(payload):
+        return {}
+
+    return EVENT_HANDLERS[payload['event']](payload, os.environ['dashboard_name_prefix'])
 
 
 def handle_prs(payload: dict, dashboard_name_prefix: str) -> dict:
     """Handles pull request webhook events
 
-    :param payload: the payload of the POST request coming from the webhook
+    :param payload: the compact message of the webhook event
     :type payload: dict
-    :param dashboard_name_prefix: the dashboard name prefix to use for the widget
+    :param dashboard_name_prefix: the dashboard name prefix, unused because the widget goes on the repository's details
+                                  dashboard (see dashboards.get_details_dashboard_name())
     :type dashboard_name_prefix: str
     :returns: the widget representing the metric that the event is for or an empty dictionary if no widget is created
     :rtype: dict
     """
     labels = {
-        'key': 'pull_request',
         'name': 'Pull Request Duration',
         'title': ' Pull Requests',
         'id': 'pullrequests'
     }
     if payload['action'] == 'closed':
-        if payload['pull_request']['merged']:
-            pr_merged_metric = cw_interactions.new_metric(payload['repository']['name'], 'PRs Merged', 1)
+        if payload['merged'] == 'true':
+            pr_merged_metric = cw_interactions.new_metric(payload['repo_name'], 'PRs Merged', 1)
             cw_interactions.put_metrics_in_cloudwatch([pr_merged_metric])
 
-        pr_closed_metric = cw_interactions.new_metric(payload['repository']['name'], 'PRs Closed', 1)
+        pr_closed_metric = cw_interactions.new_metric(payload['repo_name'], 'PRs Closed', 1)
         cw_interactions.put_metrics_in_cloudwatch([pr_closed_metric])
 
-        return create_issue_or_pr_widget(payload, labels, dashboard_name_prefix)
+        return create_issue_or_pr_widget(payload, labels)
 
     if payload['action'] == 'opened':
-        pr_opened_metric = cw_interactions.new_metric(payload['repository']['name'], 'PRs Opened', 1)
+        pr_opened_metric = cw_interactions.new_metric(payload['repo_name'], 'PRs Opened', 1)
         cw_interactions.put_metrics_in_cloudwatch([pr_opened_metric])
 
     return {}
@@ -64,110 +64,233 @@ def handle_prs(payload: dict, dashboard_name_prefix: str) -> dict:
 def handle_issues(payload: dict, dashboard_name_prefix: str) -> dict:
     """Handles issue webhook events
 
-    :param payload: the payload of the POST request coming from the webhook
+    :param payload: the compact message of the webhook event
     :type payload: dict
-    :param dashboard_name_prefix: the dashboard name prefix to use for the widget
+    :param dashboard_name_prefix: the dashboard name prefix, unused because the widget goes on the repository's details
+                                  dashboard (see dashboards.get_details_dashboard_name())
     :type dashboard_name_prefix: str
     :returns: the widget representing the metric that the event is for or an empty dictionary if no widget is created
     :rtype: dict
     """
     labels = {
-        'key': 'issue',
         'name': 'Issue Duration',
         'title': ' Issues',
         'id': 'issues'
     }
     if payload['action'] == 'closed':
-        issue_closed_metric = cw_interactions.new_metric(payload['repository']['name'], 'Issues Closed', 1)
+        issue_closed_metric = cw_interactions.new_metric(payload['repo_name'], 'Issues Closed', 1)
         cw_interactions.put_metrics_in_cloudwatch([issue_closed_metric])
 
-        return create_issue_or_pr_widget(payload, labels, dashboard_name_prefix)
+        return create_issue_or_pr_widget(payload, labels)
 
     if payload['action'] == 'opened':
-        issue_opened_metric = cw_interactions.new_metric(payload['repository']['name'], 'Issues Opened', 1)
+        issue_opened_metric = cw_interactions.new_metric(payload['repo_name'], 'Issues Opened', 1)
         cw_interactions.put_metrics_in_cloudwatch([issue_opened_metric])
 
     return {}
 
 
-def create_issue_or_pr_widget(payload: dict, labels: dict, dashboard_name_prefix: str) -> dict:
+def handle_responses(payload: dict, dashboard_name_prefix: str) -> dict:
+    """Handles issue comment and pull request review webhook events by measuring the time from an issue or PR being
+    opened to its first response
+
+    Comments and reviews by the author or by bots aren't responses, and comments on pull requests are left to their
+    reviews. Each item is marked as responded to in the state table, so only its first response is measured
+
+    :param payload: the compact message of the webhook event
+    :type payload: dict
+    :param dashboard_name_prefix: the dashboard name prefix, unused because the widget goes on the repository's details
+                                  dashboard (see dashboards.get_details_dashboard_name())
+    :type dashboard_name_prefix: str
+    :returns: the widget representing the metric or an empty dictionary if the event isn't a first response
+    :rtype: dict
+    """
+    if payload['event'] == 'pull_request_review':
+        item = 'pull_request'
+        labels = {
+            'name': 'Time to First Review',
+            'title': ' Pull Request Reviews',
+            'id': 'pullrequestreviews'
+        }
+    else:
+        item = 'issue'
+        labels = {
+            'name': 'Time to First Response',
+            'title': ' Issue Responses',
+            'id': 'issueresponses'
+        }
+    if payload['event'] == 'issue_comment' and payload.get('pull_request_url'):
+        return {}
+    if payload.get('sender') == payload.get('author') or payload.get('sender_type') == 'Bot':
+        return {}
+    if not payload.get('number') or not payload.get('created_at') or not payload.get('responded_at'):
+        return {}
+
+    time_format = '%Y-%m-%dT%H:%M:%SZ'
+    elapsed_time = datetime.datetime.strptime(payload['responded_at'], time_format) - \
+        datetime.datetime.strptime(payload['created_at'], time_format)
+    ttl_seconds = response_markers.MAX_RESPONSE_SECONDS - math.ceil(elapsed_time.total_seconds())
+    repo_name = payload['repo_name']
+    if ttl_seconds <= 0:
+        print('Response to ' + item + ' ' + payload['number'] + ' of ' + repo_name + ' was too late to be measured')
+        return {}
+
+    owner = payload.get('owner') or os.environ['owner']
+    holder = response_markers.mark_responded(owner, repo_name, item, payload['number'], ttl_seconds)
+    if not holder:
+        return {}
+    try:
+        return create_issue_or_pr_widget(payload, labels, end_field='responded_at')
+    except Exception:
+        # The event is retried, and measures the response again
+        response_markers.unmark_responded(owner, repo_name, item, payload['number'], holder)
+        raise
+
+
+def create_issue_or_pr_widget(payload: dict, labels: dict, end_field='closed_at') -> dict:
     """Calculates the duration of an issue or PR and creates a widget representing the graph
 
-    :param payload: the payload of the POST request coming from the webhook
+    :param payload: the compact message of the webhook event
     :type payload: dict
-    :param labels: the payload key, metric name, and widget title for the webhook event
+    :param labels: the metric name, widget title, and widget id for the webhook event
     :type labels: dict
-    :param dashboard_name_prefix: the dashboard name prefix to use for the widget
-    :type dashboard_name_prefix: str
+    :param end_field: the message field of the time the duration ends at (default is 'closed_at')
+    :type end_field: str
     :returns: the widget representing the metric
     :rtype: dict
     """
     time_format = '%Y-%m-%dT%H:%M:%SZ'
-    time_closed = datetime.datetime.strptime(payload[labels['key']]['closed_at'], time_format)
-    time_created = datetime.datetime.strptime(payload[labels['key']]['created_at'], time_format)
+    time_closed = datetime.datetime.strptime(payload[end_field], time_format)
+    time_created = datetime.datetime.strptime(payload['created_at'], time_format)
 
     elapsed_time = time_closed - time_created
-    repo_name = payload['repository']['name']
     data = {labels['name']: math.ceil(elapsed_time.total_seconds())}
-    cw_metric = cw_interactions.create_metric_widget(repo_name, data, title=repo_name + labels['title'],
-                                                     view='timeSeries', id_str=labels['id'], granularity='hours')
-    widget = {
-        dashboard_name_prefix + '-' + repo_name: [cw_metric]
+    return create_details_widget(payload['repo_name'], data, labels['title'], labels['id'], 'hours')
+
+
+def create_details_widget(repo_name: str, data: dict, title_suffix: str, id_str: str, granularity: str) -> dict:
+    """Publishes the metric data of a webhook event and creates a graph of it for the repository's details dashboard
+
+    On a shared details dashboard the graph is built for the first repository with the placeholder in its title, like
+    the hourly run builds the dashboard's other widgets, and the dashboard variables switch it to the others
+
+    :param repo_name: the name of the repository the data belongs to
+    :type repo_name: str
+    :param data: a mapping of the metric names to their values
+    :type data: dict
+    :param title_suffix: the widget title that follows the repository name
+    :type title_suffix: str
+    :param id_str: the id of the metric in the widget's expression
+    :type id_str: str
+    :param granularity: the unit the expression shows the metric in
+    :type granularity: str
+    :returns: a mapping of the details dashboard name to the widget
+    :rtype: dict
+    """
+    shared = os.environ.get('shared_details_dashboard') == 'y'
+    widget_repo_name = repo_name
+    title_repo_name = repo_name
+    if shared:
+        # The widget shows another repository's metrics, so the data is published on its own
+        cw_interactions.publish_widget_metrics(repo_name, data)
+        widget_repo_name = dashboards.get_repo_names()[0]
+        title_repo_name = cw_interactions.REPOSITORY_PLACEHOLDER
+
+    cw_metric = cw_interactions.create_metric_widget(widget_repo_name, data, title=title_repo_name + title_suffix,
+                                                     view='timeSeries', id_str=id_str, granularity=granularity,
+                                                     publish=not shared)
+    return {
+        dashboards.get_details_dashboard_name(repo_name): [cw_metric]
     }
-    return widget
 
 
 def handle_releases(payload: dict, dashboard_name_prefix: str) -> dict:
     """Calculates the time between releases and creates a widget representing the graph
 
-    :param payload: the payload of the POST request coming from the webhook
+    The release before is looked up in the release history of the repository, so GitHub is only asked for it the first
+    time. A release that was already recorded isn't counted again
+
+    :param payload: the compact message of the webhook event
     :type payload: dict
-    :param dashboard_name_prefix: the dashboard name prefix to use for the widget
+    :param dashboard_name_prefix: the dashboard name prefix, unused because the widget goes on the repository's details
+                                  dashboard (see dashboards.get_details_dashboard_name())
     :type dashboard_name_prefix: str
     :returns: the widget representing the metric
     :rtype: dict
     """
     if payload['action'] == 'published':
-        releases_metric = cw_interactions.new_metric(payload['repository']['name'], 'Releases Published', 1)
+        repo_name = payload['repo_name']
+        recorded, previous_published_at = release_history.record_release(payload['owner'], repo_name,
+                                                                         payload['published_at'])
+        if not recorded:
+            print('Release of ' + repo_name + ' published at ' + payload['published_at'] + ' was already recorded')
+            return {}
+
+        releases_metric = cw_interactions.new_metric(repo_name, 'Releases Published', 1)
         cw_interactions.put_metrics_in_cloudwatch([releases_metric])
 
-        token = boto3.client('secretsmanager').get_secret_value(SecretId='github_auth_token')['SecretString']
-        headers = {
-            'Authorization': 'token ' + token,
-            'Accept': 'application/vnd.github.nebula-preview+json',
-            'User-Agent': os.environ['user_agent_header']}
-        repo_name = payload['repository']['name']
-        url = 'https://api.github.com/repos/' + payload['repository']['owner']['login'] + '/' + repo_name + '/releases'
-
-        success, http_data, response_headers = hh.request_handler(url, headers=headers)
-
-        if success and len(http_data) > 1:
-            last_release = http_data[1]
-
+        if previous_published_at:
             time_format = '%Y-%m-%dT%H:%M:%SZ'
-            time_end = datetime.datetime.strptime(payload['release']['published_at'], time_format)
-            time_start = datetime.datetime.strptime(last_release['published_at'], time_format)
+            time_end = datetime.datetime.strptime(payload['published_at'], time_format)
+            time_start = datetime.datetime.strptime(previous_published_at, time_format)
             elapsed_time = time_end - time_start
 
             data = {'Time Between Releases': math.ceil(elapsed_time.total_seconds())}
-            widget = {
-                dashboard_name_prefix + '-' + repo_name: [
-                    cw_interactions.create_metric_widget(repo_name, data, title=repo_name + ' Releases',
-                                                         view='timeSeries', id_str='releases', granularity='days')]
-            }
-            return widget
+            return create_details_widget(repo_name, data, ' Releases', 'releases', 'days')
     return {}
 
 
-def handle_pushes(payload: dict) -> dict:
+def handle_pushes(payload: dict, dashboard_name_prefix: str) -> dict:
     """Handles push webhook events
 
-    :param payload: the payload of the POST request coming from the webhook
+    :param payload: the compact message of the webhook event
     :type payload: dict
+    :param dashboard_name_prefix: the dashboard name prefix, unused because no widget is created for pushes
+    :type dashboard_name_prefix: str
     :returns: an empty widget because no widget is created for pushes
     :rtype: dict
     """
     if payload['ref'] == 'refs/heads/master':
-        pushes_metric = cw_interactions.new_metric(payload['repository']['name'], 'Pushes to Master', 1)
+        pushes_metric = cw_interactions.new_metric(payload['repo_name'], 'Pushes to Master', 1)
         cw_interactions.put_metrics_in_cloudwatch([pushes_metric])
     return {}
+
+
+def handle_repository_counters(payload: dict, dashboard_name_prefix: str) -> dict:
+    """Handles watch, star, fork and public webhook events by publishing the repository counters they carry
+
+    The counters are published as they are in the event instead of being counted up, so duplicate events can't skew
+    them. An event delivered out of order can still publish and store an older value, so the hourly run stays
+    authoritative: it replaces the stored counters with the ones it collects whenever it requests their endpoint
+
+    :param payload: the compact message of the webhook event
+    :type payload: dict
+    :param dashboard_name_prefix: the dashboard name prefix, unused because the counters' widgets are created by the
+                                  hourly run
+    :type dashboard_name_prefix: str
+    :returns: an empty widget because no widget is created for counters
+    :rtype: dict
+    """
+    counters = {metric_name: int(payload[github_field])
+                for github_field, metric_name in repository_counters.get_counter_metric_names().items()
+                if str(payload.get(github_field, '')).isdigit()}
+    if counters:
+        cw_interactions.put_metrics_in_cloudwatch([cw_interactions.new_metric(payload['repo_name'], metric_name, value)
+                                                   for metric_name, value in counters.items()])
+        repository_counters.save_counters(payload.get('owner') or os.environ['owner'], payload['repo_name'], counters)
+    return {}
+
+
+# The functions handling each of the webhook events in webhook_messages.HANDLED_EVENTS
+EVENT_HANDLERS = {
+    'issues': handle_issues,
+    'pull_request': handle_prs,
+    'issue_comment': handle_responses,
+    'pull_request_review': handle_responses,
+    'release': handle_releases,
+    'push': handle_pushes,
+    'watch': handle_repository_counters,
+    'star': handle_repository_counters,
+    'fork': handle_repository_counters,
+    'public': handle_repository_counters
+}
@@ -0,0 +1,466 @@
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import threading
+import uuid
+
+import aws_clients
+import cloudwatch_interactions as cw_interactions
+import http_handler as hh
+import state_store
+
+# The listings walked for each repository: the request that returns the entries oldest first, the request that returns
+# them newest first if GitHub has one, the media type whose entries carry a timestamp, the timestamp field, and the
+# GitHub field (and its default display name) the history of the listing is published as
+LISTINGS = {
+    'stargazers': {
+        'url_ending': 'stargazers',
+        'http_fields': {},
+        'newest_first_http_fields': None,
+        'accept': 'application/vnd.github.v3.star+json',
+        'timestamp_field': 'starred_at',
+        'github_field': 'stargazers_count',
+        'default_metric_name': 'GitHub Stars'
+    },
+    'forks': {
+        'url_ending': 'forks',
+        'http_fields': {'sort': 'oldest'},
+        'newest_first_http_fields': {'sort': 'newest'},
+        'accept': 'application/vnd.github.v3+json',
+        'timestamp_field': 'created_at',
+        'github_field': 'forks_count',
+        'default_metric_name': 'Forks'
+    }
+}
+
+PER_PAGE = 100
+# The number of pages of one listing requested at the same time
+PAGE_WORKERS = 4
+# Requests of the hourly GitHub rate limit that the backfill leaves for the metric collection
+RATE_LIMIT_RESERVE = 500
+# The time left in the invocation at which the backfill saves its progress and continues in a new invocation
+TIME_RESERVE_MS = 60 * 1000
+# How long an invocation holds the lease on the repository it backfills. The longest timeout Lambda allows, so the lease
+# of an invocation that was stopped expires by itself before the next hourly run
+BACKFILL_LEASE_SECONDS = 15 * 60
+
+DAY_FORMAT = '%Y-%m-%d'
+
+COMPLETE = 'complete'
+RATE_LIMITED = 'rate_limited'
+OUT_OF_TIME = 'out_of_time'
+FAILED = 'failed'
+LEASED = 'leased'
+
+
+def handler(event, context) -> None:
+    """Called when the Lambda function is invoked, backfills the star and fork history of the repositories
+
+    The launch script invokes the function after every deployment and a rule invokes it hourly. Repositories that are
+    already backfilled are skipped, so only newly added repositories are walked, and a backfill that stopped at the
+    GitHub rate limit continues from where it left off once the limit resets. A backfill that runs out of time continues
+    straight away in a new invocation. Repositories that another invocation is backfilling are skipped
+
+    :param event: information about what is invoking the function, optionally containing 'repo_names' to backfill only
+                  some of the repositories and 'force' to backfill them again from the start
+    :type event: usually dict, but can also be list, str, int, float, NoneType
+    :param context: information provided by AWS Lambda about the invocation, function, and execution environment
+    :type context: LambdaContext
+    """
+    event = event if isinstance(event, dict) else {}
+    repo_names = (event.get('repo_names') or os.environ['repo_names']).split(',')
+    github_token = aws_clients.get_client('secretsmanager').get_secret_value(
+        SecretId="github_auth_token")['SecretString']
+
+    for index, full_repo_name in enumerate(repo_names):
+        owner = os.environ['owner']
+        repo_name = full_repo_name
+        if '/' in repo_name:
+            [owner, repo_name] = repo_name.split('/')
+
+        result = backfill_repository(owner, repo_name, github_token, context, force=event.get('force', False))
+        print('Backfill of %s/%s: %s' % (owner, repo_name, result))
+        if result == OUT_OF_TIME:
+            # The progress is saved, so the new invocation must not start the repository over even if forced
+            continue_in_new_invocation(context, {'repo_names': ','.join(repo_names[index:])})
+            return
+        if result == RATE_LIMITED:
+            print('Stopping until the GitHub rate limit resets, the next scheduled run continues the backfill')
+            return
+
+
+def backfill_repository(owner: str, repo_name: str, github_token: str, context, force=False) -> str:
+    """Walks the stargazers and forks of the repository at the same time and publishes their history once both are
+    walked to the end
+
+    Progress is saved in the state table after every batch of pages, so a backfill that stops for any reason resumes
+    from the last saved page. The repository is leased while it is walked, so the hourly run and an invocation
+    continuing a backfill that ran out of time never walk it at the same time
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the repository to backfill
+    :type repo_name: str
+    :param github_token: the token to authenticate the GitHub requests with
+    :type github_token: str
+    :param context: information provided by AWS Lambda about the invocation, used to stop before the function times out
+    :type context: LambdaContext
+    :param force: whether to discard any saved progress and backfill the repository from the start (default is False)
+    :type force: Optional[bool]
+    :returns: COMPLETE, RATE_LIMITED, OUT_OF_TIME, FAILED, or LEASED if another invocation is backfilling the
+              repository
+    :rtype: str
+    """
+    state_key = 'backfill#' + owner + '/' + repo_name
+    if not force and state_store.get_state(state_key).get('published'):
+        return COMPLETE
+
+    lease_key = 'backfill-lease#' + owner + '/' + repo_name
+    lease_holder = str(uuid.uuid4())
+    if not state_store.acquire_lease(lease_key, lease_holder, BACKFILL_LEASE_SECONDS):
+        return LEASED
+    try:
+        return backfill_leased_repository(owner, repo_name, github_token, context, force)
+    finally:
+        state_store.release_lease(lease_key, lease_holder)
+
+
+def backfill_leased_repository(owner: str, repo_name: str, github_token: str, context, force: bool) -> str:
+    """Backfills a repository whose lease is held (see backfill_repository())
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the repository to backfill
+    :type repo_name: str
+    :param github_token: the token to authenticate the GitHub requests with
+    :type github_token: str
+    :param context: information provided by AWS Lambda about the invocation, used to stop before the function times out
+    :type context: LambdaContext
+    :param force: whether to discard any saved progress and backfill the repository from the start
+    :type force: bool
+    :returns: COMPLETE, RATE_LIMITED, OUT_OF_TIME or FAILED
+    :rtype: str
+    """
+    state_key = 'backfill#' + owner + '/' + repo_name
+    # Read again under the lease, another invocation may have made progress or published the history meanwhile
+    progress = {} if force else state_store.get_state(state_key)
+    if progress.get('published'):
+        return COMPLETE
+
+    for listing_name in LISTINGS.keys():
+        progress.setdefault(listing_name, {'next_page': 1, 'last_page': None, 'days': {}, 'complete': False})
+
+    progress_lock = threading.Lock()
+
+    def save_progress(listing_name: str, listing_progress: dict):
+        with progress_lock:
+            progress[listing_name] = listing_progress
+            state_store.put_state(state_key, progress)
+
+    with ThreadPoolExecutor(max_workers=len(LISTINGS)) as executor:
+        futures = [executor.submit(walk_listing, owner, repo_name, github_token, listing_name, progress[listing_name],
+                                   save_progress, context)
+                   for listing_name in LISTINGS.keys()]
+        results = [future.result() for future in futures]
+
+    for result in (RATE_LIMITED, OUT_OF_TIME, FAILED):
+        if result in results:
+            return result
+
+    publish_history(owner, repo_name, progress)
+    progress['published'] = True
+    state_store.put_state(state_key, progress)
+    return COMPLETE
+
+
+def walk_listing(owner: str, repo_name: str, github_token: str, listing_name: str, progress: dict, save_progress,
+                 context) -> str:
+    """Requests the pages of a listing a batch at a time, starting from the saved progress, and counts the entries of
+    each day
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the repository the listing belongs to
+    :type repo_name: str
+    :param github_token: the token to authenticate the GitHub requests with
+    :type github_token: str
+    :param listing_name: the key of the listing in LISTINGS
+    :type listing_name: str
+    :param progress: the saved progress of the listing, its next and last page, entries per day and whether it is done.
+                     A listing truncated by GitHub is walked again newest first if it can be, which adds the entries per
+                     day from that end and the total number of entries the newest ones are counted back from
+    :type progress: dict
+    :param save_progress: called with the listing name and its new progress after every batch of pages
+    :type save_progress: Callable[[str, dict], None]
+    :param context: information provided by AWS Lambda about the invocation
+    :type context: LambdaContext
+    :returns: COMPLETE, RATE_LIMITED, OUT_OF_TIME or FAILED
+    :rtype: str
+    """
+    listing = LISTINGS[listing_name]
+    repo_url = 'https://api.github.com/repos/' + owner + '/' + repo_name
+    url = repo_url + '/' + listing['url_ending']
+    headers = {
+        'Authorization': 'token ' + github_token,
+        'Accept': listing['accept'],
+        'User-Agent': os.environ['user_agent_header']
+    }
+
+    next_page = progress['next_page']
+    last_page = progress['last_page']
+    days = dict(progress['days'])
+    truncated = progress.get('truncated', False)
+    newest_first = progress.get('newest_first', False)
+    newest_days = dict(progress.get('newest_days', {}))
+    total = progress.get('total')
+    complete = progress['complete']
+
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        while not complete:
+            http_fields = listing['newest_first_http_fields'] if newest_first else listing['http_fields']
+            # The first page is needed on its own to learn how many pages there are
+            if last_page is None:
+                pages = [next_page]
+            else:
+                pages = list(range(next_page, min(next_page + PAGE_WORKERS, last_page + 1)))
+
+            responses = list(executor.map(lambda page: request_page(url, headers, http_fields, page), pages))
+
+            result = None
+            for page, (success, data, response_headers) in zip(pages, responses):
+                if not success:
+                    if is_pagination_limit(data):
+                        # GitHub stops serving the stargazers of very popular repositories after 400 pages
+                        print('%s of %s/%s are only listed up to page %d' % (listing_name, owner, repo_name, page - 1))
+                        truncated = True
+                        if listing['newest_first_http_fields'] and not newest_first:
+                            # Only the entries between the two ends are lost when the newest are counted back from
+                            # the current total
+                            success, data, response_headers = hh.request_handler(repo_url, headers=headers)
+                            if not success:
+                                result = RATE_LIMITED if is_rate_limited(response_headers) else FAILED
+                                break
+                            print('Walking %s of %s/%s newest first' % (listing_name, owner, repo_name))
+                            newest_first = True
+                            total = data[listing['github_field']]
+                            next_page = 1
+                            last_page = None
+                        else:
+                            last_page = page - 1
+                    else:
+                        result = RATE_LIMITED if is_rate_limited(response_headers) else FAILED
+                    break
+
+                if last_page is None:
+                    last_page = hh.get_last_page_number(response_headers) or page
+                count_entries_by_day(data, listing['timestamp_field'], newest_days if newest_first else days)
+                next_page = page + 1
+
+            complete = result is None and last_page is not None and next_page > last_page
+            save_progress(listing_name, {
+                'next_page': next_page,
+                'last_page': last_page,
+                'days': dict(days),
+                'truncated': truncated,
+                'newest_first': newest_first,
+                'newest_days': dict(newest_days),
+                'total': total,
+                'complete': complete
+            })
+
+            if result is not None:
+                return result
+            if not complete and rate_limit_remaining(responses) < RATE_LIMIT_RESERVE:
+                return RATE_LIMITED
+            if not complete and context is not None and context.get_remaining_time_in_millis() < TIME_RESERVE_MS:
+                return OUT_OF_TIME
+
+    return COMPLETE
+
+
+def request_page(url: str, headers: dict, http_fields: dict, page: int) -> tuple:
+    """Requests one page of a listing
+
+    :param url: the url of the listing
+    :type url: str
+    :param headers: the HTTP headers to send with the request
+    :type headers: dict
+    :param http_fields: the query fields of the listing, the page fields are added to them
+    :type http_fields: dict
+    :param page: the number of the page to request
+    :type page: int
+    :returns: the success of the request, the data returned by the request, the headers of the response
+    :rtype: tuple
+    """
+    fields = dict(http_fields)
+    fields['per_page'] = PER_PAGE
+    fields['page'] = page
+    return hh.request_handler(url, headers=headers, http_fields=fields)
+
+
+def count_entries_by_day(entries: list, timestamp_field: str, days: dict):
+    """Adds the entries of a page to the count of entries per day
+
+    :param entries: the entries of the page
+    :type entries: list
+    :param timestamp_field: the field of an entry that holds its timestamp, e.g. '2020-07-01T12:00:00Z'
+    :type timestamp_field: str
+    :param days: the number of entries per day, keyed by the day, e.g. '2020-07-01'
+    :type days: dict
+    """
+    for entry in entries:
+        timestamp = entry.get(timestamp_field) if isinstance(entry, dict) else None
+        if timestamp:
+            day = timestamp[:10]
+            days[day] = days.get(day, 0) + 1
+
+
+def is_rate_limited(response_headers: dict) -> bool:
+    """Checks whether a failed request was rejected by the primary or the secondary GitHub rate limit
+
+    :param response_headers: the headers of the failed response
+    :type response_headers: dict
+    :rtype: bool
+    """
+    return response_headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response_headers
+
+
+def is_pagination_limit(data) -> bool:
+    """Checks whether a failed request asked for a page past the last one GitHub serves for the listing
+
+    :param data: the data returned by the failed request
+    :type data: dict
+    :rtype: bool
+    """
+    return isinstance(data, dict) and 'pagination is limited' in str(data.get('message', ''))
+
+
+def rate_limit_remaining(responses: list) -> int:
+    """Reads the lowest number of requests left in the GitHub rate limit from a batch of responses
+
+    :param responses: the (success, data, headers) tuples returned by the requests
+    :type responses: list
+    :returns: the number of requests left, or a number above any reserve if the responses don't say
+    :rtype: int
+    """
+    remaining = [int(response_headers['X-RateLimit-Remaining']) for success, data, response_headers in responses
+                 if 'X-RateLimit-Remaining' in response_headers]
+    return min(remaining) if remaining else RATE_LIMIT_RESERVE
+
+
+def publish_history(owner: str, repo_name: str, progress: dict) -> int:
+    """Publishes the running totals of the walked listings
+
+    The end-of-day totals of the days CloudWatch still accepts are sent as timestamped data points of the same metrics
+    the hourly collection publishes. The totals of every day with new entries are kept in the state table, since
+    CloudWatch can't store them. Of a listing GitHub truncated, the oldest days are counted up from zero and the days
+    walked newest first are counted back from the current total, the days in between aren't known
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the repository the history belongs to
+    :type repo_name: str
+    :param progress: the progress of every listing, including its entries per day
+    :type progress: dict
+    :returns: the number of data points published
+    :rtype: int
+    """
+    field_names = {api_key: metric_name for metric_name, api_key
+                   in json.loads(os.environ['github_fields_unpaginated'] or '{}').items()}
+    now = datetime.now(timezone.utc)
+    oldest_allowed = now - cw_interactions.MAX_METRIC_BACKDATE
+    # Today is still changing and is covered by the hourly collection
+    recent_days = [(now - timedelta(days=days_ago)).strftime(DAY_FORMAT) for days_ago in range(14, 0, -1)]
+
+    metrics = []
+    history = {}
+    for listing_name, listing in LISTINGS.items():
+        metric_name = field_names.get(listing['github_field'], listing['default_metric_name'])
+        days = progress[listing_name]['days']
+        newest_days = progress[listing_name].get('newest_days') or {}
+        last_full_day = None
+        first_newest_day = None
+        if progress[listing_name].get('truncated') and days:
+            # The last day listed may be missing entries, and the days after it are missing all of them
+            last_full_day = max(days)
+            days = {day: count for day, count in days.items() if day < last_full_day}
+            if newest_days:
+                first_newest_day = min(newest_days)
+            else:
+                print('%s of %s/%s after %s are not backfilled, GitHub does not list them'
+                      % (listing_name, owner, repo_name, last_full_day))
+
+        totals = get_running_totals(days)
+        if first_newest_day is not None:
+            totals.update(get_totals_before(newest_days, progress[listing_name]['total']))
+        history[metric_name] = totals
+        sorted_days = sorted(totals.keys())
+        for day in recent_days:
+            # The days between the two ends of a truncated listing aren't known
+            newest_known = first_newest_day is not None and first_newest_day <= day
+            if last_full_day is not None and last_full_day <= day and not newest_known:
+                continue
+            timestamp = datetime.strptime(day, DAY_FORMAT).replace(hour=23, minute=59, second=59, tzinfo=timezone.utc)
+            if timestamp < oldest_allowed:
+                continue
+            index = bisect_right(sorted_days, day)
+            total = totals[sorted_days[index - 1]] if index else 0
+            metrics.append(cw_interactions.new_metric(repo_name, metric_name, total, timestamp))
+
+    state_store.put_state('history#' + owner + '/' + repo_name, history)
+    if metrics:
+        cw_interactions.put_metrics_in_cloudwatch(metrics)
+
+    print('Published %d backfilled data points for %s' % (len(metrics), repo_name))
+    return len(metrics)
+
+
+def get_running_totals(days: dict) -> dict:
+    """Turns the number of entries per day into the total number of entries at the end of each of those days
+
+    :param days: the number of entries per day, keyed by the day
+    :type days: dict
+    :returns: the running total per day, keyed by the day
+    :rtype: dict
+    """
+    totals = {}
+    total = 0
+    for day in sorted(days.keys()):
+        total += days[day]
+        totals[day] = total
+    return totals
+
+
+def get_totals_before(newest_days: dict, total: int) -> dict:
+    """Turns the number of the newest entries per day into the total number of entries at the end of each of those days,
+    counting back from the current total
+
+    :param newest_days: the number of entries per day of the newest entries, keyed by the day
+    :type newest_days: dict
+    :param total: the number of entries there are now
+    :type total: int
+    :returns: the total per day, keyed by the day
+    :rtype: dict
+    """
+    totals = {}
+    for day in sorted(newest_days.keys(), reverse=True):
+        totals[day] = total
+        total -= newest_days[day]
+    return totals
+
+
+def continue_in_new_invocation(context, event: dict):
+    """Invokes the running function again, asynchronously, so the backfill continues with a fresh timeout
+
+    :param context: information provided by AWS Lambda about the invocation
+    :type context: LambdaContext
+    :param event: the event to invoke the function with
+    :type event: dict
+    """
+    aws_clients.get_client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(event)
+    )
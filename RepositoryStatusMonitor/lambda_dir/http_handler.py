@@ -23,6 +23,44 @@ def request_handler(url: str, method='GET', headers=None, http_fields=None, post
     :rtype: tuple
     """
     response = http.request(method, url, headers=headers, fields=http_fields, body=post_body)
+    return read_response(url, response)
+
+
+def request_if_modified(url: str, etag, headers=None, http_fields=None) -> tuple:
+    """Performs a conditional GET request, which GitHub answers without data and without counting it against the rate
+    limit when nothing changed since the response with the ETag
+
+    :param url: the url to query
+    :type url: str
+    :param etag: the ETag header of the last response, or None to request the data unconditionally
+    :type etag: Optional[str]
+    :param headers: the HTTP headers to send with the request
+    :type headers: Optional[dict]
+    :param http_fields: the HTTP fields to send with the request
+    :type http_fields: Optional[dict]
+    :returns: the success of the request, the data returned by the request (None if it was not modified), the headers
+              of the response
+    :rtype: tuple
+    """
+    headers = dict(headers or {})
+    if etag:
+        headers['If-None-Match'] = etag
+    response = http.request('GET', url, headers=headers, fields=http_fields)
+    if response.status == 304:
+        return True, None, response.headers
+    return read_response(url, response)
+
+
+def read_response(url: str, response) -> tuple:
+    """Decodes the data of a response and checks that the request succeeded
+
+    :param url: the url that was queried
+    :type url: str
+    :param response: the response to the request
+    :type response: urllib3.response.HTTPResponse
+    :returns: the success of the request, the data returned by the request, the headers of the response
+    :rtype: tuple
+    """
     decoded_data = response.data.decode('utf-8')
     try:
         data_dict = json.loads(decoded_data)
@@ -54,23 +92,36 @@ def handle_pagination(url: str, data: list, response_headers: dict, http_fields:
     :rtype: tuple
     """
     if 'Link' in response_headers.keys():
-        last_link = None
-        for link in response_headers['Link'].split(','):
-            if 'rel=\"last\"' in link:
-                last_link = link.split(';')[0]
-
-        if last_link is not None:
-            match = re.search(r'[?&]page=([^&]+)', last_link)
-            if match:
-                total_pages = int(match.groups()[0])
-                for i in range(2, total_pages + 1):
-                    http_fields['page'] = i
-                    next_success, next_data, next_headers = request_handler(url,
-                                                                            headers=request_headers,
-                                                                            http_fields=http_fields)
-                    if next_success:
-                        data.extend(next_data)
+        total_pages = get_last_page_number(response_headers)
+        if total_pages is not None:
+            for i in range(2, total_pages + 1):
+                http_fields['page'] = i
+                next_success, next_data, next_headers = request_handler(url,
+                                                                        headers=request_headers,
+                                                                        http_fields=http_fields)
+                if next_success:
+                    data.extend(next_data)
 
+        if any('rel=\"last\"' in link for link in response_headers['Link'].split(',')):
             return True, data
 
     return False, data
+
+
+def get_last_page_number(response_headers: dict):
+    """Reads the number of the last page from the pagination links in the response headers
+
+    :param response_headers: the HTTP response headers containing the pagination links
+    :type response_headers: dict
+    :returns: the number of the last page, or None if the response has no link to a last page
+    :rtype: Optional[int]
+    """
+    if 'Link' not in response_headers.keys():
+        return None
+
+    for link in response_headers['Link'].split(','):
+        if 'rel=\"last\"' in link:
+            match = re.search(r'[?&]page=([^&>]+)', link.split(';')[0])
+            if match:
+                return int(match.groups()[0])
+    return None
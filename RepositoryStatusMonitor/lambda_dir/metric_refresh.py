@@ -0,0 +1,105 @@
+import json
+import os
+import uuid
+
+import aws_clients
+import state_store
+import webhook_messages
+
+# The name of the queue refresh jobs are sent to, which the metric handler tells apart from the webhook queue by
+REFRESH_QUEUE_NAME = 'RefreshQueue'
+# How long the webhook events of a repository are coalesced into one refresh job, in seconds. The job is delayed by as
+# long, so it sees the changes of every event of the window
+REFRESH_WINDOW_SECONDS = 60
+
+# The GitHub API paths that each webhook event changes the data of. A configured field depends on an event when its path
+# is one of these, or starts with one followed by '/' or '?'
+EVENT_API_PATHS = {
+    'issues': ['issues', 'open_issues_count'],
+    'pull_request': ['pulls', 'open_issues_count'],
+    'release': ['releases']
+}
+# The API paths a field's value is computed with, e.g. the open issues are counted without the open pull requests
+FIELD_DEPENDENCIES = {
+    'open_issues_count': ['pulls']
+}
+
+
+def depends_on(api_path: str, event_path: str) -> bool:
+    """Checks whether a configured field is read from the data at an API path
+
+    :param api_path: the configured API path of the field, e.g. 'releases/latest/tag_name'
+    :type api_path: str
+    :param event_path: the API path an event changes, e.g. 'releases'
+    :type event_path: str
+    :rtype: bool
+    """
+    return api_path == event_path or api_path.startswith(event_path + '/') or api_path.startswith(event_path + '?')
+
+
+def get_refresh_metric_names(events) -> set:
+    """Returns the configured GitHub fields that depend on webhook events, from the fields the hourly run collects
+
+    :param events: the webhook events, e.g. 'release'
+    :type events: Iterable[str]
+    :returns: the metric names of the fields to collect again
+    :rtype: set
+    """
+    api_paths = {}
+    for name in ['github_fields_unpaginated', 'github_fields_paginated']:
+        for metric_name, api_path in json.loads(os.environ.get(name) or '{}').items():
+            api_paths[metric_name] = api_path
+
+    event_paths = [event_path for event in events for event_path in EVENT_API_PATHS.get(event, [])]
+    metric_names = {metric_name for metric_name, api_path in api_paths.items()
+                    if any(depends_on(api_path, event_path) for event_path in event_paths)}
+    dependency_paths = [dependency for metric_name in metric_names
+                        for dependency in FIELD_DEPENDENCIES.get(api_paths[metric_name], [])]
+    metric_names.update(metric_name for metric_name, api_path in api_paths.items() if api_path in dependency_paths)
+    return metric_names
+
+
+def get_refresh_key(owner: str, repo_name: str, event: str) -> str:
+    """Returns the key of a repository's pending refresh job for an event in the state table
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param event: the webhook event
+    :type event: str
+    :rtype: str
+    """
+    return 'refresh#' + owner + '/' + repo_name + '#' + event
+
+
+def request_refresh(message: dict) -> bool:
+    """Sends a job to collect the fields that depend on a webhook event again, unless one was sent for the same
+    repository and event within the refresh window
+
+    :param message: the compact message of the webhook event
+    :type message: dict
+    :returns: whether a refresh job was sent
+    :rtype: bool
+    """
+    event = message.get('event')
+    if not os.environ.get('refresh_queue_url') or not webhook_messages.is_handled(message) or \
+            not message.get('repo_name') or not get_refresh_metric_names([event]):
+        return False
+
+    owner = message.get('owner') or os.environ['owner']
+    key = get_refresh_key(owner, message['repo_name'], event)
+    holder = str(uuid.uuid4())
+    if not state_store.acquire_lease(key, holder, REFRESH_WINDOW_SECONDS):
+        return False
+
+    try:
+        aws_clients.get_client('sqs').send_message(
+            QueueUrl=os.environ['refresh_queue_url'],
+            MessageBody=json.dumps({'owner': owner, 'repo_name': message['repo_name'], 'event': event}),
+            DelaySeconds=REFRESH_WINDOW_SECONDS)
+    except Exception:
+        # The next event of the window sends the job instead
+        state_store.release_lease(key, holder)
+        raise
+    return True
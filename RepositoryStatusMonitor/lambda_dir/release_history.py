@@ -0,0 +1,90 @@
+import os
+
+import aws_clients
+import http_handler as hh
+import state_store
+
+# How many of the latest publication times of a repository are kept, so that a release event that arrives late still
+# finds the release published before it
+MAX_REMEMBERED_RELEASES = 10
+# How many times a release is recorded again after another invocation updated the history between reading and writing
+# it, before giving up and leaving the event to be retried
+MAX_RECORD_ATTEMPTS = 5
+
+
+def get_release_key(owner: str, repo_name: str) -> str:
+    """Returns the key of a repository's release history in the state table
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :rtype: str
+    """
+    return 'release#' + owner + '/' + repo_name
+
+
+def fetch_published_times(owner: str, repo_name: str) -> list:
+    """Retrieves the publication times of the latest releases of a repository from GitHub, to seed its release history
+
+    Only the first 2 releases are requested, the release an event is about and the one before it
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :returns: the publication times of the latest releases, in GitHub's '%Y-%m-%dT%H:%M:%SZ' format
+    :rtype: list
+    """
+    token = aws_clients.get_client('secretsmanager').get_secret_value(SecretId='github_auth_token')['SecretString']
+    headers = {
+        'Authorization': 'token ' + token,
+        'Accept': 'application/vnd.github.nebula-preview+json',
+        'User-Agent': os.environ['user_agent_header']}
+    url = 'https://api.github.com/repos/' + owner + '/' + repo_name + '/releases'
+
+    success, http_data, response_headers = hh.request_handler(url, headers=headers, http_fields={'per_page': 2})
+    if not success or not isinstance(http_data, list):
+        print('Could not retrieve the latest releases of ' + owner + '/' + repo_name)
+        return []
+    # Draft releases aren't published
+    return [release['published_at'] for release in http_data if release.get('published_at')]
+
+
+def record_release(owner: str, repo_name: str, published_at: str) -> tuple:
+    """Adds the publication of a release to the history of the repository, seeding the history from GitHub the first
+    time a release of the repository is recorded
+
+    Release events of the repository handled at the same time don't overwrite each other: the history is only written
+    if it hasn't changed since it was read, and is read again otherwise
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param published_at: when the release was published, in GitHub's '%Y-%m-%dT%H:%M:%SZ' format
+    :type published_at: str
+    :returns: whether the release wasn't recorded before, and when the release before it was published (None if it
+              isn't known)
+    :rtype: tuple
+    :raises RuntimeError: if the history changed every time it was read, the event is then left to be retried
+    """
+    key = get_release_key(owner, repo_name)
+    seeded_times = None
+    for _ in range(MAX_RECORD_ATTEMPTS):
+        state, version = state_store.get_versioned_state(key)
+        published_times = state.get('published_at')
+        if published_times is None:
+            if seeded_times is None:
+                seeded_times = fetch_published_times(owner, repo_name)
+            published_times = seeded_times
+        elif published_at in published_times:
+            return False, None
+
+        # The timestamps sort in time order as strings
+        published_times = sorted(set(published_times) | {published_at}, reverse=True)[:MAX_REMEMBERED_RELEASES]
+        # Written only if no other release event of the repository was recorded since the history was read
+        if state_store.put_versioned_state(key, {'published_at': published_times}, version):
+            previous_published_at = [time for time in published_times if time < published_at]
+            return True, previous_published_at[0] if previous_published_at else None
+    raise RuntimeError('The release history of ' + owner + '/' + repo_name + ' kept changing while recording a release')
@@ -0,0 +1,96 @@
+import json
+import os
+
+import state_store
+
+# The GitHub fields of the repository endpoint that every webhook event carries in its 'repository' object, and that
+# the watch, star, fork and public events change
+WEBHOOK_COUNTER_FIELDS = ['stargazers_count', 'forks_count']
+# How long a counter taken from a webhook event or the daily reconcile is trusted, in seconds. Slightly longer than a
+# day, so the daily reconcile replaces the counters before the hourly run has to poll them again
+COUNTER_TTL_SECONDS = 25 * 3600
+
+
+def get_counter_metric_names() -> dict:
+    """Returns the metric names of the counters that webhook events keep up to date, as configured for the hourly run
+
+    :returns: a mapping of each GitHub field in WEBHOOK_COUNTER_FIELDS that is collected to its metric name
+    :rtype: dict
+    """
+    github_fields = json.loads(os.environ.get('github_fields_unpaginated') or '{}')
+    return {github_field: metric_name for metric_name, github_field in github_fields.items()
+            if github_field in WEBHOOK_COUNTER_FIELDS}
+
+
+def replaces_repository_request() -> bool:
+    """Returns whether stored counters can replace the hourly request to the repository endpoint
+
+    Counters are only stored when they do, that is when every field collected from the repository endpoint is one of
+    WEBHOOK_COUNTER_FIELDS. Otherwise the endpoint is requested every hour anyway, and storing them would only add
+    state table reads and writes
+
+    :rtype: bool
+    """
+    github_fields = json.loads(os.environ.get('github_fields_unpaginated') or '{}').values()
+    repository_fields = [github_field for github_field in github_fields if '/' not in github_field]
+    return bool(repository_fields) and all(github_field in WEBHOOK_COUNTER_FIELDS for github_field in repository_fields)
+
+
+def get_counter_key(owner: str, repo_name: str) -> str:
+    """Returns the key of a repository's counters in the state table
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :rtype: str
+    """
+    return 'counter#' + owner + '/' + repo_name
+
+
+def save_counters(owner: str, repo_name: str, counters: dict):
+    """Stores the latest values of a repository's counters, if they can replace the request to the repository endpoint
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param counters: a mapping of the metric name of each counter to its value
+    :type counters: dict
+    """
+    if not counters or not replaces_repository_request():
+        return
+    state_store.put_state(get_counter_key(owner, repo_name), counters, ttl_seconds=COUNTER_TTL_SECONDS)
+
+
+def get_counters(owner: str, repo_name: str) -> dict:
+    """Returns the counters of a repository that were stored recently enough to be used instead of polling GitHub
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :returns: a mapping of the metric name of each counter to its value, or an empty dictionary if any counter is
+              missing or expired, or the counters can't replace the request to the repository endpoint
+    :rtype: dict
+    """
+    if not replaces_repository_request():
+        return {}
+    counters = state_store.get_state(get_counter_key(owner, repo_name))
+    if not all(metric_name in counters for metric_name in get_counter_metric_names().values()):
+        return {}
+    return counters
+
+
+def get_polled_counters(sorted_widgets: dict) -> dict:
+    """Returns the counters among the metrics collected for a repository
+
+    :param sorted_widgets: the metrics of the repository sorted by widget, as returned by aggregate_metrics
+    :type sorted_widgets: dict
+    :returns: a mapping of the metric name of each counter to its value
+    :rtype: dict
+    """
+    counter_metric_names = get_counter_metric_names().values()
+    return {metric_name: value
+            for widget in sorted_widgets.values() if widget['type'] == 'metric'
+            for metric_name, value in widget['data'].items() if metric_name in counter_metric_names}
@@ -0,0 +1,66 @@
+import uuid
+
+import state_store
+
+# Only first responses within this many seconds of the issue or pull request being opened are measured. An item's
+# marker is kept until then, so a later response can't be taken for the first one once the marker has expired
+MAX_RESPONSE_SECONDS = 365 * 24 * 3600
+
+
+def get_marker_key(owner: str, repo_name: str, item: str, number: str) -> str:
+    """Returns the key of the marker of an issue or pull request that was responded to in the state table
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param item: 'issue' or 'pull_request'
+    :type item: str
+    :param number: the number of the issue or pull request
+    :type number: str
+    :rtype: str
+    """
+    return 'responded#' + owner + '/' + repo_name + '#' + item + '#' + number
+
+
+def mark_responded(owner: str, repo_name: str, item: str, number: str, ttl_seconds: int):
+    """Marks an issue or pull request as responded to, unless it already is
+
+    The marker is written with a conditional write to the state table, so only the first response of an item is
+    measured, however many invocations handle its responses at the same time
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param item: 'issue' or 'pull_request'
+    :type item: str
+    :param number: the number of the issue or pull request
+    :type number: str
+    :param ttl_seconds: how long the marker is kept, in seconds
+    :type ttl_seconds: int
+    :returns: the ID the marker was written with, needed to remove it again, or None if the item was already responded
+              to
+    :rtype: Optional[str]
+    """
+    holder = str(uuid.uuid4())
+    if not state_store.acquire_lease(get_marker_key(owner, repo_name, item, number), holder, ttl_seconds):
+        return None
+    return holder
+
+
+def unmark_responded(owner: str, repo_name: str, item: str, number: str, holder: str):
+    """Removes the marker of a response that couldn't be published, so the retried event measures it again
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param item: 'issue' or 'pull_request'
+    :type item: str
+    :param number: the number of the issue or pull request
+    :type number: str
+    :param holder: the ID the marker was written with
+    :type holder: str
+    """
+    state_store.release_lease(get_marker_key(owner, repo_name, item, number), holder)
@@ -0,0 +1,82 @@
+import json
+import os
+
+import cloudwatch_interactions as cw_interactions
+
+# The dimensions the rollup metrics are published under, instead of the REPO_NAME dimension of the repository metrics
+OWNER_DIMENSION = 'OWNER'
+REPO_GROUP_DIMENSION = 'REPO_GROUP'
+
+
+def get_rollup_metric_names() -> list:
+    """Returns the names of the metrics to total across repositories, in the order they are configured
+
+    :rtype: list
+    """
+    return [name for name in os.environ.get('rollup_metrics', '').split(',') if name]
+
+
+def get_repo_groups(owner: str, repo_name: str) -> list:
+    """Returns the user-defined groups a repository belongs to
+
+    Groups list their repositories either by name or as 'owner/repo_name'
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :returns: the names of the groups the repository is in
+    :rtype: list
+    """
+    repo_groups = json.loads(os.environ.get('repo_groups') or '{}')
+    return [group_name for group_name, group_repo_names in repo_groups.items()
+            if repo_name in group_repo_names or owner + '/' + repo_name in group_repo_names]
+
+
+def add_repository_metrics(rollups: dict, owner: str, repo_name: str, sorted_widgets: dict):
+    """Adds the metrics of one repository to the totals of its owner and of every group it belongs to
+
+    :param rollups: a mapping of (dimension name, dimension value) to the totals of each metric, updated in place
+    :type rollups: dict
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param sorted_widgets: the metrics of the repository sorted by widget, as returned by aggregate_metrics
+    :type sorted_widgets: dict
+    """
+    rollup_metric_names = get_rollup_metric_names()
+    keys = [(OWNER_DIMENSION, owner)] + [(REPO_GROUP_DIMENSION, group_name)
+                                         for group_name in get_repo_groups(owner, repo_name)]
+
+    for widget in sorted_widgets.values():
+        if widget['type'] != 'metric':
+            continue
+        for metric_name, metric_value in widget['data'].items():
+            if metric_name not in rollup_metric_names:
+                continue
+            if isinstance(metric_value, str) and metric_value.isnumeric():
+                metric_value = float(metric_value)
+            if not isinstance(metric_value, (int, float)):
+                continue
+            for key in keys:
+                totals = rollups.setdefault(key, {})
+                totals[metric_name] = totals.get(metric_name, 0) + metric_value
+
+
+def publish_rollups(rollups: dict) -> int:
+    """Publishes the totals of every owner and group as their own metrics, all in one batch
+
+    :param rollups: a mapping of (dimension name, dimension value) to the totals of each metric
+    :type rollups: dict
+    :returns: the number of metrics published
+    :rtype: int
+    """
+    metrics = [cw_interactions.new_metric(dimension_value, metric_name, total, dimension_name=dimension_name)
+               for (dimension_name, dimension_value), totals in rollups.items()
+               for metric_name, total in totals.items()]
+    if metrics:
+        cw_interactions.put_metrics_in_cloudwatch(metrics)
+
+    print('Published %d rollup metrics' % len(metrics))
+    return len(metrics)
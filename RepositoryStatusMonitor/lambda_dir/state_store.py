@@ -0,0 +1,171 @@
+import json
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+import aws_clients
+
+
+def get_state(key: str) -> dict:
+    """Retrieves the value stored under the specified key in the state table
+
+    :param key: the key of the state item
+    :type key: str
+    :returns: the stored value, or an empty dictionary if nothing is stored under the key or the item has expired
+    :rtype: dict
+    """
+    return get_versioned_state(key)[0]
+
+
+def get_versioned_state(key: str) -> tuple:
+    """Retrieves the value stored under the specified key in the state table, with the version it was stored with
+
+    :param key: the key of the state item
+    :type key: str
+    :returns: the stored value, or an empty dictionary if nothing is stored under the key or the item has expired, and
+              the version to pass to put_versioned_state() to replace it (0 if the item wasn't stored with a version)
+    :rtype: tuple
+    """
+    response = aws_clients.get_client('dynamodb').get_item(
+        TableName=os.environ['state_table_name'],
+        Key={'state_key': {'S': key}},
+        ConsistentRead=True
+    )
+    item = response.get('Item') or {}
+    version = int(item['version']['N']) if 'version' in item else 0
+    if not item or is_expired(item):
+        return {}, version
+    return json.loads(item['value']['S']), version
+
+
+def put_state(key: str, value: dict, ttl_seconds=None):
+    """Stores the value under the specified key in the state table, replacing any existing value
+
+    :param key: the key of the state item
+    :type key: str
+    :param value: the JSON-serialisable value to store
+    :type value: dict
+    :param ttl_seconds: how long the item should be kept, in seconds (default is None, which keeps it indefinitely)
+    :type ttl_seconds: Optional[int]
+    """
+    aws_clients.get_client('dynamodb').put_item(
+        TableName=os.environ['state_table_name'],
+        Item=new_state_item(key, value, ttl_seconds)
+    )
+
+
+def put_versioned_state(key: str, value: dict, version: int, ttl_seconds=None) -> bool:
+    """Stores the value under the specified key in the state table, unless it was replaced since it was read
+
+    :param key: the key of the state item
+    :type key: str
+    :param value: the JSON-serialisable value to store
+    :type value: dict
+    :param version: the version the replaced value was read with (see get_versioned_state())
+    :type version: int
+    :param ttl_seconds: how long the item should be kept, in seconds (default is None, which keeps it indefinitely)
+    :type ttl_seconds: Optional[int]
+    :returns: whether the value was stored, False if another caller replaced it first and it must be read again
+    :rtype: bool
+    """
+    item = new_state_item(key, value, ttl_seconds)
+    item['version'] = {'N': str(version + 1)}
+    if version:
+        condition = {'ConditionExpression': 'version = :version',
+                     'ExpressionAttributeValues': {':version': {'N': str(version)}}}
+    else:
+        condition = {'ConditionExpression': 'attribute_not_exists(version)'}
+    try:
+        aws_clients.get_client('dynamodb').put_item(TableName=os.environ['state_table_name'], Item=item, **condition)
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def acquire_lease(key: str, holder: str, lease_seconds: int) -> bool:
+    """Takes the lease stored under the specified key, unless another holder has it and it hasn't expired yet
+
+    :param key: the key of the lease item
+    :type key: str
+    :param holder: a unique ID of the caller, needed to release the lease
+    :type holder: str
+    :param lease_seconds: how long the lease is held if it isn't released, in seconds
+    :type lease_seconds: int
+    :returns: whether the lease was taken
+    :rtype: bool
+    """
+    now = int(time.time())
+    try:
+        aws_clients.get_client('dynamodb').put_item(
+            TableName=os.environ['state_table_name'],
+            Item={
+                'state_key': {'S': key},
+                'holder': {'S': holder},
+                'expires_at': {'N': str(now + int(lease_seconds))}
+            },
+            ConditionExpression='attribute_not_exists(state_key) OR expires_at <= :now',
+            ExpressionAttributeValues={':now': {'N': str(now)}}
+        )
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def release_lease(key: str, holder: str):
+    """Releases the lease stored under the specified key, if the holder still has it
+
+    :param key: the key of the lease item
+    :type key: str
+    :param holder: the ID the lease was taken with
+    :type holder: str
+    """
+    try:
+        aws_clients.get_client('dynamodb').delete_item(
+            TableName=os.environ['state_table_name'],
+            Key={'state_key': {'S': key}},
+            ConditionExpression='holder = :holder',
+            ExpressionAttributeValues={':holder': {'S': holder}}
+        )
+    except ClientError as error:
+        # The lease expired and was taken by someone else, who now holds it
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def new_state_item(key: str, value: dict, ttl_seconds=None) -> dict:
+    """Creates a state item in the format required by DynamoDB
+
+    :param key: the key of the state item
+    :type key: str
+    :param value: the JSON-serialisable value to store
+    :type value: dict
+    :param ttl_seconds: how long the item should be kept, in seconds (default is None, which keeps it indefinitely)
+    :type ttl_seconds: Optional[int]
+    :returns: the dictionary representing the item
+    :rtype: dict
+    """
+    item = {
+        'state_key': {'S': key},
+        'value': {'S': json.dumps(value, sort_keys=True)}
+    }
+    if ttl_seconds:
+        item['expires_at'] = {'N': str(int(time.time()) + int(ttl_seconds))}
+    return item
+
+
+def is_expired(item: dict) -> bool:
+    """Checks whether a state item is past its expiry time
+
+    DynamoDB deletes expired items in the background, sometimes days later, so reads must check the expiry themselves
+
+    :param item: the item returned by DynamoDB
+    :type item: dict
+    :returns: whether the item has expired
+    :rtype: bool
+    """
+    return 'expires_at' in item and int(item['expires_at']['N']) <= time.time()
@@ -22,3 +22,36 @@ def aws_credentials():
     os.environ['AWS_SECURITY_TOKEN'] = 'testing'
     os.environ['AWS_SESSION_TOKEN'] = 'testing'
     os.environ['AWS_REGION'] = 'us-west-2'
+
+
+def reset_clients():
+    """Drops the cached AWS clients, both of the Lambda modules and of the tests importing them from lambda_dir"""
+    import aws_clients
+    from lambda_dir import aws_clients as lambda_dir_aws_clients
+    aws_clients.reset_clients()
+    lambda_dir_aws_clients.reset_clients()
+
+
+@pytest.fixture
+def state_table(aws_credentials, monkeypatch):
+    """Mocked state table for moto, yields the DynamoDB client"""
+    # Imported here, importing moto puts a path in front of the test path that pytest_sessionstart() reads
+    from moto import mock_dynamodb2
+    monkeypatch.setenv('state_table_name', 'test-state-table')
+    with mock_dynamodb2():
+        reset_clients()
+        import aws_clients
+        dynamodb = aws_clients.get_client('dynamodb')
+        dynamodb.create_table(
+            TableName='test-state-table',
+            KeySchema=[{'AttributeName': 'state_key', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'state_key', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield dynamodb
+        reset_clients()
+
+
+def pytest_addoption(parser):
+    parser.addini('cold_import_budget_ms', 'Maximum time in milliseconds that a cold import of a Lambda handler may take',
+                  default='1000')
@@ -0,0 +1,36 @@
+from unittest.mock import patch
+
+from lambda_dir import aws_clients
+
+
+@patch('lambda_dir.aws_clients.boto3.client')
+def test_get_client_creates_client_once(mock_client, monkeypatch):
+    monkeypatch.setenv('AWS_REGION', 'test-region')
+    aws_clients.reset_clients()
+    first = aws_clients.get_client('cloudwatch')
+    second = aws_clients.get_client('cloudwatch')
+    mock_client.assert_called_once_with('cloudwatch', region_name='test-region')
+    assert first is second
+    aws_clients.reset_clients()
+
+
+@patch('lambda_dir.aws_clients.boto3.client')
+def test_get_client_one_client_per_service(mock_client, monkeypatch):
+    monkeypatch.setenv('AWS_REGION', 'test-region')
+    mock_client.side_effect = lambda service_name, region_name: service_name + '-client'
+    aws_clients.reset_clients()
+    assert aws_clients.get_client('cloudwatch') == 'cloudwatch-client'
+    assert aws_clients.get_client('sqs') == 'sqs-client'
+    assert mock_client.call_count == 2
+    aws_clients.reset_clients()
+
+
+@patch('lambda_dir.aws_clients.boto3.client')
+def test_reset_clients(mock_client, monkeypatch):
+    monkeypatch.setenv('AWS_REGION', 'test-region')
+    aws_clients.reset_clients()
+    aws_clients.get_client('cloudwatch')
+    aws_clients.reset_clients()
+    aws_clients.get_client('cloudwatch')
+    assert mock_client.call_count == 2
+    aws_clients.reset_clients()
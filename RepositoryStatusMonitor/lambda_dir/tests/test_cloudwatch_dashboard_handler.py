@@ -3,6 +3,7 @@ from unittest.mock import Mock, patch
 
 import boto3
 from moto import mock_sqs
+import pytest
 
 from lambda_dir import cloudwatch_dashboard_handler as cdh
 
@@ -64,68 +65,53 @@ def get_metric_and_widget_data():
     return sorted_widgets, metric_widget, text_widget, return_data
 
 
-@mock_sqs
+def get_sqs_event(bodies):
+    return {'Records': [{'messageId': 'message-%d' % index, 'receiptHandle': 'handle-%d' % index,
+                         'body': json.dumps(body), 'eventSource': 'aws:sqs'}
+                        for index, body in enumerate(bodies)]}
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.widget_registry')
 @patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
-@patch('lambda_dir.cloudwatch_dashboard_handler.handle_webhook_events.handle_webhook')
-def test_handler_records_in_events_valid_widgets(mock_handle_webhook, mock_crud, mock_mw, aws_credentials, monkeypatch):
-    mock_handle_webhook.return_value = {'metric': 'metric'}
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_records_in_events_valid_widgets(mock_handle_webhook, mock_crud, mock_mw, mock_registry,
+                                                 aws_credentials, monkeypatch):
+    mock_handle_webhook.return_value = {'dash-1': ['widget']}
+    mock_registry.get_unregistered_widgets.side_effect = lambda widgets: widgets
+    mock_crud.return_value = {'dash-1': {'status': 'written'}}
 
-    with mock_sqs():
-        boto3.setup_default_session()
-        sqs = boto3.client('sqs')
-        test_queue = sqs.create_queue(
-            QueueName='TestQueue'
-        )
-        response = sqs.send_message(
-            QueueUrl=test_queue['QueueUrl'],
-            MessageBody='hello'
-        )
-        messages = sqs.receive_message(
-            QueueUrl=test_queue['QueueUrl']
-        )
-        monkeypatch.setenv('queue_url', test_queue['QueueUrl'])
-        event = {'Records': [{'body': json.dumps('123'), 'receiptHandle': messages['Messages'][0]['ReceiptHandle']}]}
-        cdh.handler(event, None)
-        mock_handle_webhook.assert_called_once()
-        mock_crud.assert_called_once()
-        mock_mw.assert_not_called()
+    response = cdh.handler(get_sqs_event([{'event': 'push'}]), None)
 
+    mock_handle_webhook.assert_called_once_with({'event': 'push'})
+    mock_crud.assert_called_once()
+    mock_mw.assert_not_called()
+    assert response == {'batchItemFailures': []}
 
-@mock_sqs
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.widget_registry')
 @patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
-@patch('lambda_dir.cloudwatch_dashboard_handler.handle_webhook_events.handle_webhook')
-def test_handler_records_in_events_no_valid_widgets(mock_handle_webhook, mock_crud, mock_mw, capfd, aws_credentials,
-                                                    monkeypatch):
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_records_in_events_no_valid_widgets(mock_handle_webhook, mock_crud, mock_mw, mock_registry, capfd,
+                                                    aws_credentials, monkeypatch):
     mock_handle_webhook.return_value = {}
+    mock_registry.get_unregistered_widgets.side_effect = lambda widgets: widgets
 
-    with mock_sqs():
-        boto3.setup_default_session()
-        sqs = boto3.client('sqs')
-        test_queue = sqs.create_queue(
-            QueueName='TestQueue'
-        )
-        response = sqs.send_message(
-            QueueUrl=test_queue['QueueUrl'],
-            MessageBody='hello'
-        )
-        messages = sqs.receive_message(
-            QueueUrl=test_queue['QueueUrl']
-        )
-        monkeypatch.setenv('queue_url', test_queue['QueueUrl'])
-        event = {'Records': [{'body': json.dumps('123'), 'receiptHandle': messages['Messages'][0]['ReceiptHandle']}]}
-        cdh.handler(event, None)
-        mock_handle_webhook.assert_called_once()
-        mock_crud.assert_not_called()
-        mock_mw.assert_not_called()
-        assert 'No valid widgets, dashboard cannot be created.' in capfd.readouterr()[0]
+    response = cdh.handler(get_sqs_event([{'event': 'push'}]), None)
 
+    mock_handle_webhook.assert_called_once()
+    mock_crud.assert_not_called()
+    mock_mw.assert_not_called()
+    assert 'No valid widgets, dashboard cannot be created.' in capfd.readouterr()[0]
+    assert response == {'batchItemFailures': []}
 
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.dashboards.get_superseded_widgets', Mock(return_value={}))
 @mock_sqs
 @patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
-@patch('lambda_dir.cloudwatch_dashboard_handler.handle_webhook_events.handle_webhook')
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.handle_webhook_events.handle_webhook')
 def test_handler_records_not_in_events_no_valid_widgets(mock_handle_webhook, mock_crud, mock_mw, capfd, aws_credentials,
                                                         monkeypatch):
     mock_mw.return_value = {}
@@ -136,11 +122,11 @@ def test_handler_records_not_in_events_no_valid_widgets(mock_handle_webhook, moc
         test_queue = sqs.create_queue(
             QueueName='TestQueue'
         )
-        response = sqs.send_message(
+        sqs.send_message(
             QueueUrl=test_queue['QueueUrl'],
             MessageBody='hello'
         )
-        messages = sqs.receive_message(
+        sqs.receive_message(
             QueueUrl=test_queue['QueueUrl']
         )
         monkeypatch.setenv('queue_url', test_queue['QueueUrl'])
@@ -151,13 +137,16 @@ def test_handler_records_not_in_events_no_valid_widgets(mock_handle_webhook, moc
         assert 'No valid widgets, dashboard cannot be created.' in capfd.readouterr()[0]
 
 
+@patch('lambda_dir.cloudwatch_dashboard_handler.dashboards.get_superseded_widgets', Mock(return_value={}))
 @mock_sqs
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store')
 @patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
-@patch('lambda_dir.cloudwatch_dashboard_handler.handle_webhook_events.handle_webhook')
-def test_handler_records_not_in_events_valid_widgets(mock_handle_webhook, mock_crud, mock_mw, aws_credentials,
-                                                     monkeypatch):
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_records_not_in_events_valid_widgets(mock_handle_webhook, mock_crud, mock_mw, mock_state_store,
+                                                     aws_credentials, monkeypatch):
     mock_mw.return_value = {'metric': 'metric'}
+    mock_state_store.get_state.return_value = {}
 
     with mock_sqs():
         boto3.setup_default_session()
@@ -165,11 +154,11 @@ def test_handler_records_not_in_events_valid_widgets(mock_handle_webhook, mock_c
         test_queue = sqs.create_queue(
             QueueName='TestQueue'
         )
-        response = sqs.send_message(
+        sqs.send_message(
             QueueUrl=test_queue['QueueUrl'],
             MessageBody='hello'
         )
-        messages = sqs.receive_message(
+        sqs.receive_message(
             QueueUrl=test_queue['QueueUrl']
         )
         monkeypatch.setenv('queue_url', test_queue['QueueUrl'])
@@ -179,9 +168,90 @@ def test_handler_records_not_in_events_valid_widgets(mock_handle_webhook, mock_c
         mock_mw.assert_called_once()
 
 
+@patch('lambda_dir.cloudwatch_dashboard_handler.dashboards.get_superseded_widgets', Mock(return_value={}))
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store')
+@patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
+def test_handler_reports_failed_dashboards(mock_crud, mock_mw, mock_state_store, capfd):
+    mock_mw.return_value = {'dash-1': ['widget'], 'dash-2': ['widget']}
+    mock_state_store.get_state.return_value = {}
+    mock_crud.return_value = {
+        'dash-1': {'status': 'written'},
+        'dash-2': {'status': 'failed', 'error': 'ThrottlingException'}
+    }
+    cdh.handler({}, None)
+    out = capfd.readouterr()[0]
+    assert 'Dashboard dash-2 was not updated: ThrottlingException' in out
+    assert 'dash-1 was not updated' not in out
+    # The fingerprint isn't saved, so the next hourly run reconciles again
+    mock_state_store.put_state.assert_not_called()
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.dashboards.get_superseded_widgets', Mock(return_value={}))
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store')
+@patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
+def test_handler_saves_widget_plan_fingerprint(mock_crud, mock_mw, mock_state_store):
+    mock_mw.return_value = {'dash-1': ['widget']}
+    mock_state_store.get_state.return_value = {'fingerprint': 'old-fingerprint'}
+    mock_crud.return_value = {'dash-1': {'status': 'written'}}
+
+    cdh.handler({}, None)
+
+    mock_crud.assert_called_once()
+    mock_state_store.put_state.assert_called_once_with(
+        cdh.WIDGET_PLAN_STATE_KEY, {'fingerprint': cdh.get_widget_plan_fingerprint({'dash-1': ['widget']})})
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store')
+@patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
+def test_handler_skips_reconcile_when_widgets_unchanged(mock_crud, mock_mw, mock_state_store, capfd):
+    mock_mw.return_value = {'dash-1': ['widget']}
+    mock_state_store.get_state.return_value = {
+        'fingerprint': cdh.get_widget_plan_fingerprint({'dash-1': ['widget']})}
+
+    cdh.handler({}, None)
+
+    mock_mw.assert_called_once()
+    mock_crud.assert_not_called()
+    mock_state_store.put_state.assert_not_called()
+    assert 'Widgets unchanged since the dashboards were last reconciled' in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.dashboards.get_superseded_widgets', Mock(return_value={}))
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store')
+@patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
+def test_handler_reconcile_event_always_reconciles(mock_crud, mock_mw, mock_state_store):
+    mock_mw.return_value = {'dash-1': ['widget']}
+    fingerprint = cdh.get_widget_plan_fingerprint({'dash-1': ['widget']})
+    mock_state_store.get_state.return_value = {'fingerprint': fingerprint}
+    mock_crud.return_value = {'dash-1': {'status': 'skipped'}}
+
+    cdh.handler({'reconcile': True}, None)
+
+    mock_mw.assert_called_once_with(reconcile=True)
+    mock_crud.assert_called_once()
+    mock_state_store.put_state.assert_called_once_with(cdh.WIDGET_PLAN_STATE_KEY, {'fingerprint': fingerprint})
+
+
+def test_get_widget_plan_fingerprint(monkeypatch):
+    monkeypatch.setenv('dashboard_name_prefix', 'test-dashboard-name-prefix')
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-repo-name')
+    widgets = {'dash-1': [{'type': 'metric', 'properties': {'title': 'a'}}]}
+
+    fingerprint = cdh.get_widget_plan_fingerprint(widgets)
+
+    assert fingerprint == cdh.get_widget_plan_fingerprint({'dash-1': [{'properties': {'title': 'a'}, 'type': 'metric'}]})
+    assert fingerprint != cdh.get_widget_plan_fingerprint({'dash-1': [{'type': 'metric', 'properties': {'title': 'b'}}]})
+    monkeypatch.setenv('shared_details_dashboard', 'y')
+    assert fingerprint != cdh.get_widget_plan_fingerprint(widgets)
+
+
 @mock_sqs
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_activity_widget')
-@patch('lambda_dir.cloudwatch_dashboard_handler.github_docker.aggregate_metrics')
+@patch('collect_github_docker_metrics.aggregate_metrics')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_text_widget')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_metric_widget')
 def test_create_and_put_metrics_and_widgets(mock_cmw, mock_ctw, mock_aggregate, mock_caw, aws_credentials, monkeypatch):
@@ -192,13 +262,63 @@ def test_create_and_put_metrics_and_widgets(mock_cmw, mock_ctw, mock_aggregate,
     mock_ctw.return_value = text_widget
     mock_caw.return_value = {'test-activity': 'activity'}
     widgets = cdh.create_and_put_metrics_and_widgets()
-    mock_aggregate.assert_called_once_with('test-owner', 'test-repo-name')
+    mock_aggregate.assert_called_once_with('test-owner', 'test-repo-name', {})
     assert widgets == return_data
 
 
+@patch('lambda_dir.cloudwatch_dashboard_handler.repository_counters')
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_webhook_counters(mock_cw, mock_aggregate, mock_counters, monkeypatch):
+    set_environment(monkeypatch)
+    mock_counters.get_counters.return_value = {'GitHub Stars': 42, 'Forks': 7}
+    mock_counters.get_polled_counters.return_value = {'GitHub Stars': 42, 'Forks': 7}
+    mock_aggregate.return_value = {}
+
+    cdh.create_and_put_metrics_and_widgets()
+
+    # The counters are known from webhook events, so the repository endpoint isn't requested and nothing is stored
+    mock_aggregate.assert_called_once_with('test-owner', 'test-repo-name', {'GitHub Stars': 42, 'Forks': 7})
+    mock_counters.save_counters.assert_not_called()
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.repository_counters')
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_collected_counters_replace_known(mock_cw, mock_aggregate, mock_counters,
+                                                                             monkeypatch):
+    set_environment(monkeypatch)
+    mock_counters.get_counters.return_value = {'GitHub Stars': 42, 'Forks': 7}
+    mock_counters.get_polled_counters.return_value = {'GitHub Stars': 45, 'Forks': 7}
+    mock_aggregate.return_value = {}
+
+    cdh.create_and_put_metrics_and_widgets()
+
+    # The collected counters replace the stored ones
+    mock_counters.save_counters.assert_called_once_with('test-owner', 'test-repo-name',
+                                                        {'GitHub Stars': 45, 'Forks': 7})
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.repository_counters')
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_reconcile_polls_counters(mock_cw, mock_aggregate, mock_counters,
+                                                                     monkeypatch):
+    set_environment(monkeypatch)
+    mock_counters.get_polled_counters.return_value = {'GitHub Stars': 43, 'Forks': 7}
+    mock_aggregate.return_value = {}
+
+    cdh.create_and_put_metrics_and_widgets(reconcile=True)
+
+    mock_counters.get_counters.assert_not_called()
+    mock_aggregate.assert_called_once_with('test-owner', 'test-repo-name', {})
+    mock_counters.save_counters.assert_called_once_with('test-owner', 'test-repo-name',
+                                                        {'GitHub Stars': 43, 'Forks': 7})
+
+
 @mock_sqs
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_activity_widget')
-@patch('lambda_dir.cloudwatch_dashboard_handler.github_docker.aggregate_metrics')
+@patch('collect_github_docker_metrics.aggregate_metrics')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_text_widget')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_metric_widget')
 def test_create_and_put_metrics_and_widgets_slash_in_repo_name(mock_cmw, mock_ctw, mock_aggregate, mock_caw,
@@ -212,13 +332,13 @@ def test_create_and_put_metrics_and_widgets_slash_in_repo_name(mock_cmw, mock_ct
     mock_ctw.return_value = text_widget
     mock_caw.return_value = {'test-activity': 'activity'}
     widgets = cdh.create_and_put_metrics_and_widgets()
-    mock_aggregate.assert_called_once_with('test-owner', 'test-repo-name')
+    mock_aggregate.assert_called_once_with('test-owner', 'test-repo-name', {})
     assert widgets == return_data
 
 
 @mock_sqs
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_activity_widget')
-@patch('lambda_dir.cloudwatch_dashboard_handler.github_docker.aggregate_metrics')
+@patch('collect_github_docker_metrics.aggregate_metrics')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_text_widget')
 @patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_metric_widget')
 def test_create_and_put_metrics_and_widgets_invalid_widget_type(mock_cmw, mock_ctw, mock_aggregate, mock_caw, capfd,
@@ -238,3 +358,394 @@ def test_create_and_put_metrics_and_widgets_invalid_widget_type(mock_cmw, mock_c
     out, err = capfd.readouterr()
     assert 'Invalid widget type specified for widget: test-main' in out
     assert widgets == return_data
+
+
+@mock_sqs
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_traffic_widget')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_activity_widget')
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_text_widget')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_metric_widget')
+def test_create_and_put_metrics_and_widgets_traffic_history(mock_cmw, mock_ctw, mock_aggregate, mock_caw, mock_ctrw,
+                                                            aws_credentials, monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('traffic_history', 'y')
+    sorted_widgets, metric_widget, text_widget, return_data = get_metric_and_widget_data()
+    mock_aggregate.return_value = sorted_widgets
+    mock_cmw.return_value = metric_widget
+    mock_ctw.return_value = text_widget
+    mock_caw.return_value = {'test-activity': 'activity'}
+    mock_ctrw.return_value = {'test-traffic': 'traffic'}
+    widgets = cdh.create_and_put_metrics_and_widgets()
+    mock_ctrw.assert_called_once_with('test-repo-name')
+    return_data['test-dashboard-name-prefix-test-repo-name'].append({'test-traffic': 'traffic'})
+    assert widgets == return_data
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_traffic_widget')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_activity_widget')
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_shared_details_dashboard(mock_cw, mock_aggregate, mock_caw, mock_ctrw,
+                                                                     monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('shared_details_dashboard', 'y')
+    monkeypatch.setenv('traffic_history', 'y')
+    mock_aggregate.return_value = {
+        'test-main': {'type': 'metric', 'dashboard_level': 'main', 'data': {'test': 1}},
+        'test-metric-details': {'type': 'metric', 'dashboard_level': 'details', 'data': {'test': 2}},
+        'test-details': {'type': 'text', 'dashboard_level': 'details', 'data': {'test1': 'test2'}}
+    }
+    mock_cw.REPOSITORY_PLACEHOLDER = '{repository}'
+    mock_cw.create_metric_widget.side_effect = lambda repo_name, data, title: 'metric ' + repo_name + ': ' + title
+    mock_cw.create_log_text_widget.side_effect = lambda repo_name, title: 'log ' + repo_name + ': ' + title
+    mock_cw.create_activity_widget.side_effect = lambda repo_name: 'activity ' + repo_name
+    mock_cw.create_traffic_widget.side_effect = lambda repo_name, title: 'traffic ' + repo_name + ': ' + title
+
+    widgets = cdh.create_and_put_metrics_and_widgets()
+
+    # The shared widgets show the first repository, with the placeholder for the variable in their titles and queries
+    assert widgets == {
+        'test-dashboard-name-prefix': [
+            'metric test-repo-name: test-repo-name test-main',
+            'activity test-repo-name',
+            'metric other-repo-name: other-repo-name test-main',
+            'activity other-repo-name'
+        ],
+        'test-dashboard-name-prefix-details': [
+            'metric test-repo-name: {repository} test-metric-details',
+            'log {repository}: {repository} test-details',
+            'traffic test-repo-name: {repository} Daily Traffic'
+        ]
+    }
+    mock_cw.publish_widget_metrics.assert_called_once_with('other-repo-name', {'test': 2})
+    assert mock_cw.log_text_snapshot.call_args_list == [
+        (('test-owner', 'test-repo-name', 'test-repo-name test-details', {'test1': 'test2'}),),
+        (('other-owner', 'other-repo-name', 'other-repo-name test-details', {'test1': 'test2'}),)
+    ]
+    mock_cw.create_text_widget.assert_not_called()
+
+
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_search_widgets(mock_cw, mock_aggregate, monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('search_widgets', 'y')
+    mock_aggregate.return_value = {
+        'test-main': {'type': 'metric', 'dashboard_level': 'main', 'data': {'Stars': 1, 'Forks': 2}},
+        'test-main-text': {'type': 'text', 'dashboard_level': 'main', 'data': {'test1': 'test2'}},
+        'test-metric-details': {'type': 'metric', 'dashboard_level': 'details', 'data': {'test': 2}}
+    }
+    mock_cw.create_metric_widget.side_effect = lambda repo_name, data, title: 'metric ' + title
+    mock_cw.create_text_widget.side_effect = lambda data, title: 'text ' + title
+    mock_cw.create_search_widget.side_effect = lambda metric_name, title: 'search ' + title
+    mock_cw.create_activity_search_widgets.return_value = ['activity search']
+
+    widgets = cdh.create_and_put_metrics_and_widgets()
+
+    assert widgets == {
+        'test-dashboard-name-prefix': [
+            'search Stars by Repository',
+            'search Forks by Repository',
+            'activity search',
+            'text test-repo-name test-main-text',
+            'text other-repo-name test-main-text'
+        ],
+        'test-dashboard-name-prefix-test-repo-name': ['metric test-repo-name test-metric-details'],
+        'test-dashboard-name-prefix-other-repo-name': ['metric other-repo-name test-metric-details']
+    }
+    assert mock_cw.publish_widget_metrics.call_args_list == [
+        (('test-repo-name', {'Stars': 1, 'Forks': 2}),),
+        (('other-repo-name', {'Stars': 1, 'Forks': 2}),)
+    ]
+    assert mock_cw.fill_missing_activity_metrics.call_args_list == [(('test-repo-name',),), (('other-repo-name',),)]
+    mock_cw.create_activity_widget.assert_not_called()
+
+
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.text_widget_renderer.save_snapshot')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_custom_text_widgets(mock_cw, mock_save_snapshot, mock_aggregate,
+                                                                monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('custom_text_widgets', 'y')
+    mock_aggregate.return_value = {
+        'test-text-widget-name': {'type': 'text', 'dashboard_level': 'main', 'data': {'test1': 'test2'}},
+        'test-details': {'type': 'text', 'dashboard_level': 'details', 'data': {'test3': 'test4'}}
+    }
+    mock_cw.create_custom_text_widget.side_effect = lambda repo_name, title, data, owner: owner + ' custom ' + title
+    mock_cw.create_activity_widget.side_effect = lambda repo_name: 'activity ' + repo_name
+
+    widgets = cdh.create_and_put_metrics_and_widgets()
+
+    assert widgets == {
+        'test-dashboard-name-prefix': [
+            'test-owner custom test-repo-name Properties',
+            'activity test-repo-name',
+            'other-owner custom other-repo-name Properties',
+            'activity other-repo-name'
+        ],
+        'test-dashboard-name-prefix-test-repo-name': ['test-owner custom test-repo-name test-details'],
+        'test-dashboard-name-prefix-other-repo-name': ['other-owner custom other-repo-name test-details']
+    }
+    assert mock_save_snapshot.call_args_list == [
+        (('test-owner', 'test-repo-name', {'test-repo-name Properties': {'test1': 'test2'},
+                                           'test-repo-name test-details': {'test3': 'test4'}}),),
+        (('other-owner', 'other-repo-name', {'other-repo-name Properties': {'test1': 'test2'},
+                                             'other-repo-name test-details': {'test3': 'test4'}}),)
+    ]
+    mock_cw.create_text_widget.assert_not_called()
+
+
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.text_widget_renderer.save_snapshot')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_shared_custom_text_widgets(mock_cw, mock_save_snapshot, mock_aggregate,
+                                                                       monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('custom_text_widgets', 'y')
+    monkeypatch.setenv('shared_details_dashboard', 'y')
+    mock_aggregate.return_value = {
+        'test-details': {'type': 'text', 'dashboard_level': 'details', 'data': {'test3': 'test4'}}
+    }
+    mock_cw.REPOSITORY_PLACEHOLDER = '{repository}'
+
+    cdh.create_and_put_metrics_and_widgets()
+
+    # The variable only switches the repository, so the renderer looks up the owner of the shared widget
+    mock_cw.create_custom_text_widget.assert_called_once_with('{repository}', '{repository} test-details',
+                                                              {'test3': 'test4'}, owner=None)
+    assert [call[0][:2] for call in mock_save_snapshot.call_args_list] == [('test-owner', 'test-repo-name'),
+                                                                           ('other-owner', 'other-repo-name')]
+
+
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.text_widget_renderer.save_snapshot')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_saves_snapshot_for_refresh(mock_cw, mock_save_snapshot, mock_aggregate,
+                                                                       monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('refresh_queue_url', 'https://queue.amazonaws.com/123456789012/RefreshQueue')
+    mock_aggregate.return_value = {
+        'test-text-widget-name': {'type': 'text', 'dashboard_level': 'main', 'data': {'test1': 'test2'}}
+    }
+    mock_cw.create_text_widget.side_effect = lambda data, title: 'text ' + title
+
+    widgets = cdh.create_and_put_metrics_and_widgets()
+
+    # The refresh jobs update the text widgets from the snapshot
+    assert widgets['test-dashboard-name-prefix'][0] == 'text test-repo-name Properties'
+    mock_save_snapshot.assert_called_once_with('test-owner', 'test-repo-name',
+                                               {'test-repo-name Properties': {'test1': 'test2'}})
+
+
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.rollup_metrics.publish_rollups')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions')
+def test_create_and_put_metrics_and_widgets_rollup_metrics(mock_cw, mock_publish_rollups, mock_aggregate, monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('rollup_metrics', 'Stars')
+    monkeypatch.setenv('repo_groups', '{"group": ["test-repo-name", "other-owner/other-repo-name"]}')
+    mock_aggregate.side_effect = [
+        {'test-main': {'type': 'metric', 'dashboard_level': 'main', 'data': {'Stars': 1, 'Forks': 2}}},
+        {'test-main': {'type': 'metric', 'dashboard_level': 'main', 'data': {'Stars': 3, 'Forks': 4}}}
+    ]
+    mock_cw.create_metric_widget.side_effect = lambda repo_name, data, title: 'metric ' + title
+    mock_cw.create_activity_widget.side_effect = lambda repo_name: 'activity ' + repo_name
+    mock_cw.create_rollup_widget.return_value = 'rollup'
+
+    widgets = cdh.create_and_put_metrics_and_widgets()
+
+    expected_rollups = {
+        ('OWNER', 'test-owner'): {'Stars': 1},
+        ('REPO_GROUP', 'group'): {'Stars': 4},
+        ('OWNER', 'other-owner'): {'Stars': 3}
+    }
+    mock_publish_rollups.assert_called_once_with(expected_rollups)
+    mock_cw.create_rollup_widget.assert_called_once_with(expected_rollups)
+    assert widgets['test-dashboard-name-prefix'] == [
+        'rollup',
+        'metric test-repo-name test-main',
+        'activity test-repo-name',
+        'metric other-repo-name test-main',
+        'activity other-repo-name'
+    ]
+
+
+@pytest.fixture
+def forget_deliveries():
+    cdh.webhook_handler.webhook_deliveries.remembered_deliveries.clear()
+    yield
+    cdh.webhook_handler.webhook_deliveries.remembered_deliveries.clear()
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_catch_up')
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
+def test_catch_up_skips_delivered_events(mock_put_metrics, mock_catch_up, state_table, forget_deliveries,
+                                         monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo')
+    delivered = {'event': 'pull_request', 'delivery': 'delivery-1', 'action': 'opened', 'repo_name': 'test-repo-name',
+                 'owner': 'test-owner', 'number': '4', 'created_at': '2019-05-15T15:20:18Z'}
+    missed = dict(delivered, number='5')
+    mock_catch_up.fetch_missed_events.side_effect = [([dict(delivered, delivery=''), dict(missed, delivery='')],
+                                                      {'last_event_id': '2'}),
+                                                     ([], None)]
+
+    cdh.handler(get_sqs_event([delivered]), None)
+    cdh.catch_up_webhook_events()
+
+    assert mock_put_metrics.call_count == 2
+    assert [call[0] for call in mock_catch_up.fetch_missed_events.call_args_list] == \
+        [('test-owner', 'test-repo-name'), ('other-owner', 'other-repo')]
+    mock_catch_up.save_cursor.assert_called_once_with('test-owner', 'test-repo-name', {'last_event_id': '2'})
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_catch_up')
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.handle_webhook_records')
+def test_catch_up_keeps_cursor_of_failed_events(mock_handle_records, mock_catch_up, monkeypatch):
+    set_environment(monkeypatch)
+    mock_catch_up.fetch_missed_events.return_value = [{'event': 'push'}], {'last_event_id': '2'}
+    mock_handle_records.return_value = {'batchItemFailures': [{'itemIdentifier': 'catch-up-0'}]}
+
+    cdh.catch_up_webhook_events()
+
+    assert json.loads(mock_handle_records.call_args[0][0][0]['body']) == {'event': 'push'}
+    mock_catch_up.save_cursor.assert_not_called()
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_catch_up')
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_handler.handle_webhook_records')
+def test_catch_up_failed_repository_keeps_cursor_and_continues(mock_handle_records, mock_catch_up, monkeypatch,
+                                                               capfd):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo')
+    mock_catch_up.fetch_missed_events.side_effect = [ValueError('events API unavailable'),
+                                                     ([], {'last_event_id': '3'})]
+
+    cdh.catch_up_webhook_events()
+
+    mock_handle_records.assert_not_called()
+    mock_catch_up.save_cursor.assert_called_once_with('other-owner', 'other-repo', {'last_event_id': '3'})
+    assert 'Failed to catch up the webhook events of test-owner/test-repo-name' in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.dashboards.get_superseded_widgets', Mock(return_value={}))
+@patch('lambda_dir.cloudwatch_dashboard_handler.catch_up_webhook_events')
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store')
+@patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
+def test_handler_catches_up_webhook_events(mock_crud, mock_mw, mock_state_store, mock_catch_up, monkeypatch):
+    mock_mw.return_value = {}
+
+    cdh.handler({}, None)
+    mock_catch_up.assert_not_called()
+
+    monkeypatch.setenv('webhook_catch_up', 'y')
+    cdh.handler({}, None)
+    mock_catch_up.assert_called_once_with()
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.webhook_redrive.redrive_dead_letter_queue')
+@patch('lambda_dir.cloudwatch_dashboard_handler.create_and_put_metrics_and_widgets')
+def test_handler_redrives_dead_letter_queue(mock_mw, mock_redrive):
+    mock_redrive.return_value = {'redriven': 1, 'failed': 0, 'skipped': 0, 'more': False}
+    context = Mock()
+    context.get_remaining_time_in_millis.return_value = 300000
+
+    assert cdh.handler({'redrive': {'events': ['push']}}, context) == mock_redrive.return_value
+
+    mock_redrive.assert_called_once_with(cdh.webhook_handler.handle_webhook_records, {'events': ['push']}, 300)
+    mock_mw.assert_not_called()
+
+
+def get_refresh_event(jobs):
+    return {'Records': [{'messageId': 'job-%d' % index, 'body': json.dumps(job), 'eventSource': 'aws:sqs',
+                         'eventSourceARN': 'arn:aws:sqs:us-west-2:123456789012:RefreshQueue'}
+                        for index, job in enumerate(jobs)]}
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.cloudwatch_dashboard_handler.refresh_repository_widgets')
+def test_handler_refreshes_each_repository_once(mock_refresh, mock_crud, monkeypatch):
+    set_environment(monkeypatch)
+    mock_refresh.side_effect = lambda owner, repo_name, events: {
+        'test-dashboard-name-prefix-' + repo_name: [{'type': 'text', 'properties': {'title': repo_name}}]}
+    mock_crud.return_value = {'test-dashboard-name-prefix-repo-a': {'status': cdh.cw_interactions.WRITTEN},
+                              'test-dashboard-name-prefix-repo-b': {'status': cdh.cw_interactions.FAILED,
+                                                                    'error': 'throttled'}}
+
+    response = cdh.handler(get_refresh_event([{'owner': 'aws', 'repo_name': 'repo-a', 'event': 'release'},
+                                              {'owner': 'aws', 'repo_name': 'repo-a', 'event': 'pull_request'},
+                                              {'owner': 'aws', 'repo_name': 'repo-b', 'event': 'release'},
+                                              'not a job']), None)
+
+    assert [call[0] for call in mock_refresh.call_args_list] == [('aws', 'repo-a', {'release', 'pull_request'}),
+                                                                 ('aws', 'repo-b', {'release'})]
+    mock_crud.assert_called_once()
+    # The job of the dashboard that failed is retried, as is the job that couldn't be read
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'job-3'}, {'itemIdentifier': 'job-2'}]}
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.text_widget_renderer.save_snapshot')
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store.get_state')
+@patch('collect_github_docker_metrics.aggregate_metrics')
+@patch('lambda_dir.cloudwatch_dashboard_handler.cw_interactions.publish_widget_metrics')
+def test_refresh_repository_widgets(mock_publish, mock_aggregate, mock_get_state, mock_save_snapshot, monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('widgets', json.dumps({'Releases': {'type': 'text', 'metrics': []}}))
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'Latest GitHub Release': 'releases/latest/tag_name',
+        'Latest Release Asset Download Count': 'releases/latest/assets',
+        'GitHub Stars': 'stargazers_count'
+    }))
+    monkeypatch.setenv('github_fields_paginated', json.dumps({'Open Pull Requests': 'pulls'}))
+    mock_aggregate.return_value = {
+        'Releases': {'type': 'text', 'dashboard_level': 'main', 'data': {'Latest GitHub Release': 'v1.1'}},
+        'Latest Release Asset Download Count': {'type': 'text', 'dashboard_level': 'details',
+                                                'data': {'new.zip': '0', 'Total': '0'}},
+        'test-metric-widget-name': {'type': 'metric', 'dashboard_level': 'details', 'data': {'Open Pull Requests': 2}}
+    }
+    mock_get_state.return_value = {
+        'test-repo-name Releases': {'Latest GitHub Release': 'v1.0', 'Release Date': 'May 15, 2019'},
+        'test-repo-name Latest Release Asset Download Count': {'old.zip': '12', 'Total': '12'}
+    }
+
+    widgets = cdh.refresh_repository_widgets('test-owner', 'test-repo-name', {'release'})
+
+    assert mock_aggregate.call_args[1]['only_metrics'] == {'Latest GitHub Release',
+                                                           'Latest Release Asset Download Count'}
+    mock_publish.assert_called_once_with('test-repo-name', {'Open Pull Requests': 2})
+    # The values of a configured widget that weren't collected again are kept, a built widget is replaced
+    mock_get_state.assert_called_once_with('text#test-owner/test-repo-name')
+    assert mock_save_snapshot.call_args[0][:2] == ('test-owner', 'test-repo-name')
+    assert mock_save_snapshot.call_args[0][2] == {
+        'test-repo-name Releases': {'Latest GitHub Release': 'v1.1', 'Release Date': 'May 15, 2019'},
+        'test-repo-name Latest Release Asset Download Count': {'new.zip': '0', 'Total': '0'}
+    }
+    assert list(widgets) == ['test-dashboard-name-prefix', 'test-dashboard-name-prefix-test-repo-name']
+    assert widgets['test-dashboard-name-prefix'][0]['properties']['markdown'].startswith('## test-repo-name Releases')
+    assert 'v1.1' in widgets['test-dashboard-name-prefix'][0]['properties']['markdown']
+
+
+@patch('lambda_dir.cloudwatch_dashboard_handler.text_widget_renderer.save_snapshot')
+@patch('lambda_dir.cloudwatch_dashboard_handler.state_store.get_state')
+@patch('collect_github_docker_metrics.aggregate_metrics')
+def test_refresh_repository_widgets_without_snapshot(mock_aggregate, mock_get_state, mock_save_snapshot, monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('widgets', json.dumps({}))
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({'Latest GitHub Release': 'releases/latest/tag_name'}))
+    mock_aggregate.return_value = {
+        'test-text-widget-name': {'type': 'text', 'dashboard_level': 'main', 'data': {'Latest GitHub Release': 'v1.1'}}
+    }
+    mock_get_state.return_value = {}
+
+    # The hourly run hasn't stored the other values of the widget yet
+    assert cdh.refresh_repository_widgets('test-owner', 'test-repo-name', {'release'}) == {}
+    assert cdh.refresh_repository_widgets('test-owner', 'test-repo-name', {'push'}) == {}
+    assert mock_aggregate.call_count == 1
@@ -1,15 +1,32 @@
+from datetime import datetime, timezone
 import json
 import os
+import re
+import threading
+import time
 from unittest.mock import Mock, patch
 
 import boto3
 import botocore.session
 from botocore.stub import Stubber
 from moto import mock_cloudwatch
+import pytest
 
+from lambda_dir import aws_clients
 from lambda_dir import cloudwatch_interactions as cw
 
 
+@pytest.fixture(autouse=True)
+def dashboard_leases(request):
+    """Grants every dashboard lease without a state table, except to the tests marked with 'state_table'"""
+    if 'state_table' in request.keywords:
+        yield
+        return
+    with patch('lambda_dir.cloudwatch_interactions.state_store.acquire_lease', return_value=True), \
+            patch('lambda_dir.cloudwatch_interactions.state_store.release_lease'):
+        yield
+
+
 def test_new_metric_good_input():
     repo_name = 'repo-name'
     metric_name = 'metric-name'
@@ -30,6 +47,13 @@ def test_new_metric_good_input():
     assert metric == metric_to_compare
 
 
+def test_new_metric_with_timestamp():
+    timestamp = datetime(2020, 8, 20, tzinfo=timezone.utc)
+    metric = cw.new_metric('repo-name', 'metric-name', 12, timestamp)
+    assert metric['Timestamp'] == timestamp
+    assert metric['Value'] == 12
+
+
 def test_new_metric_no_metric_name():
     repo_name = 'repo-name'
     metric_value = 12
@@ -103,6 +127,45 @@ def test_create_text_widget_good_input():
     assert text_widget == text_widget_to_compare
 
 
+def test_create_text_table():
+    assert cw.create_text_table({'a': '1', 'b': '2'}) == ' Name | Value \n ----|----- \na | 1\nb | 2\n'
+
+
+def test_create_custom_text_widget(monkeypatch):
+    monkeypatch.setenv('text_widget_renderer_arn', 'test-renderer-arn')
+    text_data = {'a': '1', 'b': '2', 'c': '3', 'd': '4'}
+
+    widget = cw.create_custom_text_widget('repo-name', 'repo-name Properties', text_data)
+
+    assert widget == {
+        'type': 'custom',
+        'width': 6,
+        'height': 6,
+        'properties': {
+            'endpoint': 'test-renderer-arn',
+            'params': {'repo_name': 'repo-name', 'title': 'repo-name Properties'},
+            'updateOn': {'refresh': True, 'resize': False, 'timeRange': False},
+            'title': 'repo-name Properties'
+        }
+    }
+    assert cw.widget_identity(widget) == ('custom', 'repo-name Properties')
+
+
+def test_create_custom_text_widget_with_owner(monkeypatch):
+    monkeypatch.setenv('text_widget_renderer_arn', 'test-renderer-arn')
+
+    widget = cw.create_custom_text_widget('repo-name', 'repo-name Properties', {'a': '1'}, owner='repo-owner')
+
+    assert widget['properties']['params'] == {'owner': 'repo-owner', 'repo_name': 'repo-name',
+                                              'title': 'repo-name Properties'}
+
+
+def test_create_custom_text_widget_same_for_new_text(monkeypatch):
+    monkeypatch.setenv('text_widget_renderer_arn', 'test-renderer-arn')
+    assert cw.create_custom_text_widget('repo-name', 'title', {'a': '1'}) == cw.create_custom_text_widget(
+        'repo-name', 'title', {'a': '2'})
+
+
 def test_create_text_widget_empty_title():
     title = ''
     text_data = {'test_key': 'test_val'}
@@ -150,6 +213,15 @@ def test_create_metric_widget_good_input_no_granularity(monkeypatch, aws_credent
     assert metric_widget == metric_widget_to_compare
 
 
+@patch('lambda_dir.cloudwatch_interactions.publish_widget_metrics')
+def test_create_metric_widget_without_publishing(mock_publish, monkeypatch):
+    monkeypatch.setenv('namespace', 'namespace')
+    monkeypatch.setenv('AWS_REGION', 'us-west-2')
+    metric_widget = cw.create_metric_widget('repo-name', {'test_val_2': 12}, title='repo-name widget', publish=False)
+    assert metric_widget['properties']['metrics'] == [['namespace', 'test_val_2', 'REPO_NAME', 'repo-name']]
+    mock_publish.assert_not_called()
+
+
 @mock_cloudwatch
 def test_create_metric_widget_good_input_with_granularity_minutes(monkeypatch, aws_credentials):
     monkeypatch.setenv("namespace", "namespace")
@@ -560,10 +632,471 @@ def test_create_or_update_dashboard_good_input_overwrite_same_widget(monkeypatch
     assert len(updated_widgets) == 1
 
 
-@patch('lambda_dir.cloudwatch_interactions.cloudwatch.get_metric_data')
+@mock_cloudwatch
+def test_create_or_update_dashboard_unchanged_dashboard_skipped(monkeypatch, capfd, aws_credentials):
+    cloudwatch = boto3.client('cloudwatch')
+    dashboard_name = 'dash-name'
+    widget = {
+        'type': 'metric',
+        'width': 6,
+        'height': 6,
+        'properties': {
+            'metrics': [
+                ['namespace', 'GitHub Stars', 'REPO_NAME', 'repo-name']
+            ],
+            'view': 'singleValue',
+            'period': 3600,
+            'stat': 'Maximum',
+            'region': os.environ['AWS_REGION'],
+            'title': dashboard_name + ' Repository Status'
+        }
+    }
+    user_widget = {'type': 'text', 'width': 6, 'height': 6, 'properties': {'markdown': 'hello'}}
+    cloudwatch.put_dashboard(
+        DashboardName=dashboard_name,
+        DashboardBody=json.dumps({'widgets': [widget, user_widget]}, indent=4)
+    )
+
+    cw.create_or_update_dashboard({dashboard_name: [json.loads(json.dumps(widget))]})
+    out, err = capfd.readouterr()
+    assert 'Populating dashboard' not in out
+    assert 'Dashboards written: 0, unchanged and skipped: 1' in out
+
+
+@mock_cloudwatch
+def test_create_or_update_dashboard_counts_written_and_skipped(monkeypatch, capfd, aws_credentials):
+    cloudwatch = boto3.client('cloudwatch')
+    widget = cw.create_text_widget({'Stars': '3'}, title='repo-name Properties')
+    cloudwatch.put_dashboard(DashboardName='unchanged-dash', DashboardBody=json.dumps({'widgets': [widget]}))
+    cloudwatch.put_dashboard(DashboardName='changed-dash', DashboardBody=json.dumps({'widgets': [widget]}))
+
+    cw.create_or_update_dashboard({
+        'unchanged-dash': [cw.create_text_widget({'Stars': '3'}, title='repo-name Properties')],
+        'changed-dash': [cw.create_text_widget({'Stars': '4'}, title='repo-name Properties')],
+        'new-dash': [cw.create_text_widget({'Stars': '4'}, title='repo-name Properties')]
+    })
+    out, err = capfd.readouterr()
+    assert 'Dashboards written: 2, unchanged and skipped: 1' in out
+    changed_body = json.loads(cloudwatch.get_dashboard(DashboardName='changed-dash')['DashboardBody'])
+    assert '4' in changed_body['widgets'][0]['properties']['markdown']
+
+
+def get_mock_cloudwatch(dashboard_pages: list, existing_widgets=None):
+    mock_cloudwatch = Mock()
+    mock_cloudwatch.exceptions.DashboardInvalidInputError = type('DashboardInvalidInputError', (Exception,), {})
+    mock_cloudwatch.get_paginator.return_value.paginate.return_value = [
+        {'DashboardEntries': [{'DashboardName': name} for name in page]} for page in dashboard_pages
+    ]
+    mock_cloudwatch.get_dashboard.return_value = {'DashboardBody': json.dumps({'widgets': existing_widgets or []})}
+    return mock_cloudwatch
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_list_dashboard_names_follows_every_page(mock_get_client):
+    mock_cloudwatch = get_mock_cloudwatch([['prefix-a', 'prefix-b'], ['prefix-c']])
+    mock_get_client.return_value = mock_cloudwatch
+
+    assert cw.list_dashboard_names('prefix') == {'prefix-a', 'prefix-b', 'prefix-c'}
+    mock_cloudwatch.get_paginator.assert_called_once_with('list_dashboards')
+    mock_cloudwatch.get_paginator.return_value.paginate.assert_called_once_with(DashboardNamePrefix='prefix')
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_create_or_update_dashboard_lists_once_and_fetches_existing_only(mock_get_client):
+    mock_cloudwatch = get_mock_cloudwatch([['prefix'], ['prefix-repo-1']])
+    mock_get_client.return_value = mock_cloudwatch
+    widget = cw.create_text_widget({'Stars': '3'}, title='repo Properties')
+    dashboard_widget_mapping = {name: [dict(widget)] for name in ['prefix', 'prefix-repo-1', 'prefix-repo-2']}
+
+    results = cw.create_or_update_dashboard(dashboard_widget_mapping)
+
+    # Besides the one listing, only the dashboard that is created is listed again, under its lease
+    assert mock_cloudwatch.get_paginator.return_value.paginate.call_args_list == [
+        ((), {'DashboardNamePrefix': 'prefix'}),
+        ((), {'DashboardNamePrefix': 'prefix-repo-2'})
+    ]
+    fetched = sorted(call[1]['DashboardName'] for call in mock_cloudwatch.get_dashboard.call_args_list)
+    assert fetched == ['prefix', 'prefix-repo-1']
+    assert results == {name: {'status': cw.WRITTEN} for name in dashboard_widget_mapping.keys()}
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_create_or_update_dashboard_failures_are_isolated(mock_get_client, capfd):
+    mock_cloudwatch = get_mock_cloudwatch([[]])
+    mock_get_client.return_value = mock_cloudwatch
+
+    def put_dashboard(DashboardName, DashboardBody):
+        if DashboardName == 'prefix-invalid':
+            raise mock_cloudwatch.exceptions.DashboardInvalidInputError('invalid widget')
+        if DashboardName == 'prefix-throttled':
+            raise RuntimeError('throttled')
+
+    mock_cloudwatch.put_dashboard.side_effect = put_dashboard
+    widget = cw.create_text_widget({'Stars': '3'}, title='repo Properties')
+    names = ['prefix-good', 'prefix-invalid', 'prefix-throttled']
+
+    results = cw.create_or_update_dashboard({name: [dict(widget)] for name in names})
+
+    assert results['prefix-good'] == {'status': cw.WRITTEN}
+    assert results['prefix-invalid']['status'] == cw.FAILED
+    assert 'invalid widget' in results['prefix-invalid']['error']
+    assert results['prefix-throttled']['status'] == cw.FAILED
+    assert 'throttled' in results['prefix-throttled']['error']
+    assert 'Dashboards written: 1, unchanged and skipped: 0, failed: 2' in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_create_or_update_dashboard_bounded_concurrency(mock_get_client):
+    mock_cloudwatch = get_mock_cloudwatch([[]])
+    mock_get_client.return_value = mock_cloudwatch
+    lock = threading.Lock()
+    running = [0]
+    most_running = [0]
+
+    def put_dashboard(DashboardName, DashboardBody):
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    mock_cloudwatch.put_dashboard.side_effect = put_dashboard
+    widget = cw.create_text_widget({'Stars': '3'}, title='repo Properties')
+
+    results = cw.create_or_update_dashboard({'prefix-' + str(i): [dict(widget)] for i in range(40)})
+
+    assert len(results) == 40
+    assert mock_cloudwatch.put_dashboard.call_count == 40
+    assert 1 < most_running[0] <= cw.MAX_DASHBOARD_WORKERS
+
+
+def test_create_or_update_dashboard_nothing_to_do():
+    assert cw.create_or_update_dashboard({}) == {}
+
+
+def new_metric_widget(title: str, metric_name='GitHub Stars', **layout) -> dict:
+    widget = {
+        'type': 'metric',
+        'width': 6,
+        'height': 6,
+        'properties': {
+            'metrics': [['namespace', metric_name, 'REPO_NAME', title]],
+            'view': 'singleValue',
+            'period': 3600,
+            'stat': 'Maximum',
+            'region': 'us-west-2',
+            'title': title
+        }
+    }
+    widget.update(layout)
+    return widget
+
+
+def test_widget_identity():
+    assert cw.widget_identity(new_metric_widget('repo Stars')) == ('metric', 'repo Stars')
+    assert cw.widget_identity(cw.create_text_widget({'Stars': '3'}, title='repo Properties')) == (
+        'text', 'repo Properties')
+    assert cw.widget_identity({'type': 'text', 'properties': {'markdown': '# Notes'}}) == ('text', 'Notes')
+    assert cw.widget_identity({'type': 'text', 'properties': {'markdown': 'no heading\n# later heading'}}) is None
+    assert cw.widget_identity({'type': 'metric', 'properties': {'metrics': []}}) is None
+
+
+def test_merge_widgets_text_title_must_match_exactly():
+    existing = [cw.create_text_widget({'Stars': '1'}, title='repo-name Properties Extended')]
+    new = cw.create_text_widget({'Stars': '2'}, title='repo-name Properties')
+
+    merged = cw.merge_widgets(existing, [new])
+
+    assert merged == [existing[0], new]
+
+
+def test_merge_widgets_keeps_existing_layout_and_user_widgets():
+    user_widget = {'type': 'text', 'x': 0, 'y': 0, 'width': 24, 'height': 2, 'properties': {'markdown': 'Team notes'}}
+    existing_metric = new_metric_widget('repo Stars', x=0, y=2, width=12)
+    existing_metric['properties']['view'] = 'timeSeries'
+    existing_text = dict(cw.create_text_widget({'Stars': '1'}, title='repo Properties'), x=12, y=2)
+
+    new_text = cw.create_text_widget({'Stars': '2'}, title='repo Properties')
+    new_metric = new_metric_widget('repo Stars', metric_name='GitHub Forks')
+    added_widget = new_metric_widget('repo Watchers')
+
+    merged = cw.merge_widgets([user_widget, existing_metric, existing_text], [new_text, added_widget, new_metric])
+
+    assert merged[0] == user_widget
+    assert (merged[1]['x'], merged[1]['y'], merged[1]['width']) == (0, 2, 12)
+    assert merged[1]['properties']['view'] == 'timeSeries'
+    assert merged[1]['properties']['metrics'] == new_metric['properties']['metrics']
+    assert (merged[2]['x'], merged[2]['y']) == (12, 2)
+    assert merged[2]['properties']['markdown'] == new_text['properties']['markdown']
+    assert merged[3] == added_widget
+    assert len(merged) == 4
+    # The existing widgets aren't changed in place
+    assert existing_metric['properties']['metrics'][0][1] == 'GitHub Stars'
+
+
+def test_merge_widgets_removes_superseded_widgets():
+    user_widget = new_metric_widget('Team board')
+    existing = [new_metric_widget('repo Stars'), user_widget, new_metric_widget('repo Activity'),
+                new_metric_widget('GitHub Stars by Repository')]
+    search_widget = new_metric_widget('GitHub Stars by Repository')
+
+    merged = cw.merge_widgets(existing, [search_widget], {('metric', 'repo Stars'), ('metric', 'repo Activity'),
+                                                          ('metric', 'GitHub Stars by Repository')})
+
+    # A superseded widget that is also put again stays, widgets added by users are never superseded
+    assert [cw.widget_identity(widget) for widget in merged] == [('metric', 'Team board'),
+                                                                 ('metric', 'GitHub Stars by Repository')]
+
+
+def test_merge_widgets_text_types_replace_each_other(monkeypatch):
+    monkeypatch.setenv('text_widget_renderer_arn', 'arn')
+    existing = [cw.create_text_widget({'Stars': '1'}, title='repo Properties'),
+                cw.create_text_widget({'Stars': '1'}, title='other-repo Properties')]
+    custom_widget = cw.create_custom_text_widget('repo', 'repo Properties', {'Stars': '2'})
+
+    merged = cw.merge_widgets(existing, [custom_widget])
+
+    assert [cw.widget_identity(widget) for widget in merged] == [('text', 'other-repo Properties'),
+                                                                 ('custom', 'repo Properties')]
+
+
+def test_merge_widgets_hundreds_of_widgets():
+    existing = []
+    for i in range(300):
+        existing.append(new_metric_widget('repo-%d Stars' % i, x=(i % 4) * 6, y=(i // 4) * 6))
+        existing.append(cw.create_text_widget({'Stars': str(i)}, title='repo-%d Properties' % i))
+        if i % 10 == 0:
+            existing.append({'type': 'text', 'properties': {'markdown': 'user note %d' % i}})
+    # Consecutive widgets with the same identity, which removing while iterating used to skip
+    existing.append(new_metric_widget('repo-0 Stars'))
+
+    new = []
+    for i in range(350):
+        new.append(new_metric_widget('repo-%d Stars' % i, metric_name='Forks'))
+        new.append(cw.create_text_widget({'Stars': str(i + 1)}, title='repo-%d Properties' % i))
+
+    merged = cw.merge_widgets(existing, new)
+
+    assert len(merged) == len(existing) + 100
+    assert merged[:len(existing)] != existing
+    for original, widget in zip(existing, merged):
+        assert cw.widget_identity(original) == cw.widget_identity(widget)
+        assert {key: value for key, value in original.items() if key != 'properties'} == {
+            key: value for key, value in widget.items() if key != 'properties'}
+    updated_metrics = [widget for widget in merged[:600] if widget['type'] == 'metric']
+    assert all(widget['properties']['metrics'][0][1] == 'Forks' for widget in updated_metrics)
+    assert merged[1]['properties']['markdown'] == new[1]['properties']['markdown']
+    user_notes = [widget for widget in merged if 'user note' in widget['properties'].get('markdown', '')]
+    assert len(user_notes) == 30
+    # Only the first of two widgets with the same identity is updated, the other is kept as it was
+    assert merged[len(existing) - 1] == existing[-1]
+    assert [cw.widget_identity(widget) for widget in merged[len(existing):]] == [
+        cw.widget_identity(widget) for widget in new[600:]]
+
+
+def test_get_page_names():
+    existing_dashboard_names = {'prefix', 'prefix-page-10', 'prefix-page-2', 'prefix-repo', 'prefix-repo-page-2',
+                                'prefix-page-x'}
+    assert cw.get_page_names('prefix', existing_dashboard_names) == ['prefix', 'prefix-page-2', 'prefix-page-10']
+    assert cw.get_page_names('prefix-repo', existing_dashboard_names) == ['prefix-repo', 'prefix-repo-page-2']
+    assert cw.get_page_names('new-prefix', existing_dashboard_names) == ['new-prefix']
+
+
+def test_plan_pages_single_page():
+    widgets = [new_metric_widget('repo-%d Stars' % i) for i in range(10)]
+    assert cw.plan_pages('prefix', widgets, {}) == {'prefix': widgets}
+
+
+def test_plan_pages_splits_at_widget_limit():
+    widgets = [new_metric_widget('repo-%d Stars' % i) for i in range(600)]
+    per_page = int((cw.MAX_WIDGETS_PER_DASHBOARD - 1) * cw.PAGE_FILL_RATIO)
+
+    pages = cw.plan_pages('prefix', widgets, {})
+
+    assert list(pages.keys()) == ['prefix', 'prefix-page-2']
+    assert pages['prefix'] == widgets[:per_page]
+    assert pages['prefix-page-2'] == widgets[per_page:]
+
+
+def test_plan_pages_splits_at_metric_limit():
+    widget = new_metric_widget('repo Stars')
+    widget['properties']['metrics'] = widget['properties']['metrics'] * 100
+    widgets = [dict(widget, properties=dict(widget['properties'], title='repo-%d' % i)) for i in range(50)]
+
+    pages = cw.plan_pages('prefix', widgets, {})
+
+    assert [len(page_widgets) for page_widgets in pages.values()] == [22, 22, 6]
+    assert list(pages.keys()) == ['prefix', 'prefix-page-2', 'prefix-page-3']
+
+
+def test_plan_pages_splits_at_body_size():
+    widgets = [cw.create_text_widget({'Notes': 'x' * 100000}, title='repo-%d Properties' % i) for i in range(20)]
+
+    pages = cw.plan_pages('prefix', widgets, {})
+
+    assert len(pages) > 1
+    for page_widgets in pages.values():
+        assert len(json.dumps({'widgets': page_widgets})) <= cw.MAX_DASHBOARD_BODY_BYTES * cw.PAGE_FILL_RATIO
+
+
+def test_plan_pages_widgets_stay_on_their_page():
+    existing_bodies = {
+        'prefix': {'widgets': [new_metric_widget('repo-1 Stars')]},
+        'prefix-page-2': {'widgets': [new_metric_widget('repo-2 Stars')]},
+        'prefix-page-4': {'widgets': [new_metric_widget('repo-4 Stars')]}
+    }
+    widgets = [new_metric_widget('repo-%d Stars' % i) for i in [5, 4, 2, 1]]
+
+    pages = cw.plan_pages('prefix', widgets, existing_bodies)
+
+    assert pages == {
+        'prefix': [widgets[3]],
+        'prefix-page-2': [widgets[2]],
+        'prefix-page-4': [widgets[0], widgets[1]]
+    }
+
+
+@patch('lambda_dir.cloudwatch_interactions.MAX_WIDGETS_PER_DASHBOARD', 11)
+def test_plan_pages_new_page_number_skips_existing_pages():
+    existing_bodies = {
+        'prefix': {'widgets': [new_metric_widget('repo-1 Stars')]},
+        'prefix-page-3': {'widgets': [new_metric_widget('repo-%d Stars' % i) for i in range(100, 109)]}
+    }
+    pages = cw.plan_pages('prefix', [new_metric_widget('repo-2 Stars')], existing_bodies)
+    assert pages == {'prefix': [], 'prefix-page-3': [], 'prefix-page-4': [new_metric_widget('repo-2 Stars')]}
+
+
+def test_create_page_index_widget():
+    widget = cw.create_page_index_widget('prefix', ['prefix', 'prefix-page-2'])
+    assert cw.widget_identity(widget) == ('text', 'prefix Pages')
+    assert widget['properties']['markdown'] == (
+        '## prefix Pages\n[Page 1](#dashboards:name=prefix) | [Page 2](#dashboards:name=prefix-page-2)')
+
+
+@mock_cloudwatch
+def test_create_or_update_dashboard_sharded(monkeypatch, capfd, aws_credentials):
+    cloudwatch = boto3.client('cloudwatch')
+    user_widget = {'type': 'text', 'width': 6, 'height': 6, 'properties': {'markdown': 'Team notes'}}
+    cloudwatch.put_dashboard(DashboardName='prefix', DashboardBody=json.dumps({'widgets': [user_widget]}))
+    widgets = [new_metric_widget('repo-%d Stars' % i) for i in range(600)]
+
+    results = cw.create_or_update_dashboard({'prefix': widgets})
+
+    assert results == {'prefix': {'status': cw.WRITTEN}, 'prefix-page-2': {'status': cw.WRITTEN}}
+    first_page = json.loads(cloudwatch.get_dashboard(DashboardName='prefix')['DashboardBody'])['widgets']
+    second_page = json.loads(cloudwatch.get_dashboard(DashboardName='prefix-page-2')['DashboardBody'])['widgets']
+    index_widget = cw.create_page_index_widget('prefix', ['prefix', 'prefix-page-2'])
+    assert first_page[0] == index_widget
+    assert first_page[1] == user_widget
+    assert second_page[0] == index_widget
+    assert len(first_page) + len(second_page) == 603
+
+    # A repository added later goes on the last page, and the pages that didn't change aren't written
+    results = cw.create_or_update_dashboard({'prefix': widgets + [new_metric_widget('repo-new Stars')]})
+    assert results == {'prefix': {'status': cw.SKIPPED}, 'prefix-page-2': {'status': cw.WRITTEN}}
+    second_page = json.loads(cloudwatch.get_dashboard(DashboardName='prefix-page-2')['DashboardBody'])['widgets']
+    assert second_page[-1]['properties']['title'] == 'repo-new Stars'
+
+
+@mock_cloudwatch
+def test_create_or_update_dashboard_sets_properties_and_keeps_existing_ones(aws_credentials):
+    cloudwatch = boto3.client('cloudwatch')
+    widget = new_metric_widget('repo Stars')
+    cloudwatch.put_dashboard(DashboardName='prefix-details',
+                             DashboardBody=json.dumps({'widgets': [widget], 'start': '-PT6H'}))
+    variables = cw.create_repository_variables(['repo', 'other-repo'])
+
+    results = cw.create_or_update_dashboard({'prefix-details': [widget]}, {'prefix-details': {'variables': variables}})
+
+    assert results == {'prefix-details': {'status': cw.WRITTEN}}
+    body = json.loads(cloudwatch.get_dashboard(DashboardName='prefix-details')['DashboardBody'])
+    assert body == {'widgets': [widget], 'start': '-PT6H', 'variables': variables}
+
+    results = cw.create_or_update_dashboard({'prefix-details': [widget]}, {'prefix-details': {'variables': variables}})
+    assert results == {'prefix-details': {'status': cw.SKIPPED}}
+
+
+def test_create_repository_variables():
+    [property_variable, pattern_variable] = cw.create_repository_variables(['repo', 'other-repo'])
+    assert property_variable['type'] == 'property'
+    assert property_variable['property'] == 'REPO_NAME'
+    assert pattern_variable['type'] == 'pattern'
+    assert re.fullmatch(pattern_variable['pattern'], cw.REPOSITORY_PLACEHOLDER)
+    # The pattern only matches the placeholder, not repository names, log groups or other parts of the dashboard
+    assert not re.search(pattern_variable['pattern'], "SOURCE '/aws/lambda/MetricsHandler' | filter repo_name = 'repo'")
+    for variable in [property_variable, pattern_variable]:
+        assert variable['defaultValue'] == 'repo'
+        assert variable['values'] == [{'value': 'repo', 'label': 'repo'},
+                                      {'value': 'other-repo', 'label': 'other-repo'}]
+
+
+def test_create_traffic_widget_title(monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('AWS_REGION', 'us-west-2')
+    assert cw.create_traffic_widget('repo')['properties']['title'] == 'repo Daily Traffic'
+    widget = cw.create_traffic_widget('repo', title=cw.REPOSITORY_PLACEHOLDER + ' Daily Traffic')
+    assert widget['properties']['title'] == '{repository} Daily Traffic'
+    assert widget['properties']['metrics'][0][3] == 'repo'
+
+
+def test_create_log_text_widget(monkeypatch):
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'MetricsHandler')
+    widget = cw.create_log_text_widget('repo', 'repo Properties')
+    assert widget['type'] == 'log'
+    assert cw.widget_identity(widget) == ('log', 'repo Properties')
+    assert widget['properties']['query'].startswith("SOURCE '/aws/lambda/MetricsHandler' |")
+    assert "repo_name = 'repo' and title = 'repo Properties'" in widget['properties']['query']
+
+
+def test_log_text_snapshot(capfd):
+    cw.log_text_snapshot('owner', 'repo', 'repo Properties', {'Latest Release': 'v1.0', 'License': 'Apache-2.0'})
+    lines = [json.loads(line) for line in capfd.readouterr()[0].splitlines()]
+    assert lines == [
+        {'snapshot': 'text', 'owner': 'owner', 'repo_name': 'repo', 'title': 'repo Properties',
+         'name': 'Latest Release', 'value': 'v1.0'},
+        {'snapshot': 'text', 'owner': 'owner', 'repo_name': 'repo', 'title': 'repo Properties', 'name': 'License',
+         'value': 'Apache-2.0'}
+    ]
+
+
+@patch('lambda_dir.cloudwatch_interactions.put_metrics_in_cloudwatch')
+def test_publish_widget_metrics(mock_put_metrics):
+    cw.publish_widget_metrics('repo', {'GitHub Stars': 3, 'Forks': 1})
+    assert mock_put_metrics.call_args[0][0] == [cw.new_metric('repo', 'GitHub Stars', 3), cw.new_metric('repo', 'Forks', 1)]
+
+
+def test_get_dashboard_fingerprint_ignores_key_order_and_formatting():
+    body = {'widgets': [{'type': 'text', 'width': 6, 'properties': {'markdown': '# title', 'background': 'solid'}}]}
+    reordered_body = json.loads('{"widgets": [{"properties": {"background": "solid", "markdown": "# title"}, '
+                                '"width": 6, "type": "text"}]}')
+    assert cw.get_dashboard_fingerprint(body) == cw.get_dashboard_fingerprint(reordered_body)
+
+
+def test_get_dashboard_fingerprint_detects_changes():
+    body = {'widgets': [{'type': 'text', 'properties': {'markdown': '# title'}}]}
+    changed_body = {'widgets': [{'type': 'text', 'properties': {'markdown': '# other title'}}]}
+    assert cw.get_dashboard_fingerprint(body) != cw.get_dashboard_fingerprint(changed_body)
+    assert cw.get_dashboard_fingerprint(body) != cw.get_dashboard_fingerprint(dict(body, periodOverride='inherit'))
+
+
+def test_get_dashboard_fingerprint_widget_order():
+    first = {'type': 'text', 'properties': {'markdown': '# first'}}
+    second = {'type': 'text', 'properties': {'markdown': '# second'}}
+    # Without positions the order decides the layout
+    assert cw.get_dashboard_fingerprint({'widgets': [first, second]}) != cw.get_dashboard_fingerprint(
+        {'widgets': [second, first]})
+
+    first = dict(first, x=0, y=0)
+    second = dict(second, x=6, y=0)
+    assert cw.get_dashboard_fingerprint({'widgets': [first, second]}) == cw.get_dashboard_fingerprint(
+        {'widgets': [second, first]})
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
 @patch('lambda_dir.cloudwatch_interactions.put_metrics_in_cloudwatch')
 @patch('lambda_dir.cloudwatch_interactions.new_metric')
-def test_create_activity_widget(mock_new_metric, mock_put_metrics, mock_get, capfd, monkeypatch):
+def test_create_activity_widget(mock_new_metric, mock_put_metrics, mock_get_client, capfd, monkeypatch):
     monkeypatch.setenv('namespace', 'test-namespace')
     monkeypatch.setenv('AWS_REGION', 'test-region')
     expected_metric_names = [
@@ -575,7 +1108,7 @@ def test_create_activity_widget(mock_new_metric, mock_put_metrics, mock_get, cap
         'Releases Published',
         'Pushes to Master'
     ]
-    mock_get.return_value = {
+    mock_get_client.return_value.get_metric_data.return_value = {
         'MetricDataResults': [{'Label': name, 'Values': []} for name in expected_metric_names],
     }
     mock_new_metric.side_effect = lambda repo, name, value: print(repo, name, value)
@@ -598,4 +1131,235 @@ def test_create_activity_widget(mock_new_metric, mock_put_metrics, mock_get, cap
             'region': 'test-region',
             'title': 'test-repo-name Activity Over the Last 24 hours'
         }
-    }
\ No newline at end of file
+    }
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+@patch('lambda_dir.cloudwatch_interactions.put_metrics_in_cloudwatch')
+def test_fill_missing_activity_metrics_only_fills_missing(mock_put_metrics, mock_get_client, monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    mock_get_client.return_value.get_metric_data.return_value = {
+        'MetricDataResults': [{'Label': name, 'Values': [] if name == 'PRs Opened' else [2.0]}
+                              for name in cw.ACTIVITY_METRIC_NAMES],
+    }
+
+    cw.fill_missing_activity_metrics('test-repo-name')
+
+    mock_put_metrics.assert_called_once_with([cw.new_metric('test-repo-name', 'PRs Opened', 0)])
+
+
+def test_new_metric_other_dimension():
+    metric = cw.new_metric('test-owner', 'GitHub Stars', 3, dimension_name='OWNER')
+    assert metric['Dimensions'] == [{'Name': 'OWNER', 'Value': 'test-owner'}]
+
+
+def test_create_rollup_widget(monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('AWS_REGION', 'test-region')
+    rollups = {
+        ('OWNER', 'test-owner'): {'GitHub Stars': 7, 'Open Pull Requests': 3},
+        ('REPO_GROUP', 'tools'): {'GitHub Stars': 4}
+    }
+
+    widget = cw.create_rollup_widget(rollups)
+
+    assert widget == {
+        'type': 'metric',
+        'width': 6,
+        'height': 3,
+        'properties': {
+            'metrics': [
+                ['test-namespace', 'GitHub Stars', 'OWNER', 'test-owner', {'label': 'test-owner GitHub Stars'}],
+                ['test-namespace', 'Open Pull Requests', 'OWNER', 'test-owner',
+                 {'label': 'test-owner Open Pull Requests'}],
+                ['test-namespace', 'GitHub Stars', 'REPO_GROUP', 'tools', {'label': 'tools GitHub Stars'}]
+            ],
+            'view': 'singleValue',
+            'period': 3600,
+            'stat': 'Maximum',
+            'region': 'test-region',
+            'title': 'Totals Across Repositories'
+        }
+    }
+
+
+def test_create_search_widget(monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('AWS_REGION', 'test-region')
+
+    widget = cw.create_search_widget('GitHub Stars', 'GitHub Stars by Repository')
+
+    assert widget == {
+        'type': 'metric',
+        'width': 6,
+        'height': 6,
+        'properties': {
+            'metrics': [[{
+                'expression': 'SORT(SEARCH(\'{test-namespace,REPO_NAME} MetricName="GitHub Stars"\', \'Maximum\', '
+                              '3600), MAX, DESC, 25)',
+                'id': 'search',
+                'label': "${PROP('Dim.REPO_NAME')}"
+            }]],
+            'view': 'bar',
+            'period': 3600,
+            'stat': 'Maximum',
+            'region': 'test-region',
+            'title': 'GitHub Stars by Repository'
+        }
+    }
+
+
+def test_create_activity_search_widgets(monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('AWS_REGION', 'test-region')
+
+    widgets = cw.create_activity_search_widgets()
+
+    assert [widget['properties']['title'] for widget in widgets] == [
+        name + ' Over the Last 24 hours' for name in cw.ACTIVITY_METRIC_NAMES]
+    for widget in widgets:
+        expression = widget['properties']['metrics'][0][0]['expression']
+        assert "'Sum', 86400), SUM, DESC, 25)" in expression
+        assert widget['properties']['stat'] == 'Sum'
+        assert widget['properties']['period'] == 86400
+        # The widget doesn't name any repository, so it stays the same as repositories come and go
+        assert 'test-repo-name' not in json.dumps(widget)
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_put_metrics_in_cloudwatch_single_request(mock_get_client, monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    metrics = [cw.new_metric('repo-name', 'metric-name', value) for value in range(3)]
+    cw.put_metrics_in_cloudwatch(metrics)
+    mock_get_client.return_value.put_metric_data.assert_called_once_with(Namespace='test-namespace',
+                                                                         MetricData=metrics)
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_put_metrics_in_cloudwatch_splits_large_batches(mock_get_client, monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    metrics = [cw.new_metric('repo-name', 'metric-name', value) for value in range(cw.MAX_METRIC_DATA_PER_PUT + 1)]
+    cw.put_metrics_in_cloudwatch(metrics)
+    calls = mock_get_client.return_value.put_metric_data.call_args_list
+    assert len(calls) == 2
+    assert calls[0][1]['MetricData'] == metrics[:cw.MAX_METRIC_DATA_PER_PUT]
+    assert calls[1][1]['MetricData'] == metrics[cw.MAX_METRIC_DATA_PER_PUT:]
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_buffered_metrics(mock_get_client, monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    metrics = [cw.new_metric('repo-name', 'metric-name', value) for value in range(3)]
+
+    with pytest.raises(ValueError):
+        with cw.buffered_metrics():
+            for metric in metrics:
+                cw.put_metrics_in_cloudwatch([metric])
+            mock_get_client.return_value.put_metric_data.assert_not_called()
+            raise ValueError('bad payload')
+
+    mock_get_client.return_value.put_metric_data.assert_called_once_with(Namespace='test-namespace',
+                                                                         MetricData=metrics)
+    cw.put_metrics_in_cloudwatch(metrics[:1])
+    assert mock_get_client.return_value.put_metric_data.call_count == 2
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_buffered_metrics_dropped_on_error(mock_get_client, monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+
+    with pytest.raises(ValueError):
+        with cw.buffered_metrics(put_on_error=False):
+            cw.put_metrics_in_cloudwatch([cw.new_metric('repo-name', 'metric-name', 1)])
+            raise ValueError('bad payload')
+
+    mock_get_client.return_value.put_metric_data.assert_not_called()
+
+
+@patch('lambda_dir.cloudwatch_interactions.aws_clients.get_client')
+def test_buffered_metrics_nested(mock_get_client, monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    metrics = [cw.new_metric('repo-name', 'metric-name', value) for value in range(3)]
+
+    with cw.buffered_metrics():
+        cw.put_metrics_in_cloudwatch(metrics[:1])
+        with cw.buffered_metrics(put_on_error=False):
+            cw.put_metrics_in_cloudwatch(metrics[1:2])
+        with pytest.raises(ValueError):
+            with cw.buffered_metrics(put_on_error=False):
+                cw.put_metrics_in_cloudwatch([cw.new_metric('repo-name', 'metric-name', 9)])
+                raise ValueError('bad payload')
+        cw.put_metrics_in_cloudwatch(metrics[2:])
+        mock_get_client.return_value.put_metric_data.assert_not_called()
+
+    # The inner buffers are put in the outer one, without the metrics of the one that failed
+    mock_get_client.return_value.put_metric_data.assert_called_once_with(Namespace='test-namespace',
+                                                                         MetricData=metrics)
+
+
+def test_create_traffic_widget(monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('AWS_REGION', 'test-region')
+    traffic_widget = cw.create_traffic_widget('test-repo-name')
+    assert traffic_widget['properties']['metrics'] == [
+        ['test-namespace', 'Daily Clones', 'REPO_NAME', 'test-repo-name'],
+        ['test-namespace', 'Daily Unique Cloners', 'REPO_NAME', 'test-repo-name'],
+        ['test-namespace', 'Daily Views', 'REPO_NAME', 'test-repo-name'],
+        ['test-namespace', 'Daily Unique Visitors', 'REPO_NAME', 'test-repo-name']
+    ]
+    assert traffic_widget['properties']['view'] == 'timeSeries'
+    assert traffic_widget['properties']['period'] == 86400
+    assert traffic_widget['properties']['title'] == 'test-repo-name Daily Traffic'
+
+
+@pytest.fixture
+def moto_dashboards(state_table):
+    with mock_cloudwatch():
+        yield
+
+
+def slow_merge_widgets(existing_widgets, widgets_to_put, superseded_identities=None, merge_widgets=cw.merge_widgets):
+    # Widens the gap between reading and writing a dashboard, so unguarded concurrent updates would overwrite each other
+    time.sleep(0.05)
+    return merge_widgets(existing_widgets, widgets_to_put, superseded_identities)
+
+
+@pytest.mark.state_table
+@patch('lambda_dir.cloudwatch_interactions.merge_widgets', side_effect=slow_merge_widgets)
+def test_concurrent_updates_of_one_dashboard_lose_no_widgets(mock_merge, moto_dashboards, monkeypatch):
+    # DynamoDB applies a conditional write atomically, moto doesn't across threads
+    acquire_lease = cw.state_store.acquire_lease
+    dynamodb_lock = threading.Lock()
+
+    def atomic_acquire_lease(*args):
+        with dynamodb_lock:
+            return acquire_lease(*args)
+
+    monkeypatch.setattr(cw.state_store, 'acquire_lease', atomic_acquire_lease)
+    titles = ['repo-%d Properties' % index for index in range(8)]
+    threads = [threading.Thread(target=cw.create_or_update_dashboard,
+                                args=({'prefix': [cw.create_text_widget({'Stars': '3'}, title=title)]},))
+               for title in titles]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    body = json.loads(aws_clients.get_client('cloudwatch').get_dashboard(DashboardName='prefix')['DashboardBody'])
+    assert sorted(cw.widget_identity(widget)[1] for widget in body['widgets']) == titles
+    # Every lease was released
+    assert aws_clients.get_client('dynamodb').scan(TableName='test-state-table')['Count'] == 0
+
+
+@pytest.mark.state_table
+@patch('lambda_dir.cloudwatch_interactions.DASHBOARD_LEASE_WAIT_SECONDS', 0)
+def test_reconcile_dashboard_fails_when_lease_is_held(moto_dashboards, capfd):
+    from lambda_dir import state_store
+    state_store.acquire_lease('dashboard-lease#prefix', 'other-invocation', 60)
+    widget = cw.create_text_widget({'Stars': '3'}, title='repo Properties')
+
+    results = cw.create_or_update_dashboard({'prefix': [widget]})
+
+    assert results['prefix']['status'] == cw.FAILED
+    assert 'another invocation' in results['prefix']['error']
+    assert aws_clients.get_client('cloudwatch').list_dashboards()['DashboardEntries'] == []
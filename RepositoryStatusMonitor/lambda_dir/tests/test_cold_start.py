@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from lambda_dir import webhook_messages
+
+# Every module that is the entry point of a Lambda function in the stack
+HANDLER_MODULES = ['cloudwatch_dashboard_handler', 'history_backfill', 'text_widget_renderer', 'webhook_creator',
+                   'webhook_handler']
+
+IMPORT_TIMER = ('import sys, time\n'
+                'start = time.perf_counter()\n'
+                'import {module}\n'
+                'print((time.perf_counter() - start) * 1000)\n'
+                'print(" ".join(sys.modules))\n')
+
+
+def cold_import(module: str) -> tuple:
+    """Imports the module in a fresh interpreter, the same way a Lambda cold start does, and returns the best of three
+    import times in milliseconds and the modules loaded by the import"""
+    lambda_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # No region or credentials: importing a handler must never need to talk to AWS
+    environment = {name: value for name, value in os.environ.items() if not name.startswith('AWS_')}
+    timings = []
+    loaded_modules = []
+    for _ in range(3):
+        completed_process = subprocess.run([sys.executable, '-c', IMPORT_TIMER.format(module=module)],
+                                           cwd=lambda_path, env=environment, capture_output=True)
+        assert completed_process.returncode == 0, completed_process.stderr.decode('utf-8')
+        import_time, loaded_modules = completed_process.stdout.decode('utf-8').splitlines()
+        timings.append(float(import_time))
+    return min(timings), loaded_modules.split(' ')
+
+
+@pytest.mark.parametrize('module', HANDLER_MODULES)
+def test_handler_cold_import_within_budget(module, pytestconfig):
+    budget = float(pytestconfig.getini('cold_import_budget_ms'))
+    import_time, loaded_modules = cold_import(module)
+    print('Cold import of %s took %.1f ms (budget %.0f ms)' % (module, import_time, budget))
+    assert import_time <= budget
+
+
+def test_webhook_path_does_not_import_collection_stack():
+    import_time, loaded_modules = cold_import('cloudwatch_dashboard_handler')
+    assert 'collect_github_docker_metrics' not in loaded_modules
+
+
+def test_webhook_handler_only_imports_packaged_modules():
+    import_time, loaded_modules = cold_import('webhook_handler')
+    lambda_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    lambda_modules = {file_name[:-3] for file_name in os.listdir(lambda_path) if file_name.endswith('.py')}
+    # The stack packages the webhook handler with these modules only
+    assert lambda_modules.intersection(loaded_modules) == set(webhook_messages.WEBHOOK_HANDLER_MODULES)
@@ -269,7 +269,7 @@ def test_aggregate_metrics(mock_process, mock_unpgn, mock_verify, mock_pgn, mock
     mock_unpgn.return_value = unpgn_metric
     mock_verify.side_effect = [({'test-github-unpgn': 0}, {}), ({}, {'test-docker': 'hello'})]
     mock_pgn.return_value = {'test-github-pgn': 12}
-    mock_sort.side_effect = lambda metric, text, param_to_name: print('Requested metric data:', metric,
+    mock_sort.side_effect = lambda metric, text, param_to_name, only_metrics: print('Requested metric data:', metric,
                                                                       '\nRequested text data:', text)
 
     with mock_secretsmanager():
@@ -302,7 +302,7 @@ def test_aggregate_metrics_no_docker(mock_process, mock_unpgn, mock_verify, mock
     mock_unpgn.return_value = unpgn_metric
     mock_verify.side_effect = [({'test-github-unpgn': 0}, {}), ({}, {'test-docker': 'hello'})]
     mock_pgn.return_value = {'test-github-pgn': 12}
-    mock_sort.side_effect = lambda metric, text, param_to_name: print('Requested metric data:', metric,
+    mock_sort.side_effect = lambda metric, text, param_to_name, only_metrics: print('Requested metric data:', metric,
                                                                       '\nRequested text data:', text)
 
     with mock_secretsmanager():
@@ -317,6 +317,192 @@ def test_aggregate_metrics_no_docker(mock_process, mock_unpgn, mock_verify, mock
         assert "Requested text data: {'test-docker': 'hello'}" not in out
 
 
+@mock_secretsmanager
+@patch('lambda_dir.collect_github_docker_metrics.sort_metrics_by_widget')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_paginated_metrics')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_unpaginated_metrics')
+def test_aggregate_metrics_known_metrics(mock_unpgn, mock_pgn, mock_sort, monkeypatch, aws_credentials):
+    monkeypatch.setenv('docker_bool', 'n')
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'GitHub Stars': 'stargazers_count',
+        'Forks': 'forks_count',
+        'Latest GitHub Release': 'releases/latest/tag_name'
+    }))
+    monkeypatch.setenv('github_fields_paginated', json.dumps({'Open Pull Requests': 'pulls'}))
+    monkeypatch.setenv('docker_fields', json.dumps({}))
+    mock_unpgn.side_effect = lambda url, repo_name, headers=None, param=None: {'tag_name': 'v1.0'}
+    mock_pgn.return_value = {}
+    mock_sort.side_effect = lambda metric, text, param_to_name, only_metrics: (metric, text)
+
+    with mock_secretsmanager():
+        boto3.setup_default_session()
+        boto3.client('secretsmanager').create_secret(
+            Name='github_auth_token',
+            SecretString='1234'
+        )
+        metric_data, text_data = github_docker.aggregate_metrics('test-owner', 'test-repo-name',
+                                                                 {'GitHub Stars': 42, 'Forks': 7})
+
+    # Every metric of the repository endpoint is known, so only the release is requested
+    mock_unpgn.assert_called_once()
+    assert mock_unpgn.call_args[1]['param'] == 'releases/latest'
+    assert metric_data == {'GitHub Stars': 42, 'Forks': 7}
+    assert text_data == {'Latest GitHub Release': 'v1.0'}
+
+
+@mock_secretsmanager
+@patch('lambda_dir.collect_github_docker_metrics.sort_metrics_by_widget')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_paginated_metrics')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_unpaginated_metrics')
+def test_aggregate_metrics_known_metrics_requested(mock_unpgn, mock_pgn, mock_sort, monkeypatch, aws_credentials):
+    monkeypatch.setenv('docker_bool', 'n')
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'GitHub Stars': 'stargazers_count',
+        'Forks': 'forks_count',
+        'Open Issues': 'open_issues_count'
+    }))
+    monkeypatch.setenv('github_fields_paginated', json.dumps({'Open Pull Requests': 'pulls'}))
+    monkeypatch.setenv('docker_fields', json.dumps({}))
+    mock_unpgn.return_value = {'stargazers_count': 45, 'forks_count': 8, 'open_issues_count': 3}
+    mock_pgn.return_value = {}
+    mock_sort.side_effect = lambda metric, text, param_to_name, only_metrics: (metric, text)
+
+    with mock_secretsmanager():
+        boto3.setup_default_session()
+        boto3.client('secretsmanager').create_secret(
+            Name='github_auth_token',
+            SecretString='1234'
+        )
+        metric_data, text_data = github_docker.aggregate_metrics('test-owner', 'test-repo-name',
+                                                                 {'GitHub Stars': 42, 'Forks': 7})
+
+    # The open issues aren't known, so the repository endpoint is requested and its collected counters are used
+    mock_unpgn.assert_called_once()
+    assert metric_data == {'GitHub Stars': 45, 'Forks': 8, 'Open Issues': 3}
+
+
+@patch('lambda_dir.collect_github_docker_metrics.traffic_history.publish_traffic_history')
+@patch('lambda_dir.collect_github_docker_metrics.sort_metrics_by_widget')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_paginated_metrics')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_unpaginated_metrics')
+def test_aggregate_metrics_only_metrics(mock_unpgn, mock_pgn, mock_sort, mock_publish, monkeypatch, aws_credentials):
+    monkeypatch.setenv('docker_bool', 'y')
+    monkeypatch.setenv('traffic_history', 'y')
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'GitHub Stars': 'stargazers_count',
+        'Latest GitHub Release': 'releases/latest/tag_name'
+    }))
+    monkeypatch.setenv('github_fields_paginated', json.dumps({'Open Pull Requests': 'pulls', 'Contributors': 'contributors'}))
+    monkeypatch.setenv('docker_fields', json.dumps({'Docker Pull Count': 'pull_count'}))
+    mock_unpgn.side_effect = lambda url, repo_name, headers=None, param=None: {'tag_name': 'v1.1'}
+    mock_pgn.return_value = {'Open Pull Requests': 3}
+    mock_sort.side_effect = lambda metric, text, param_to_name, only_metrics: (metric, text, only_metrics)
+
+    with mock_secretsmanager():
+        boto3.setup_default_session()
+        boto3.client('secretsmanager').create_secret(
+            Name='github_auth_token',
+            SecretString='1234'
+        )
+        metric_data, text_data, only_metrics = github_docker.aggregate_metrics(
+            'test-owner', 'test-repo-name', only_metrics={'Latest GitHub Release', 'Open Pull Requests'})
+
+    # Neither the repository endpoint, the traffic history nor Docker is requested
+    mock_unpgn.assert_called_once()
+    assert mock_unpgn.call_args[1]['param'] == 'releases/latest'
+    assert mock_pgn.call_args[0][2] == {'Open Pull Requests': 'pulls'}
+    mock_publish.assert_not_called()
+    assert (metric_data, text_data) == ({'Open Pull Requests': 3}, {'Latest GitHub Release': 'v1.1'})
+    assert only_metrics == {'Latest GitHub Release', 'Open Pull Requests'}
+
+
+def test_sort_metrics_by_widget_only_metrics(monkeypatch, capfd):
+    monkeypatch.setenv('widgets', json.dumps({'Releases': {'type': 'text', 'metrics': ['releases/latest/tag_name']},
+                                              'Activity': {'type': 'metric', 'metrics': ['stargazers_count']}}))
+    monkeypatch.setenv('default_metric_widget_name', 'test-metric-widget-name')
+    monkeypatch.setenv('default_text_widget_name', 'test-text-widget-name')
+    param_to_name = {'releases/latest/tag_name': 'Latest GitHub Release', 'stargazers_count': 'GitHub Stars'}
+
+    sorted_metrics = github_docker.sort_metrics_by_widget({}, {'Latest GitHub Release': 'v1.1'}, param_to_name,
+                                                          {'Latest GitHub Release'})
+
+    assert sorted_metrics == {'Releases': {'type': 'text', 'dashboard_level': 'details',
+                                           'data': {'Latest GitHub Release': 'v1.1'}}}
+    # The metrics that weren't collected aren't missing
+    assert 'GitHub Stars' not in capfd.readouterr()[0]
+
+
+@mock_secretsmanager
+@patch('lambda_dir.collect_github_docker_metrics.traffic_history.publish_traffic_history')
+@patch('lambda_dir.collect_github_docker_metrics.sort_metrics_by_widget')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_paginated_metrics')
+@patch('lambda_dir.collect_github_docker_metrics.verify_and_retrieve_metric_data')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_unpaginated_metrics')
+@patch('lambda_dir.collect_github_docker_metrics.process_fields')
+def test_aggregate_metrics_traffic_history(mock_process, mock_unpgn, mock_verify, mock_pgn, mock_sort, mock_publish,
+                                           monkeypatch, aws_credentials):
+    monkeypatch.setenv('docker_bool', 'n')
+    monkeypatch.setenv('traffic_history', 'y')
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+
+    mock_process.side_effect = lambda name: ({'traffic/clones': {'Clones': 'uniques'}}, {'test-name': 'test-param'})
+    mock_unpgn.side_effect = lambda url, repo_name, headers=None, param=None: {'test-data-for': param}
+    mock_verify.return_value = {}, {}
+    mock_pgn.return_value = {}
+
+    with mock_secretsmanager():
+        boto3.setup_default_session()
+        boto3.client('secretsmanager').create_secret(
+            Name='github_auth_token',
+            SecretString='1234'
+        )
+        github_docker.aggregate_metrics('test-owner', 'test-repo-name')
+
+    # traffic/clones is part of the configured fields, so only traffic/views needs an extra request
+    assert mock_unpgn.call_count == 2
+    mock_publish.assert_called_once_with('test-owner', 'test-repo-name', {
+        'traffic/clones': {'test-data-for': 'traffic/clones'},
+        'traffic/views': {'test-data-for': 'traffic/views'}
+    })
+
+
+@mock_secretsmanager
+@patch('lambda_dir.collect_github_docker_metrics.traffic_history.publish_traffic_history')
+@patch('lambda_dir.collect_github_docker_metrics.sort_metrics_by_widget')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_paginated_metrics')
+@patch('lambda_dir.collect_github_docker_metrics.verify_and_retrieve_metric_data')
+@patch('lambda_dir.collect_github_docker_metrics.retrieve_unpaginated_metrics')
+@patch('lambda_dir.collect_github_docker_metrics.process_fields')
+def test_aggregate_metrics_traffic_history_failure(mock_process, mock_unpgn, mock_verify, mock_pgn, mock_sort,
+                                                   mock_publish, monkeypatch, aws_credentials, capfd):
+    monkeypatch.setenv('docker_bool', 'n')
+    monkeypatch.setenv('traffic_history', 'y')
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+
+    mock_process.side_effect = lambda name: ({'None': {'GitHub Stars': 'stargazers_count'}}, {})
+    mock_unpgn.return_value = {}
+    mock_verify.return_value = {'GitHub Stars': 3}, {}
+    mock_pgn.return_value = {}
+    mock_sort.return_value = {'test-widget': {'type': 'metric', 'dashboard_level': 'main', 'data': {'GitHub Stars': 3}}}
+    mock_publish.side_effect = Exception('The state table is unavailable')
+
+    with mock_secretsmanager():
+        boto3.setup_default_session()
+        boto3.client('secretsmanager').create_secret(
+            Name='github_auth_token',
+            SecretString='1234'
+        )
+        sorted_metrics = github_docker.aggregate_metrics('test-owner', 'test-repo-name')
+
+    # The repository's metrics are still collected without the traffic history
+    assert sorted_metrics == mock_sort.return_value
+    assert mock_sort.call_args[0][0] == {'GitHub Stars': 3}
+    assert 'Failed to publish the traffic history of test-owner/test-repo-name' in capfd.readouterr()[0]
+
+
 @patch('lambda_dir.collect_github_docker_metrics.process_metrics')
 def test_sort_metrics_by_widget_no_default(mock_process, monkeypatch):
     mock_process.side_effect = lambda sorted_metrics, param_to_name: sorted_metrics
@@ -0,0 +1,90 @@
+import json
+
+from lambda_dir import dashboards
+
+
+def set_environment(monkeypatch):
+    monkeypatch.setenv('repo_names', 'test-repo-name')
+    monkeypatch.setenv('dashboard_name_prefix', 'test-dashboard-name-prefix')
+
+
+def test_get_failed_dashboards():
+    results = {
+        'prefix': {'status': 'written'},
+        'prefix-page-2': {'status': 'failed', 'error': 'error'},
+        'prefix-repo': {'status': 'skipped'},
+        'prefix-other': {'status': 'failed', 'error': 'error'}
+    }
+    assert dashboards.get_failed_dashboards(['prefix', 'prefix-repo', 'prefix-other'], results) == {'prefix', 'prefix-other'}
+
+
+def test_get_dashboard_properties(monkeypatch):
+    set_environment(monkeypatch)
+    assert dashboards.get_dashboard_properties() == {}
+
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('shared_details_dashboard', 'y')
+    properties = dashboards.get_dashboard_properties()
+    variables = properties['test-dashboard-name-prefix-details']['variables']
+    assert [variable['type'] for variable in variables] == ['property', 'pattern']
+    assert [value['value'] for value in variables[0]['values']] == ['test-repo-name', 'other-repo-name']
+
+
+def test_get_details_dashboard_name(monkeypatch):
+    set_environment(monkeypatch)
+    assert dashboards.get_details_dashboard_name('test-repo-name') == 'test-dashboard-name-prefix-test-repo-name'
+    monkeypatch.setenv('shared_details_dashboard', 'y')
+    assert dashboards.get_details_dashboard_name('test-repo-name') == 'test-dashboard-name-prefix-details'
+
+
+def test_get_superseded_widgets_search_widgets(monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('default_metric_widget_name', 'Metrics')
+    monkeypatch.setenv('widgets', json.dumps({
+        'Popularity': {'type': 'metric', 'dashboard_level': 'main', 'metrics': ['stargazers_count']},
+        'Community': {'type': 'metric', 'dashboard_level': 'details', 'metrics': ['forks_count']}
+    }))
+    monkeypatch.setenv('search_widgets', 'y')
+
+    superseded = dashboards.get_superseded_widgets({'test-dashboard-name-prefix': []})
+
+    assert superseded['test-dashboard-name-prefix'] == {
+        ('metric', 'test-repo-name Popularity'), ('metric', 'test-repo-name Activity Over the Last 24 hours'),
+        ('metric', 'other-repo-name Popularity'), ('metric', 'other-repo-name Activity Over the Last 24 hours')
+    }
+
+
+def test_get_superseded_widgets_without_search_widgets(monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('AWS_REGION', 'us-west-2')
+    metric_widget = {'type': 'metric', 'properties': {
+        'title': 'test-repo-name Popularity',
+        'metrics': [['test-namespace', 'GitHub Stars', 'REPO_NAME', 'test-repo-name']]
+    }}
+
+    superseded = dashboards.get_superseded_widgets({'test-dashboard-name-prefix': [metric_widget]})
+
+    assert ('metric', 'GitHub Stars by Repository') in superseded['test-dashboard-name-prefix']
+    assert ('metric', 'PRs Merged Over the Last 24 hours') in superseded['test-dashboard-name-prefix']
+    assert ('metric', 'test-repo-name Popularity') not in superseded['test-dashboard-name-prefix']
+
+
+def test_get_superseded_widgets_shared_details_dashboard(monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('AWS_REGION', 'us-west-2')
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    widgets = {'test-dashboard-name-prefix-details': [
+        {'type': 'metric', 'properties': {'title': '{repository} Community', 'metrics': []}},
+        {'type': 'log', 'properties': {'title': '{repository} Languages', 'query': ''}}
+    ]}
+
+    superseded = dashboards.get_superseded_widgets(widgets)
+
+    # The widgets built for the first repository before the titles held the placeholder
+    assert superseded['test-dashboard-name-prefix-details'] == {
+        ('metric', 'test-repo-name Community'), ('text', 'test-repo-name Languages'),
+        ('custom', 'test-repo-name Languages'), ('log', 'test-repo-name Languages')
+    }
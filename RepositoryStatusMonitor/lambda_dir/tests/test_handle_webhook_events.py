@@ -1,22 +1,10 @@
-from unittest.mock import call, patch
+import json
+from unittest.mock import Mock, call, patch
 
-import boto3
 import pytest
-from moto import mock_secretsmanager
 
 from lambda_dir import handle_webhook_events as hw
-
-
-@mock_secretsmanager
-@pytest.fixture(scope='module', autouse=True)
-def create_secret():
-    with mock_secretsmanager():
-        boto3.setup_default_session()
-        boto3.client('secretsmanager').create_secret(
-            Name='github_auth_token',
-            SecretString='1234'
-        )
-        yield
+from lambda_dir import webhook_messages
 
 
 def set_environment(monkeypatch):
@@ -25,70 +13,72 @@ def set_environment(monkeypatch):
     monkeypatch.setenv('owner', 'test-owner')
 
 
+@pytest.fixture
+def mock_handlers():
+    handlers = {event: Mock(return_value={'widget': event}) for event in hw.EVENT_HANDLERS}
+    with patch.dict('lambda_dir.handle_webhook_events.EVENT_HANDLERS', handlers):
+        yield handlers
+
+
+def get_mock_handlers(mock_handlers: dict):
+    return [mock_handlers[event] for event in ['push', 'release', 'pull_request', 'issues']]
+
+
 def get_payload(payload_type: str):
     payloads = {
         'issue': {
-            "action": "closed",
-            "issue": {
-                "created_at": "2019-05-15T15:20:18Z",
-                "closed_at": "2019-05-15T15:40:18Z",
-            },
-            "repository": {
-                "name": "test-repo-name"
-            }
+            'event': 'issues',
+            'action': 'closed',
+            'repo_name': 'test-repo-name',
+            'created_at': '2019-05-15T15:20:18Z',
+            'closed_at': '2019-05-15T15:40:18Z'
         },
         'pr': {
-            "action": "closed",
-            "pull_request": {
-                "created_at": "2019-05-15T15:20:18Z",
-                "closed_at": "2019-05-15T15:40:18Z",
-            },
-            "repository": {
-                "name": "test-repo-name"
-            }
+            'event': 'pull_request',
+            'action': 'closed',
+            'repo_name': 'test-repo-name',
+            'created_at': '2019-05-15T15:20:18Z',
+            'closed_at': '2019-05-15T15:40:18Z',
+            'merged': 'false'
         },
         'release': {
-            "action": "published",
-            "release": {
-                "published_at": "2019-05-15T15:40:18Z"
-            },
-            "repository": {
-                "name": "test-repo-name",
-                "owner": {
-                    "login": "aws"
-                }
-            }
+            'event': 'release',
+            'action': 'published',
+            'repo_name': 'test-repo-name',
+            'owner': 'aws',
+            'published_at': '2019-05-15T15:40:18Z'
         },
         'push': {
-            'ref': 'refs/heads/master',
-            "pusher": {
-                "name": "pusher"
-            },
-            "repository": {
-                "name": "test-repo-name"
-            }
+            'event': 'push',
+            'repo_name': 'test-repo-name',
+            'ref': 'refs/heads/master'
+        },
+        'comment': {
+            'event': 'issue_comment',
+            'action': 'created',
+            'repo_name': 'test-repo-name',
+            'owner': 'aws',
+            'number': '7',
+            'created_at': '2019-05-15T15:20:18Z',
+            'author': 'author',
+            'pull_request_url': '',
+            'responded_at': '2019-05-15T17:20:18Z',
+            'sender': 'maintainer',
+            'sender_type': 'User'
         },
         'bad_event': {
-            "action": "closed",
-            "bad": {
-                "created_at": "2019-05-15T15:20:18Z",
-                "closed_at": "2019-05-15T15:40:18Z",
-            },
-            "repository": {
-                "name": "test-repo-name"
-            }
+            'event': 'bad',
+            'action': 'closed',
+            'repo_name': 'test-repo-name'
         },
 
     }
     return payloads[payload_type]
 
 
-@patch('lambda_dir.handle_webhook_events.handle_issues')
-@patch('lambda_dir.handle_webhook_events.handle_prs')
-@patch('lambda_dir.handle_webhook_events.handle_releases')
-@patch('lambda_dir.handle_webhook_events.handle_pushes')
-def test_handle_webhook_issue(mock_push, mock_release, mock_pr, mock_issue, monkeypatch):
+def test_handle_webhook_issue(mock_handlers, monkeypatch):
     set_environment(monkeypatch)
+    mock_push, mock_release, mock_pr, mock_issue = get_mock_handlers(mock_handlers)
     mock_issue.return_value = {'test-issue': 'test'}
     payload = get_payload('issue')
 
@@ -100,12 +90,9 @@ def test_handle_webhook_issue(mock_push, mock_release, mock_pr, mock_issue, monk
     assert handle_webhook_return == {'test-issue': 'test'}
 
 
-@patch('lambda_dir.handle_webhook_events.handle_issues')
-@patch('lambda_dir.handle_webhook_events.handle_prs')
-@patch('lambda_dir.handle_webhook_events.handle_releases')
-@patch('lambda_dir.handle_webhook_events.handle_pushes')
-def test_handle_webhook_pr(mock_push, mock_release, mock_pr, mock_issue, monkeypatch):
+def test_handle_webhook_pr(mock_handlers, monkeypatch):
     set_environment(monkeypatch)
+    mock_push, mock_release, mock_pr, mock_issue = get_mock_handlers(mock_handlers)
     mock_pr.return_value = {'test-pr': 'test'}
     payload = get_payload('pr')
 
@@ -117,12 +104,9 @@ def test_handle_webhook_pr(mock_push, mock_release, mock_pr, mock_issue, monkeyp
     assert handle_webhook_return == {'test-pr': 'test'}
 
 
-@patch('lambda_dir.handle_webhook_events.handle_issues')
-@patch('lambda_dir.handle_webhook_events.handle_prs')
-@patch('lambda_dir.handle_webhook_events.handle_releases')
-@patch('lambda_dir.handle_webhook_events.handle_pushes')
-def test_handle_webhook_release(mock_push, mock_release, mock_pr, mock_issue, monkeypatch):
+def test_handle_webhook_release(mock_handlers, monkeypatch):
     set_environment(monkeypatch)
+    mock_push, mock_release, mock_pr, mock_issue = get_mock_handlers(mock_handlers)
     mock_release.return_value = {'test-release': 'test'}
     payload = get_payload('release')
 
@@ -134,12 +118,9 @@ def test_handle_webhook_release(mock_push, mock_release, mock_pr, mock_issue, mo
     assert handle_webhook_return == {'test-release': 'test'}
 
 
-@patch('lambda_dir.handle_webhook_events.handle_issues')
-@patch('lambda_dir.handle_webhook_events.handle_prs')
-@patch('lambda_dir.handle_webhook_events.handle_releases')
-@patch('lambda_dir.handle_webhook_events.handle_pushes')
-def test_handle_webhook_push(mock_push, mock_release, mock_pr, mock_issue, monkeypatch):
+def test_handle_webhook_push(mock_handlers, monkeypatch):
     set_environment(monkeypatch)
+    mock_push, mock_release, mock_pr, mock_issue = get_mock_handlers(mock_handlers)
     mock_push.return_value = {'test-push': 'test'}
     payload = get_payload('push')
 
@@ -147,16 +128,13 @@ def test_handle_webhook_push(mock_push, mock_release, mock_pr, mock_issue, monke
     mock_release.assert_not_called()
     mock_pr.assert_not_called()
     mock_issue.assert_not_called()
-    mock_push.assert_called_once_with(payload)
+    mock_push.assert_called_once_with(payload, 'test-dashboard-name-prefix')
     assert handle_webhook_return == {'test-push': 'test'}
 
 
-@patch('lambda_dir.handle_webhook_events.handle_issues')
-@patch('lambda_dir.handle_webhook_events.handle_prs')
-@patch('lambda_dir.handle_webhook_events.handle_releases')
-@patch('lambda_dir.handle_webhook_events.handle_pushes')
-def test_handle_webhook_other_event(mock_push, mock_release, mock_pr, mock_issue, monkeypatch):
+def test_handle_webhook_other_event(mock_handlers, monkeypatch):
     set_environment(monkeypatch)
+    mock_push, mock_release, mock_pr, mock_issue = get_mock_handlers(mock_handlers)
     payload = get_payload('bad_event')
     handle_webhook_return = hw.handle_webhook(payload)
     mock_release.assert_not_called()
@@ -166,6 +144,47 @@ def test_handle_webhook_other_event(mock_push, mock_release, mock_pr, mock_issue
     assert not handle_webhook_return
 
 
+def test_handle_webhook_unhandled_action(mock_handlers, monkeypatch):
+    set_environment(monkeypatch)
+    mock_push, mock_release, mock_pr, mock_issue = get_mock_handlers(mock_handlers)
+    payload = get_payload('issue')
+    payload['action'] = 'labeled'
+
+    assert hw.handle_webhook(payload) == {}
+    mock_issue.assert_not_called()
+
+
+@pytest.mark.parametrize('event', sorted(webhook_messages.HANDLED_EVENTS))
+def test_handle_webhook_dispatches_every_handled_event(event, mock_handlers, monkeypatch):
+    set_environment(monkeypatch)
+    message = {'event': event}
+    message.update({field: values[0] for field, values in webhook_messages.HANDLED_EVENTS[event].items()})
+
+    assert hw.handle_webhook(message) == {'widget': event}
+
+
+def test_event_handlers_cover_handled_events():
+    assert hw.EVENT_HANDLERS.keys() == webhook_messages.HANDLED_EVENTS.keys()
+
+
+def test_handle_webhook_full_payload(mock_handlers, monkeypatch):
+    set_environment(monkeypatch)
+    mock_pr, mock_issue = mock_handlers['pull_request'], mock_handlers['issues']
+    mock_pr.return_value = 'pr widget'
+    payload = {
+        'action': 'closed',
+        'pull_request': {'created_at': '2019-05-15T15:20:18Z', 'closed_at': '2019-05-15T15:40:18Z', 'merged': True},
+        'repository': {'name': 'test-repo-name', 'owner': {'login': 'aws'}}
+    }
+
+    assert hw.handle_webhook(payload) == 'pr widget'
+    mock_issue.assert_not_called()
+    message = mock_pr.call_args[0][0]
+    assert message['event'] == 'pull_request'
+    assert message['repo_name'] == 'test-repo-name'
+    assert message['merged'] == 'true'
+
+
 @patch('lambda_dir.handle_webhook_events.create_issue_or_pr_widget')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.new_metric')
@@ -173,7 +192,7 @@ def test_handle_prs_closed_and_merged(mock_new_metric, mock_put_metrics, mock_cr
     mock_new_metric.side_effect = ['merged', 'closed']
     mock_create_widget.return_value = {'test-widget': 'pull_request'}
     payload = get_payload('pr')
-    payload['pull_request']['merged'] = True
+    payload['merged'] = 'true'
     handle_prs_return = hw.handle_prs(payload, 'test-dashboard-name-prefix')
     mock_put_metrics.assert_has_calls([call(['merged']), call(['closed'])])
     assert handle_prs_return == {'test-widget': 'pull_request'}
@@ -186,7 +205,7 @@ def test_handle_prs_closed_not_merged(mock_new_metric, mock_put_metrics, mock_cr
     mock_new_metric.return_value = 'closed'
     mock_create_widget.return_value = {'test-widget': 'pull_request'}
     payload = get_payload('pr')
-    payload['pull_request']['merged'] = False
+    payload['merged'] = 'false'
     handle_prs_return = hw.handle_prs(payload, 'test-dashboard-name-prefix')
     mock_put_metrics.assert_called_once_with(['closed'])
     assert handle_prs_return == {'test-widget': 'pull_request'}
@@ -257,7 +276,7 @@ def test_handle_issues_neither_opened_nor_closed(mock_new_metric, mock_put_metri
 
 
 def mock_create_metric_widget_side_effect(repo_name: str, data: dict, title: str, view: str, id_str: str,
-                                          granularity: str):
+                                          granularity: str, publish: bool):
     print(data)
     print(title)
     return 'widget'
@@ -265,7 +284,8 @@ def mock_create_metric_widget_side_effect(repo_name: str, data: dict, title: str
 
 @patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget',
        side_effect=mock_create_metric_widget_side_effect)
-def test_create_issue_or_pr_widget(mock_create_metric_widget, capfd):
+def test_create_issue_or_pr_widget(mock_create_metric_widget, capfd, monkeypatch):
+    set_environment(monkeypatch)
     payload = get_payload('issue')
     payload['action'] = 'assigned'
     labels = {
@@ -274,30 +294,119 @@ def test_create_issue_or_pr_widget(mock_create_metric_widget, capfd):
         'title': ' Issues',
         'id': 'issues'
     }
-    widget = hw.create_issue_or_pr_widget(payload, labels, 'test-dashboard-name-prefix')
+    widget = hw.create_issue_or_pr_widget(payload, labels)
     out, err = capfd.readouterr()
     assert "{'Issue Duration': 1200}" in out
     assert 'test-repo-name Issues' in out
     assert widget == {'test-dashboard-name-prefix-test-repo-name': ['widget']}
 
 
+@patch('lambda_dir.handle_webhook_events.cw_interactions.publish_widget_metrics')
+@patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget')
+def test_create_issue_or_pr_widget_shared_details_dashboard(mock_create_metric_widget, mock_publish, monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('shared_details_dashboard', 'y')
+    monkeypatch.setenv('repo_names', 'first-repo-name,test-owner/test-repo-name')
+    mock_create_metric_widget.return_value = 'widget'
+    labels = {'name': 'Issue Duration', 'title': ' Issues', 'id': 'issues'}
+
+    widget = hw.create_issue_or_pr_widget(get_payload('issue'), labels)
+
+    # The data is published for the repository, the widget is the shared one built for the first repository
+    mock_publish.assert_called_once_with('test-repo-name', {'Issue Duration': 1200})
+    mock_create_metric_widget.assert_called_once_with('first-repo-name', {'Issue Duration': 1200},
+                                                      title='{repository} Issues', view='timeSeries',
+                                                      id_str='issues', granularity='hours', publish=False)
+    assert widget == {'test-dashboard-name-prefix-details': ['widget']}
+
+
+@patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget',
+       side_effect=mock_create_metric_widget_side_effect)
+@patch('lambda_dir.handle_webhook_events.response_markers.mark_responded')
+def test_handle_responses_first_response(mock_mark, mock_create_metric_widget, capfd, monkeypatch):
+    set_environment(monkeypatch)
+    mock_mark.return_value = 'holder'
+
+    widget = hw.handle_responses(get_payload('comment'), 'test-dashboard-name-prefix')
+
+    out, err = capfd.readouterr()
+    assert "{'Time to First Response': 7200}" in out
+    assert 'test-repo-name Issue Responses' in out
+    assert widget == {'test-dashboard-name-prefix-test-repo-name': ['widget']}
+    mock_mark.assert_called_once_with('aws', 'test-repo-name', 'issue', '7',
+                                      hw.response_markers.MAX_RESPONSE_SECONDS - 7200)
+
+
+@patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget',
+       side_effect=mock_create_metric_widget_side_effect)
+@patch('lambda_dir.handle_webhook_events.response_markers.mark_responded')
+def test_handle_responses_first_review(mock_mark, mock_create_metric_widget, capfd, monkeypatch):
+    set_environment(monkeypatch)
+    mock_mark.return_value = 'holder'
+    payload = dict(get_payload('comment'), event='pull_request_review', action='submitted')
+
+    hw.handle_responses(payload, 'test-dashboard-name-prefix')
+
+    out, err = capfd.readouterr()
+    assert "{'Time to First Review': 7200}" in out
+    assert 'test-repo-name Pull Request Reviews' in out
+    assert mock_mark.call_args[0][2] == 'pull_request'
+
+
+@patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget')
+@patch('lambda_dir.handle_webhook_events.response_markers.mark_responded')
+def test_handle_responses_already_responded(mock_mark, mock_create_metric_widget):
+    mock_mark.return_value = None
+
+    assert hw.handle_responses(get_payload('comment'), 'test-dashboard-name-prefix') == {}
+    mock_create_metric_widget.assert_not_called()
+
+
+@pytest.mark.parametrize('fields', [
+    {'sender': 'author'},
+    {'sender_type': 'Bot'},
+    {'pull_request_url': 'https://api.github.com/repos/aws/test-repo-name/pulls/7'},
+    {'created_at': ''},
+    {'responded_at': '2020-05-15T15:20:18Z'}
+])
+@patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget')
+@patch('lambda_dir.handle_webhook_events.response_markers.mark_responded')
+def test_handle_responses_not_measured(mock_mark, mock_create_metric_widget, fields):
+    payload = dict(get_payload('comment'), **fields)
+
+    assert hw.handle_responses(payload, 'test-dashboard-name-prefix') == {}
+    mock_mark.assert_not_called()
+    mock_create_metric_widget.assert_not_called()
+
+
+@patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget')
+@patch('lambda_dir.handle_webhook_events.response_markers')
+def test_handle_responses_failed_metric(mock_markers, mock_create_metric_widget):
+    mock_markers.MAX_RESPONSE_SECONDS = 365 * 24 * 3600
+    mock_markers.mark_responded.return_value = 'holder'
+    mock_create_metric_widget.side_effect = ValueError('throttled')
+
+    with pytest.raises(ValueError):
+        hw.handle_responses(get_payload('comment'), 'test-dashboard-name-prefix')
+    mock_markers.unmark_responded.assert_called_once_with('aws', 'test-repo-name', 'issue', '7', 'holder')
+
+
 @patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget',
        side_effect=mock_create_metric_widget_side_effect)
-@patch('lambda_dir.handle_webhook_events.hh.request_handler')
+@patch('lambda_dir.handle_webhook_events.release_history.record_release')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.new_metric')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
-def test_handle_releases(mock_put_metrics, mock_new_metric, mock_get, mock_create_metric_widget, capfd, monkeypatch,
+def test_handle_releases(mock_put_metrics, mock_new_metric, mock_record, mock_create_metric_widget, capfd, monkeypatch,
                          aws_credentials):
-    mock_releases = [{'published_at': "2019-05-15T15:40:18Z"}, {'published_at': "2019-05-15T15:20:18Z"}]
-    mock_get.return_value = True, mock_releases, {}
+    mock_record.return_value = True, '2019-05-15T15:20:18Z'
     set_environment(monkeypatch)
     payload = get_payload('release')
 
     handle_releases_return = hw.handle_releases(payload, 'test-dashboard-name-prefix')
     out, err = capfd.readouterr()
+    mock_record.assert_called_once_with('aws', 'test-repo-name', '2019-05-15T15:40:18Z')
     mock_put_metrics.assert_called_once()
     mock_new_metric.assert_called_once()
-    mock_get.assert_called_once()
     assert "{'Time Between Releases': 1200}" in out
     assert 'test-repo-name Releases' in out
     assert handle_releases_return == {'test-dashboard-name-prefix-test-repo-name': ['widget']}
@@ -305,50 +414,49 @@ def test_handle_releases(mock_put_metrics, mock_new_metric, mock_get, mock_creat
 
 @patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget',
        side_effect=mock_create_metric_widget_side_effect)
-@patch('lambda_dir.handle_webhook_events.hh.request_handler')
+@patch('lambda_dir.handle_webhook_events.release_history.record_release')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.new_metric')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
-def test_handle_releases_not_published(mock_put_metrics, mock_new_metric, mock_get, mock_create_metric_widget, capfd,
+def test_handle_releases_not_published(mock_put_metrics, mock_new_metric, mock_record, mock_create_metric_widget, capfd,
                                        monkeypatch):
     payload = get_payload('release')
     payload['action'] = 'other'
     handle_releases_return = hw.handle_releases(payload, 'test-dashboard-name-prefix')
     mock_put_metrics.assert_not_called()
     mock_new_metric.assert_not_called()
-    mock_get.assert_not_called()
+    mock_record.assert_not_called()
     mock_create_metric_widget.assert_not_called()
     assert not handle_releases_return
 
 
 @patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget',
        side_effect=mock_create_metric_widget_side_effect)
-@patch('lambda_dir.handle_webhook_events.hh.request_handler')
+@patch('lambda_dir.handle_webhook_events.release_history.record_release')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.new_metric')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
-def test_handle_releases_bad_get(mock_put_metrics, mock_new_metric, mock_get, mock_create_metric_widget, capfd,
-                                 monkeypatch):
-    mock_get.return_value = False, [], {}
+def test_handle_releases_already_recorded(mock_put_metrics, mock_new_metric, mock_record, mock_create_metric_widget,
+                                          capfd, monkeypatch):
+    mock_record.return_value = False, None
     set_environment(monkeypatch)
     payload = get_payload('release')
 
     handle_releases_return = hw.handle_releases(payload, 'test-dashboard-name-prefix')
     out, err = capfd.readouterr()
-    mock_put_metrics.assert_called_once()
-    mock_new_metric.assert_called_once()
-    mock_get.assert_called_once()
+    mock_put_metrics.assert_not_called()
+    mock_new_metric.assert_not_called()
     mock_create_metric_widget.assert_not_called()
+    assert 'Release of test-repo-name published at 2019-05-15T15:40:18Z was already recorded' in out
     assert not handle_releases_return
 
 
 @patch('lambda_dir.handle_webhook_events.cw_interactions.create_metric_widget',
        side_effect=mock_create_metric_widget_side_effect)
-@patch('lambda_dir.handle_webhook_events.hh.request_handler')
+@patch('lambda_dir.handle_webhook_events.release_history.record_release')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.new_metric')
 @patch('lambda_dir.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
-def test_handle_releases_no_previous_release(mock_put_metrics, mock_new_metric, mock_get, mock_create_metric_widget,
+def test_handle_releases_no_previous_release(mock_put_metrics, mock_new_metric, mock_record, mock_create_metric_widget,
                                              capfd, monkeypatch):
-    mock_releases = [{'published_at': "2019-05-15T14:20:18Z"}]
-    mock_get.return_value = True, mock_releases, {}
+    mock_record.return_value = True, None
     set_environment(monkeypatch)
     payload = get_payload('release')
 
@@ -356,7 +464,6 @@ def test_handle_releases_no_previous_release(mock_put_metrics, mock_new_metric,
     out, err = capfd.readouterr()
     mock_put_metrics.assert_called_once()
     mock_new_metric.assert_called_once()
-    mock_get.assert_called_once()
     mock_create_metric_widget.assert_not_called()
     assert not handle_releases_return
 
@@ -366,7 +473,7 @@ def test_handle_releases_no_previous_release(mock_put_metrics, mock_new_metric,
 def test_handle_push(mock_new_metric, mock_put_metrics):
     mock_new_metric.return_value = 'push'
     payload = get_payload('push')
-    handle_pushes_return = hw.handle_pushes(payload)
+    handle_pushes_return = hw.handle_pushes(payload, 'test-dashboard-name-prefix')
     mock_put_metrics.assert_called_once_with(['push'])
     assert not handle_pushes_return
 
@@ -376,7 +483,35 @@ def test_handle_push(mock_new_metric, mock_put_metrics):
 def test_handle_push_not_master(mock_new_metric, mock_put_metrics):
     payload = get_payload('release')
     payload['ref'] = 'refs/heads/test'
-    handle_pushes_return = hw.handle_pushes(payload)
+    handle_pushes_return = hw.handle_pushes(payload, 'test-dashboard-name-prefix')
     mock_new_metric.assert_not_called()
     mock_put_metrics.assert_not_called()
     assert not handle_pushes_return
+
+
+@patch('lambda_dir.handle_webhook_events.repository_counters.save_counters')
+@patch('lambda_dir.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
+def test_handle_repository_counters(mock_put_metrics, mock_save_counters, monkeypatch):
+    monkeypatch.setenv('namespace', 'test-namespace')
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'GitHub Stars': 'stargazers_count', 'Forks': 'forks_count', 'Watchers': 'subscribers_count'}))
+    payload = {'event': 'star', 'action': 'created', 'owner': 'test-owner', 'repo_name': 'test-repo-name',
+               'stargazers_count': '42', 'forks_count': '0'}
+
+    assert hw.handle_repository_counters(payload, 'test-dashboard-name-prefix') == {}
+
+    metrics = mock_put_metrics.call_args[0][0]
+    assert {(metric['MetricName'], metric['Value']) for metric in metrics} == {('GitHub Stars', 42), ('Forks', 0)}
+    assert metrics[0]['Dimensions'] == [{'Name': 'REPO_NAME', 'Value': 'test-repo-name'}]
+    mock_save_counters.assert_called_once_with('test-owner', 'test-repo-name', {'GitHub Stars': 42, 'Forks': 0})
+
+
+@patch('lambda_dir.handle_webhook_events.repository_counters.save_counters')
+@patch('lambda_dir.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
+def test_handle_repository_counters_not_collected(mock_put_metrics, mock_save_counters, monkeypatch):
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({'Watchers': 'subscribers_count'}))
+    payload = {'event': 'fork', 'repo_name': 'test-repo-name', 'stargazers_count': '42', 'forks_count': '7'}
+
+    assert hw.handle_repository_counters(payload, 'test-dashboard-name-prefix') == {}
+    mock_put_metrics.assert_not_called()
+    mock_save_counters.assert_not_called()
@@ -0,0 +1,432 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+from lambda_dir import history_backfill as hb
+
+
+def set_environment(monkeypatch):
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('owner', 'test-owner')
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+    monkeypatch.setenv('github_fields_unpaginated', '{"Stars": "stargazers_count"}')
+
+
+def get_day(days_ago: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).strftime('%Y-%m-%d')
+
+
+def new_progress(next_page=1, last_page=None, days=None, complete=False):
+    return {'next_page': next_page, 'last_page': last_page, 'days': days or {}, 'complete': complete}
+
+
+def fake_listing(pages: dict, remaining=4000, failures=None):
+    """Returns a side effect serving the numbered pages of a listing, with a pagination link on every page"""
+    failures = failures or {}
+
+    def request_handler(url, headers=None, http_fields=None):
+        page = http_fields['page']
+        if page in failures:
+            return False, failures[page][0], failures[page][1]
+        return True, pages[page], {
+            'Link': '<' + url + '?per_page=100&page=' + str(len(pages)) + '>; rel="last"',
+            'X-RateLimit-Remaining': str(remaining)
+        }
+
+    return request_handler
+
+
+def stars(*days):
+    return [{'starred_at': day + 'T12:00:00Z', 'user': {}} for day in days]
+
+
+def test_count_entries_by_day():
+    days = {'2020-07-01': 1}
+    hb.count_entries_by_day(stars('2020-07-01', '2020-07-01', '2020-07-02') + [{}], 'starred_at', days)
+    assert days == {'2020-07-01': 3, '2020-07-02': 1}
+
+
+def test_get_running_totals():
+    assert hb.get_running_totals({'2020-07-03': 2, '2020-07-01': 1, '2020-07-02': 4}) == {
+        '2020-07-01': 1, '2020-07-02': 5, '2020-07-03': 7
+    }
+
+
+def test_rate_limit_remaining():
+    responses = [(True, [], {'X-RateLimit-Remaining': '900'}), (True, [], {'X-RateLimit-Remaining': '899'}),
+                 (True, [], {})]
+    assert hb.rate_limit_remaining(responses) == 899
+    assert hb.rate_limit_remaining([(True, [], {})]) == hb.RATE_LIMIT_RESERVE
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_walks_every_page(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    pages = {page: stars('2020-07-0' + str(page)) for page in range(1, 7)}
+    mock_get.side_effect = fake_listing(pages)
+    save_progress = Mock()
+
+    result = hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers', new_progress(), save_progress, None)
+
+    assert result == hb.COMPLETE
+    requested_pages = sorted(call[1]['http_fields']['page'] for call in mock_get.call_args_list)
+    assert requested_pages == [1, 2, 3, 4, 5, 6]
+    assert mock_get.call_args[1]['headers']['Accept'] == 'application/vnd.github.v3.star+json'
+    # The first page alone, then the rest in batches of PAGE_WORKERS
+    assert save_progress.call_count == 3
+    listing_name, final_progress = save_progress.call_args[0]
+    assert listing_name == 'stargazers'
+    assert final_progress['complete']
+    assert final_progress['days'] == {'2020-07-0' + str(page): 1 for page in range(1, 7)}
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_forks_sorted_oldest_first(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    mock_get.side_effect = fake_listing({1: [{'created_at': '2020-07-01T00:00:00Z'}]})
+    save_progress = Mock()
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'forks', new_progress(), save_progress,
+                           None) == hb.COMPLETE
+    assert mock_get.call_args[0][0] == 'https://api.github.com/repos/test-owner/test-repo-name/forks'
+    assert mock_get.call_args[1]['http_fields'] == {'sort': 'oldest', 'per_page': 100, 'page': 1}
+    assert save_progress.call_args[0][1]['days'] == {'2020-07-01': 1}
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_resumes_from_saved_page(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    pages = {page: stars('2020-07-0' + str(page)) for page in range(1, 4)}
+    mock_get.side_effect = fake_listing(pages)
+    save_progress = Mock()
+    progress = new_progress(next_page=3, last_page=3, days={'2020-07-01': 1, '2020-07-02': 1})
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers', progress, save_progress,
+                           None) == hb.COMPLETE
+    assert [call[1]['http_fields']['page'] for call in mock_get.call_args_list] == [3]
+    assert save_progress.call_args[0][1]['days'] == {'2020-07-01': 1, '2020-07-02': 1, '2020-07-03': 1}
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_already_complete(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    save_progress = Mock()
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers',
+                           new_progress(next_page=3, last_page=2, complete=True), save_progress, None) == hb.COMPLETE
+    mock_get.assert_not_called()
+    save_progress.assert_not_called()
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_stops_at_rate_limit_reserve(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    pages = {page: stars('2020-07-01') for page in range(1, 10)}
+    mock_get.side_effect = fake_listing(pages, remaining=hb.RATE_LIMIT_RESERVE - 1)
+    save_progress = Mock()
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers', new_progress(), save_progress,
+                           None) == hb.RATE_LIMITED
+    assert mock_get.call_count == 1
+    saved_progress = save_progress.call_args[0][1]
+    assert saved_progress['next_page'] == 2
+    assert saved_progress['last_page'] == 9
+    assert not saved_progress['complete']
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_rate_limited_request_keeps_earlier_pages(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    pages = {page: stars('2020-07-0' + str(page)) for page in range(1, 7)}
+    failures = {3: ({'message': 'API rate limit exceeded'}, {'X-RateLimit-Remaining': '0'})}
+    mock_get.side_effect = fake_listing(pages, failures=failures)
+    save_progress = Mock()
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers', new_progress(), save_progress,
+                           None) == hb.RATE_LIMITED
+    saved_progress = save_progress.call_args[0][1]
+    # Page 4 and 5 succeeded, but are requested again so no page is skipped
+    assert saved_progress['next_page'] == 3
+    assert saved_progress['days'] == {'2020-07-01': 1, '2020-07-02': 1}
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_failed_request(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    failures = {2: ({'message': 'Server Error'}, {})}
+    mock_get.side_effect = fake_listing({1: stars('2020-07-01'), 2: stars('2020-07-02')}, failures=failures)
+    save_progress = Mock()
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers', new_progress(), save_progress,
+                           None) == hb.FAILED
+    assert save_progress.call_args[0][1]['next_page'] == 2
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_pagination_limit(mock_get, monkeypatch, capfd):
+    set_environment(monkeypatch)
+    pages = {page: stars('2020-07-0' + str(page)) for page in range(1, 6)}
+    failures = {
+        page: ({'message': 'In order to keep the API fast for everyone, pagination is limited for this resource.'}, {})
+        for page in (4, 5)
+    }
+    mock_get.side_effect = fake_listing(pages, failures=failures)
+    save_progress = Mock()
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers', new_progress(), save_progress,
+                           None) == hb.COMPLETE
+    saved_progress = save_progress.call_args[0][1]
+    assert saved_progress['complete']
+    assert saved_progress['truncated']
+    assert saved_progress['last_page'] == 3
+    assert 'only listed up to page 3' in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_pagination_limit_walks_newest_first(mock_get, monkeypatch, capfd):
+    set_environment(monkeypatch)
+    limited = {'message': 'In order to keep the API fast for everyone, pagination is limited for this resource.'}
+    oldest_first = fake_listing({page: [{'created_at': '2020-07-0' + str(page) + 'T00:00:00Z'}] for page in (1, 2, 3)},
+                                failures={3: (limited, {})})
+    newest_first = fake_listing({page: [{'created_at': '2020-08-0' + str(3 - page) + 'T00:00:00Z'}] for page in (1, 2)},
+                                failures={2: (limited, {})})
+
+    def request_handler(url, headers=None, http_fields=None):
+        if url == 'https://api.github.com/repos/test-owner/test-repo-name':
+            return True, {'forks_count': 500}, {}
+        if http_fields['sort'] == 'newest':
+            return newest_first(url, headers=headers, http_fields=http_fields)
+        return oldest_first(url, headers=headers, http_fields=http_fields)
+
+    mock_get.side_effect = request_handler
+    save_progress = Mock()
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'forks', new_progress(), save_progress,
+                           None) == hb.COMPLETE
+    saved_progress = save_progress.call_args[0][1]
+    assert saved_progress['complete']
+    assert saved_progress['truncated']
+    assert saved_progress['days'] == {'2020-07-01': 1, '2020-07-02': 1}
+    assert saved_progress['newest_days'] == {'2020-08-02': 1}
+    assert saved_progress['total'] == 500
+    assert 'newest first' in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.history_backfill.hh.request_handler')
+def test_walk_listing_out_of_time(mock_get, monkeypatch):
+    set_environment(monkeypatch)
+    mock_get.side_effect = fake_listing({page: stars('2020-07-01') for page in range(1, 10)})
+    context = Mock()
+    context.get_remaining_time_in_millis.return_value = hb.TIME_RESERVE_MS - 1
+
+    assert hb.walk_listing('test-owner', 'test-repo-name', 'token', 'stargazers', new_progress(), Mock(),
+                           context) == hb.OUT_OF_TIME
+    assert mock_get.call_count == 1
+
+
+@patch('lambda_dir.history_backfill.state_store.put_state')
+@patch('lambda_dir.history_backfill.cw_interactions.put_metrics_in_cloudwatch')
+def test_publish_history(mock_put_metrics, mock_put_state, monkeypatch):
+    set_environment(monkeypatch)
+    progress = {
+        'stargazers': new_progress(days={'2015-01-01': 5, get_day(3): 2, get_day(1): 1}, complete=True),
+        'forks': new_progress(days={'2016-01-01': 3}, complete=True)
+    }
+
+    published = hb.publish_history('test-owner', 'test-repo-name', progress)
+
+    metrics = mock_put_metrics.call_args[0][0]
+    assert published == len(metrics)
+    stars_by_day = {metric['Timestamp'].strftime('%Y-%m-%d'): metric['Value'] for metric in metrics
+                    if metric['MetricName'] == 'Stars'}
+    forks_by_day = {metric['Timestamp'].strftime('%Y-%m-%d'): metric['Value'] for metric in metrics
+                    if metric['MetricName'] == 'Forks'}
+    assert stars_by_day[get_day(4)] == 5
+    assert stars_by_day[get_day(3)] == 7
+    assert stars_by_day[get_day(2)] == 7
+    assert stars_by_day[get_day(1)] == 8
+    assert get_day(0) not in stars_by_day
+    assert set(forks_by_day.values()) == {3}
+    oldest_allowed = datetime.now(timezone.utc) - hb.cw_interactions.MAX_METRIC_BACKDATE
+    assert all(metric['Timestamp'] >= oldest_allowed for metric in metrics)
+    mock_put_state.assert_called_once_with('history#test-owner/test-repo-name', {
+        'Stars': {'2015-01-01': 5, get_day(3): 7, get_day(1): 8},
+        'Forks': {'2016-01-01': 3}
+    })
+
+
+@patch('lambda_dir.history_backfill.state_store.put_state')
+@patch('lambda_dir.history_backfill.cw_interactions.put_metrics_in_cloudwatch')
+def test_publish_history_truncated_listing(mock_put_metrics, mock_put_state, monkeypatch, capfd):
+    set_environment(monkeypatch)
+    progress = {
+        'stargazers': dict(new_progress(days={get_day(5): 2, get_day(3): 4}, complete=True), truncated=True),
+        'forks': new_progress(complete=True)
+    }
+
+    hb.publish_history('test-owner', 'test-repo-name', progress)
+
+    star_days = [metric['Timestamp'].strftime('%Y-%m-%d') for metric in mock_put_metrics.call_args[0][0]
+                 if metric['MetricName'] == 'Stars']
+    assert get_day(5) in star_days
+    assert get_day(3) not in star_days
+    assert get_day(1) not in star_days
+    assert mock_put_state.call_args[0][1]['Stars'] == {get_day(5): 2}
+    out = capfd.readouterr()[0]
+    assert 'stargazers of test-owner/test-repo-name after ' + get_day(3) + ' are not backfilled' in out
+
+
+@patch('lambda_dir.history_backfill.state_store.put_state')
+@patch('lambda_dir.history_backfill.cw_interactions.put_metrics_in_cloudwatch')
+def test_publish_history_truncated_listing_walked_newest_first(mock_put_metrics, mock_put_state, monkeypatch):
+    set_environment(monkeypatch)
+    forks = dict(new_progress(days={get_day(20): 2, get_day(10): 4}, complete=True), truncated=True,
+                 newest_days={get_day(6): 3, get_day(3): 1, get_day(1): 2}, total=100)
+    progress = {'stargazers': new_progress(complete=True), 'forks': forks}
+
+    hb.publish_history('test-owner', 'test-repo-name', progress)
+
+    forks_by_day = {metric['Timestamp'].strftime('%Y-%m-%d'): metric['Value']
+                    for metric in mock_put_metrics.call_args[0][0] if metric['MetricName'] == 'Forks'}
+    # The oldest days are counted up from zero, the newest back from the total, the days in between aren't known
+    assert forks_by_day[get_day(11)] == 2
+    assert not {get_day(10), get_day(9), get_day(8), get_day(7)} & set(forks_by_day)
+    assert [forks_by_day[get_day(days_ago)] for days_ago in range(6, 0, -1)] == [97, 97, 97, 98, 98, 100]
+    assert mock_put_state.call_args[0][1]['Forks'] == {get_day(20): 2, get_day(6): 97, get_day(3): 98, get_day(1): 100}
+
+
+def test_get_totals_before():
+    assert hb.get_totals_before({'2020-07-03': 2, '2020-07-01': 1, '2020-07-02': 4}, 10) == {
+        '2020-07-03': 10, '2020-07-02': 8, '2020-07-01': 4
+    }
+
+
+@patch('lambda_dir.history_backfill.publish_history')
+@patch('lambda_dir.history_backfill.walk_listing')
+@patch('lambda_dir.history_backfill.state_store')
+def test_backfill_repository_already_published(mock_state_store, mock_walk_listing, mock_publish_history):
+    mock_state_store.get_state.return_value = {'published': True}
+
+    assert hb.backfill_repository('test-owner', 'test-repo-name', 'token', None) == hb.COMPLETE
+    mock_state_store.get_state.assert_called_once_with('backfill#test-owner/test-repo-name')
+    mock_walk_listing.assert_not_called()
+    mock_publish_history.assert_not_called()
+
+
+@patch('lambda_dir.history_backfill.publish_history')
+@patch('lambda_dir.history_backfill.walk_listing')
+@patch('lambda_dir.history_backfill.state_store')
+def test_backfill_repository_force_starts_over(mock_state_store, mock_walk_listing, mock_publish_history):
+    mock_state_store.get_state.return_value = {'published': True}
+    mock_walk_listing.return_value = hb.COMPLETE
+
+    assert hb.backfill_repository('test-owner', 'test-repo-name', 'token', None, force=True) == hb.COMPLETE
+    mock_state_store.get_state.assert_not_called()
+    walked_progress = {call[0][3]: call[0][4] for call in mock_walk_listing.call_args_list}
+    assert walked_progress == {'stargazers': new_progress(), 'forks': new_progress()}
+
+
+@patch('lambda_dir.history_backfill.publish_history')
+@patch('lambda_dir.history_backfill.hh.request_handler')
+@patch('lambda_dir.history_backfill.state_store')
+def test_backfill_repository_walks_both_listings_then_publishes(mock_state_store, mock_get, mock_publish_history,
+                                                                monkeypatch):
+    set_environment(monkeypatch)
+    mock_state_store.get_state.return_value = {}
+    star_listing = fake_listing({1: stars('2020-07-01'), 2: stars('2020-07-02')})
+    fork_listing = fake_listing({1: [{'created_at': '2020-07-03T00:00:00Z'}]})
+    mock_get.side_effect = lambda url, headers=None, http_fields=None: (
+        star_listing if url.endswith('stargazers') else fork_listing)(url, headers=headers, http_fields=http_fields)
+
+    assert hb.backfill_repository('test-owner', 'test-repo-name', 'token', None) == hb.COMPLETE
+
+    published_progress = mock_publish_history.call_args[0][2]
+    assert published_progress['stargazers']['days'] == {'2020-07-01': 1, '2020-07-02': 1}
+    assert published_progress['forks']['days'] == {'2020-07-03': 1}
+    final_state = mock_state_store.put_state.call_args[0]
+    assert final_state[0] == 'backfill#test-owner/test-repo-name'
+    assert final_state[1]['published']
+
+
+@patch('lambda_dir.history_backfill.publish_history')
+@patch('lambda_dir.history_backfill.walk_listing')
+@patch('lambda_dir.history_backfill.state_store')
+def test_backfill_repository_not_published_until_complete(mock_state_store, mock_walk_listing, mock_publish_history):
+    mock_state_store.get_state.return_value = {}
+    mock_walk_listing.side_effect = lambda owner, repo_name, token, listing_name, *args: (
+        hb.RATE_LIMITED if listing_name == 'stargazers' else hb.COMPLETE)
+
+    assert hb.backfill_repository('test-owner', 'test-repo-name', 'token', None) == hb.RATE_LIMITED
+    mock_publish_history.assert_not_called()
+
+
+@patch('lambda_dir.history_backfill.publish_history')
+@patch('lambda_dir.history_backfill.walk_listing')
+@patch('lambda_dir.history_backfill.state_store')
+def test_backfill_repository_leased_by_another_invocation(mock_state_store, mock_walk_listing, mock_publish_history):
+    mock_state_store.get_state.return_value = {}
+    mock_state_store.acquire_lease.return_value = False
+
+    assert hb.backfill_repository('test-owner', 'test-repo-name', 'token', None) == hb.LEASED
+    mock_state_store.acquire_lease.assert_called_once()
+    assert mock_state_store.acquire_lease.call_args[0][0] == 'backfill-lease#test-owner/test-repo-name'
+    mock_walk_listing.assert_not_called()
+    mock_state_store.put_state.assert_not_called()
+    mock_state_store.release_lease.assert_not_called()
+
+
+@patch('lambda_dir.history_backfill.publish_history')
+@patch('lambda_dir.history_backfill.walk_listing')
+@patch('lambda_dir.history_backfill.state_store')
+def test_backfill_repository_releases_lease(mock_state_store, mock_walk_listing, mock_publish_history):
+    mock_state_store.get_state.return_value = {}
+    mock_walk_listing.return_value = hb.OUT_OF_TIME
+
+    assert hb.backfill_repository('test-owner', 'test-repo-name', 'token', None) == hb.OUT_OF_TIME
+    # Released before the handler continues in a new invocation, which takes the lease again
+    lease_holder = mock_state_store.acquire_lease.call_args[0][1]
+    mock_state_store.release_lease.assert_called_once_with('backfill-lease#test-owner/test-repo-name', lease_holder)
+
+
+@patch('lambda_dir.history_backfill.continue_in_new_invocation')
+@patch('lambda_dir.history_backfill.backfill_repository')
+@patch('lambda_dir.history_backfill.aws_clients.get_client')
+def test_handler_continues_in_new_invocation(mock_get_client, mock_backfill_repository, mock_continue, monkeypatch):
+    set_environment(monkeypatch)
+    mock_get_client.return_value.get_secret_value.return_value = {'SecretString': 'token'}
+    mock_backfill_repository.return_value = hb.OUT_OF_TIME
+    context = Mock()
+
+    hb.handler({'force': True}, context)
+
+    mock_backfill_repository.assert_called_once_with('test-owner', 'test-repo-name', 'token', context, force=True)
+    mock_continue.assert_called_once_with(context, {'repo_names': 'test-repo-name,other-owner/other-repo-name'})
+
+
+@patch('lambda_dir.history_backfill.continue_in_new_invocation')
+@patch('lambda_dir.history_backfill.backfill_repository')
+@patch('lambda_dir.history_backfill.aws_clients.get_client')
+def test_handler_stops_when_rate_limited(mock_get_client, mock_backfill_repository, mock_continue, monkeypatch):
+    set_environment(monkeypatch)
+    mock_get_client.return_value.get_secret_value.return_value = {'SecretString': 'token'}
+    mock_backfill_repository.return_value = hb.RATE_LIMITED
+
+    hb.handler({'source': 'aws.events'}, None)
+
+    assert mock_backfill_repository.call_count == 1
+    mock_continue.assert_not_called()
+
+
+@patch('lambda_dir.history_backfill.continue_in_new_invocation')
+@patch('lambda_dir.history_backfill.backfill_repository')
+@patch('lambda_dir.history_backfill.aws_clients.get_client')
+def test_handler_backfills_every_repository(mock_get_client, mock_backfill_repository, mock_continue, monkeypatch):
+    set_environment(monkeypatch)
+    mock_get_client.return_value.get_secret_value.return_value = {'SecretString': 'token'}
+    mock_backfill_repository.return_value = hb.COMPLETE
+
+    hb.handler({}, None)
+
+    assert [call[0][:2] for call in mock_backfill_repository.call_args_list] == [
+        ('test-owner', 'test-repo-name'), ('other-owner', 'other-repo-name')
+    ]
+    mock_continue.assert_not_called()
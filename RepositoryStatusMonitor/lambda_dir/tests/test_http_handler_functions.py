@@ -29,6 +29,26 @@ def test_request_handler_bad_github_request_no_message(mock_get, capfd):
     assert 'Request not put through' in capfd.readouterr()[0]
 
 
+@patch('lambda_dir.http_handler.http.request')
+def test_request_if_modified_not_modified(mock_get):
+    mock_get.return_value.status = 304
+    mock_get.return_value.data = b''
+    success, data, res_headers = hh.request_if_modified('test-url', '"etag"', headers={'Accept': 'json'})
+    assert success
+    assert data is None
+    assert mock_get.call_args[1]['headers'] == {'Accept': 'json', 'If-None-Match': '"etag"'}
+
+
+@patch('lambda_dir.http_handler.http.request')
+def test_request_if_modified_modified(mock_get):
+    mock_get.return_value.status = 200
+    mock_get.return_value.data = '[{"id": "1"}]'.encode()
+    success, data, res_headers = hh.request_if_modified('test-url', None)
+    assert success
+    assert data == [{'id': '1'}]
+    assert mock_get.call_args[1]['headers'] == {}
+
+
 @patch('lambda_dir.http_handler.request_handler')
 def test_handle_pagination_correct(mock_get):
     data = ['first']
@@ -50,3 +70,14 @@ def test_handle_pagination_no_more_pages(mock_get):
     assert not success
     assert 'first' in data
     assert 'second' not in data
+
+
+def test_get_last_page_number():
+    res_headers = {'Link': '<https://api.github.com/repositories/1/stargazers?per_page=100&page=2>; rel="next", '
+                           '<https://api.github.com/repositories/1/stargazers?per_page=100&page=500>; rel="last"'}
+    assert hh.get_last_page_number(res_headers) == 500
+
+
+def test_get_last_page_number_no_last_link():
+    assert hh.get_last_page_number({'Link': '<lastlink?page=2>; rel="next"'}) is None
+    assert hh.get_last_page_number({}) is None
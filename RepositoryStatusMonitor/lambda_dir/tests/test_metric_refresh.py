@@ -0,0 +1,92 @@
+import json
+
+from moto import mock_sqs
+import pytest
+
+from lambda_dir import metric_refresh
+
+
+def set_fields(monkeypatch):
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'GitHub Stars': 'stargazers_count',
+        'Open Issues': 'open_issues_count',
+        'Latest GitHub Release': 'releases/latest/tag_name',
+        'Latest Release Asset Download Count': 'releases/latest/assets',
+        'Longest Inactive Issue': 'issues?sort=created&direction=asc/0*title',
+        'Longest Inactive PR': 'pulls?sort=updated/0*title',
+        'Language Breakdown': 'languages/'
+    }))
+    monkeypatch.setenv('github_fields_paginated', json.dumps({'Open Pull Requests': 'pulls',
+                                                              'Contributors': 'contributors'}))
+
+
+@pytest.fixture
+def refresh_queue(state_table, monkeypatch):
+    set_fields(monkeypatch)
+    monkeypatch.setenv('owner', 'test-owner')
+    with mock_sqs():
+        sqs = metric_refresh.aws_clients.get_client('sqs')
+        queue_url = sqs.create_queue(QueueName='RefreshQueue')['QueueUrl']
+        monkeypatch.setenv('refresh_queue_url', queue_url)
+        yield sqs, queue_url
+
+
+def get_queued_jobs(sqs, queue_url):
+    # The jobs are delayed by the refresh window
+    attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['ApproximateNumberOfMessagesDelayed'])
+    return int(attributes['Attributes']['ApproximateNumberOfMessagesDelayed'])
+
+
+def test_get_refresh_metric_names(monkeypatch):
+    set_fields(monkeypatch)
+
+    assert metric_refresh.get_refresh_metric_names(['release']) == {'Latest GitHub Release',
+                                                                    'Latest Release Asset Download Count'}
+    # The open issues are counted without the open pull requests, so both are collected again
+    assert metric_refresh.get_refresh_metric_names(['pull_request']) == {'Open Pull Requests', 'Longest Inactive PR',
+                                                                         'Open Issues'}
+    assert metric_refresh.get_refresh_metric_names(['issues']) == {'Open Issues', 'Longest Inactive Issue',
+                                                                   'Open Pull Requests'}
+    assert metric_refresh.get_refresh_metric_names(['push', 'star']) == set()
+
+
+def test_depends_on():
+    assert metric_refresh.depends_on('pulls', 'pulls')
+    assert metric_refresh.depends_on('pulls?sort=updated/0*title', 'pulls')
+    assert metric_refresh.depends_on('releases/latest/tag_name', 'releases')
+    assert not metric_refresh.depends_on('pullsomething', 'pulls')
+
+
+def test_request_refresh_coalesces_events(refresh_queue):
+    sqs, queue_url = refresh_queue
+    release = {'event': 'release', 'action': 'published', 'repo_name': 'test-repo-name', 'owner': 'aws'}
+    pull_request = {'event': 'pull_request', 'action': 'closed', 'repo_name': 'test-repo-name', 'owner': ''}
+
+    assert metric_refresh.request_refresh(release)
+    assert not metric_refresh.request_refresh(release)
+    assert metric_refresh.request_refresh(pull_request)
+    assert not metric_refresh.request_refresh(dict(pull_request, action='opened'))
+
+    assert get_queued_jobs(sqs, queue_url) == 2
+
+
+def test_request_refresh_ignores_unrelated_events(refresh_queue, monkeypatch):
+    sqs, queue_url = refresh_queue
+
+    assert not metric_refresh.request_refresh({'event': 'push', 'ref': 'refs/heads/master', 'repo_name': 'repo'})
+    assert not metric_refresh.request_refresh({'event': 'issues', 'action': 'labeled', 'repo_name': 'repo'})
+    monkeypatch.delenv('refresh_queue_url')
+    assert not metric_refresh.request_refresh({'event': 'release', 'action': 'published', 'repo_name': 'repo'})
+
+    assert get_queued_jobs(sqs, queue_url) == 0
+
+
+def test_request_refresh_failed_job(refresh_queue, monkeypatch):
+    monkeypatch.setenv('refresh_queue_url', 'https://queue.amazonaws.com/123456789012/missing-queue')
+    release = {'event': 'release', 'action': 'published', 'repo_name': 'test-repo-name', 'owner': 'aws'}
+
+    with pytest.raises(Exception):
+        metric_refresh.request_refresh(release)
+
+    # The window isn't taken by the job that wasn't sent
+    assert metric_refresh.state_store.get_state(metric_refresh.get_refresh_key('aws', 'test-repo-name', 'release')) == {}
@@ -0,0 +1,105 @@
+from unittest.mock import patch
+
+import pytest
+
+from lambda_dir import release_history
+
+
+@pytest.fixture
+def state(state_table):
+    return release_history.state_store
+
+
+@patch('lambda_dir.release_history.fetch_published_times')
+def test_record_release_seeds_history_once(mock_fetch, state):
+    mock_fetch.return_value = ['2019-05-15T15:40:18Z', '2019-05-15T15:20:18Z']
+
+    assert release_history.record_release('aws', 'repo', '2019-05-15T15:40:18Z') == (True, '2019-05-15T15:20:18Z')
+    assert release_history.record_release('aws', 'repo', '2019-05-16T15:40:18Z') == (True, '2019-05-15T15:40:18Z')
+
+    mock_fetch.assert_called_once_with('aws', 'repo')
+    assert state.get_state('release#aws/repo') == {
+        'published_at': ['2019-05-16T15:40:18Z', '2019-05-15T15:40:18Z', '2019-05-15T15:20:18Z']}
+
+
+@patch('lambda_dir.release_history.fetch_published_times')
+def test_record_release_duplicate(mock_fetch, state):
+    state.put_state('release#aws/repo', {'published_at': ['2019-05-15T15:40:18Z', '2019-05-15T15:20:18Z']})
+
+    assert release_history.record_release('aws', 'repo', '2019-05-15T15:40:18Z') == (False, None)
+    mock_fetch.assert_not_called()
+
+
+@patch('lambda_dir.release_history.fetch_published_times')
+def test_record_release_out_of_order(mock_fetch, state):
+    state.put_state('release#aws/repo', {'published_at': ['2019-05-17T00:00:00Z', '2019-05-15T00:00:00Z']})
+
+    # A release published between the two known ones arrives late
+    assert release_history.record_release('aws', 'repo', '2019-05-16T00:00:00Z') == (True, '2019-05-15T00:00:00Z')
+    assert release_history.record_release('aws', 'repo', '2019-05-14T00:00:00Z') == (True, None)
+    mock_fetch.assert_not_called()
+
+
+@patch('lambda_dir.release_history.MAX_REMEMBERED_RELEASES', 2)
+@patch('lambda_dir.release_history.fetch_published_times', return_value=[])
+def test_record_release_keeps_latest(mock_fetch, state):
+    for day in ['13', '14', '15']:
+        release_history.record_release('aws', 'repo', '2019-05-' + day + 'T00:00:00Z')
+
+    assert state.get_state('release#aws/repo') == {'published_at': ['2019-05-15T00:00:00Z', '2019-05-14T00:00:00Z']}
+
+
+@patch('lambda_dir.release_history.fetch_published_times', return_value=[])
+def test_record_release_concurrent_events(mock_fetch, state):
+    state.put_state('release#aws/repo', {'published_at': ['2019-05-14T00:00:00Z']})
+    get_versioned_state = state.get_versioned_state
+    concurrent_results = []
+
+    def record_concurrent_release(key):
+        value, version = get_versioned_state(key)
+        if not concurrent_results:
+            # Another release event of the repository is recorded after this one read the history
+            concurrent_results.append(None)
+            concurrent_results[0] = release_history.record_release('aws', 'repo', '2019-05-16T00:00:00Z')
+        return value, version
+
+    with patch('lambda_dir.release_history.state_store.get_versioned_state', side_effect=record_concurrent_release):
+        assert release_history.record_release('aws', 'repo', '2019-05-15T00:00:00Z') == (True, '2019-05-14T00:00:00Z')
+
+    assert concurrent_results == [(True, '2019-05-14T00:00:00Z')]
+    assert state.get_state('release#aws/repo') == {
+        'published_at': ['2019-05-16T00:00:00Z', '2019-05-15T00:00:00Z', '2019-05-14T00:00:00Z']}
+
+
+@patch('lambda_dir.release_history.MAX_RECORD_ATTEMPTS', 2)
+@patch('lambda_dir.release_history.state_store.put_versioned_state', return_value=False)
+@patch('lambda_dir.release_history.fetch_published_times', return_value=[])
+def test_record_release_history_keeps_changing(mock_fetch, mock_put, state):
+    with pytest.raises(RuntimeError):
+        release_history.record_release('aws', 'repo', '2019-05-15T00:00:00Z')
+    assert mock_put.call_count == 2
+
+
+@patch('lambda_dir.release_history.hh.request_handler')
+@patch('lambda_dir.release_history.aws_clients.get_client')
+def test_fetch_published_times(mock_get_client, mock_request, monkeypatch):
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+    mock_get_client.return_value.get_secret_value.return_value = {'SecretString': '1234'}
+    mock_request.return_value = True, [{'published_at': '2019-05-15T15:40:18Z'}, {'published_at': None}], {}
+
+    assert release_history.fetch_published_times('aws', 'repo') == ['2019-05-15T15:40:18Z']
+    mock_request.assert_called_once()
+    assert mock_request.call_args[0][0] == 'https://api.github.com/repos/aws/repo/releases'
+    assert mock_request.call_args[1]['http_fields'] == {'per_page': 2}
+    assert mock_request.call_args[1]['headers']['Authorization'] == 'token 1234'
+
+
+@patch('lambda_dir.release_history.hh.request_handler')
+@patch('lambda_dir.release_history.aws_clients.get_client')
+def test_fetch_published_times_failed(mock_get_client, mock_request, monkeypatch, capfd):
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+    mock_get_client.return_value.get_secret_value.return_value = {'SecretString': '1234'}
+    mock_request.return_value = False, {'message': 'Not Found'}, {}
+
+    assert release_history.fetch_published_times('aws', 'repo') == []
+    assert 'Could not retrieve the latest releases of aws/repo' in capfd.readouterr()[0]
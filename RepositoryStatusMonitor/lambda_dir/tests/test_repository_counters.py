@@ -0,0 +1,86 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from lambda_dir import repository_counters
+
+
+@pytest.fixture
+def counter_fields(monkeypatch):
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'GitHub Stars': 'stargazers_count',
+        'Forks': 'forks_count',
+        'Watchers': 'subscribers_count',
+        'Latest GitHub Release': 'releases/latest/tag_name'
+    }))
+
+
+def test_get_counter_metric_names(counter_fields):
+    assert repository_counters.get_counter_metric_names() == {'stargazers_count': 'GitHub Stars',
+                                                              'forks_count': 'Forks'}
+
+
+def test_get_counter_metric_names_not_configured(monkeypatch):
+    monkeypatch.delenv('github_fields_unpaginated', raising=False)
+    assert repository_counters.get_counter_metric_names() == {}
+
+
+@pytest.fixture
+def repository_counter_fields(monkeypatch):
+    monkeypatch.setenv('github_fields_unpaginated', json.dumps({
+        'GitHub Stars': 'stargazers_count',
+        'Forks': 'forks_count',
+        'Latest GitHub Release': 'releases/latest/tag_name'
+    }))
+
+
+def test_replaces_repository_request(repository_counter_fields):
+    assert repository_counters.replaces_repository_request()
+
+
+def test_replaces_repository_request_other_repository_fields(counter_fields):
+    # The watchers come from the repository endpoint too, so it is requested every hour anyway
+    assert not repository_counters.replaces_repository_request()
+
+
+@patch('lambda_dir.repository_counters.state_store.put_state')
+def test_save_counters(mock_put_state, repository_counter_fields):
+    repository_counters.save_counters('aws', 'repo', {'GitHub Stars': 42, 'Forks': 7})
+    mock_put_state.assert_called_once_with('counter#aws/repo', {'GitHub Stars': 42, 'Forks': 7},
+                                           ttl_seconds=repository_counters.COUNTER_TTL_SECONDS)
+
+
+@patch('lambda_dir.repository_counters.state_store.put_state')
+def test_save_counters_not_replacing_repository_request(mock_put_state, counter_fields):
+    repository_counters.save_counters('aws', 'repo', {'GitHub Stars': 42, 'Forks': 7})
+    mock_put_state.assert_not_called()
+
+
+@patch('lambda_dir.repository_counters.state_store.get_state')
+def test_get_counters(mock_get_state, repository_counter_fields):
+    mock_get_state.return_value = {'GitHub Stars': 42, 'Forks': 7}
+
+    assert repository_counters.get_counters('aws', 'repo') == {'GitHub Stars': 42, 'Forks': 7}
+    mock_get_state.assert_called_once_with('counter#aws/repo')
+
+
+@patch('lambda_dir.repository_counters.state_store.get_state')
+def test_get_counters_missing_counter(mock_get_state, repository_counter_fields):
+    mock_get_state.return_value = {'GitHub Stars': 42}
+    assert repository_counters.get_counters('aws', 'repo') == {}
+
+
+@patch('lambda_dir.repository_counters.state_store.get_state')
+def test_get_counters_not_replacing_repository_request(mock_get_state, counter_fields):
+    assert repository_counters.get_counters('aws', 'repo') == {}
+    mock_get_state.assert_not_called()
+
+
+def test_get_polled_counters(counter_fields):
+    sorted_widgets = {
+        'Popularity': {'type': 'metric', 'dashboard_level': 'main', 'data': {'GitHub Stars': 42, 'Watchers': 3}},
+        'Community': {'type': 'metric', 'dashboard_level': 'details', 'data': {'Forks': 7}},
+        'Properties': {'type': 'text', 'dashboard_level': 'main', 'data': {'Latest GitHub Release': 'v1.0'}}
+    }
+    assert repository_counters.get_polled_counters(sorted_widgets) == {'GitHub Stars': 42, 'Forks': 7}
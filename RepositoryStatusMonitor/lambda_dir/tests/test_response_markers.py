@@ -0,0 +1,22 @@
+from lambda_dir import response_markers
+
+
+def test_get_marker_key():
+    assert response_markers.get_marker_key('aws', 'repo', 'issue', '7') == 'responded#aws/repo#issue#7'
+
+
+def test_mark_responded_once(state_table):
+    assert response_markers.mark_responded('aws', 'repo', 'issue', '7', 3600)
+    assert response_markers.mark_responded('aws', 'repo', 'issue', '7', 3600) is None
+    # The markers of issues and pull requests are kept apart
+    assert response_markers.mark_responded('aws', 'repo', 'pull_request', '7', 3600)
+
+
+def test_unmark_responded(state_table):
+    holder = response_markers.mark_responded('aws', 'repo', 'issue', '7', 3600)
+
+    response_markers.unmark_responded('aws', 'repo', 'issue', '7', holder)
+
+    assert 'Item' not in state_table.get_item(TableName='test-state-table',
+                                              Key={'state_key': {'S': 'responded#aws/repo#issue#7'}})
+    assert response_markers.mark_responded('aws', 'repo', 'issue', '7', 3600)
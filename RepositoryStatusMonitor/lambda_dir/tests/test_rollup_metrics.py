@@ -0,0 +1,84 @@
+from unittest.mock import patch
+
+from lambda_dir import rollup_metrics
+
+
+def get_sorted_widgets(stars, pulls):
+    return {
+        'Repository Status': {'type': 'metric', 'dashboard_level': 'main',
+                              'data': {'GitHub Stars': stars, 'Health': 80}},
+        'Pull Requests': {'type': 'metric', 'dashboard_level': 'details', 'data': {'Open Pull Requests': pulls}},
+        'Properties': {'type': 'text', 'dashboard_level': 'main', 'data': {'GitHub Stars': '1'}}
+    }
+
+
+def test_get_rollup_metric_names(monkeypatch):
+    monkeypatch.setenv('rollup_metrics', 'GitHub Stars,Open Pull Requests')
+    assert rollup_metrics.get_rollup_metric_names() == ['GitHub Stars', 'Open Pull Requests']
+
+
+def test_get_rollup_metric_names_empty(monkeypatch):
+    monkeypatch.setenv('rollup_metrics', '')
+    assert rollup_metrics.get_rollup_metric_names() == []
+
+
+def test_get_repo_groups(monkeypatch):
+    monkeypatch.setenv('repo_groups', '{"tools": ["repo-a", "other-owner/repo-b"], "all": ["repo-a", "repo-b"], '
+                                      '"none": []}')
+    assert rollup_metrics.get_repo_groups('test-owner', 'repo-a') == ['tools', 'all']
+    assert rollup_metrics.get_repo_groups('other-owner', 'repo-b') == ['tools', 'all']
+    assert rollup_metrics.get_repo_groups('test-owner', 'repo-b') == ['all']
+
+
+def test_get_repo_groups_not_configured(monkeypatch):
+    monkeypatch.delenv('repo_groups', raising=False)
+    assert rollup_metrics.get_repo_groups('test-owner', 'repo-a') == []
+
+
+def test_add_repository_metrics(monkeypatch):
+    monkeypatch.setenv('rollup_metrics', 'GitHub Stars,Open Pull Requests')
+    monkeypatch.setenv('repo_groups', '{"tools": ["repo-b"]}')
+    rollups = {}
+
+    rollup_metrics.add_repository_metrics(rollups, 'test-owner', 'repo-a', get_sorted_widgets(3, 1))
+    rollup_metrics.add_repository_metrics(rollups, 'test-owner', 'repo-b', get_sorted_widgets('4', 2))
+    rollup_metrics.add_repository_metrics(rollups, 'other-owner', 'repo-c', get_sorted_widgets(5, 'unknown'))
+
+    assert rollups == {
+        ('OWNER', 'test-owner'): {'GitHub Stars': 7, 'Open Pull Requests': 3},
+        ('REPO_GROUP', 'tools'): {'GitHub Stars': 4, 'Open Pull Requests': 2},
+        ('OWNER', 'other-owner'): {'GitHub Stars': 5}
+    }
+
+
+def test_add_repository_metrics_no_rollups_configured(monkeypatch):
+    monkeypatch.delenv('rollup_metrics', raising=False)
+    rollups = {}
+
+    rollup_metrics.add_repository_metrics(rollups, 'test-owner', 'repo-a', get_sorted_widgets(3, 1))
+
+    assert rollups == {}
+
+
+@patch('lambda_dir.rollup_metrics.cw_interactions.put_metrics_in_cloudwatch')
+def test_publish_rollups_in_one_batch(mock_put_metrics, monkeypatch):
+    rollups = {
+        ('OWNER', 'test-owner'): {'GitHub Stars': 7, 'Open Pull Requests': 3},
+        ('REPO_GROUP', 'tools'): {'GitHub Stars': 4}
+    }
+
+    assert rollup_metrics.publish_rollups(rollups) == 3
+
+    mock_put_metrics.assert_called_once()
+    metrics = mock_put_metrics.call_args[0][0]
+    assert [(metric['Dimensions'], metric['MetricName'], metric['Value']) for metric in metrics] == [
+        ([{'Name': 'OWNER', 'Value': 'test-owner'}], 'GitHub Stars', 7),
+        ([{'Name': 'OWNER', 'Value': 'test-owner'}], 'Open Pull Requests', 3),
+        ([{'Name': 'REPO_GROUP', 'Value': 'tools'}], 'GitHub Stars', 4)
+    ]
+
+
+@patch('lambda_dir.rollup_metrics.cw_interactions.put_metrics_in_cloudwatch')
+def test_publish_rollups_nothing_to_publish(mock_put_metrics):
+    assert rollup_metrics.publish_rollups({}) == 0
+    mock_put_metrics.assert_not_called()
@@ -0,0 +1,79 @@
+import time
+
+from lambda_dir import aws_clients
+from lambda_dir import state_store
+
+
+def test_get_state_missing_key(state_table):
+    assert state_store.get_state('test-missing-key') == {}
+
+
+def test_put_and_get_state(state_table):
+    state_store.put_state('test-key', {'test-field': [1, 2]})
+    assert state_store.get_state('test-key') == {'test-field': [1, 2]}
+
+
+def test_put_state_replaces_value(state_table):
+    state_store.put_state('test-key', {'test-field': 1})
+    state_store.put_state('test-key', {'test-other-field': 2})
+    assert state_store.get_state('test-key') == {'test-other-field': 2}
+
+
+def test_put_state_with_ttl(state_table):
+    state_store.put_state('test-key', {'test-field': 1}, ttl_seconds=60)
+    item = aws_clients.get_client('dynamodb').get_item(TableName='test-state-table',
+                                                       Key={'state_key': {'S': 'test-key'}})['Item']
+    assert int(item['expires_at']['N']) >= int(time.time()) + 59
+    assert state_store.get_state('test-key') == {'test-field': 1}
+
+
+def test_get_state_expired_item(state_table):
+    item = state_store.new_state_item('test-key', {'test-field': 1})
+    item['expires_at'] = {'N': str(int(time.time()) - 1)}
+    aws_clients.get_client('dynamodb').put_item(TableName='test-state-table', Item=item)
+    assert state_store.get_state('test-key') == {}
+
+
+def test_put_versioned_state(state_table):
+    assert state_store.get_versioned_state('test-key') == ({}, 0)
+    assert state_store.put_versioned_state('test-key', {'test-field': 1}, 0)
+    assert state_store.get_versioned_state('test-key') == ({'test-field': 1}, 1)
+
+    assert state_store.put_versioned_state('test-key', {'test-field': 2}, 1)
+    # Written from a value read before the last write
+    assert not state_store.put_versioned_state('test-key', {'test-field': 3}, 1)
+    assert not state_store.put_versioned_state('test-other-key', {'test-field': 1}, 1)
+    assert state_store.get_versioned_state('test-key') == ({'test-field': 2}, 2)
+
+
+def test_put_versioned_state_replaces_unversioned_value(state_table):
+    state_store.put_state('test-key', {'test-field': 1})
+    assert state_store.get_versioned_state('test-key') == ({'test-field': 1}, 0)
+    assert state_store.put_versioned_state('test-key', {'test-field': 2}, 0)
+    assert not state_store.put_versioned_state('test-key', {'test-field': 3}, 0)
+
+
+def test_acquire_lease(state_table):
+    assert state_store.acquire_lease('test-lease', 'holder-1', 60)
+    assert not state_store.acquire_lease('test-lease', 'holder-2', 60)
+
+
+def test_acquire_lease_after_release(state_table):
+    assert state_store.acquire_lease('test-lease', 'holder-1', 60)
+    state_store.release_lease('test-lease', 'holder-1')
+    assert state_store.acquire_lease('test-lease', 'holder-2', 60)
+
+
+def test_acquire_expired_lease(state_table):
+    aws_clients.get_client('dynamodb').put_item(TableName='test-state-table', Item={
+        'state_key': {'S': 'test-lease'},
+        'holder': {'S': 'holder-1'},
+        'expires_at': {'N': str(int(time.time()) - 1)}
+    })
+    assert state_store.acquire_lease('test-lease', 'holder-2', 60)
+
+
+def test_release_lease_held_by_someone_else(state_table):
+    assert state_store.acquire_lease('test-lease', 'holder-1', 60)
+    state_store.release_lease('test-lease', 'holder-2')
+    assert not state_store.acquire_lease('test-lease', 'holder-3', 60)
@@ -0,0 +1,129 @@
+from unittest.mock import patch
+
+import pytest
+
+from lambda_dir import text_widget_renderer as renderer
+
+
+@pytest.fixture(autouse=True)
+def set_environment(monkeypatch):
+    monkeypatch.setenv('repo_names', 'test-repo-name,other-owner/other-repo-name')
+    monkeypatch.setenv('owner', 'test-owner')
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    renderer.snapshot_cache.clear()
+    yield
+    renderer.snapshot_cache.clear()
+
+
+def get_custom_widget_event(repo_name='test-repo-name', title='test-repo-name Properties', owner='test-owner'):
+    # The shape of the event CloudWatch sends when a dashboard shows the widget
+    return {
+        'owner': owner,
+        'repo_name': repo_name,
+        'title': title,
+        'widgetContext': {
+            'dashboardName': 'test-dashboard',
+            'widgetId': 'widget-1',
+            'accountId': '123456789012',
+            'locale': 'en',
+            'timezone': {'label': 'UTC', 'offsetISO': '+00:00', 'offsetInMinutes': 0},
+            'period': 300,
+            'isAutoPeriod': True,
+            'timeRange': {'mode': 'relative', 'start': 1600000000000, 'end': 1600003600000},
+            'theme': 'light',
+            'linkCharts': True,
+            'title': title,
+            'forms': {'all': {}},
+            'params': {'owner': owner, 'repo_name': repo_name, 'title': title},
+            'width': 588,
+            'height': 300
+        }
+    }
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_handler_renders_snapshot(mock_get_state):
+    mock_get_state.return_value = {'test-repo-name Properties': {'License': 'Apache-2.0'}}
+
+    response = renderer.handler(get_custom_widget_event(), None)
+
+    assert response == {'markdown': ' Name | Value \n ----|----- \nLicense | Apache-2.0\n'}
+    mock_get_state.assert_called_once_with('text#test-owner/test-repo-name')
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_handler_looks_up_owner(mock_get_state):
+    mock_get_state.return_value = {}
+
+    renderer.handler(get_custom_widget_event(repo_name='other-repo-name', owner=None), None)
+    renderer.handler(get_custom_widget_event(owner=None), None)
+
+    # A shared widget leaves the owner out, the owner the repository is configured with is used
+    assert mock_get_state.call_args_list == [(('text#other-owner/other-repo-name',),),
+                                             (('text#test-owner/test-repo-name',),)]
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_handler_no_snapshot_yet(mock_get_state):
+    mock_get_state.return_value = {}
+
+    response = renderer.handler(get_custom_widget_event(), None)
+
+    assert response == {'markdown': 'No values have been collected for test-repo-name Properties yet.'}
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_handler_missing_params(mock_get_state):
+    response = renderer.handler({'widgetContext': {}}, None)
+
+    assert 'repo_name' in response['markdown']
+    mock_get_state.assert_not_called()
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_handler_describe(mock_get_state):
+    response = renderer.handler({'describe': True}, None)
+
+    assert response == {'markdown': renderer.DOCUMENTATION}
+    mock_get_state.assert_not_called()
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_get_snapshot_cached_within_ttl(mock_get_state):
+    mock_get_state.return_value = {'title': {'a': '1'}}
+
+    renderer.get_snapshot('test-owner', 'test-repo-name')
+    assert renderer.get_snapshot('test-owner', 'test-repo-name') == {'title': {'a': '1'}}
+
+    mock_get_state.assert_called_once_with('text#test-owner/test-repo-name')
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_get_snapshot_cached_by_owner(mock_get_state):
+    mock_get_state.side_effect = [{'title': {'a': '1'}}, {'title': {'a': '2'}}]
+
+    renderer.get_snapshot('test-owner', 'test-repo-name')
+
+    # Repositories of the same name with different owners don't share a snapshot
+    assert renderer.get_snapshot('other-owner', 'test-repo-name') == {'title': {'a': '2'}}
+
+
+@patch('lambda_dir.text_widget_renderer.time.monotonic')
+@patch('lambda_dir.text_widget_renderer.state_store.get_state')
+def test_get_snapshot_read_again_after_ttl(mock_get_state, mock_monotonic):
+    mock_get_state.side_effect = [{'title': {'a': '1'}}, {'title': {'a': '2'}}]
+    mock_monotonic.side_effect = [100, 100 + renderer.CACHE_TTL_SECONDS, 100 + renderer.CACHE_TTL_SECONDS]
+
+    renderer.get_snapshot('test-owner', 'test-repo-name')
+
+    assert renderer.get_snapshot('test-owner', 'test-repo-name') == {'title': {'a': '2'}}
+    assert mock_get_state.call_count == 2
+
+
+@patch('lambda_dir.text_widget_renderer.state_store.put_state')
+def test_save_snapshot(mock_put_state):
+    renderer.save_snapshot('test-owner', 'test-repo-name', {'title': {'a': '1'}})
+    mock_put_state.assert_called_once_with('text#test-owner/test-repo-name', {'title': {'a': '1'}})
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from lambda_dir import traffic_history
+
+
+def get_day(days_ago: int) -> str:
+    day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_ago)
+    return day.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def get_traffic_data():
+    return {
+        'traffic/clones': {
+            'count': 7,
+            'uniques': 4,
+            'clones': [
+                {'timestamp': get_day(1), 'count': 3, 'uniques': 2},
+                {'timestamp': get_day(0), 'count': 4, 'uniques': 2}
+            ]
+        },
+        'traffic/views': {
+            'count': 10,
+            'uniques': 5,
+            'views': [
+                {'timestamp': get_day(0), 'count': 10, 'uniques': 5}
+            ]
+        }
+    }
+
+
+def mock_new_metric_side_effect(repo_name, metric_name, metric_value, timestamp):
+    return (metric_name, metric_value, timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+
+@patch('lambda_dir.traffic_history.state_store.put_state')
+@patch('lambda_dir.traffic_history.state_store.get_state')
+@patch('lambda_dir.traffic_history.cw_interactions.put_metrics_in_cloudwatch')
+@patch('lambda_dir.traffic_history.cw_interactions.new_metric', side_effect=mock_new_metric_side_effect)
+def test_publish_traffic_history_nothing_published_yet(mock_new_metric, mock_put_metrics, mock_get_state,
+                                                       mock_put_state):
+    mock_get_state.return_value = {}
+    published = traffic_history.publish_traffic_history('test-owner', 'test-repo-name', get_traffic_data())
+
+    assert published == 6
+    mock_get_state.assert_called_once_with('traffic#test-owner/test-repo-name')
+    mock_put_metrics.assert_called_once_with([
+        ('Daily Clones', 3, get_day(1)),
+        ('Daily Unique Cloners', 2, get_day(1)),
+        ('Daily Clones', 4, get_day(0)),
+        ('Daily Unique Cloners', 2, get_day(0)),
+        ('Daily Views', 10, get_day(0)),
+        ('Daily Unique Visitors', 5, get_day(0))
+    ])
+    mock_put_state.assert_called_once_with('traffic#test-owner/test-repo-name', {
+        'traffic/clones': {get_day(1): [3, 2], get_day(0): [4, 2]},
+        'traffic/views': {get_day(0): [10, 5]}
+    })
+
+
+@patch('lambda_dir.traffic_history.state_store.put_state')
+@patch('lambda_dir.traffic_history.state_store.get_state')
+@patch('lambda_dir.traffic_history.cw_interactions.put_metrics_in_cloudwatch')
+@patch('lambda_dir.traffic_history.cw_interactions.new_metric', side_effect=mock_new_metric_side_effect)
+def test_publish_traffic_history_only_new_or_changed_days(mock_new_metric, mock_put_metrics, mock_get_state,
+                                                          mock_put_state):
+    mock_get_state.return_value = {
+        'traffic/clones': {get_day(1): [3, 2], get_day(0): [1, 1]},
+        'traffic/views': {get_day(0): [10, 5]}
+    }
+    published = traffic_history.publish_traffic_history('test-owner', 'test-repo-name', get_traffic_data())
+
+    assert published == 2
+    mock_put_metrics.assert_called_once_with([
+        ('Daily Clones', 4, get_day(0)),
+        ('Daily Unique Cloners', 2, get_day(0))
+    ])
+    mock_put_state.assert_called_once()
+
+
+@patch('lambda_dir.traffic_history.state_store.put_state')
+@patch('lambda_dir.traffic_history.state_store.get_state')
+@patch('lambda_dir.traffic_history.cw_interactions.put_metrics_in_cloudwatch')
+@patch('lambda_dir.traffic_history.cw_interactions.new_metric', side_effect=mock_new_metric_side_effect)
+def test_publish_traffic_history_nothing_changed(mock_new_metric, mock_put_metrics, mock_get_state, mock_put_state):
+    mock_get_state.return_value = {
+        'traffic/clones': {get_day(1): [3, 2], get_day(0): [4, 2]},
+        'traffic/views': {get_day(0): [10, 5]}
+    }
+    published = traffic_history.publish_traffic_history('test-owner', 'test-repo-name', get_traffic_data())
+
+    assert published == 0
+    mock_put_metrics.assert_not_called()
+    mock_put_state.assert_not_called()
+
+
+@patch('lambda_dir.traffic_history.state_store.put_state')
+@patch('lambda_dir.traffic_history.state_store.get_state')
+@patch('lambda_dir.traffic_history.cw_interactions.put_metrics_in_cloudwatch')
+@patch('lambda_dir.traffic_history.cw_interactions.new_metric', side_effect=mock_new_metric_side_effect)
+def test_publish_traffic_history_skips_days_outside_backdate_window(mock_new_metric, mock_put_metrics, mock_get_state,
+                                                                    mock_put_state):
+    mock_get_state.return_value = {}
+    traffic_data = {'traffic/clones': {'clones': [{'timestamp': get_day(14), 'count': 3, 'uniques': 2}]}}
+    published = traffic_history.publish_traffic_history('test-owner', 'test-repo-name', traffic_data)
+
+    assert published == 0
+    mock_put_metrics.assert_not_called()
+
+
+@patch('lambda_dir.traffic_history.state_store.put_state')
+@patch('lambda_dir.traffic_history.state_store.get_state')
+@patch('lambda_dir.traffic_history.cw_interactions.put_metrics_in_cloudwatch')
+def test_publish_traffic_history_failed_requests(mock_put_metrics, mock_get_state, mock_put_state):
+    mock_get_state.return_value = {}
+    published = traffic_history.publish_traffic_history('test-owner', 'test-repo-name',
+                                                        {'traffic/clones': {}, 'traffic/views': []})
+
+    assert published == 0
+    mock_put_metrics.assert_not_called()
+    mock_put_state.assert_not_called()
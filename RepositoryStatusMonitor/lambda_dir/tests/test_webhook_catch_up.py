@@ -0,0 +1,106 @@
+from unittest.mock import patch
+
+import pytest
+
+from lambda_dir import webhook_catch_up
+
+
+@pytest.fixture
+def github(monkeypatch):
+    """Keeps the state table in a dictionary and mocks the GitHub token"""
+    states = {}
+    monkeypatch.setenv('user_agent_header', 'test-user-agent-header')
+    monkeypatch.setattr(webhook_catch_up.state_store, 'get_state', lambda key: states.get(key, {}))
+    with patch('lambda_dir.webhook_catch_up.aws_clients.get_client') as mock_get_client:
+        mock_get_client.return_value.get_secret_value.return_value = {'SecretString': '1234'}
+        yield states
+
+
+def get_events(ids):
+    events = {
+        'IssuesEvent': {'action': 'opened', 'issue': {'number': 3, 'created_at': '2019-05-15T15:20:18Z'}},
+        'PushEvent': {'ref': 'refs/heads/master', 'head': 'abc123'},
+        'WatchEvent': {'action': 'started'},
+        'PullRequestEvent': {'action': 'synchronize', 'number': 4, 'pull_request': {'number': 4}}
+    }
+    return [{'id': str(event_id), 'type': event_type, 'repo': {'name': 'aws/repo'}, 'payload': payload}
+            for event_id, (event_type, payload) in zip(ids, events.items())]
+
+
+def test_get_event_message():
+    issue, push = get_events([2, 1])[:2]
+
+    issue_message = webhook_catch_up.get_event_message(issue)
+    push_message = webhook_catch_up.get_event_message(push)
+
+    assert (issue_message['event'], issue_message['action'], issue_message['number']) == ('issues', 'opened', '3')
+    assert (issue_message['owner'], issue_message['repo_name'], issue_message['delivery']) == ('aws', 'repo', '')
+    assert (push_message['event'], push_message['ref'], push_message['head']) == \
+        ('push', 'refs/heads/master', 'abc123')
+
+
+@patch('lambda_dir.webhook_catch_up.hh.request_if_modified')
+def test_fetch_missed_events(mock_request, github):
+    github['events-cursor#aws/repo'] = {'etag': '"old"', 'last_event_id': '10'}
+    mock_request.return_value = True, get_events([14, 13, 12, 11]) + get_events([10]), {'ETag': '"new"'}
+
+    messages, cursor = webhook_catch_up.fetch_missed_events('aws', 'repo')
+
+    # Oldest first, without the events the handlers don't act on
+    assert [message['event'] for message in messages] == ['push', 'issues']
+    assert cursor == {'etag': '"new"', 'last_event_id': '14'}
+    assert mock_request.call_count == 1
+    assert mock_request.call_args[0] == ('https://api.github.com/repos/aws/repo/events', '"old"')
+    assert mock_request.call_args[1]['headers']['Authorization'] == 'token 1234'
+
+
+@patch('lambda_dir.webhook_catch_up.hh.request_if_modified')
+def test_fetch_missed_events_not_modified(mock_request, github):
+    github['events-cursor#aws/repo'] = {'etag': '"old"', 'last_event_id': '10'}
+    mock_request.return_value = True, None, {}
+
+    assert webhook_catch_up.fetch_missed_events('aws', 'repo') == ([], None)
+
+
+@patch('lambda_dir.webhook_catch_up.hh.request_if_modified')
+def test_fetch_missed_events_first_run(mock_request, github):
+    mock_request.return_value = True, get_events([14, 13]), {'ETag': '"new"'}
+
+    # History from before the cursor existed isn't replayed
+    assert webhook_catch_up.fetch_missed_events('aws', 'repo') == ([], {'etag': '"new"', 'last_event_id': '14'})
+    assert mock_request.call_args[0][1] is None
+
+
+@patch('lambda_dir.webhook_catch_up.EVENTS_PER_PAGE', 2)
+@patch('lambda_dir.webhook_catch_up.hh.request_if_modified')
+def test_fetch_missed_events_pages(mock_request, github):
+    github['events-cursor#aws/repo'] = {'etag': '"old"', 'last_event_id': '10'}
+    mock_request.side_effect = [(True, get_events([14, 13]), {'ETag': '"new"'}),
+                                (True, get_events([12, 11])[1:] + get_events([10]), {'ETag': '"page-2"'})]
+
+    messages, cursor = webhook_catch_up.fetch_missed_events('aws', 'repo')
+
+    assert [message['event'] for message in messages] == ['push', 'push', 'issues']
+    assert cursor == {'etag': '"new"', 'last_event_id': '14'}
+    # Only the first page is conditional
+    assert [call[0][1] for call in mock_request.call_args_list] == ['"old"', None]
+    assert [call[1]['http_fields']['page'] for call in mock_request.call_args_list] == [1, 2]
+
+
+@patch('lambda_dir.webhook_catch_up.EVENTS_PER_PAGE', 2)
+@patch('lambda_dir.webhook_catch_up.hh.request_if_modified')
+def test_fetch_missed_events_failed_page(mock_request, github):
+    github['events-cursor#aws/repo'] = {'etag': '"old"', 'last_event_id': '10'}
+    mock_request.side_effect = [(True, get_events([14, 13]), {'ETag': '"new"'}), (False, {'message': 'error'}, {})]
+
+    # The cursor stays, so the events are caught up on the next run
+    assert webhook_catch_up.fetch_missed_events('aws', 'repo') == ([], None)
+
+
+def test_save_cursor(monkeypatch):
+    states = {}
+    monkeypatch.setattr(webhook_catch_up.state_store, 'put_state', lambda key, value: states.update({key: value}))
+
+    webhook_catch_up.save_cursor('aws', 'repo', {'etag': '"new"', 'last_event_id': '14'})
+
+    assert states == {'events-cursor#aws/repo': {'etag': '"new"', 'last_event_id': '14'}}
@@ -32,7 +32,7 @@ def test_handler_good_github_response(mock_post, aws_credentials, capfd, monkeyp
     mock_post.return_value = True, {'message': 'Test Good'}, {}
 
     wc.handler({}, None)
-    assert 'issues, pull_request, release, push webhook created' in capfd.readouterr()[0]
+    assert 'issues, issue_comment, pull_request, pull_request_review, release, push, watch, star, fork, public webhook created' in capfd.readouterr()[0]
 
 
 @patch('lambda_dir.webhook_creator.hh.request_handler')
@@ -41,7 +41,7 @@ def test_handler_bad_github_response(mock_post, aws_credentials, capfd, monkeypa
     mock_post.return_value = False, {'message': 'bad response'}, {}
 
     wc.handler({}, None)
-    assert 'Error creating webhook for repository test-repo for events issues, pull_request, release, push: bad response' in capfd.readouterr()[0]
+    assert 'Error creating webhook for repository test-repo for events issues, issue_comment, pull_request, pull_request_review, release, push, watch, star, fork, public: bad response' in capfd.readouterr()[0]
 
 
 @patch('lambda_dir.webhook_creator.hh.request_handler')
@@ -51,5 +51,5 @@ def test_handler_bad_github_response_errors_in_keys(mock_post, aws_credentials,
     mock_post.return_value = False, data, {}
 
     wc.handler({}, None)
-    assert 'Error creating webhook for repository test-repo for events issues, pull_request, release, push: errors in keys' in capfd.readouterr()[0]
+    assert 'Error creating webhook for repository test-repo for events issues, issue_comment, pull_request, pull_request_review, release, push, watch, star, fork, public: errors in keys' in capfd.readouterr()[0]
 
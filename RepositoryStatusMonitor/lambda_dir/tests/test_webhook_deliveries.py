@@ -0,0 +1,81 @@
+from unittest.mock import patch
+
+import pytest
+
+from lambda_dir import aws_clients
+from lambda_dir import webhook_deliveries
+
+
+@pytest.fixture(autouse=True)
+def forget_deliveries():
+    webhook_deliveries.remembered_deliveries.clear()
+    yield
+    webhook_deliveries.remembered_deliveries.clear()
+
+
+def get_claim(delivery_id):
+    item = aws_clients.get_client('dynamodb').get_item(TableName='test-state-table',
+                                                       Key={'state_key': {'S': 'delivery#' + delivery_id}})
+    return item.get('Item')
+
+
+def test_claim_delivery_once(state_table):
+    assert webhook_deliveries.claim_delivery('delivery-1')
+    assert not webhook_deliveries.claim_delivery('delivery-1')
+    assert webhook_deliveries.claim_delivery('delivery-2')
+    assert get_claim('delivery-1')['holder']['S'] == webhook_deliveries.remembered_deliveries['delivery-1']
+
+
+def test_claim_delivery_claimed_by_another_environment(state_table):
+    assert webhook_deliveries.claim_delivery('delivery-1')
+    webhook_deliveries.remembered_deliveries.clear()
+
+    assert not webhook_deliveries.claim_delivery('delivery-1')
+    # Only deliveries this environment holds are remembered, so it can still take over a released one
+    assert 'delivery-1' not in webhook_deliveries.remembered_deliveries
+
+
+@patch('lambda_dir.webhook_deliveries.state_store.acquire_lease', return_value=True)
+def test_claim_delivery_remembered_in_memory(mock_acquire_lease):
+    assert webhook_deliveries.claim_delivery('delivery-1')
+    assert not webhook_deliveries.claim_delivery('delivery-1')
+    mock_acquire_lease.assert_called_once()
+
+
+@patch('lambda_dir.webhook_deliveries.MAX_REMEMBERED_DELIVERIES', 2)
+@patch('lambda_dir.webhook_deliveries.state_store.acquire_lease', return_value=True)
+def test_claim_delivery_forgets_least_recently_used(mock_acquire_lease):
+    for delivery_id in ['delivery-1', 'delivery-2', 'delivery-3']:
+        webhook_deliveries.claim_delivery(delivery_id)
+
+    assert list(webhook_deliveries.remembered_deliveries) == ['delivery-2', 'delivery-3']
+
+
+@patch('lambda_dir.webhook_deliveries.state_store.acquire_lease')
+def test_claim_delivery_without_id(mock_acquire_lease):
+    assert webhook_deliveries.claim_delivery('')
+    assert webhook_deliveries.claim_delivery(None)
+    mock_acquire_lease.assert_not_called()
+
+
+@patch('lambda_dir.webhook_deliveries.state_store.acquire_lease', side_effect=RuntimeError('throttled'))
+def test_claim_delivery_error_forgets_delivery(mock_acquire_lease):
+    with pytest.raises(RuntimeError):
+        webhook_deliveries.claim_delivery('delivery-1')
+    assert 'delivery-1' not in webhook_deliveries.remembered_deliveries
+
+
+def test_release_delivery(state_table):
+    webhook_deliveries.claim_delivery('delivery-1')
+
+    webhook_deliveries.release_delivery('delivery-1')
+
+    assert get_claim('delivery-1') is None
+    assert webhook_deliveries.claim_delivery('delivery-1')
+
+
+@patch('lambda_dir.webhook_deliveries.state_store.release_lease')
+def test_release_delivery_not_claimed(mock_release_lease):
+    webhook_deliveries.release_delivery('delivery-1')
+    webhook_deliveries.release_delivery(None)
+    mock_release_lease.assert_not_called()
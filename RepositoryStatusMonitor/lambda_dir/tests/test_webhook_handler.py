@@ -0,0 +1,201 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from lambda_dir import webhook_handler
+
+
+def set_environment(monkeypatch):
+    monkeypatch.setenv('repo_names', 'test-repo-name')
+    monkeypatch.setenv('owner', 'test-owner')
+    monkeypatch.setenv('dashboard_name_prefix', 'test-dashboard-name-prefix')
+
+
+def get_sqs_event(bodies):
+    return {'Records': [{'messageId': 'message-%d' % index, 'receiptHandle': 'handle-%d' % index,
+                         'body': json.dumps(body), 'eventSource': 'aws:sqs'}
+                        for index, body in enumerate(bodies)]}
+
+
+@pytest.fixture
+def forget_deliveries():
+    webhook_handler.webhook_deliveries.remembered_deliveries.clear()
+    yield
+    webhook_handler.webhook_deliveries.remembered_deliveries.clear()
+
+
+@patch('lambda_dir.webhook_handler.widget_registry')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_handles_every_record_with_one_update_per_dashboard(mock_handle_webhook, mock_crud, mock_registry):
+    mock_registry.get_unregistered_widgets.side_effect = lambda widgets: widgets
+    mock_handle_webhook.side_effect = [
+        {'dash-1': ['widget-1']},
+        {},
+        {'dash-1': ['widget-2'], 'dash-2': ['widget-3']}
+    ]
+    mock_crud.return_value = {'dash-1': {'status': 'written'}, 'dash-2': {'status': 'written'}}
+
+    response = webhook_handler.handler(get_sqs_event([{'event': 1}, {'event': 2}, {'event': 3}]), None)
+
+    assert [call[0][0] for call in mock_handle_webhook.call_args_list] == [{'event': 1}, {'event': 2}, {'event': 3}]
+    mock_crud.assert_called_once_with({'dash-1': ['widget-1', 'widget-2'], 'dash-2': ['widget-3']}, {}, None)
+    assert response == {'batchItemFailures': []}
+
+
+@patch('lambda_dir.webhook_handler.widget_registry')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_reports_only_failed_records(mock_handle_webhook, mock_crud, mock_registry, capfd):
+    mock_registry.get_unregistered_widgets.side_effect = lambda widgets: widgets
+    mock_handle_webhook.side_effect = [{'dash-1': ['widget-1']}, KeyError('action'), {'dash-1': ['widget-2']}]
+    mock_crud.return_value = {'dash-1': {'status': 'written'}}
+
+    response = webhook_handler.handler(get_sqs_event([{'event': 1}, {'event': 2}, {'event': 3}]), None)
+
+    mock_crud.assert_called_once_with({'dash-1': ['widget-1', 'widget-2']}, {}, None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+    assert "Failed to handle webhook event message-1: KeyError('action')" in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.webhook_handler.widget_registry')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_failed_dashboard_does_not_retry_records(mock_handle_webhook, mock_crud, mock_registry, capfd):
+    mock_handle_webhook.return_value = {'dash-1': ['widget-1'], 'dash-2': ['widget-2']}
+    mock_registry.get_unregistered_widgets.side_effect = lambda widgets: widgets
+    mock_crud.return_value = {
+        'dash-1': {'status': 'failed', 'error': 'ThrottlingException'},
+        'dash-2': {'status': 'written'}
+    }
+
+    response = webhook_handler.handler(get_sqs_event([{'event': 1}]), None)
+
+    # The event's metrics are already published, retrying it would count them again
+    assert response == {'batchItemFailures': []}
+    assert 'Dashboard dash-1 was not updated: ThrottlingException' in capfd.readouterr()[0]
+    # Only the widgets that made it onto their dashboard are registered
+    mock_registry.register_widgets.assert_called_once_with({'dash-2': ['widget-2']})
+
+
+@patch('lambda_dir.webhook_handler.widget_registry')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_registered_widgets_only_publish_metrics(mock_handle_webhook, mock_crud, mock_registry, capfd):
+    mock_handle_webhook.return_value = {'dash-1': ['widget-1']}
+    mock_registry.get_unregistered_widgets.return_value = {}
+
+    response = webhook_handler.handler(get_sqs_event([{'event': 1}, {'event': 2}]), None)
+
+    mock_crud.assert_not_called()
+    mock_registry.register_widgets.assert_not_called()
+    assert response == {'batchItemFailures': []}
+    assert 'Widgets already on their dashboards, only metrics were published.' in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.webhook_handler.handle_webhook_events.cw_interactions.put_metrics_in_cloudwatch')
+def test_handler_publishes_replayed_delivery_once(mock_put_metrics, state_table, forget_deliveries, monkeypatch):
+    set_environment(monkeypatch)
+    # DynamoDB applies a conditional write atomically, moto doesn't across threads
+    acquire_lease = webhook_handler.webhook_deliveries.state_store.acquire_lease
+    dynamodb_lock = threading.Lock()
+
+    def atomic_acquire_lease(*args):
+        with dynamodb_lock:
+            return acquire_lease(*args)
+
+    monkeypatch.setattr(webhook_handler.webhook_deliveries.state_store, 'acquire_lease', atomic_acquire_lease)
+    message = {'event': 'pull_request', 'delivery': 'delivery-1', 'action': 'opened', 'repo_name': 'test-repo-name'}
+
+    def replay(execution_environment):
+        # Each replay after the first few comes from an execution environment that hasn't seen the delivery
+        if execution_environment % 4 == 0:
+            webhook_handler.webhook_deliveries.remembered_deliveries.clear()
+        return webhook_handler.handler(get_sqs_event([message, message]), None)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(replay, range(32)))
+
+    assert mock_put_metrics.call_count == 1
+    assert all(response == {'batchItemFailures': []} for response in responses)
+
+
+@patch('lambda_dir.webhook_handler.widget_registry')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.cw_interactions.aws_clients.get_client')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_retried_delivery_publishes_metrics_once(mock_handle_webhook, mock_get_client, mock_crud, mock_registry,
+                                                         state_table, forget_deliveries, monkeypatch):
+    set_environment(monkeypatch)
+    monkeypatch.setenv('namespace', 'test-namespace')
+    mock_registry.get_unregistered_widgets.return_value = {}
+    metric = webhook_handler.cw_interactions.new_metric('test-repo-name', 'Pull Requests Opened', 1)
+    attempts = []
+
+    def handle_webhook(message):
+        # The first attempt publishes the metric, then fails part of the way
+        webhook_handler.cw_interactions.put_metrics_in_cloudwatch([metric])
+        attempts.append(message)
+        if len(attempts) == 1:
+            raise ValueError('state table unavailable')
+        return {}
+
+    mock_handle_webhook.side_effect = handle_webhook
+    event = get_sqs_event([{'event': 'pull_request', 'delivery': 'delivery-1'}])
+
+    assert webhook_handler.handler(event, None) == {'batchItemFailures': [{'itemIdentifier': 'message-0'}]}
+    mock_get_client.return_value.put_metric_data.assert_not_called()
+
+    # SQS retries the record, and its metric is published once
+    assert webhook_handler.handler(event, None) == {'batchItemFailures': []}
+    mock_get_client.return_value.put_metric_data.assert_called_once_with(Namespace='test-namespace',
+                                                                         MetricData=[metric])
+
+
+@patch('lambda_dir.webhook_handler.webhook_deliveries')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_skips_duplicate_delivery(mock_handle_webhook, mock_crud, mock_deliveries, capfd):
+    mock_deliveries.claim_delivery.return_value = False
+
+    response = webhook_handler.handler(get_sqs_event([{'event': 'push', 'delivery': 'delivery-1'}]), None)
+
+    mock_handle_webhook.assert_not_called()
+    mock_crud.assert_not_called()
+    assert response == {'batchItemFailures': []}
+    assert 'Skipped webhook event delivery-1, it was already handled' in capfd.readouterr()[0]
+
+
+@patch('lambda_dir.webhook_handler.webhook_deliveries')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_releases_failed_delivery(mock_handle_webhook, mock_crud, mock_deliveries):
+    mock_deliveries.claim_delivery.return_value = True
+    mock_handle_webhook.side_effect = [ValueError('bad payload'), {}]
+
+    response = webhook_handler.handler(get_sqs_event([{'event': 'push', 'delivery': 'delivery-1'},
+                                                      {'event': 'push', 'delivery': 'delivery-2'}]), None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-0'}]}
+    mock_deliveries.release_delivery.assert_called_once_with('delivery-1')
+
+
+@patch('lambda_dir.webhook_handler.metric_refresh.request_refresh')
+@patch('lambda_dir.webhook_handler.widget_registry')
+@patch('lambda_dir.webhook_handler.dashboards.cw_interactions.create_or_update_dashboard')
+@patch('lambda_dir.webhook_handler.handle_webhook_events.handle_webhook')
+def test_handler_requests_refresh_for_handled_events(mock_handle_webhook, mock_crud, mock_registry,
+                                                     mock_request_refresh, capfd):
+    mock_handle_webhook.side_effect = [ValueError('bad payload'), {}, {}]
+    mock_request_refresh.side_effect = [True, ValueError('queue unavailable')]
+    messages = [{'event': 'release', 'repo_name': 'repo-%d' % index} for index in range(3)]
+
+    response = webhook_handler.handler(get_sqs_event(messages), None)
+
+    assert [call[0][0] for call in mock_request_refresh.call_args_list] == messages[1:]
+    # A refresh that couldn't be requested is left to the hourly run
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-0'}]}
+    assert 'Failed to request a refresh for webhook event message-2' in capfd.readouterr()[0]
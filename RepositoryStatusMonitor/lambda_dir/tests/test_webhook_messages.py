@@ -0,0 +1,173 @@
+import json
+
+from lambda_dir import webhook_messages
+
+
+def test_get_request_template():
+    template = webhook_messages.get_request_template()
+
+    assert '\n' not in template
+    assert "#if($input.params('X-GitHub-Event') == 'pull_request' || $input.params('X-GitHub-Event') == " \
+           "'pull_request_review')#set($item = 'pull_request')#end" in template
+    assert '#set($responded_at = $input.path("$.${response}"))' in template
+    assert "#set($repo_name = $input.path('$.repository.name'))" in template
+    assert '#set($created_at = $input.path("$.${item}.created_at"))' in template
+    assert template.endswith(
+        '"forks_count":"#if($forks_count)$util.urlEncode($util.escapeJavaScript("$forks_count"))#end"}')
+    assert 'Action=SendMessage&MessageBody={"event":"#if($event)' in template
+
+
+def test_compact_payload_issue():
+    payload = {
+        'action': 'closed',
+        'issue': {'number': 7, 'created_at': '2019-05-15T15:20:18Z', 'closed_at': '2019-05-15T15:40:18Z', 'body': 'long text'},
+        'repository': {'name': 'test-repo-name', 'owner': {'login': 'aws'}, 'description': 'a repository'},
+        'sender': {'login': 'someone'}
+    }
+
+    assert webhook_messages.compact_payload(payload) == {
+        'event': 'issues',
+        'delivery': '',
+        'action': 'closed',
+        'repo_name': 'test-repo-name',
+        'owner': 'aws',
+        'number': '7',
+        'created_at': '2019-05-15T15:20:18Z',
+        'closed_at': '2019-05-15T15:40:18Z',
+        'author': '',
+        'pull_request_url': '',
+        'responded_at': '',
+        'sender': 'someone',
+        'sender_type': '',
+        'merged': '',
+        'release_id': '',
+        'published_at': '',
+        'ref': '',
+        'head': '',
+        'stargazers_count': '',
+        'forks_count': ''
+    }
+
+
+def test_compact_payload_pull_request():
+    payload = {
+        'action': 'closed',
+        'pull_request': {'created_at': '2019-05-15T15:20:18Z', 'closed_at': '2019-05-15T15:40:18Z', 'merged': False},
+        'repository': {'name': 'test-repo-name'}
+    }
+
+    message = webhook_messages.compact_payload(payload)
+
+    assert message['event'] == 'pull_request'
+    assert message['created_at'] == '2019-05-15T15:20:18Z'
+    assert message['merged'] == 'false'
+    assert message['owner'] == ''
+
+
+def test_compact_payload_release_and_push():
+    release = webhook_messages.compact_payload({
+        'action': 'published',
+        'release': {'published_at': '2019-05-15T15:40:18Z'},
+        'repository': {'name': 'test-repo-name', 'owner': {'login': 'aws'}}
+    })
+    push = webhook_messages.compact_payload({
+        'ref': 'refs/heads/master',
+        'pusher': {'name': 'pusher'},
+        'commits': [{'id': str(commit)} for commit in range(100)],
+        'repository': {'name': 'test-repo-name'}
+    })
+
+    assert (release['event'], release['published_at'], release['owner']) == \
+        ('release', '2019-05-15T15:40:18Z', 'aws')
+    assert (push['event'], push['ref']) == ('push', 'refs/heads/master')
+    assert list(push) == list(webhook_messages.MESSAGE_FIELDS)
+
+
+def test_compact_payload_comment_and_review():
+    comment = webhook_messages.compact_payload({
+        'action': 'created',
+        'issue': {'number': 7, 'created_at': '2019-05-15T15:20:18Z', 'user': {'login': 'author'},
+                  'pull_request': {'url': 'https://api.github.com/repos/aws/test-repo-name/pulls/7'}},
+        'comment': {'created_at': '2019-05-15T15:40:18Z', 'body': 'long text'},
+        'repository': {'name': 'test-repo-name'},
+        'sender': {'login': 'maintainer', 'type': 'User'}
+    })
+    review = webhook_messages.compact_payload({
+        'action': 'submitted',
+        'pull_request': {'number': 8, 'created_at': '2019-05-15T15:20:18Z', 'user': {'login': 'author'}},
+        'review': {'submitted_at': '2019-05-15T16:20:18Z', 'state': 'approved'},
+        'repository': {'name': 'test-repo-name'},
+        'sender': {'login': 'reviewer', 'type': 'User'}
+    })
+
+    assert (comment['event'], comment['number'], comment['author'], comment['sender']) == \
+        ('issue_comment', '7', 'author', 'maintainer')
+    assert (comment['responded_at'], comment['pull_request_url']) == \
+        ('2019-05-15T15:40:18Z', 'https://api.github.com/repos/aws/test-repo-name/pulls/7')
+    assert (review['event'], review['number'], review['created_at'], review['responded_at']) == \
+        ('pull_request_review', '8', '2019-05-15T15:20:18Z', '2019-05-15T16:20:18Z')
+    assert webhook_messages.is_handled(comment) and webhook_messages.is_handled(review)
+    assert not webhook_messages.is_handled(dict(comment, action='edited'))
+
+
+def test_compact_payload_unknown_event():
+    assert webhook_messages.compact_payload({'zen': 'Keep it logically awesome.'})['event'] == ''
+
+
+def test_is_handled():
+    assert webhook_messages.is_handled({'event': 'issues', 'action': 'closed'})
+    assert webhook_messages.is_handled({'event': 'pull_request', 'action': 'opened'})
+    assert webhook_messages.is_handled({'event': 'push', 'ref': 'refs/heads/master'})
+    assert webhook_messages.is_handled({'event': 'star', 'action': 'deleted'})
+    assert webhook_messages.is_handled({'event': 'fork'})
+    assert not webhook_messages.is_handled({'event': 'issues', 'action': 'labeled'})
+    # Passes the shared filter of the events filtered on their action, but isn't handled
+    assert not webhook_messages.is_handled({'event': 'issues', 'action': 'deleted'})
+    assert not webhook_messages.is_handled({'event': 'pull_request', 'action': 'synchronize'})
+    assert not webhook_messages.is_handled({'event': 'push', 'ref': 'refs/heads/feature'})
+    assert not webhook_messages.is_handled({'event': 'ping'})
+    assert not webhook_messages.is_handled({})
+
+
+def test_compact_payload_event():
+    message = webhook_messages.compact_payload({'ref': 'refs/heads/master', 'after': 'abc123'}, event='push')
+
+    assert (message['event'], message['head']) == ('push', 'abc123')
+
+
+def test_get_event_key():
+    issue = {'event': 'issues', 'action': 'closed', 'repo_name': 'test-repo-name', 'owner': 'aws', 'number': '7',
+             'created_at': '2019-05-15T15:20:18Z', 'closed_at': '2019-05-15T15:40:18Z', 'delivery': 'abc'}
+    reopened_and_closed = dict(issue, closed_at='2019-05-16T15:40:18Z')
+    push = {'event': 'push', 'ref': 'refs/heads/master', 'repo_name': 'test-repo-name', 'owner': 'aws',
+            'head': 'abc123'}
+
+    assert webhook_messages.get_event_key(issue) == \
+        'issues#aws#test-repo-name#7#closed#2019-05-15T15:20:18Z#2019-05-15T15:40:18Z'
+    # The same event caught up from the events API has no delivery
+    assert webhook_messages.get_event_key(dict(issue, delivery='')) == webhook_messages.get_event_key(issue)
+    assert webhook_messages.get_event_key(reopened_and_closed) != webhook_messages.get_event_key(issue)
+    assert webhook_messages.get_event_key(push) == 'push#aws#test-repo-name#abc123#refs/heads/master'
+    # Messages queued before the event's number was part of the message aren't identified
+    assert webhook_messages.get_event_key(dict(issue, number='')) is None
+    assert webhook_messages.get_event_key({'event': 'star', 'action': 'created', 'repo_name': 'test-repo-name'}) is None
+
+
+def test_get_claim_id():
+    push = {'event': 'push', 'ref': 'refs/heads/master', 'repo_name': 'test-repo-name', 'owner': 'aws',
+            'head': 'abc123', 'delivery': 'delivery-1'}
+
+    assert webhook_messages.get_claim_id(push) == 'push#aws#test-repo-name#abc123#refs/heads/master'
+    assert webhook_messages.get_claim_id({'event': 'star', 'delivery': 'delivery-1'}) == 'delivery-1'
+    assert webhook_messages.get_claim_id({'event': 'star', 'delivery': ''}) is None
+
+
+def test_get_filter_criteria():
+    patterns = [json.loads(event_filter['Pattern']) for event_filter in webhook_messages.get_filter_criteria()['Filters']]
+
+    assert patterns == [
+        {'body': {'event': ['issues', 'pull_request', 'issue_comment', 'pull_request_review', 'release', 'watch', 'star'],
+                  'action': ['opened', 'closed', 'created', 'submitted', 'published', 'started', 'deleted']}},
+        {'body': {'event': ['push'], 'ref': ['refs/heads/master']}},
+        {'body': {'event': ['fork', 'public']}}
+    ]
@@ -0,0 +1,130 @@
+import json
+from unittest.mock import Mock, patch
+
+from moto import mock_sqs
+import pytest
+
+from lambda_dir import webhook_redrive
+
+
+@pytest.fixture
+def dead_letter_queue(monkeypatch):
+    monkeypatch.setattr(webhook_redrive, 'REDRIVE_POLLERS', 2)
+    monkeypatch.setattr(webhook_redrive, 'REDRIVE_WAIT_SECONDS', 0)
+    with mock_sqs():
+        webhook_redrive.aws_clients.reset_clients()
+        sqs = webhook_redrive.aws_clients.get_client('sqs')
+        queue_url = sqs.create_queue(QueueName='DeadLetterQueue')['QueueUrl']
+        monkeypatch.setenv('dead_letter_queue_url', queue_url)
+        yield sqs, queue_url
+        webhook_redrive.aws_clients.reset_clients()
+
+
+def send_messages(sqs, queue_url, messages):
+    for message in messages:
+        sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(message))
+
+
+def count_messages(sqs, queue_url):
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'])
+    return sum(int(value) for value in attributes['Attributes'].values())
+
+
+def handle_all_records(records):
+    return {'batchItemFailures': []}
+
+
+def test_matches_filter():
+    message = {'event': 'push', 'owner': 'aws', 'repo_name': 'test-repo-name'}
+
+    assert webhook_redrive.matches_filter(message, [], [])
+    assert webhook_redrive.matches_filter(message, ['test-repo-name'], ['push', 'issues'])
+    assert webhook_redrive.matches_filter(message, ['aws/test-repo-name'], [])
+    assert not webhook_redrive.matches_filter(message, ['other-owner/test-repo-name'], [])
+    assert not webhook_redrive.matches_filter(message, [], ['issues'])
+
+
+def test_redrive_dead_letter_queue(dead_letter_queue, capfd):
+    sqs, queue_url = dead_letter_queue
+    send_messages(sqs, queue_url, [{'event': 'push', 'repo_name': 'test-repo-name', 'delivery': str(delivery)}
+                                   for delivery in range(25)])
+    handle_records = Mock(side_effect=handle_all_records)
+
+    counts = webhook_redrive.redrive_dead_letter_queue(handle_records, {}, 300)
+
+    assert counts == {'redriven': 25, 'failed': 0, 'skipped': 0, 'more': False}
+    assert all(len(call[0][0]) <= webhook_redrive.REDRIVE_BATCH_SIZE for call in handle_records.call_args_list)
+    assert sorted(json.loads(record['body'])['delivery'] for call in handle_records.call_args_list
+                  for record in call[0][0]) == sorted(str(delivery) for delivery in range(25))
+    assert count_messages(sqs, queue_url) == 0
+    assert 'Redrove 25 webhook events in' in capfd.readouterr()[0]
+
+
+def test_redrive_dead_letter_queue_filter(dead_letter_queue):
+    sqs, queue_url = dead_letter_queue
+    send_messages(sqs, queue_url, [{'event': 'push', 'repo_name': 'test-repo-name', 'owner': 'aws'},
+                                   {'event': 'issues', 'repo_name': 'test-repo-name', 'owner': 'aws'},
+                                   {'event': 'push', 'repo_name': 'other-repo', 'owner': 'aws'}])
+    handle_records = Mock(side_effect=handle_all_records)
+
+    counts = webhook_redrive.redrive_dead_letter_queue(
+        handle_records, {'repo_names': ['aws/test-repo-name'], 'events': ['push']}, 300)
+
+    assert counts == {'redriven': 1, 'failed': 0, 'skipped': 2, 'more': False}
+    assert [json.loads(record['body'])['event'] for record in handle_records.call_args[0][0]] == ['push']
+    # The events that don't match stay on the queue
+    assert count_messages(sqs, queue_url) == 2
+
+
+def test_redrive_dead_letter_queue_keeps_failed_events(dead_letter_queue):
+    sqs, queue_url = dead_letter_queue
+    send_messages(sqs, queue_url, [{'event': 'push', 'repo_name': 'test-repo-name'}])
+
+    def fail_all_records(records):
+        return {'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in records]}
+
+    counts = webhook_redrive.redrive_dead_letter_queue(fail_all_records, {}, 300)
+
+    assert counts == {'redriven': 0, 'failed': 1, 'skipped': 0, 'more': False}
+    assert count_messages(sqs, queue_url) == 1
+
+
+def test_redrive_dead_letter_queue_buffers_metrics(dead_letter_queue):
+    sqs, queue_url = dead_letter_queue
+    send_messages(sqs, queue_url, [{'event': 'push', 'repo_name': 'test-repo-name'}])
+    buffers = []
+
+    def handle_records(records):
+        buffers.append(webhook_redrive.cw_interactions.metric_buffers.metrics)
+        return handle_all_records(records)
+
+    webhook_redrive.redrive_dead_letter_queue(handle_records, {}, 300)
+
+    assert buffers == [[]]
+
+
+@patch('lambda_dir.webhook_redrive.webhook_deliveries')
+@patch('lambda_dir.webhook_redrive.cw_interactions.buffered_metrics')
+def test_redrive_dead_letter_queue_failed_metrics(mock_buffered_metrics, mock_deliveries, dead_letter_queue, capfd):
+    sqs, queue_url = dead_letter_queue
+    send_messages(sqs, queue_url, [{'event': 'push', 'repo_name': 'test-repo-name', 'delivery': 'delivery-1'}])
+    mock_buffered_metrics.return_value.__exit__.side_effect = ValueError('throttled')
+
+    counts = webhook_redrive.redrive_dead_letter_queue(handle_all_records, {}, 300)
+
+    assert counts == {'redriven': 0, 'failed': 1, 'skipped': 0, 'more': False}
+    mock_deliveries.release_delivery.assert_called_once_with('delivery-1')
+    assert count_messages(sqs, queue_url) == 1
+    assert 'Failed to put the metrics of 1 redriven webhook events' in capfd.readouterr()[0]
+
+
+def test_redrive_dead_letter_queue_deadline(dead_letter_queue):
+    sqs, queue_url = dead_letter_queue
+    send_messages(sqs, queue_url, [{'event': 'push', 'repo_name': 'test-repo-name'}])
+    handle_records = Mock(side_effect=handle_all_records)
+
+    counts = webhook_redrive.redrive_dead_letter_queue(handle_records, {}, webhook_redrive.REDRIVE_TIME_MARGIN_SECONDS)
+
+    assert counts == {'redriven': 0, 'failed': 0, 'skipped': 0, 'more': True}
+    handle_records.assert_not_called()
@@ -0,0 +1,89 @@
+from unittest.mock import patch
+
+import pytest
+
+from lambda_dir import widget_registry
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    widget_registry.registry_cache.clear()
+    yield
+    widget_registry.registry_cache.clear()
+
+
+def new_widget(title, metric_name='Issue Duration'):
+    return {
+        'type': 'metric',
+        'properties': {'metrics': [['namespace', metric_name, 'REPO_NAME', 'repo']], 'title': title}
+    }
+
+
+def test_get_registry_key():
+    assert widget_registry.get_registry_key('prefix-repo', new_widget('repo Issues')) == \
+        'widget#prefix-repo#metric#repo Issues'
+
+
+def test_get_registry_key_no_identity():
+    assert widget_registry.get_registry_key('prefix-repo', {'type': 'metric', 'properties': {}}) is None
+
+
+def test_get_widget_fingerprint_changes_with_definition():
+    assert widget_registry.get_widget_fingerprint(new_widget('repo Issues')) == \
+        widget_registry.get_widget_fingerprint(new_widget('repo Issues'))
+    assert widget_registry.get_widget_fingerprint(new_widget('repo Issues')) != \
+        widget_registry.get_widget_fingerprint(new_widget('repo Issues', 'Other Duration'))
+
+
+@patch('lambda_dir.widget_registry.state_store.get_state')
+def test_get_unregistered_widgets(mock_get_state):
+    registered = new_widget('repo Issues')
+    changed = new_widget('repo Pull Requests')
+    registry = {
+        'widget#prefix-repo#metric#repo Issues': {'fingerprint': widget_registry.get_widget_fingerprint(registered)},
+        'widget#prefix-repo#metric#repo Pull Requests': {'fingerprint': 'old-definition'},
+        'widget#prefix-done#metric#repo Issues': {'fingerprint': widget_registry.get_widget_fingerprint(registered)}
+    }
+    mock_get_state.side_effect = lambda key: registry.get(key, {})
+    untitled = {'type': 'metric', 'properties': {}}
+
+    unregistered = widget_registry.get_unregistered_widgets({
+        'prefix-repo': [registered, changed, untitled],
+        'prefix-other': [new_widget('other Releases')],
+        'prefix-done': [registered]
+    })
+
+    assert unregistered == {
+        'prefix-repo': [changed, untitled],
+        'prefix-other': [new_widget('other Releases')]
+    }
+
+
+@patch('lambda_dir.widget_registry.state_store.get_state')
+@patch('lambda_dir.widget_registry.state_store.put_state')
+def test_registered_widgets_are_remembered_in_memory(mock_put_state, mock_get_state):
+    widget = new_widget('repo Issues')
+
+    widget_registry.register_widgets({'prefix-repo': [widget]})
+
+    assert widget_registry.get_unregistered_widgets({'prefix-repo': [widget]}) == {}
+    mock_get_state.assert_not_called()
+    mock_put_state.assert_called_once_with('widget#prefix-repo#metric#repo Issues',
+                                           {'fingerprint': widget_registry.get_widget_fingerprint(widget)},
+                                           ttl_seconds=widget_registry.REGISTRY_TTL_SECONDS)
+
+
+@patch('lambda_dir.widget_registry.time.monotonic')
+@patch('lambda_dir.widget_registry.state_store.get_state')
+def test_registry_read_again_after_cache_ttl(mock_get_state, mock_monotonic):
+    widget = new_widget('repo Issues')
+    mock_get_state.return_value = {'fingerprint': widget_registry.get_widget_fingerprint(widget)}
+    mock_monotonic.return_value = 100
+
+    assert widget_registry.get_unregistered_widgets({'prefix-repo': [widget]}) == {}
+    assert widget_registry.get_unregistered_widgets({'prefix-repo': [widget]}) == {}
+    mock_monotonic.return_value = 100 + widget_registry.CACHE_TTL_SECONDS
+    mock_get_state.return_value = {}
+
+    assert widget_registry.get_unregistered_widgets({'prefix-repo': [widget]}) == {'prefix-repo': [widget]}
+    assert mock_get_state.call_count == 2
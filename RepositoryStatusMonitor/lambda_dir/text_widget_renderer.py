@@ -0,0 +1,117 @@
+import os
+import time
+
+import cloudwatch_interactions as cw_interactions
+import state_store
+
+# How long a snapshot is served from memory before it is read from the state table again, in seconds. The snapshots
+# only change once an hour, so a short cache absorbs dashboard refreshes and several widgets of the same repository
+CACHE_TTL_SECONDS = 60
+
+# Shown in the CloudWatch console when the function is added as a custom widget
+DOCUMENTATION = '''## Text Widget Renderer
+Renders a text widget of a repository from the latest values collected by the MetricsHandler function.
+
+Param | Description
+---|---
+**owner** | The owner of the repository, looked up in the monitored repositories if left out
+**repo_name** | The name of the repository, without its owner
+**title** | The title of the text widget, e.g. `repo_name Properties`
+
+```
+owner: repository-owner
+repo_name: repository-name
+title: repository-name Properties
+```
+'''
+
+# Maps the snapshot key of each repository to the time its snapshot was read and the snapshot, kept for as long as the
+# execution environment is reused
+snapshot_cache = {}
+
+
+def handler(event, context) -> dict:
+    """Called by CloudWatch when a dashboard shows a custom text widget, renders the widget's latest collected values
+
+    :param event: the params of the custom widget, with CloudWatch's 'widgetContext', or 'describe' when the console
+                  asks for the documentation of the widget
+    :type event: dict
+    :param context: information provided by AWS Lambda about the invocation, function, and execution environment
+    :type context: LambdaContext
+    :returns: the markdown to show in the widget
+    :rtype: dict
+    """
+    if event.get('describe'):
+        return {'markdown': DOCUMENTATION}
+
+    repo_name = event.get('repo_name')
+    title = event.get('title')
+    if not repo_name or not title:
+        return {'markdown': 'The widget needs the `repo_name` and `title` params.'}
+
+    # The widgets of a shared details dashboard leave the owner out, as dashboard variables only switch the repo_name
+    owner = event.get('owner') or get_repository_owner(repo_name)
+    text_data = get_snapshot(owner, repo_name).get(title)
+    if not text_data:
+        return {'markdown': 'No values have been collected for ' + title + ' yet.'}
+
+    return {'markdown': cw_interactions.create_text_table(text_data)}
+
+
+def get_repository_owner(repo_name: str) -> str:
+    """Returns the owner of a monitored repository
+
+    :param repo_name: the name of the repository, without its owner
+    :type repo_name: str
+    :returns: the owner the repository is configured with, or the default owner
+    :rtype: str
+    """
+    for configured_repo_name in os.environ['repo_names'].split(','):
+        if '/' in configured_repo_name and configured_repo_name.split('/')[1] == repo_name:
+            return configured_repo_name.split('/')[0]
+    return os.environ['owner']
+
+
+def get_snapshot_key(owner: str, repo_name: str) -> str:
+    """Returns the key of a repository's text snapshot in the state table
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :rtype: str
+    """
+    return 'text#' + owner + '/' + repo_name
+
+
+def save_snapshot(owner: str, repo_name: str, text_data_by_title: dict):
+    """Stores the latest values of every text widget of a repository for the renderer to read
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param text_data_by_title: a mapping of each widget title to the widget's text data
+    :type text_data_by_title: dict
+    """
+    state_store.put_state(get_snapshot_key(owner, repo_name), text_data_by_title)
+
+
+def get_snapshot(owner: str, repo_name: str) -> dict:
+    """Returns the latest values of every text widget of a repository, from memory if they were read recently
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :returns: a mapping of each widget title to the widget's text data
+    :rtype: dict
+    """
+    snapshot_key = get_snapshot_key(owner, repo_name)
+    cached = snapshot_cache.get(snapshot_key)
+    if cached and time.monotonic() - cached[0] < CACHE_TTL_SECONDS:
+        return cached[1]
+
+    snapshot = state_store.get_state(snapshot_key)
+    snapshot_cache[snapshot_key] = (time.monotonic(), snapshot)
+    return snapshot
@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+
+import cloudwatch_interactions as cw_interactions
+import state_store
+
+# Maps each GitHub traffic endpoint to the key of its per-day breakdown and the metric names for the day's total and
+# unique counts
+TRAFFIC_ENDPOINTS = {
+    'traffic/clones': ('clones', 'Daily Clones', 'Daily Unique Cloners'),
+    'traffic/views': ('views', 'Daily Views', 'Daily Unique Visitors')
+}
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def publish_traffic_history(owner: str, repo_name: str, traffic_data: dict) -> int:
+    """Publishes each day of the GitHub traffic breakdown as a data point timestamped with that day
+
+    Days that were already published with the same counts are skipped, so each day is normally sent once, plus once more
+    for every hour its counts are still growing. All new or changed days are sent in one batch
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the repository the traffic data belongs to
+    :type repo_name: str
+    :param traffic_data: a mapping of the traffic endpoints (e.g. 'traffic/clones') to the data they returned
+    :type traffic_data: dict
+    :returns: the number of data points published
+    :rtype: int
+    """
+    state_key = 'traffic#' + owner + '/' + repo_name
+    published_days = state_store.get_state(state_key)
+    oldest_allowed = datetime.now(timezone.utc) - cw_interactions.MAX_METRIC_BACKDATE
+
+    metrics = []
+    current_days = {}
+    for endpoint, (breakdown_key, count_metric_name, uniques_metric_name) in TRAFFIC_ENDPOINTS.items():
+        if endpoint not in traffic_data or not isinstance(traffic_data[endpoint], dict):
+            continue
+
+        previous_counts = published_days.get(endpoint, {})
+        counts_by_day = {}
+        for day in traffic_data[endpoint].get(breakdown_key, []):
+            timestamp = datetime.strptime(day['timestamp'], TIME_FORMAT).replace(tzinfo=timezone.utc)
+            if timestamp < oldest_allowed:
+                continue
+
+            counts = [day['count'], day['uniques']]
+            counts_by_day[day['timestamp']] = counts
+            if previous_counts.get(day['timestamp']) != counts:
+                metrics.append(cw_interactions.new_metric(repo_name, count_metric_name, day['count'], timestamp))
+                metrics.append(cw_interactions.new_metric(repo_name, uniques_metric_name, day['uniques'], timestamp))
+        current_days[endpoint] = counts_by_day
+
+    if metrics:
+        cw_interactions.put_metrics_in_cloudwatch(metrics)
+        # Only the days inside GitHub's 14 day window are kept, so the state stays the same size
+        state_store.put_state(state_key, current_days)
+
+    print('Published %d daily traffic data points for %s' % (len(metrics), repo_name))
+    return len(metrics)
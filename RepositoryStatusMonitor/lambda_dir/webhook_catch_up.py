@@ -0,0 +1,113 @@
+import os
+
+import aws_clients
+import http_handler as hh
+import state_store
+import webhook_messages
+
+# The webhook event of each events API type the webhook handlers act on. The events API has no events for stars, and
+# the counters of the watch, fork and public events are polled by the daily reconcile
+EVENT_TYPES = {
+    'IssuesEvent': 'issues',
+    'PullRequestEvent': 'pull_request',
+    'ReleaseEvent': 'release',
+    'PushEvent': 'push'
+}
+# The events API returns at most 300 events of the last 90 days, in pages of up to 100
+EVENTS_PER_PAGE = 100
+MAX_EVENT_PAGES = 3
+
+
+def get_cursor_key(owner: str, repo_name: str) -> str:
+    """Returns the key of a repository's events cursor in the state table
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :rtype: str
+    """
+    return 'events-cursor#' + owner + '/' + repo_name
+
+
+def get_event_message(event: dict) -> dict:
+    """Builds the compact message of an event from the events API, as the mapping template builds it for the webhook
+    event
+
+    :param event: the event, as returned by the events API
+    :type event: dict
+    :returns: the compact message, without a delivery
+    :rtype: dict
+    """
+    owner, repo_name = event['repo']['name'].split('/')
+    payload = dict(event.get('payload') or {})
+    payload['repository'] = {'name': repo_name, 'owner': {'login': owner}}
+    # The push event's 'after' commit is the 'head' of the events API
+    payload.setdefault('after', payload.get('head'))
+    return webhook_messages.compact_payload(payload, event=EVENT_TYPES[event['type']])
+
+
+def fetch_missed_events(owner: str, repo_name: str) -> tuple:
+    """Retrieves the events of a repository from the events API that happened after its cursor
+
+    The first page is requested with the ETag of the last run's first page, so an hour without events costs one request
+    that doesn't count against the rate limit. Pages are requested until one reaches the cursor
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :returns: the compact messages of the missed events the webhook handlers act on, oldest first, and the cursor to save
+              once they are handled (None if it doesn't change)
+    :rtype: tuple
+    """
+    cursor = state_store.get_state(get_cursor_key(owner, repo_name))
+    last_event_id = int(cursor.get('last_event_id', 0))
+
+    token = aws_clients.get_client('secretsmanager').get_secret_value(SecretId='github_auth_token')['SecretString']
+    headers = {
+        'Authorization': 'token ' + token,
+        'Accept': 'application/vnd.github.v3+json',
+        'User-Agent': os.environ['user_agent_header']}
+    url = 'https://api.github.com/repos/' + owner + '/' + repo_name + '/events'
+
+    events = []
+    new_cursor = None
+    for page in range(1, MAX_EVENT_PAGES + 1):
+        http_fields = {'per_page': EVENTS_PER_PAGE, 'page': page}
+        success, http_data, response_headers = hh.request_if_modified(
+            url, cursor.get('etag') if page == 1 else None, headers=headers, http_fields=http_fields)
+        if not success:
+            # The events that were listed are caught up again on the next run
+            return [], None
+        if http_data is None:
+            break
+        if page == 1 and http_data:
+            new_cursor = {'etag': response_headers.get('ETag'), 'last_event_id': http_data[0]['id']}
+        if not last_event_id:
+            # Without a cursor, the events were handled through webhooks or happened before the repository was monitored
+            break
+
+        new_events = [event for event in http_data if int(event['id']) > last_event_id]
+        events.extend(new_events)
+        if len(new_events) < len(http_data) or len(http_data) < EVENTS_PER_PAGE:
+            break
+    else:
+        print('More than ' + str(MAX_EVENT_PAGES * EVENTS_PER_PAGE) + ' events of ' + owner + '/' + repo_name +
+              ' since the last catch-up, the oldest ones are no longer listed by GitHub')
+
+    messages = [get_event_message(event) for event in reversed(events) if event['type'] in EVENT_TYPES]
+    return [message for message in messages if webhook_messages.is_handled(message)], new_cursor
+
+
+def save_cursor(owner: str, repo_name: str, cursor: dict):
+    """Stores how far the events of a repository were caught up
+
+    :param owner: the owner of the repository
+    :type owner: str
+    :param repo_name: the name of the repository
+    :type repo_name: str
+    :param cursor: the ETag of the first page of events and the ID of the latest event
+    :type cursor: dict
+    """
+    state_store.put_state(get_cursor_key(owner, repo_name), cursor)
@@ -1,8 +1,7 @@
 import json
 import os
 
-import boto3
-
+import aws_clients
 import http_handler as hh
 
 
@@ -14,19 +13,20 @@ def handler(event, context):
     :param context: information provided by AWS Lambda about the invocation, function, and execution environment
     :type context: LambdaContext
     """
-    events = ['issues', 'pull_request', 'release', 'push']
+    events = ['issues', 'issue_comment', 'pull_request', 'pull_request_review', 'release', 'push', 'watch', 'star',
+              'fork', 'public']
+    github_headers = {
+        'Authorization': 'token ' + aws_clients.get_client('secretsmanager').get_secret_value(
+            SecretId='github_auth_token')['SecretString'],
+        'Accept': 'application/vnd.github.v3+json',
+        'Content-Type': 'application/json',
+        'User-Agent': os.environ['user_agent_header']
+    }
     for repo_name in os.environ['repo_names'].split(','):
         owner = os.environ['owner']
         if '/' in repo_name:
             [owner, repo_name] = repo_name.split('/')
         github_url = 'https://api.github.com/repos/' + owner + '/' + repo_name + '/hooks'
-        github_headers = {
-            'Authorization': 'token ' + boto3.client('secretsmanager').get_secret_value(SecretId='github_auth_token')[
-                'SecretString'],
-            'Accept': 'application/vnd.github.v3+json',
-            'Content-Type': 'application/json',
-            'User-Agent': os.environ['user_agent_header']
-        }
 
         payload = json.dumps({
             'active': True,
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import threading
+import uuid
+
+import state_store
+
+# How long a delivery is remembered, in seconds. GitHub redelivers for up to 3 days, and a message stays on the webhook
+# queue for at most its default retention of 4 days
+DELIVERY_TTL_SECONDS = 4 * 24 * 3600
+# How many deliveries a warm execution environment remembers before asking the state table
+MAX_REMEMBERED_DELIVERIES = 1000
+
+# Maps each delivery claimed by this execution environment to the holder it was claimed with, least recently used first
+remembered_deliveries = OrderedDict()
+remembered_deliveries_lock = threading.Lock()
+
+
+def get_delivery_key(delivery_id: str) -> str:
+    """Returns the key of a delivery in the state table
+
+    :param delivery_id: the 'X-GitHub-Delivery' header of the webhook event
+    :type delivery_id: str
+    :rtype: str
+    """
+    return 'delivery#' + delivery_id
+
+
+def remember_delivery(delivery_id: str, holder: str):
+    """Remembers a delivery in memory, forgetting the least recently used one when there are too many
+
+    Must be called with remembered_deliveries_lock held
+
+    :param delivery_id: the 'X-GitHub-Delivery' header of the webhook event
+    :type delivery_id: str
+    :param holder: the ID the delivery was claimed with
+    :type holder: str
+    """
+    remembered_deliveries[delivery_id] = holder
+    remembered_deliveries.move_to_end(delivery_id)
+    while len(remembered_deliveries) > MAX_REMEMBERED_DELIVERIES:
+        remembered_deliveries.popitem(last=False)
+
+
+def claim_delivery(delivery_id) -> bool:
+    """Claims a webhook delivery, so that only the first of its redeliveries and SQS duplicates is handled
+
+    Deliveries claimed recently by this execution environment are refused from memory. Others are claimed with a
+    conditional write to the state table, which only one invocation can win
+
+    :param delivery_id: the 'X-GitHub-Delivery' header of the webhook event, or None if the message doesn't have one
+    :type delivery_id: Optional[str]
+    :returns: whether the delivery should be handled, always True for messages without a delivery ID
+    :rtype: bool
+    """
+    if not delivery_id:
+        return True
+
+    holder = str(uuid.uuid4())
+    with remembered_deliveries_lock:
+        if delivery_id in remembered_deliveries:
+            remembered_deliveries.move_to_end(delivery_id)
+            return False
+        remember_delivery(delivery_id, holder)
+
+    claimed = False
+    try:
+        claimed = state_store.acquire_lease(get_delivery_key(delivery_id), holder, DELIVERY_TTL_SECONDS)
+    finally:
+        if not claimed:
+            # Another invocation has the delivery, and releases it again if it fails to handle it
+            with remembered_deliveries_lock:
+                remembered_deliveries.pop(delivery_id, None)
+    return claimed
+
+
+def release_delivery(delivery_id):
+    """Releases the claim on a delivery that couldn't be handled, so that SQS can retry it
+
+    :param delivery_id: the 'X-GitHub-Delivery' header of the webhook event, or None if the message doesn't have one
+    :type delivery_id: Optional[str]
+    """
+    if not delivery_id:
+        return
+
+    with remembered_deliveries_lock:
+        holder = remembered_deliveries.pop(delivery_id, None)
+    if holder:
+        state_store.release_lease(get_delivery_key(delivery_id), holder)
@@ -0,0 +1,81 @@
+import json
+
+import cloudwatch_interactions as cw_interactions
+import dashboards
+import handle_webhook_events
+import metric_refresh
+import webhook_deliveries
+import webhook_messages
+import widget_registry
+
+
+def handler(event, context):
+    """Called when a batch of webhook events from the SQS queue invokes the Lambda function
+
+    The function is packaged with only the modules the webhook path imports (see
+    webhook_messages.WEBHOOK_HANDLER_MODULES), so it starts quickly, and runs with its own concurrency, so bursts of
+    events don't compete with the hourly run
+
+    :param event: the SQS records of the batch
+    :type event: dict
+    :param context: information provided by AWS Lambda about the invocation, function, and execution environment
+    :type context: LambdaContext
+    :returns: the partial batch response listing the records that failed, so SQS only retries those
+    :rtype: dict
+    """
+    return handle_webhook_records(event['Records'])
+
+
+def handle_webhook_records(records: list) -> dict:
+    """Handles a batch of webhook events from the SQS queue, updating each dashboard the events change once
+
+    The metrics of an event are published once it is handled, so only the events that couldn't be handled are reported
+    as failures, and their retries don't publish any of their metrics twice. Retrying the events of a dashboard that
+    failed to update would count their activity again, and the widgets webhook events create are the same for every
+    event of a repository, so the next event puts them again. Widgets that are already on their dashboards aren't put
+    again, so most events only publish metrics. Redeliveries and duplicates of an event that was already handled,
+    whether it was delivered or caught up from the events API, are acknowledged without publishing anything
+
+    :param records: the SQS records of the batch
+    :type records: list
+    :returns: the partial batch response, listing the message IDs of the records that failed
+    :rtype: dict
+    """
+    print("Updating widgets for %d webhook events" % len(records))
+    widgets = {}
+    failed_message_ids = []
+    for record in records:
+        event_id = None
+        try:
+            message = json.loads(record['body'])
+            event_id = webhook_messages.get_claim_id(message)
+            if not webhook_deliveries.claim_delivery(event_id):
+                print('Skipped webhook event ' + event_id + ', it was already handled')
+                continue
+            # The metrics are only put once the event is handled, so that retrying an event that failed part of the
+            # way doesn't count the metrics it already published again
+            with cw_interactions.buffered_metrics(put_on_error=False):
+                webhook_widgets = handle_webhook_events.handle_webhook(message)
+        except Exception as error:
+            print('Failed to handle webhook event ' + record['messageId'] + ': ' + repr(error))
+            failed_message_ids.append(record['messageId'])
+            webhook_deliveries.release_delivery(event_id)
+            continue
+        try:
+            metric_refresh.request_refresh(message)
+        except Exception as error:
+            # The hourly run collects the fields anyway, so the event isn't retried
+            print('Failed to request a refresh for webhook event ' + record['messageId'] + ': ' + repr(error))
+        for dashboard_name, dashboard_widgets in (webhook_widgets or {}).items():
+            widgets.setdefault(dashboard_name, []).extend(dashboard_widgets)
+
+    unregistered_widgets = widget_registry.get_unregistered_widgets(widgets)
+    if widgets and not unregistered_widgets:
+        print('Widgets already on their dashboards, only metrics were published.')
+    else:
+        dashboard_results = dashboards.update_dashboards(unregistered_widgets)
+        failed_dashboards = dashboards.get_failed_dashboards(unregistered_widgets.keys(), dashboard_results)
+        widget_registry.register_widgets({dashboard_name: dashboard_widgets
+                                          for dashboard_name, dashboard_widgets in unregistered_widgets.items()
+                                          if dashboard_name not in failed_dashboards})
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
@@ -0,0 +1,214 @@
+import json
+
+# The API Gateway puts these fields on the webhook queue instead of GitHub's full payload. The mapping template and the
+# handling of the queued messages are both built from MESSAGE_FIELDS, so they cannot disagree on the message.
+# Maps each field of the message to the VTL expression that reads it from the webhook request. '$item' is the payload
+# key of the issue or pull request the event is about, and '$response' the path of the time a comment or review was
+# made, both set by the template from the 'X-GitHub-Event' header
+MESSAGE_FIELDS = {
+    'event': "$input.params('X-GitHub-Event')",
+    'delivery': "$input.params('X-GitHub-Delivery')",
+    'action': "$input.path('$.action')",
+    'repo_name': "$input.path('$.repository.name')",
+    'owner': "$input.path('$.repository.owner.login')",
+    'number': '$input.path("$.${item}.number")',
+    'created_at': '$input.path("$.${item}.created_at")',
+    'closed_at': '$input.path("$.${item}.closed_at")',
+    'author': '$input.path("$.${item}.user.login")',
+    'pull_request_url': "$input.path('$.issue.pull_request.url')",
+    'responded_at': '$input.path("$.${response}")',
+    'sender': "$input.path('$.sender.login')",
+    'sender_type': "$input.path('$.sender.type')",
+    'merged': "$input.path('$.pull_request.merged')",
+    'release_id': "$input.path('$.release.id')",
+    'published_at': "$input.path('$.release.published_at')",
+    'ref': "$input.path('$.ref')",
+    'head': "$input.path('$.after')",
+    'stargazers_count': "$input.path('$.repository.stargazers_count')",
+    'forks_count': "$input.path('$.repository.forks_count')"
+}
+
+# The webhook events the handlers act on, mapped to the values of the message fields they act on. Messages that don't
+# match are dropped by the filter criteria of the queue's event source, and ignored by handle_webhook()
+HANDLED_EVENTS = {
+    'issues': {'action': ['opened', 'closed']},
+    'pull_request': {'action': ['opened', 'closed']},
+    'issue_comment': {'action': ['created']},
+    'pull_request_review': {'action': ['submitted']},
+    'release': {'action': ['published']},
+    'push': {'ref': ['refs/heads/master']},
+    'watch': {'action': ['started']},
+    'star': {'action': ['created', 'deleted']},
+    'fork': {},
+    'public': {}
+}
+
+# The fields that identify what each event counts, the first one being the ID of the issue, pull request, release or
+# commit. Webhook deliveries and the events caught up from the events API have the same key, so each is counted once
+EVENT_KEY_FIELDS = {
+    'issues': ['number', 'action', 'created_at', 'closed_at'],
+    'pull_request': ['number', 'action', 'created_at', 'closed_at'],
+    'release': ['release_id', 'action', 'published_at'],
+    'push': ['head', 'ref']
+}
+
+# The GitHub event of each payload key, for payloads that reach the queue without the 'X-GitHub-Event' header. The first
+# key found decides, so comments and reviews come before the issue or pull request they are on
+PAYLOAD_KEY_EVENTS = {
+    'comment': 'issue_comment',
+    'review': 'pull_request_review',
+    'issue': 'issues',
+    'pull_request': 'pull_request',
+    'release': 'release',
+    'pusher': 'push',
+    'forkee': 'fork'
+}
+
+# The modules the webhook handler function is packaged with, the webhook_handler module and every module it imports.
+# The stack leaves the rest of lambda_dir out of its asset, e.g. the collection modules and the tests
+WEBHOOK_HANDLER_MODULES = [
+    'aws_clients',
+    'cloudwatch_interactions',
+    'dashboards',
+    'handle_webhook_events',
+    'http_handler',
+    'metric_refresh',
+    'release_history',
+    'repository_counters',
+    'response_markers',
+    'state_store',
+    'webhook_deliveries',
+    'webhook_handler',
+    'webhook_messages',
+    'widget_registry'
+]
+
+
+def get_request_template() -> str:
+    """Returns the mapping template that turns a webhook request into an SQS SendMessage request with a compact message
+
+    The template is kept on one line, as the SendMessage request is form encoded and a line break would become part of
+    the first parameter name. Values are JSON escaped and URL encoded, and fields missing from the payload are empty
+
+    :returns: the VTL mapping template
+    :rtype: str
+    """
+    template = "#set($item = 'issue')#set($response = 'comment.created_at')"
+    template += "#if($input.params('X-GitHub-Event') == 'pull_request' || " \
+                "$input.params('X-GitHub-Event') == 'pull_request_review')#set($item = 'pull_request')#end"
+    template += "#if($input.params('X-GitHub-Event') == 'pull_request_review')" \
+                "#set($response = 'review.submitted_at')#end"
+    for field, expression in MESSAGE_FIELDS.items():
+        template += '#set($' + field + ' = ' + expression + ')'
+
+    fields = ['"' + field + '":"#if($' + field + ')$util.urlEncode($util.escapeJavaScript("$' + field + '"))#end"'
+              for field in MESSAGE_FIELDS]
+    return template + 'Action=SendMessage&MessageBody={' + ','.join(fields) + '}'
+
+
+def compact_payload(payload: dict, event=None) -> dict:
+    """Builds the compact message of a full GitHub payload, as the mapping template does
+
+    Messages queued before the mapping template was deployed carry the full payload and no event
+
+    :param payload: the full payload of the webhook event
+    :type payload: dict
+    :param event: the name of the event, found from the keys of the payload if None (default is None)
+    :type event: Optional[str]
+    :returns: the compact message, with the same fields as the ones built by the mapping template
+    :rtype: dict
+    """
+    if event is None:
+        event = next((event for key, event in PAYLOAD_KEY_EVENTS.items() if key in payload), '')
+    item = payload.get('pull_request' if event in ['pull_request', 'pull_request_review'] else 'issue') or {}
+    response = payload.get('review') or {}
+    if event != 'pull_request_review':
+        response = {'submitted_at': (payload.get('comment') or {}).get('created_at')}
+    repository = payload.get('repository') or {}
+    sender = payload.get('sender') or {}
+    merged = (payload.get('pull_request') or {}).get('merged')
+
+    message = {
+        'event': event,
+        'delivery': '',
+        'action': payload.get('action'),
+        'repo_name': repository.get('name'),
+        'owner': (repository.get('owner') or {}).get('login'),
+        'number': item.get('number'),
+        'created_at': item.get('created_at'),
+        'closed_at': item.get('closed_at'),
+        'author': (item.get('user') or {}).get('login'),
+        'pull_request_url': ((payload.get('issue') or {}).get('pull_request') or {}).get('url'),
+        'responded_at': response.get('submitted_at'),
+        'sender': sender.get('login'),
+        'sender_type': sender.get('type'),
+        'merged': None if merged is None else str(merged).lower(),
+        'release_id': (payload.get('release') or {}).get('id'),
+        'published_at': (payload.get('release') or {}).get('published_at'),
+        'ref': payload.get('ref'),
+        'head': payload.get('after'),
+        'stargazers_count': repository.get('stargazers_count'),
+        'forks_count': repository.get('forks_count')
+    }
+    return {field: '' if message[field] is None else str(message[field]) for field in MESSAGE_FIELDS}
+
+
+def is_handled(message: dict) -> bool:
+    """Checks whether the handlers act on a webhook event
+
+    :param message: the compact message of the webhook event
+    :type message: dict
+    :rtype: bool
+    """
+    fields = HANDLED_EVENTS.get(message.get('event'))
+    if fields is None:
+        return False
+    return all(message.get(field) in values for field, values in fields.items())
+
+
+def get_event_key(message: dict):
+    """Returns the key that identifies what a webhook event counts, whether it was delivered or caught up
+
+    :param message: the compact message of the webhook event
+    :type message: dict
+    :returns: the key, or None if the event isn't counted or the message doesn't identify what it counts
+    :rtype: Optional[str]
+    """
+    fields = EVENT_KEY_FIELDS.get(message.get('event'))
+    if not fields or not message.get(fields[0]) or not message.get('repo_name'):
+        return None
+    return '#'.join([message['event'], message.get('owner', ''), message['repo_name']] +
+                    [str(message.get(field, '')) for field in fields])
+
+
+def get_claim_id(message: dict):
+    """Returns the ID a webhook event is claimed with before it is handled, so it is only handled once
+
+    :param message: the compact message of the webhook event
+    :type message: dict
+    :returns: the event's key (see get_event_key()), its 'X-GitHub-Delivery' header for events without a key, or None
+              if it has neither
+    :rtype: Optional[str]
+    """
+    return get_event_key(message) or message.get('delivery') or None
+
+
+def get_filter_criteria() -> dict:
+    """Returns the filter criteria of the webhook queue's event source, so that events the handlers don't act on never
+    invoke the function
+
+    An event source takes at most 5 filters, so the events that are filtered on the same fields share one filter with
+    the values of all of them. The few combinations that pass the filter without being handled, e.g. a deleted issue,
+    are ignored by handle_webhook()
+
+    :returns: the FilterCriteria of an AWS::Lambda::EventSourceMapping, one filter per set of filtered fields
+    :rtype: dict
+    """
+    patterns = {}
+    for event, fields in HANDLED_EVENTS.items():
+        pattern = patterns.setdefault(tuple(fields.keys()), {'event': []})
+        pattern['event'].append(event)
+        for field, values in fields.items():
+            pattern.setdefault(field, []).extend(value for value in values if value not in pattern.get(field, []))
+    return {'Filters': [{'Pattern': json.dumps({'body': pattern}, separators=(',', ':'))}
+                        for pattern in patterns.values()]}
@@ -0,0 +1,184 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import time
+
+import aws_clients
+import cloudwatch_interactions as cw_interactions
+import webhook_deliveries
+import webhook_messages
+
+# The most messages SQS returns for one ReceiveMessage request
+REDRIVE_BATCH_SIZE = 10
+# How many pollers receive and replay batches of the dead-letter queue at the same time
+REDRIVE_POLLERS = 4
+# How long a poller waits for messages before deciding the dead-letter queue is empty, in seconds
+REDRIVE_WAIT_SECONDS = 1
+# How long before the function times out the pollers stop receiving batches, in seconds, so the last ones can finish
+REDRIVE_TIME_MARGIN_SECONDS = 30
+
+REDRIVE_COUNTS = ['redriven', 'failed', 'skipped']
+
+
+def matches_filter(message: dict, repo_names: list, events: list) -> bool:
+    """Checks whether a webhook event is one of the events to redrive
+
+    :param message: the compact message of the webhook event
+    :type message: dict
+    :param repo_names: the repositories to redrive the events of, by name or as 'owner/repo_name', or empty for all
+    :type repo_names: list
+    :param events: the webhook events to redrive, e.g. 'pull_request', or empty for all
+    :type events: list
+    :rtype: bool
+    """
+    if events and message.get('event') not in events:
+        return False
+    if repo_names:
+        full_name = message.get('owner', '') + '/' + message.get('repo_name', '')
+        return message.get('repo_name') in repo_names or full_name in repo_names
+    return True
+
+
+def replay_batch(handle_records, queue_url: str, sqs_messages: list, repo_names: list, events: list) -> dict:
+    """Replays a batch of messages from the dead-letter queue as a batch of webhook events, with their metrics put in
+    CloudWatch together, and deletes the messages that were handled
+
+    Messages that don't match the filter or fail again stay on the queue
+
+    :param handle_records: the function that handles a batch of webhook events from the SQS queue
+    :type handle_records: Callable[[list], dict]
+    :param queue_url: the URL of the dead-letter queue
+    :type queue_url: str
+    :param sqs_messages: the messages received from the dead-letter queue
+    :type sqs_messages: list
+    :param repo_names: the repositories to redrive the events of, or empty for all
+    :type repo_names: list
+    :param events: the webhook events to redrive, or empty for all
+    :type events: list
+    :returns: how many events were redriven, failed again and didn't match the filter
+    :rtype: dict
+    """
+    counts = dict.fromkeys(REDRIVE_COUNTS, 0)
+    records = []
+    messages = []
+    for sqs_message in sqs_messages:
+        try:
+            message = json.loads(sqs_message['Body'])
+        except ValueError:
+            message = {}
+        if not isinstance(message, dict):
+            message = {}
+        if 'event' not in message:
+            message = webhook_messages.compact_payload(message)
+        if not matches_filter(message, repo_names, events):
+            counts['skipped'] += 1
+            continue
+        records.append({'messageId': sqs_message['MessageId'], 'receiptHandle': sqs_message['ReceiptHandle'],
+                        'body': sqs_message['Body']})
+        messages.append(message)
+    if not records:
+        return counts
+
+    try:
+        with cw_interactions.buffered_metrics():
+            response = handle_records(records)
+    except Exception as error:
+        print('Failed to put the metrics of %d redriven webhook events: %r' % (len(records), error))
+        # The events stay on the queue, and are handled again by the next redrive
+        for message in messages:
+            webhook_deliveries.release_delivery(webhook_messages.get_claim_id(message))
+        counts['failed'] += len(records)
+        return counts
+
+    failed_message_ids = {failure['itemIdentifier'] for failure in response['batchItemFailures']}
+    handled_records = [record for record in records if record['messageId'] not in failed_message_ids]
+    counts['failed'] += len(failed_message_ids)
+    counts['redriven'] += len(handled_records)
+    if handled_records:
+        delete_response = aws_clients.get_client('sqs').delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': record['messageId'], 'ReceiptHandle': record['receiptHandle']} for record in handled_records])
+        for failure in delete_response.get('Failed', []):
+            # The event was handled, so redriving it again skips it as a duplicate
+            print('Could not delete redriven webhook event ' + failure['Id'] + ': ' + failure.get('Message', ''))
+    return counts
+
+
+def poll_dead_letter_queue(handle_records, queue_url: str, repo_names: list, events: list, deadline: float) -> dict:
+    """Receives and replays batches of the dead-letter queue until it is empty or the deadline passes
+
+    Received messages stay invisible until after the deadline, so messages that don't match the filter or fail again
+    aren't received twice by the same redrive
+
+    :param handle_records: the function that handles a batch of webhook events from the SQS queue
+    :type handle_records: Callable[[list], dict]
+    :param queue_url: the URL of the dead-letter queue
+    :type queue_url: str
+    :param repo_names: the repositories to redrive the events of, or empty for all
+    :type repo_names: list
+    :param events: the webhook events to redrive, or empty for all
+    :type events: list
+    :param deadline: the time.monotonic() after which no more batches are received
+    :type deadline: float
+    :returns: how many events were redriven, failed again and didn't match the filter, and whether the deadline passed
+              before the queue was empty
+    :rtype: dict
+    """
+    counts = dict.fromkeys(REDRIVE_COUNTS, 0)
+    counts['more'] = False
+    while True:
+        remaining_seconds = deadline - time.monotonic()
+        if remaining_seconds <= 0:
+            counts['more'] = True
+            return counts
+
+        response = aws_clients.get_client('sqs').receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=REDRIVE_BATCH_SIZE,
+            WaitTimeSeconds=REDRIVE_WAIT_SECONDS,
+            VisibilityTimeout=math.ceil(remaining_seconds) + REDRIVE_TIME_MARGIN_SECONDS)
+        sqs_messages = response.get('Messages', [])
+        if not sqs_messages:
+            return counts
+
+        batch_counts = replay_batch(handle_records, queue_url, sqs_messages, repo_names, events)
+        for name in REDRIVE_COUNTS:
+            counts[name] += batch_counts[name]
+
+
+def redrive_dead_letter_queue(handle_records, options: dict, remaining_seconds: float) -> dict:
+    """Replays the webhook events that failed too often and were moved to the dead-letter queue
+
+    Several pollers receive batches at the same time, and each batch is handled like a batch from the webhook queue, so
+    events that were already handled are skipped. Only the events that were handled are deleted from the queue
+
+    :param handle_records: the function that handles a batch of webhook events from the SQS queue
+    :type handle_records: Callable[[list], dict]
+    :param options: the optional 'repo_names' and 'events' lists to only redrive the events of some repositories or
+                    some webhook events
+    :type options: dict
+    :param remaining_seconds: how long the function can run before it times out
+    :type remaining_seconds: float
+    :returns: how many events were redriven, failed again and didn't match the filter, and whether events may be left
+              to redrive in another invocation
+    :rtype: dict
+    """
+    repo_names = options.get('repo_names') or []
+    events = options.get('events') or []
+    start = time.monotonic()
+    deadline = start + remaining_seconds - REDRIVE_TIME_MARGIN_SECONDS
+
+    with ThreadPoolExecutor(max_workers=REDRIVE_POLLERS) as executor:
+        poller_counts = list(executor.map(
+            lambda poller: poll_dead_letter_queue(handle_records, os.environ['dead_letter_queue_url'], repo_names,
+                                                  events, deadline),
+            range(REDRIVE_POLLERS)))
+
+    counts = {name: sum(poller[name] for poller in poller_counts) for name in REDRIVE_COUNTS}
+    counts['more'] = any(poller['more'] for poller in poller_counts)
+    elapsed_seconds = time.monotonic() - start
+    print('Redrove %d webhook events in %.1f seconds (%.1f events per second), %d failed again and %d did not match '
+          'the filter' % (counts['redriven'], elapsed_seconds, counts['redriven'] / max(elapsed_seconds, 0.001),
+                          counts['failed'], counts['skipped']))
+    return counts
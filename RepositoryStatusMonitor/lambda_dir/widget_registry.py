@@ -0,0 +1,95 @@
+import hashlib
+import json
+import time
+
+import cloudwatch_interactions as cw_interactions
+import state_store
+
+# How long a widget is trusted to still be on its dashboard, in seconds. After that it is put again, which restores
+# widgets that were removed from the dashboard by hand
+REGISTRY_TTL_SECONDS = 24 * 3600
+# How long a widget read from the state table is remembered in memory, in seconds
+CACHE_TTL_SECONDS = 15 * 60
+
+# Maps the registry key of each widget known to be on its dashboard to its fingerprint and the time it is remembered
+# until, kept for as long as the execution environment is reused
+registry_cache = {}
+
+
+def get_registry_key(dashboard_name: str, widget: dict):
+    """Returns the key of a widget in the registry
+
+    :param dashboard_name: the name of the dashboard the widget is on
+    :type dashboard_name: str
+    :param widget: the widget
+    :type widget: dict
+    :returns: the key, or None if the widget has no identity (see cw_interactions.widget_identity())
+    :rtype: Optional[str]
+    """
+    identity = cw_interactions.widget_identity(widget)
+    if identity is None:
+        return None
+    return 'widget#' + dashboard_name + '#' + identity[0] + '#' + identity[1]
+
+
+def get_widget_fingerprint(widget: dict) -> str:
+    """Returns a fingerprint of the definition of a widget, so a widget whose definition changes is put again
+
+    :param widget: the widget
+    :type widget: dict
+    :returns: the hex digest of the SHA-256 hash of the canonical JSON of the widget
+    :rtype: str
+    """
+    return hashlib.sha256(json.dumps(widget, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def is_registered(registry_key: str, fingerprint: str) -> bool:
+    """Checks whether the widget was put on its dashboard with the same definition, in memory first
+
+    :param registry_key: the key of the widget in the registry
+    :type registry_key: str
+    :param fingerprint: the fingerprint of the widget's current definition
+    :type fingerprint: str
+    :rtype: bool
+    """
+    cached = registry_cache.get(registry_key)
+    if cached and time.monotonic() < cached[1]:
+        return cached[0] == fingerprint
+
+    registered_fingerprint = state_store.get_state(registry_key).get('fingerprint')
+    if registered_fingerprint:
+        registry_cache[registry_key] = (registered_fingerprint, time.monotonic() + CACHE_TTL_SECONDS)
+    return registered_fingerprint == fingerprint
+
+
+def get_unregistered_widgets(dashboard_widget_mapping: dict) -> dict:
+    """Leaves out the widgets that are already on their dashboards with the same definition
+
+    :param dashboard_widget_mapping: a mapping of the dashboard name to its list of widgets
+    :type dashboard_widget_mapping: dict
+    :returns: a mapping of the dashboard name to the widgets that need to be put, without dashboards that need none
+    :rtype: dict
+    """
+    unregistered_widgets = {}
+    for dashboard_name, widgets in dashboard_widget_mapping.items():
+        for widget in widgets:
+            registry_key = get_registry_key(dashboard_name, widget)
+            if registry_key is None or not is_registered(registry_key, get_widget_fingerprint(widget)):
+                unregistered_widgets.setdefault(dashboard_name, []).append(widget)
+    return unregistered_widgets
+
+
+def register_widgets(dashboard_widget_mapping: dict):
+    """Records that the widgets were put on their dashboards
+
+    :param dashboard_widget_mapping: a mapping of the dashboard name to the list of widgets that were put
+    :type dashboard_widget_mapping: dict
+    """
+    for dashboard_name, widgets in dashboard_widget_mapping.items():
+        for widget in widgets:
+            registry_key = get_registry_key(dashboard_name, widget)
+            if registry_key is None:
+                continue
+            fingerprint = get_widget_fingerprint(widget)
+            state_store.put_state(registry_key, {'fingerprint': fingerprint}, ttl_seconds=REGISTRY_TTL_SECONDS)
+            registry_cache[registry_key] = (fingerprint, time.monotonic() + CACHE_TTL_SECONDS)
@@ -1,11 +1,19 @@
 #! /usr/bin/env python3
 
+import sys
+
 from colorama import init as colorama_init
 
 import launch_functions.launch_functions as lf
 
 colorama_init()
 
+arguments = lf.parse_arguments()
+if arguments.redrive:
+    lf.print_header("*** REDRIVING WEBHOOK EVENTS ***")
+    lf.redrive_dead_letter_queue(arguments.redrive_repos, arguments.redrive_events)
+    sys.exit()
+
 lf.print_header("*** LAUNCHING OPEN SOURCE DASHBOARD ***")
 
 interactive = lf.check_interactive()
@@ -52,3 +60,9 @@ lf.deploy(github_token)
 
 lf.print_section_header("CREATING WEBHOOKS ... ")
 lf.invoke_webhook_creator()
+
+lf.print_section_header("RECONCILING DASHBOARDS ... ")
+lf.invoke_dashboard_reconcile()
+
+lf.print_section_header("BACKFILLING HISTORY ... ")
+lf.invoke_history_backfill()
@@ -70,15 +70,30 @@ def print_cyan(content: str):
     print(Fore.CYAN + content + Fore.RESET)
 
 
+def parse_arguments() -> argparse.Namespace:
+    """Parses the flags of the launch script
+
+    :returns: the parsed flags
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Argument parser for launch.py')
+    parser.add_argument('--d', action='store_true', help='This flag disables interactive mode')
+    parser.add_argument('--redrive', action='store_true',
+                        help='This flag replays the webhook events of the dead-letter queue instead of launching')
+    parser.add_argument('--redrive-repos', default='',
+                        help='The comma-separated repositories to replay the webhook events of, all if left empty')
+    parser.add_argument('--redrive-events', default='',
+                        help='The comma-separated webhook events to replay, e.g. pull_request, all if left empty')
+    return parser.parse_args()
+
+
 def check_interactive() -> bool:
     """Checks the --d flag to see if the launch script should be interactive or not
 
     :returns: a boolean that represents whether the launch script should be interactive or not
     :rtype: bool
     """
-    parser = argparse.ArgumentParser(description='Argument parser for launch.py')
-    parser.add_argument('--d', action='store_true', help='This flag disables interactive mode')
-    return not parser.parse_args().d
+    return not parse_arguments().d
 
 
 def get_context_variables(context_vars: list) -> dict:
@@ -257,6 +272,62 @@ def invoke_webhook_creator():
     run_command('rm response.json', True, print_command=False, print_success=False)
 
 
+def invoke_dashboard_reconcile():
+    """Invokes the MetricsHandler Lambda function asynchronously to collect the metrics and reconcile the dashboards"""
+    with open('reconcile_event.json', 'w') as json_file:
+        json.dump({'reconcile': True}, json_file)
+
+    # fileb:// passes the payload as is to both versions of the AWS CLI
+    invoke_lambda_command = ('aws lambda invoke --function-name MetricsHandler --invocation-type Event '
+                             '--payload fileb://reconcile_event.json response.json')
+    print('\nReconciling dashboards 📊 📊 📊 ')
+    run_command(invoke_lambda_command, True)
+    run_command('rm response.json reconcile_event.json', True, print_command=False, print_success=False)
+
+
+def invoke_history_backfill():
+    """Invokes the HistoryBackfill Lambda function asynchronously, since a backfill can take longer than a deployment"""
+    invoke_lambda_command = 'aws lambda invoke --function-name HistoryBackfill --invocation-type Event response.json'
+    print('\nBackfilling star and fork history 📈 📈 📈 ')
+    run_command(invoke_lambda_command, True)
+    run_command('rm response.json', True, print_command=False, print_success=False)
+
+
+def redrive_dead_letter_queue(repo_names: str, events: str):
+    """Invokes the MetricsHandler Lambda function to replay the webhook events of the dead-letter queue, again for as
+    long as it runs out of time before every event was tried
+
+    :param repo_names: the comma-separated repositories to replay the events of, or empty for all
+    :type repo_names: str
+    :param events: the comma-separated webhook events to replay, or empty for all
+    :type events: str
+    """
+    with open('redrive_event.json', 'w') as json_file:
+        json.dump({'redrive': {'repo_names': [name for name in repo_names.split(',') if name],
+                               'events': [event for event in events.split(',') if event]}}, json_file)
+
+    # A redrive runs for up to the function's timeout, longer than the CLI waits for a response by default
+    invoke_lambda_command = ('aws lambda invoke --function-name MetricsHandler --cli-read-timeout 0 '
+                             '--payload fileb://redrive_event.json response.json')
+    print('\nRedriving webhook events 🔁 🔁 🔁 ')
+    totals = {'redriven': 0, 'failed': 0, 'skipped': 0}
+    more = True
+    while more:
+        run_command(invoke_lambda_command, True, print_success=False)
+        with open('response.json') as json_file:
+            counts = json.load(json_file)
+        if 'errorMessage' in counts:
+            print_red('\tThe redrive failed: ' + counts['errorMessage'])
+            break
+        for name in totals:
+            totals[name] += counts[name]
+        more = counts['more']
+    run_command('rm response.json redrive_event.json', True, print_command=False, print_success=False)
+
+    print_green('\tRedrove %d webhook events, %d failed again and %d did not match the filter' %
+                (totals['redriven'], totals['failed'], totals['skipped']))
+
+
 def verify_context_variables(variables: dict, context_variables: list, non_empty_context_vars: list, questions: dict,
                              config_values: list) -> dict:
     """Presents the context variables to the user for approval and updates them in `cdk.json` accordingly
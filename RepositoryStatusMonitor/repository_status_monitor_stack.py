@@ -2,16 +2,17 @@ from sys import stderr
 
 from aws_cdk import (
     aws_apigateway as apigw,
+    aws_dynamodb as dynamodb,
     aws_events as events,
     aws_events_targets as targets,
     aws_iam as iam,
     aws_lambda as _lambda,
-    aws_lambda_event_sources as lambda_event_source,
     aws_sqs as sqs,
     core
 )
 
 from lambda_dir import http_handler as hh
+from lambda_dir import webhook_messages
 
 
 class RepositoryStatusMonitorStack(core.Stack):
@@ -23,8 +24,9 @@ class RepositoryStatusMonitorStack(core.Stack):
     -------
     create_role_and_policy()
         Creates an AWS IAM role, attaches a custom policy to it, and returns the role
-    create_event_with_permissions(lambda_function: _lambda.Function)
-        Creates an AWS EventBridge rule and attaches the AWS Lambda function parameter as a target
+    create_event_with_permissions(lambda_function: _lambda.Function, rule_id: str, rule_name: str, schedule: str,
+                                  event_input: dict)
+        Creates a scheduled AWS EventBridge rule and attaches the AWS Lambda function parameter as a target
     handle_parameters()
         Retrieves all context variables, checks for valid input, performs all necessary processing, and returns a dictionary of the processed variables
     validate_repo_names(repo_names: str)
@@ -58,6 +60,32 @@ class RepositoryStatusMonitorStack(core.Stack):
         lambda_timeout = 300
         if self.node.try_get_context('lambda_timeout'):
             lambda_timeout = int(self.node.try_get_context('lambda_timeout'))
+        # how many webhook events the metric handler receives at once, and how long SQS waits to fill a batch
+        webhook_batch_size = 10
+        if self.node.try_get_context('webhook_batch_size'):
+            webhook_batch_size = int(self.node.try_get_context('webhook_batch_size'))
+        webhook_batching_window = 0
+        if self.node.try_get_context('webhook_batching_window'):
+            webhook_batching_window = int(self.node.try_get_context('webhook_batching_window'))
+        if webhook_batch_size > 10 and webhook_batching_window < 1:
+            raise ValueError('Need to specify a webhook batching window of at least 1 second for batches of more than '
+                             '10 webhook events.')
+        # the webhook handler runs separately from the hourly run, with its own timeout, memory and reserved concurrency
+        webhook_handler_timeout = 60
+        if self.node.try_get_context('webhook_handler_timeout'):
+            webhook_handler_timeout = int(self.node.try_get_context('webhook_handler_timeout'))
+        webhook_handler_memory = 256
+        if self.node.try_get_context('webhook_handler_memory'):
+            webhook_handler_memory = int(self.node.try_get_context('webhook_handler_memory'))
+        # reserved concurrency is taken from the account's unreserved concurrency, so it is only set when asked for
+        webhook_handler_concurrency = None
+        if self.node.try_get_context('webhook_handler_concurrency'):
+            webhook_handler_concurrency = int(self.node.try_get_context('webhook_handler_concurrency'))
+        if webhook_handler_timeout > lambda_timeout:
+            raise ValueError('Need to specify a webhook handler timeout no longer than the Lambda timeout, which the '
+                             'webhook queue waits for before retrying an event.')
+        if webhook_handler_concurrency is not None and webhook_handler_concurrency < 1:
+            raise ValueError('Need to specify a reserved concurrency of at least 1 for the webhook handler.')
 
         dead_letter_queue = sqs.Queue(
             self, 'DeadLetterQueue',
@@ -71,7 +99,46 @@ class RepositoryStatusMonitorStack(core.Stack):
                 max_receive_count=3,
                 queue=dead_letter_queue)
         )
-        metric_handler_dict['queue_url'] = webhook_queue.queue_url
+        # The metric handler replays the webhook events of the dead-letter queue when it is invoked with 'redrive' set
+        metric_handler_dict['dead_letter_queue_url'] = dead_letter_queue.queue_url
+        # Webhook events send jobs to collect the metrics they change again, without waiting for the hourly run. A job
+        # that keeps failing is dropped after an hour, since the hourly run has collected its metrics by then
+        refresh_queue = sqs.Queue(
+            self, 'RefreshQueue',
+            queue_name='RefreshQueue',
+            visibility_timeout=core.Duration.seconds(lambda_timeout),
+            retention_period=core.Duration.hours(1)
+        )
+        metric_handler_dict['refresh_queue_url'] = refresh_queue.queue_url
+
+        # Small pieces of state that must survive between invocations, e.g. which days of traffic are published
+        state_table = dynamodb.Table(
+            self, 'StateTable',
+            table_name='RepositoryStatusMonitorState',
+            partition_key=dynamodb.Attribute(name='state_key', type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute='expires_at',
+            removal_policy=core.RemovalPolicy.DESTROY
+        )
+        metric_handler_dict['state_table_name'] = state_table.table_name
+
+        # Renders the text widgets of the dashboards when they are viewed, from the snapshots the metric handler stores
+        text_widget_renderer_role = self.create_lambda_role_and_policy('TextWidgetRendererRole', ['dynamodb:GetItem'])
+        text_widget_renderer_function = _lambda.Function(
+            self, 'TextWidgetRenderer',
+            function_name='TextWidgetRenderer',
+            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.asset('lambda_dir'),
+            handler='text_widget_renderer.handler',
+            role=text_widget_renderer_role,
+            environment={
+                'state_table_name': state_table.table_name,
+                'repo_names': metric_handler_dict['repo_names'],
+                'owner': metric_handler_dict['owner']
+            },
+            timeout=core.Duration.seconds(10)
+        )
+        metric_handler_dict['text_widget_renderer_arn'] = text_widget_renderer_function.function_arn
 
         metric_handler_management_role = self.create_lambda_role_and_policy(
             'MetricHandlerManagementRole',
@@ -81,6 +148,9 @@ class RepositoryStatusMonitorStack(core.Stack):
                 'cloudwatch:ListDashboards',
                 'cloudwatch:PutDashboard',
                 'cloudwatch:PutMetricData',
+                'dynamodb:DeleteItem',
+                'dynamodb:GetItem',
+                'dynamodb:PutItem',
                 'logs:CreateLogGroup',
                 'logs:CreateLogStream',
                 'logs:PutLogEvents',
@@ -99,10 +169,69 @@ class RepositoryStatusMonitorStack(core.Stack):
             timeout=core.Duration.seconds(metric_handler_timeout)
         )
         self.create_event_with_permissions(metric_handler_function)
+        # The hourly run only reconciles the dashboards when their widgets change, the daily run also repairs dashboards
+        # that were edited or deleted by hand
+        self.create_event_with_permissions(metric_handler_function, 'ReconcileRule', 'DailyDashboardReconcile',
+                                           'rate(1 day)', {'reconcile': True})
+
+        # Handles the webhook events, packaged with only the modules the webhook path imports so it starts quickly
+        webhook_handler_role = self.create_lambda_role_and_policy(
+            'WebhookHandlerRole',
+            [
+                'cloudwatch:GetDashboard',
+                'cloudwatch:ListDashboards',
+                'cloudwatch:PutDashboard',
+                'cloudwatch:PutMetricData',
+                'dynamodb:DeleteItem',
+                'dynamodb:GetItem',
+                'dynamodb:PutItem',
+                'logs:CreateLogGroup',
+                'logs:CreateLogStream',
+                'logs:PutLogEvents',
+                'secretsmanager:GetSecretValue'
+            ]
+        )
+        webhook_handler_function = _lambda.Function(
+            self, 'WebhookHandler',
+            function_name='WebhookHandler',
+            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.from_asset('lambda_dir', exclude=['*'] + [
+                '!' + module + '.py' for module in webhook_messages.WEBHOOK_HANDLER_MODULES]),
+            handler='webhook_handler.handler',
+            role=webhook_handler_role,
+            environment=metric_handler_dict,
+            memory_size=webhook_handler_memory,
+            reserved_concurrent_executions=webhook_handler_concurrency,
+            timeout=core.Duration.seconds(webhook_handler_timeout)
+        )
 
         # Connect SQS to Lambda
-        sqs_event_source = lambda_event_source.SqsEventSource(webhook_queue)
-        metric_handler_function.add_event_source(sqs_event_source)
+        webhook_queue.grant_consume_messages(webhook_handler_function)
+        dead_letter_queue.grant_consume_messages(metric_handler_function)
+        webhook_event_source = _lambda.EventSourceMapping(
+            self, 'WebhookQueueEventSource',
+            target=webhook_handler_function,
+            event_source_arn=webhook_queue.queue_arn,
+            batch_size=webhook_batch_size,
+            max_batching_window=core.Duration.seconds(webhook_batching_window)
+        )
+        # The handler reports the events of a batch that failed, so SQS only retries those instead of the whole batch
+        webhook_event_source.node.default_child.add_property_override('FunctionResponseTypes',
+                                                                      ['ReportBatchItemFailures'])
+        # Events the handlers don't act on, e.g. labeled issues or pushes to other branches, never invoke the function
+        webhook_event_source.node.default_child.add_property_override('FilterCriteria',
+                                                                      webhook_messages.get_filter_criteria())
+        refresh_queue.grant_send_messages(webhook_handler_function)
+        refresh_queue.grant_send_messages(metric_handler_function)
+        refresh_queue.grant_consume_messages(metric_handler_function)
+        refresh_event_source = _lambda.EventSourceMapping(
+            self, 'RefreshQueueEventSource',
+            target=metric_handler_function,
+            event_source_arn=refresh_queue.queue_arn,
+            batch_size=10
+        )
+        refresh_event_source.node.default_child.add_property_override('FunctionResponseTypes',
+                                                                      ['ReportBatchItemFailures'])
 
         apigw_webhook_url = self.create_and_integrate_apigw(webhook_queue, metric_handler_dict['dashboard_name_prefix'])
         webhook_creator_dict['apigw_endpoint'] = apigw_webhook_url
@@ -119,6 +248,39 @@ class RepositoryStatusMonitorStack(core.Stack):
             timeout=core.Duration.seconds(5)
         )
 
+        history_backfill_dict = {
+            'repo_names': metric_handler_dict['repo_names'],
+            'owner': metric_handler_dict['owner'],
+            'user_agent_header': metric_handler_dict['user_agent_header'],
+            'namespace': metric_handler_dict['namespace'],
+            'github_fields_unpaginated': metric_handler_dict['github_fields_unpaginated'],
+            'state_table_name': state_table.table_name
+        }
+        history_backfill_role = self.create_lambda_role_and_policy(
+            'HistoryBackfillRole',
+            [
+                'cloudwatch:PutMetricData',
+                'dynamodb:DeleteItem',
+                'dynamodb:GetItem',
+                'dynamodb:PutItem',
+                'lambda:InvokeFunction',
+                'secretsmanager:GetSecretValue'
+            ]
+        )
+        history_backfill_function = _lambda.Function(
+            self, 'HistoryBackfill',
+            function_name='HistoryBackfill',
+            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.asset('lambda_dir'),
+            handler='history_backfill.handler',
+            role=history_backfill_role,
+            environment=history_backfill_dict,
+            # The longest timeout Lambda allows, a backfill that needs longer continues in a new invocation
+            timeout=core.Duration.minutes(15)
+        )
+        # Repositories that are already backfilled are skipped, so the hourly run only continues unfinished backfills
+        self.create_event_with_permissions(history_backfill_function, 'HistoryBackfillRule', 'HourlyHistoryBackfill')
+
     def create_lambda_role_and_policy(self, name: str, actions: list) -> iam.Role:
         """Creates an AWS IAM role, attaches a managed and a custom policy to it, and returns the role 
 
@@ -143,19 +305,30 @@ class RepositoryStatusMonitorStack(core.Stack):
         ))
         return role
 
-    def create_event_with_permissions(self, lambda_function: _lambda.Function) -> None:
-        """Creates an AWS EventBridge rule and attaches the AWS Lambda function parameter as a target
+    def create_event_with_permissions(self, lambda_function: _lambda.Function, rule_id='Rule',
+                                      rule_name='HourlyMetricRetrieval', schedule='rate(1 hour)',
+                                      event_input=None) -> None:
+        """Creates a scheduled AWS EventBridge rule and attaches the AWS Lambda function parameter as a target
 
         :param lambda_function: the AWS Lambda function for which to create the rule
         :type lambda_function: aws_cdk.aws_lambda.Function
+        :param rule_id: the ID of the rule (default is "Rule")
+        :type rule_id: Optional[str]
+        :param rule_name: the name of the rule (default is "HourlyMetricRetrieval")
+        :type rule_name: Optional[str]
+        :param schedule: the schedule expression of the rule (default is "rate(1 hour)")
+        :type schedule: Optional[str]
+        :param event_input: the event to invoke the function with (default is None, which sends the EventBridge event)
+        :type event_input: Optional[dict]
         """
-        hourly_metric_retrieval_rule = events.Rule(
-            self, 'Rule',
-            rule_name='HourlyMetricRetrieval',
+        rule = events.Rule(
+            self, rule_id,
+            rule_name=rule_name,
             enabled=True,
-            schedule=events.Schedule.expression('rate(1 hour)')
+            schedule=events.Schedule.expression(schedule)
         )
-        hourly_metric_retrieval_rule.add_target(targets.LambdaFunction(lambda_function))
+        target_input = events.RuleTargetInput.from_object(event_input) if event_input is not None else None
+        rule.add_target(targets.LambdaFunction(lambda_function, event=target_input))
 
     def handle_parameters(self) -> tuple:
         """Retrieves all context variables, checks for valid input, performs all necessary processing, and returns a dictionary of the processed variables
@@ -178,6 +351,20 @@ class RepositoryStatusMonitorStack(core.Stack):
         widgets = self.node.try_get_context('widgets') if self.node.try_get_context('widgets') is not None else ""
         default_metric_widget_name = self.node.try_get_context('default_metric_widget_name')
         default_text_widget_name = self.node.try_get_context('default_text_widget_name')
+        traffic_history = self.node.try_get_context('traffic_history') if self.node.try_get_context(
+            'traffic_history') is not None else "n"
+        shared_details_dashboard = self.node.try_get_context('shared_details_dashboard') if self.node.try_get_context(
+            'shared_details_dashboard') is not None else "n"
+        search_widgets = self.node.try_get_context('search_widgets') if self.node.try_get_context(
+            'search_widgets') is not None else "n"
+        rollup_metrics = self.node.try_get_context('rollup_metrics') if self.node.try_get_context(
+            'rollup_metrics') is not None else ""
+        repo_groups = self.node.try_get_context('repo_groups') if self.node.try_get_context(
+            'repo_groups') is not None else ""
+        custom_text_widgets = self.node.try_get_context('custom_text_widgets') if self.node.try_get_context(
+            'custom_text_widgets') is not None else "n"
+        webhook_catch_up = self.node.try_get_context('webhook_catch_up') if self.node.try_get_context(
+            'webhook_catch_up') is not None else "y"
 
         if not self.node.try_get_context('github_token'):
             raise ValueError('Need to specify GitHub token.')
@@ -212,7 +399,14 @@ class RepositoryStatusMonitorStack(core.Stack):
             'user_agent_header': user_agent_header,
             'widgets': widgets,
             'default_metric_widget_name': default_metric_widget_name,
-            'default_text_widget_name': default_text_widget_name
+            'default_text_widget_name': default_text_widget_name,
+            'traffic_history': traffic_history,
+            'shared_details_dashboard': shared_details_dashboard,
+            'search_widgets': search_widgets,
+            'rollup_metrics': rollup_metrics,
+            'repo_groups': repo_groups,
+            'custom_text_widgets': custom_text_widgets,
+            'webhook_catch_up': webhook_catch_up
         }
 
         webhook_creator_dict = {
@@ -268,7 +462,8 @@ class RepositoryStatusMonitorStack(core.Stack):
         return ','.join(valid_names)
 
     def create_and_integrate_apigw(self, queue: sqs.Queue, dashboard_name_prefix: str) -> str:
-        """Creates API Gateway and integrates with SQS queue
+        """Creates API Gateway and integrates with SQS queue, which only receives the fields of each webhook event that
+        the MetricsHandler function reads
 
         :param queue: the SQS queue to integrate with
         :type queue: aws_cdk.aws_sqs.Queue
@@ -300,7 +495,7 @@ class RepositoryStatusMonitorStack(core.Stack):
         apigw_integration_options = apigw.IntegrationOptions(
             credentials_role=webhook_apigw_role,
             integration_responses=[apigw_integration_response],
-            request_templates={'application/json': 'Action=SendMessage&MessageBody=$input.body'},
+            request_templates={'application/json': webhook_messages.get_request_template()},
             passthrough_behavior=apigw.PassthroughBehavior.NEVER,
             request_parameters={'integration.request.header.Content-Type': "'application/x-www-form-urlencoded'"}
         )
@@ -1,32 +1,37 @@
 import json
 import subprocess
+from unittest.mock import patch
 
 import pytest
 from aws_cdk import core
 
+from lambda_dir import webhook_messages
 from repository_status_monitor_stack import RepositoryStatusMonitorStack
 
 
+def get_context(github):
+    return {
+        'github_token': github,
+        'repo_names': 'aws-node-termination-handler',
+        'dashboard_name_prefix': 'test-dash',
+        'get_docker': 'y',
+        'github_fields_unpaginated': 'Stars,stargazers_count;Forks,forks_count;Open Issues,open_issues_count;Watchers,subscribers_count',
+        'github_fields_paginated': 'Open Pull Requests,pulls',
+        'docker_fields': 'Pull Count,pull_count',
+        'owner': 'aws',
+        'namespace': 'open-source-dashboard',
+        'user_agent_header': 'OpenSourceDashboard',
+        'default_metric_widget_name': 'default_metric_widget_name',
+        'default_text_widget_name': 'default_text_widget_name'
+    }
+
+
 def retrieve_template(github):
     try:
         with open('tests/template.json') as json_file:
             return json.dumps(json.load(json_file), indent=4, sort_keys=True)
     except FileNotFoundError:
-        context = {
-            'github_token': github,
-            'repo_names': 'aws-node-termination-handler',
-            'dashboard_name_prefix': 'test-dash',
-            'get_docker': 'y',
-            'github_fields_unpaginated': 'Stars,stargazers_count;Forks,forks_count;Open Issues,open_issues_count;Watchers,subscribers_count',
-            'github_fields_paginated': 'Open Pull Requests,pulls',
-            'docker_fields': 'Pull Count,pull_count',
-            'owner': 'aws',
-            'namespace': 'open-source-dashboard',
-            'user_agent_header': 'OpenSourceDashboard',
-            'default_metric_widget_name': 'default_metric_widget_name',
-            'default_text_widget_name': 'default_text_widget_name'
-        }
-        app = core.App(context=context)
+        app = core.App(context=get_context(github))
         RepositoryStatusMonitorStack(app, 'RepositoryStatusMonitor')
         template = app.synth().get_stack('RepositoryStatusMonitor').template
         with open('tests/template.json', 'w') as json_file:
@@ -42,18 +47,53 @@ def remove_template():
         print(remove_template_file.stderr.decode('utf-8'))
 
 
-def test_two_queues_created(github):
-    assert retrieve_template(github).count('AWS::SQS::Queue') == 2
+def test_three_queues_created(github):
+    assert retrieve_template(github).count('AWS::SQS::Queue') == 3
 
 
 def test_dead_letter_queue_created(github):
     assert '"QueueName": "DeadLetterQueue"' in retrieve_template(github)
 
 
+def test_metric_handler_can_redrive_dead_letter_queue(github):
+    template = json.loads(retrieve_template(github))
+    metric_handler = next(resource for resource in template['Resources'].values()
+                          if resource['Properties'].get('FunctionName') == 'MetricsHandler')
+    assert 'dead_letter_queue_url' in metric_handler['Properties']['Environment']['Variables']
+    statements = [statement for resource in template['Resources'].values() if resource['Type'] == 'AWS::IAM::Policy'
+                  for statement in resource['Properties']['PolicyDocument']['Statement']]
+    assert any('sqs:DeleteMessage' in statement['Action'] and
+               statement['Resource'].get('Fn::GetAtt', [''])[0].startswith('DeadLetterQueue')
+               for statement in statements if isinstance(statement['Resource'], dict))
+
+
 def test_webhook_queue_created(github):
     assert '"QueueName": "WebhookQueue"' in retrieve_template(github)
 
 
+def test_refresh_queue_created(github):
+    template = json.loads(retrieve_template(github))
+    refresh_queue = next(resource for resource in template['Resources'].values()
+                         if resource['Properties'].get('QueueName') == 'RefreshQueue')
+    assert refresh_queue['Properties']['MessageRetentionPeriod'] == 3600
+    metric_handler = next(resource for resource in template['Resources'].values()
+                          if resource['Properties'].get('FunctionName') == 'MetricsHandler')
+    assert 'refresh_queue_url' in metric_handler['Properties']['Environment']['Variables']
+    event_sources = [resource for resource in template['Resources'].values()
+                     if resource['Type'] == 'AWS::Lambda::EventSourceMapping']
+    assert len(event_sources) == 2
+    assert all(event_source['Properties']['FunctionResponseTypes'] == ['ReportBatchItemFailures']
+               for event_source in event_sources)
+
+
+def test_state_table_created(github):
+    assert '"TableName": "RepositoryStatusMonitorState"' in retrieve_template(github)
+
+
+def test_state_table_has_ttl(github):
+    assert '"AttributeName": "expires_at"' in retrieve_template(github)
+
+
 def test_both_custom_roles_created(github):
     assert retrieve_template(github).count('AWS::IAM::Role') >= 2
 
@@ -79,6 +119,8 @@ def test_metric_handler_management_role_default_policy_has_correct_actions(githu
     assert 'cloudwatch:ListDashboards' in retrieve_template(github)
     assert 'cloudwatch:PutDashboard' in retrieve_template(github)
     assert 'cloudwatch:PutMetricData' in retrieve_template(github)
+    assert 'dynamodb:GetItem' in retrieve_template(github)
+    assert 'dynamodb:PutItem' in retrieve_template(github)
     assert 'logs:CreateLogGroup' in retrieve_template(github)
     assert 'logs:CreateLogStream' in retrieve_template(github)
     assert 'logs:PutLogEvents' in retrieve_template(github)
@@ -93,8 +135,8 @@ def test_webhook_creator_role_default_policy_has_correct_actions(github):
     assert '"Action": "secretsmanager:GetSecretValue"' in retrieve_template(github)
 
 
-def test_both_lambdas_created(github):
-    assert retrieve_template(github).count('AWS::Lambda::Function') == 2
+def test_all_lambdas_created(github):
+    assert retrieve_template(github).count('AWS::Lambda::Function') == 5
 
 
 def test_metric_handler_lambda_created(github):
@@ -105,6 +147,49 @@ def test_webhook_creator_lambda_created(github):
     assert '"FunctionName": "WebhookCreator"' in retrieve_template(github)
 
 
+def test_history_backfill_lambda_created(github):
+    assert '"FunctionName": "HistoryBackfill"' in retrieve_template(github)
+
+
+def test_text_widget_renderer_lambda_created(github):
+    assert '"FunctionName": "TextWidgetRenderer"' in retrieve_template(github)
+
+
+def test_text_widget_renderer_role_created(github):
+    assert '"RoleName": "TextWidgetRendererRole"' in retrieve_template(github)
+
+
+def test_metric_handler_knows_text_widget_renderer(github):
+    assert '"text_widget_renderer_arn"' in retrieve_template(github)
+
+
+def test_metric_handler_catches_up_webhook_events(github):
+    assert '"webhook_catch_up": "y"' in retrieve_template(github)
+
+
+def test_metric_handler_role_can_release_dashboard_leases(github):
+    assert 'dynamodb:DeleteItem' in retrieve_template(github)
+
+
+def test_history_backfill_role_created(github):
+    assert '"RoleName": "HistoryBackfillRole"' in retrieve_template(github)
+
+
+def test_history_backfill_role_can_continue_itself(github):
+    assert 'lambda:InvokeFunction' in retrieve_template(github)
+
+
+def test_dashboard_reconcile_rule_created(github):
+    template = retrieve_template(github)
+    assert '"Name": "DailyDashboardReconcile"' in template
+    assert '"ScheduleExpression": "rate(1 day)"' in template
+    assert '"Input": "{\\"reconcile\\":true}"' in template
+
+
+def test_history_backfill_rule_created(github):
+    assert '"Name": "HourlyHistoryBackfill"' in retrieve_template(github)
+
+
 def test_metric_handler_eventbridge_rule_created(github):
     assert 'AWS::Events::Rule' in retrieve_template(github)
 
@@ -113,6 +198,57 @@ def test_webhook_queue_event_source_mapping_created(github):
     assert 'AWS::Lambda::EventSourceMapping' in retrieve_template(github)
 
 
+def test_webhook_handler_lambda_created(github):
+    resources = json.loads(retrieve_template(github))['Resources']
+    functions = {resource['Properties']['FunctionName']: resource['Properties'] for resource in resources.values()
+                 if resource['Type'] == 'AWS::Lambda::Function'}
+    webhook_handler = functions['WebhookHandler']
+    assert webhook_handler['Handler'] == 'webhook_handler.handler'
+    assert (webhook_handler['Timeout'], webhook_handler['MemorySize']) == (60, 256)
+    # Reserved concurrency is opt-in
+    assert 'ReservedConcurrentExecutions' not in webhook_handler
+    # The webhook handler is packaged on its own, and the hourly run keeps its longer timeout
+    assert webhook_handler['Code'] != functions['MetricsHandler']['Code']
+    assert functions['MetricsHandler']['Timeout'] == 300
+
+    event_source = [resource for resource in resources.values()
+                    if resource['Type'] == 'AWS::Lambda::EventSourceMapping' and
+                    resource['Properties']['EventSourceArn']['Fn::GetAtt'][0].startswith('WebhookQueue')][0]
+    assert event_source['Properties']['FunctionName']['Ref'].startswith('WebhookHandler')
+
+
+@patch('repository_status_monitor_stack.hh.request_handler',
+       return_value=(True, [{'full_name': 'aws/aws-node-termination-handler'}], {}))
+def test_webhook_handler_reserved_concurrency(mock_request, github):
+    app = core.App(context=dict(get_context(github), webhook_handler_concurrency='5'))
+    RepositoryStatusMonitorStack(app, 'RepositoryStatusMonitor')
+    resources = app.synth().get_stack('RepositoryStatusMonitor').template['Resources']
+    webhook_handler = [resource['Properties'] for resource in resources.values()
+                       if resource['Type'] == 'AWS::Lambda::Function' and
+                       resource['Properties']['FunctionName'] == 'WebhookHandler'][0]
+    assert webhook_handler['ReservedConcurrentExecutions'] == 5
+
+
+def test_webhook_queue_event_source_reports_batch_item_failures(github):
+    template = retrieve_template(github)
+    assert '"BatchSize": 10' in template
+    assert '"MaximumBatchingWindowInSeconds": 0' in template
+    assert '"ReportBatchItemFailures"' in template
+
+
+def test_webhook_queue_event_source_filters_unhandled_events(github):
+    resources = json.loads(retrieve_template(github))['Resources']
+    event_source = [resource for resource in resources.values()
+                    if resource['Type'] == 'AWS::Lambda::EventSourceMapping' and
+                    resource['Properties']['EventSourceArn']['Fn::GetAtt'][0].startswith('WebhookQueue')][0]
+    filters = event_source['Properties']['FilterCriteria']['Filters']
+
+    assert event_source['Properties']['FilterCriteria'] == webhook_messages.get_filter_criteria()
+    # An event source takes at most 5 filters
+    assert len(filters) <= 5
+    assert {'Pattern': '{"body":{"event":["push"],"ref":["refs/heads/master"]}}'} in filters
+
+
 def test_api_gateway_created(github):
     assert 'AWS::ApiGateway::RestApi' in retrieve_template(github)
 
@@ -121,6 +257,21 @@ def test_api_gateway_has_post_method(github):
     assert 'AWS::ApiGateway::Method' in retrieve_template(github)
 
 
+def test_api_gateway_queues_compact_webhook_messages(github):
+    resources = json.loads(retrieve_template(github))['Resources']
+    methods = [resource for resource in resources.values() if resource['Type'] == 'AWS::ApiGateway::Method']
+    request_template = methods[0]['Properties']['Integration']['RequestTemplates']['application/json']
+
+    assert request_template == webhook_messages.get_request_template()
+    assert '$input.body' not in request_template
+    assert request_template.startswith("#set($item = 'issue')")
+    assert "$input.params('X-GitHub-Event')" in request_template
+    assert 'Action=SendMessage&MessageBody={"event":"' in request_template
+    for field in webhook_messages.MESSAGE_FIELDS:
+        assert '"' + field + '":"#if($' + field + ')' in request_template
+    assert '\n' not in request_template
+
+
 def test_lambda_name_correct(github):
     assert 'MetricsHandler' in retrieve_template(github)
 